@@ -14,13 +14,187 @@
 
 """Handlers to make calls against the DoubleClick for Publishers (DFP) API."""
 
+import hashlib
 from httplib import HTTPException
+import json
+import re
+import threading
+import time
+
+import entity_diff
 from googleads.ad_manager import AdManagerClient
 from googleads.ad_manager import FilterStatement
 from googleads.common import ZeepServiceProxy
-from googleads.oauth2 import GoogleRefreshTokenClient
-from requests_toolbelt.adapters import appengine
+from http_transport import GetLastResponseSize
+from http_transport import GetSession
+from http_transport import GetThreadDeadline
+from http_transport import InstallSharedTransport
+from http_transport import PooledRefreshTokenClient
+from http_transport import READ_TIMEOUT
+from http_transport import SetThreadDeadline
+from parallel import AsCompleted
+from parallel import CancelledError
+from parallel import TimeoutError
+from parallel import WorkerPool
+import page_sizer
+import pql_parser
+import reference_data
+from requests.exceptions import Timeout
+import soap_stream
+import upstream_scheduler
 from utils import retry
+from zeep.exceptions import Fault
+from zeep.helpers import serialize_object
+
+from google.appengine.api import memcache
+
+# Maximum number of upstream calls a single APIHandler makes at once.
+_MAX_CONCURRENT_CALLS = 4
+
+# Maximum number of networks queried at once by a fan-out. The DFP API's
+# quota is per network, so this only bounds the instance's own load.
+_MAX_FANOUT_CALLS = 20
+
+# Service and getter function behind each entity method, for callers that page
+# through results or resolve services ahead of time.
+_METHOD_SERVICES = {
+    'GetAllNetworks': ('NetworkService', None),
+    'GetUsers': ('UserService', 'getUsersByStatement'),
+    'GetAdUnits': ('InventoryService', 'getAdUnitsByStatement'),
+    'GetCompanies': ('CompanyService', 'getCompaniesByStatement'),
+    'GetCreatives': ('CreativeService', 'getCreativesByStatement'),
+    'GetCreativeTemplates': ('CreativeTemplateService',
+                             'getCreativeTemplatesByStatement'),
+    'GetCustomTargetingKeys': ('CustomTargetingService',
+                               'getCustomTargetingKeysByStatement'),
+    'GetCustomTargetingValues': ('CustomTargetingService',
+                                 'getCustomTargetingValuesByStatement'),
+    'GetLICAs': ('LineItemCreativeAssociationService',
+                 'getLineItemCreativeAssociationsByStatement'),
+    'GetOrders': ('OrderService', 'getOrdersByStatement'),
+    'GetLineItems': ('LineItemService', 'getLineItemsByStatement'),
+    'GetPlacements': ('PlacementService', 'getPlacementsByStatement'),
+    'GetPQLSelection': ('PublisherQueryLanguageService', None),
+    'RunReportJob': ('ReportService', None),
+    'GetDeliveryForecasts': ('ForecastService', None),
+    'GetAvailabilityForecasts': ('ForecastService', None),
+    'GetProspectiveAvailabilityForecasts': ('ForecastService', None),
+}
+
+# Service and perform function behind each entity method that supports bulk
+# actions such as PauseLineItems.
+ACTION_SERVICES = {
+    'GetCreatives': ('CreativeService', 'performCreativeAction'),
+    'GetLICAs': ('LineItemCreativeAssociationService',
+                 'performLineItemCreativeAssociationAction'),
+    'GetLineItems': ('LineItemService', 'performLineItemAction'),
+    'GetOrders': ('OrderService', 'performOrderAction'),
+}
+# Number of ids per bulk action statement. Larger statements risk running
+# into the API's per call processing deadline, while smaller ones waste calls
+# against the network's quota.
+_ACTION_CHUNK_SIZE = 200
+# Seconds between the first report job status polls, and the longest delay
+# the polls back off to. Small reports finish within a few seconds, large ones
+# can take minutes.
+_REPORT_POLL_INITIAL_DELAY = 1.0
+_REPORT_POLL_MAX_DELAY = 15.0
+_REPORT_POLL_BACKOFF = 1.5
+# Bytes read at once when downloading a report.
+_REPORT_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Number of line items per delivery forecast call. Line items are forecast
+# in contention with the others of their call only.
+_FORECAST_BATCH_SIZE = 100
+# Seconds for which forecasts of identical inputs are reused.
+_FORECAST_CACHE_SECONDS = 10 * 60
+_FORECAST_OPTIONS = {
+    'includeTargetingCriteriaBreakdown': False,
+    'includeContendingLineItems': False,
+}
+# PQL table and columns, by entity attribute, of the entity methods whose
+# aggregates can be computed from PQL rows. Selecting only the grouped columns
+# transfers a fraction of the data of the full entities.
+_PQL_AGGREGATE_TABLES = {
+    'GetAdUnits': ('Ad_Unit', {
+        'parentId': 'ParentId',
+        'status': 'Status',
+    }),
+    'GetLineItems': ('Line_Item', {
+        'costType': 'CostType',
+        'deliveryRateType': 'DeliveryRateType',
+        'isMissingCreatives': 'IsMissingCreatives',
+        'lineItemType': 'LineItemType',
+        'orderId': 'OrderId',
+        'status': 'Status',
+    }),
+    'GetUsers': ('User', {
+        'roleId': 'RoleId',
+        'roleName': 'RoleName',
+    }),
+}
+# Maximum number of entities counted by an aggregate. Larger collections are
+# reported as incomplete rather than paged through at length.
+_MAX_AGGREGATE_ENTITIES = 50000
+# Seconds for which aggregates and counts of identical queries are reused.
+_AGGREGATE_CACHE_SECONDS = 5 * 60
+# Attributes identifying the entities of methods whose entities have no id.
+_ENTITY_KEY_ATTRIBUTES = {
+    'GetLICAs': ('lineItemId', 'creativeId'),
+}
+# Maximum number of changed entities whose changed fields a diff lists.
+_MAX_FIELD_DIFFS = 100
+
+
+class _NetworkScopedClient(AdManagerClient):
+  """AdManagerClient whose network code can be overridden per thread.
+
+  Service proxies read the client's network code whenever a call is made, so
+  a per thread override lets concurrent calls share the service proxies while
+  targeting different networks.
+  """
+
+  def __init__(self, *args, **kwargs):
+    self._thread_local = threading.local()
+    self._network_code = None
+    super(_NetworkScopedClient, self).__init__(*args, **kwargs)
+
+  @property
+  def network_code(self):
+    return (getattr(self._thread_local, 'network_code', None) or
+            self._network_code)
+
+  @network_code.setter
+  def network_code(self, network_code):
+    self._network_code = network_code
+
+  def SetThreadNetworkCode(self, network_code):
+    """Overrides the network code for calls made on the current thread.
+
+    Args:
+      network_code: str The network code, or None to remove the override.
+    """
+    self._thread_local.network_code = network_code
+
+
+class _ScheduledService(object):
+  """Service proxy whose calls wait for upstream_scheduler to admit them.
+
+  Other attributes, such as the ones soap_stream uses, are the proxy's own.
+  """
+
+  def __init__(self, service, api_handler):
+    self._service = service
+    self._api_handler = api_handler
+
+  def __getattr__(self, name):
+    value = getattr(self._service, name)
+    if name.startswith('_') or not callable(value):
+      return value
+
+    def ScheduledCall(*args, **kwargs):
+      # pylint: disable=protected-access
+      return self._api_handler._Schedule(value, *args, **kwargs)
+    return ScheduledCall
 
 
 class APIHandler(object):
@@ -32,17 +206,133 @@ class APIHandler(object):
     Args:
       client_id: The client id retrieved from the Cloud Console.
       client_secret: The client secret retrieved from the Cloud Console.
-      user: The models.AppUser retrieved from the Datastore.
+      user: The models.AppUser retrieved from the Datastore. May be None if
+            SetUser is called before the first API call, which allows services
+            to be prefetched while the user is still being looked up.
       application_name: The name of the AppEngine application.
     """
-    credentials = GoogleRefreshTokenClient(
-        client_id, client_secret, user.refresh_token)
+    InstallSharedTransport()
+    self._client_id = client_id
+    self._client_secret = client_secret
+    self._pool = WorkerPool(_MAX_CONCURRENT_CALLS)
+    self._services = {}
+    self._service_futures = {}
+    self._credentials_future = None
+    self.user = None
+    self.client = _NetworkScopedClient(None, application_name,
+                                  cache=ZeepServiceProxy.NO_CACHE,
+                                  timeout=READ_TIMEOUT)
+    # Maximum number of entities per call. None for page sizes tuned to each
+    # service and network by page_sizer.
+    self.page_limit = None
+    # Priority of the handler's upstream calls, upstream_scheduler.BULK for
+    # work that pages through many entities or networks.
+    self.priority = upstream_scheduler.INTERACTIVE
+    if user:
+      self.SetUser(user)
+
+  def SetUser(self, user):
+    """Sets the user whose credentials are used for API calls.
+
+    The access token is refreshed in the background, so the refresh overlaps
+    with any services that are still being resolved.
+
+    Args:
+      user: The models.AppUser retrieved from the Datastore.
+    """
     self.user = user
-    self.client = AdManagerClient(credentials, application_name,
-                            cache=ZeepServiceProxy.NO_CACHE)
-    self.page_limit = 25
-    appengine.monkeypatch()
+    credentials = PooledRefreshTokenClient(
+        self._client_id, self._client_secret, user.refresh_token)
+    self.client.oauth2_client = credentials
+    self._credentials_future = self._pool.Submit(credentials.CreateHttpHeader)
 
+  def Prefetch(self, *method_names):
+    """Starts resolving the services used by the given methods.
+
+    Resolving a service downloads and parses its WSDL, which does not need
+    the user's credentials. Starting it early lets it overlap with the user
+    lookup and the access token refresh.
+
+    Args:
+      *method_names: str Names of APIHandler methods, such as 'GetLineItems'.
+    """
+    for method_name in method_names:
+      service_name = _METHOD_SERVICES[method_name][0]
+      if (service_name not in self._services and
+          service_name not in self._service_futures):
+        self._service_futures[service_name] = self._pool.Submit(
+            self.client.GetService, service_name)
+
+  def _GetService(self, service_name):
+    """Returns a service proxy, reusing it within this handler.
+
+    Args:
+      service_name: str Name of the DFP API service.
+
+    Returns:
+      ZeepServiceProxy The service, whose calls are scheduled by
+      upstream_scheduler.
+    """
+    if service_name not in self._services:
+      future = self._service_futures.pop(service_name, None)
+      if future:
+        self._services[service_name] = future.Result()
+      else:
+        self._services[service_name] = self.client.GetService(service_name)
+    return _ScheduledService(self._services[service_name], self)
+
+  def _Schedule(self, func, *args, **kwargs):
+    """Makes an upstream call once upstream_scheduler admits it.
+
+    Args:
+      func: func The function making the call.
+      *args: Positional arguments for func.
+      **kwargs: Keyword arguments for func.
+
+    Returns:
+      The function's return value.
+    """
+    user_key = self.user.email if self.user else None
+    return upstream_scheduler.GetScheduler().Run(
+        user_key, self.priority, func, *args, **kwargs)
+
+  def _ScheduleStream(self, func, *args, **kwargs):
+    """Makes an upstream call whose response is streamed, see _Schedule.
+
+    The call keeps its slot until its response has been read or closed.
+
+    Args:
+      func: func The function making the call, which returns an iterator
+            over the response.
+      *args: Positional arguments for func.
+      **kwargs: Keyword arguments for func.
+
+    Returns:
+      iterator The items of the function's iterator.
+    """
+    user_key = self.user.email if self.user else None
+    return upstream_scheduler.GetScheduler().RunStream(
+        user_key, self.priority, func, *args, **kwargs)
+
+  def GetPageLimit(self, method_name, network_code):
+    """Returns the maximum number of entities per call.
+
+    Args:
+      method_name: str Name of an entity method, such as 'GetLineItems'.
+      network_code: str Network code the entities are looked up in.
+
+    Returns:
+      int page_limit if it is set, the page size page_sizer chose otherwise.
+    """
+    if self.page_limit:
+      return self.page_limit
+    return page_sizer.GetPageSize(method_name, network_code)
+
+  def _WaitForCredentials(self):
+    """Waits for the background access token refresh, if any."""
+    if self._credentials_future:
+      future, self._credentials_future = self._credentials_future, None
+      future.Result()
 
   @retry(HTTPException)
   def GetAllNetworks(self):
@@ -51,7 +341,8 @@ class APIHandler(object):
     Returns:
       list List of Network data objects.
     """
-    network_service = self.client.GetService('NetworkService')
+    network_service = self._GetService('NetworkService')
+    self._WaitForCredentials()
     networks = network_service.getAllNetworks()
     return {
         'results': networks,
@@ -65,7 +356,8 @@ class APIHandler(object):
     Returns:
       Network A network object.
     """
-    network_service = self.client.GetService('NetworkService')
+    network_service = self._GetService('NetworkService')
+    self._WaitForCredentials()
     return network_service.makeTestNetwork()
 
   @retry(HTTPException)
@@ -80,9 +372,10 @@ class APIHandler(object):
     Returns:
       dict Dict including a list of User data objects and total set size.
     """
-    user_service = self.client.GetService('UserService')
-    return self._GetLimitedResults(user_service.getUsersByStatement,
-                                   network_code, statement)
+    user_service = self._GetService('UserService')
+    return self._GetLimitedResults(
+        'GetUsers', user_service.getUsersByStatement, network_code,
+        statement)
 
   @retry(HTTPException)
   def GetAdUnits(self, network_code, statement=None):
@@ -96,9 +389,10 @@ class APIHandler(object):
     Returns:
       dict Dict including a list of AdUnit data objects and total set size.
     """
-    inventory_service = self.client.GetService('InventoryService')
-    return self._GetLimitedResults(inventory_service.getAdUnitsByStatement,
-                                   network_code, statement)
+    inventory_service = self._GetService('InventoryService')
+    return self._GetLimitedResults(
+        'GetAdUnits', inventory_service.getAdUnitsByStatement, network_code,
+        statement)
 
   @retry(HTTPException)
   def GetCompanies(self, network_code, statement=None):
@@ -112,9 +406,10 @@ class APIHandler(object):
     Returns:
       dict Dict including a list of Company data objects and total set size.
     """
-    company_service = self.client.GetService('CompanyService')
-    return self._GetLimitedResults(company_service.getCompaniesByStatement,
-                                   network_code, statement)
+    company_service = self._GetService('CompanyService')
+    return self._GetLimitedResults(
+        'GetCompanies', company_service.getCompaniesByStatement, network_code,
+        statement)
 
   @retry(HTTPException)
   def GetCreatives(self, network_code, statement=None):
@@ -128,9 +423,10 @@ class APIHandler(object):
     Returns:
       dict Dict including a list of Creative data objects and total set size.
     """
-    creative_service = self.client.GetService('CreativeService')
-    return self._GetLimitedResults(creative_service.getCreativesByStatement,
-                                   network_code, statement)
+    creative_service = self._GetService('CreativeService')
+    return self._GetLimitedResults(
+        'GetCreatives', creative_service.getCreativesByStatement, network_code,
+        statement)
 
   @retry(HTTPException)
   def GetCreativeTemplates(self, network_code, statement=None):
@@ -145,9 +441,10 @@ class APIHandler(object):
       dict Dict including a list of Creative Template data objects and total
       set size.
     """
-    creative_template_service = self.client.GetService(
+    creative_template_service = self._GetService(
         'CreativeTemplateService')
     return self._GetLimitedResults(
+        'GetCreativeTemplates',
         creative_template_service.getCreativeTemplatesByStatement, network_code,
         statement)
 
@@ -164,8 +461,9 @@ class APIHandler(object):
       dict Dict including a list of Custom Targeting data objects and total
       set size.
     """
-    custom_targeting_service = self.client.GetService('CustomTargetingService')
+    custom_targeting_service = self._GetService('CustomTargetingService')
     return self._GetLimitedResults(
+        'GetCustomTargetingKeys',
         custom_targeting_service.getCustomTargetingKeysByStatement,
         network_code, statement)
 
@@ -182,8 +480,9 @@ class APIHandler(object):
       dict Dict including a list of Custom Targeting data objects and total
       set size.
     """
-    custom_targeting_service = self.client.GetService('CustomTargetingService')
+    custom_targeting_service = self._GetService('CustomTargetingService')
     return self._GetLimitedResults(
+        'GetCustomTargetingValues',
         custom_targeting_service.getCustomTargetingValuesByStatement,
         network_code, statement)
 
@@ -199,10 +498,10 @@ class APIHandler(object):
     Returns:
       dict Dict including a list of LICA data objects and total set size.
     """
-    lica_service = self.client.GetService('LineItemCreativeAssociationService')
+    lica_service = self._GetService('LineItemCreativeAssociationService')
     return self._GetLimitedResults(
-        lica_service.getLineItemCreativeAssociationsByStatement, network_code,
-        statement)
+        'GetLICAs', lica_service.getLineItemCreativeAssociationsByStatement,
+        network_code, statement)
 
   @retry(HTTPException)
   def GetOrders(self, network_code, statement=None):
@@ -216,9 +515,10 @@ class APIHandler(object):
     Returns:
       dict Dict including a list of Order data objects and total set size.
     """
-    order_service = self.client.GetService('OrderService')
-    return self._GetLimitedResults(order_service.getOrdersByStatement,
-                                   network_code, statement)
+    order_service = self._GetService('OrderService')
+    return self._GetLimitedResults(
+        'GetOrders', order_service.getOrdersByStatement, network_code,
+        statement)
 
   @retry(HTTPException)
   def GetLineItems(self, network_code, statement=None):
@@ -232,9 +532,10 @@ class APIHandler(object):
     Returns:
       dict Dict including a list of Line Item data objects and total set size.
     """
-    line_item_service = self.client.GetService('LineItemService')
-    return self._GetLimitedResults(line_item_service.getLineItemsByStatement,
-                                   network_code, statement)
+    line_item_service = self._GetService('LineItemService')
+    return self._GetLimitedResults(
+        'GetLineItems', line_item_service.getLineItemsByStatement, network_code,
+        statement)
 
   @retry(HTTPException)
   def GetPlacements(self, network_code, statement=None):
@@ -248,9 +549,10 @@ class APIHandler(object):
     Returns:
       dict Dict including a list of Placement data objects and total set size.
     """
-    placement_service = self.client.GetService('PlacementService')
-    return self._GetLimitedResults(placement_service.getPlacementsByStatement,
-                                   network_code, statement)
+    placement_service = self._GetService('PlacementService')
+    return self._GetLimitedResults(
+        'GetPlacements', placement_service.getPlacementsByStatement,
+        network_code, statement)
 
   @retry(HTTPException)
   def GetPQLSelection(self, network_code, statement):
@@ -263,21 +565,31 @@ class APIHandler(object):
     Returns:
       dict Dict including a list of Row objects and total set size.
     """
-    pql_service = self.client.GetService('PublisherQueryLanguageService')
-    return self._GetLimitedResults(pql_service.select, network_code, statement,
-                                   True)
+    # selects against static tables are answered from a local copy
+    statement.limit = min(statement.limit,
+                          self.GetPageLimit('GetPQLSelection', network_code))
+    local_result = reference_data.Select(statement, network_code, self.user)
+    if local_result is not None:
+      return local_result
+
+    pql_service = self._GetService('PublisherQueryLanguageService')
+    return self._GetLimitedResults('GetPQLSelection', pql_service.select,
+                                   network_code, statement, True)
 
   def _GetLimitedResults(self,
+                         method_name,
                          getter_func,
                          network_code=None,
                          statement=None,
                          is_pql_result=False):
-    """Returns up to 25 entities given a getter_func.
+    """Returns up to a page of entities given a getter_func.
 
     The set of users returned can be altered by specifying a statement with
-    an offset or a limit less than 25.
+    an offset or a limit less than the page limit, see GetPageLimit. Full
+    pages and timeouts are reported to page_sizer.
 
     Args:
+      method_name: str Name of the entity method, such as 'GetLineItems'.
       getter_func: func Function to retrieve results from a service.
       network_code: str Network code to use when interacting with the service.
                     Defaults to None.
@@ -290,23 +602,1041 @@ class APIHandler(object):
     Returns:
       dict Dict including a list of data objects and total set size.
     """
+    self._WaitForCredentials()
     self.client.network_code = network_code
+    page_limit = self.GetPageLimit(method_name, network_code)
     if statement:
-      statement.limit = min(statement.limit, self.page_limit)
+      statement.limit = min(statement.limit, page_limit)
     else:
-      statement = FilterStatement(limit=self.page_limit)
-    response = getter_func(statement.ToStatement())
+      statement = FilterStatement(limit=page_limit)
+    start = time.time()
+    try:
+      response = getter_func(statement.ToStatement())
+    except Timeout:
+      # timeouts cut short by a deadline say nothing about the page size
+      if GetThreadDeadline() is None:
+        page_sizer.RecordTimeout(method_name, network_code, statement.limit)
+      raise
+    # time only the call, not its wait for upstream_scheduler to admit it
+    admitted = upstream_scheduler.GetLastAdmissionTime()
+    seconds = time.time() - max(start, admitted or start)
     if is_pql_result:
-      return {
+      return_obj = {
           'results': response['rows'] if 'rows' in response else [],
           'columns': [
               column['labelName'] for column in response['columnTypes']
           ],
       }
+    else:
+      total_result_set_size = response['totalResultSetSize']
+      results = response['results'] if total_result_set_size > 0 else []
+      return_obj = {
+          'results': results,
+          'totalResultSetSize': total_result_set_size,
+      }
+
+    if len(return_obj['results']) == statement.limit:
+      page_sizer.RecordPage(method_name, network_code, statement.limit,
+                            seconds, GetLastResponseSize())
+    return return_obj
+
+  def StreamResults(self, method_name, network_code, statement=None):
+    """Returns a page of entities, parsing the response incrementally.
+
+    Unlike the entity methods, which return the whole page at once, this
+    yields each entity as soon as it has been read, so only one entity at a
+    time is held in memory.
+
+    Args:
+      method_name: str Name of an entity method, such as 'GetLineItems'.
+      network_code: str Network code to use when looking up entities.
+      statement: FilterStatement PQL Statement to filter results.
+                 Defaults to None.
+
+    Returns:
+      generator Yields ('totalResultSetSize', int) and ('startIndex', int),
+      then ('results', entity) for each data object of the page.
+    """
+    service_name, getter_name = _METHOD_SERVICES[method_name]
+    service = self._GetService(service_name)
+    self._WaitForCredentials()
+    self.client.network_code = network_code
+    page_limit = self.GetPageLimit(method_name, network_code)
+    if statement:
+      statement.limit = min(statement.limit, page_limit)
+    else:
+      statement = FilterStatement(limit=page_limit)
+    # the entities are parsed as the caller reads them, and the call keeps
+    # its slot until then
+    return self._ScheduleStream(retry(HTTPException)(soap_stream.IterPage),
+                                service, getter_name, statement.ToStatement())
+
+  def GetAllResults(self, method_name, network_code, where_clause='',
+                    page_size=500, limit=None, offset=0):
+    """Pages through every entity matching a where clause.
+
+    The first page is fetched to learn the total result set size; the other
+    pages are then fetched concurrently, a few pages ahead of the consumer,
+    and yielded in order.
+
+    Args:
+      method_name: str Name of an entity method, such as 'GetLineItems'.
+      network_code: str Network code to use when looking up entities.
+      where_clause: str PQL where clause, without LIMIT or OFFSET.
+                    Defaults to all entities.
+      page_size: int Number of entities per request. Defaults to 500, the
+                 maximum allowed by the DFP API.
+      limit: int Maximum number of entities to return. Defaults to all.
+      offset: int Number of matching entities to skip. Defaults to 0.
+
+    Yields:
+      list The data objects of each page.
+    """
+    service_name, getter_name = _METHOD_SERVICES[method_name]
+    getter_func = getattr(self._GetService(service_name), getter_name)
+    self._WaitForCredentials()
+    self.client.network_code = network_code
+
+    @retry(HTTPException)
+    def GetPage(page_offset):
+      page_limit = page_size
+      if limit is not None:
+        page_limit = min(page_size, offset + limit - page_offset)
+      statement = FilterStatement(where_clause, limit=page_limit,
+                                  offset=page_offset)
+      response = getter_func(statement.ToStatement())
+      if response['totalResultSetSize'] > 0 and response['results']:
+        return response['totalResultSetSize'], response['results']
+      return response['totalResultSetSize'], []
+
+    total_result_set_size, results = GetPage(offset)
+    yield results
+    end = total_result_set_size
+    if limit is not None:
+      end = min(end, offset + limit)
+    page_offsets = range(offset + page_size, end, page_size)
+
+    # keep at most a few pages in flight so memory stays bounded when the
+    # consumer is slower than the API
+    pending = []
+    for page_offset in page_offsets:
+      pending.append(self._pool.Submit(GetPage, page_offset))
+      if len(pending) >= self._pool.max_workers:
+        yield pending.pop(0).Result()[1]
+    for future in pending:
+      yield future.Result()[1]
+
+  def GetAllPQLRows(self, network_code, select_statement, page_size=500):
+    """Pages through every row returned by a PQL select statement.
+
+    Args:
+      network_code: str Network code to make the query in.
+      select_statement: str PQL select statement, without LIMIT or OFFSET.
+      page_size: int Number of rows per request. Defaults to 500, the maximum
+                 allowed by the DFP API.
+
+    Yields:
+      list The Row objects of each page.
+    """
+    pql_service = self._GetService('PublisherQueryLanguageService')
+    self._WaitForCredentials()
+    self.client.network_code = network_code
+    select = retry(HTTPException)(pql_service.select)
+
+    offset = 0
+    while True:
+      statement = FilterStatement(select_statement, limit=page_size,
+                                  offset=offset)
+      response = select(statement.ToStatement())
+      rows = []
+      if 'rows' in response and response['rows']:
+        rows = response['rows']
+      yield rows
+      if len(rows) < page_size:
+        return
+      offset += page_size
+
+  def Aggregate(self, method_name, network_code, group_by, where_clause=''):
+    """Counts the entities matching a where clause by attribute values.
+
+    Where the attributes are columns of a PQL table, only those columns are
+    selected through PQL. Otherwise the entities are paged through and only
+    the count of each group is kept.
+
+    Args:
+      method_name: str Name of an entity method, such as 'GetLineItems'.
+      network_code: str Network code to count entities in.
+      group_by: list The attributes to group by, such as ['status'].
+      where_clause: str PQL where clause, without LIMIT or OFFSET.
+                    Defaults to all entities.
+
+    Returns:
+      dict The groups, as dicts of the attributes' values and their count,
+      largest first, the number of entities counted, whether every matching
+      entity was counted and the source of the counts, 'pql' or 'entities'.
+    """
+    cache_key = _QueryCacheKey('aggregate', self.user, network_code,
+                               method_name, group_by,
+                               _CanonicalClause(method_name, where_clause))
+    result = memcache.get(cache_key)
+    if result is not None:
+      return result
+
+    table, columns = _PQL_AGGREGATE_TABLES.get(method_name, (None, {}))
+    if all(attribute in columns for attribute in group_by):
+      try:
+        result = self._AggregatePQLRows(
+            network_code, group_by,
+            'SELECT %s FROM %s %s' % (', '.join(
+                columns[attribute] for attribute in group_by), table,
+                                      where_clause))
+      except Fault:
+        # the where clause filters on attributes the table does not have
+        result = None
+    if result is None:
+      result = _CountGroups(
+          group_by,
+          ([_GroupValue(getattr(entity, attribute, None))
+            for attribute in group_by]
+           for page in self.GetAllResults(
+               method_name, network_code, where_clause,
+               limit=_MAX_AGGREGATE_ENTITIES + 1)
+           for entity in page))
+      result['source'] = 'entities'
+    memcache.set(cache_key, result, time=_AGGREGATE_CACHE_SECONDS)
+    return result
+
+  def _AggregatePQLRows(self, network_code, group_by, select_statement):
+    """Counts the rows of a PQL select statement by their values.
+
+    Args:
+      network_code: str Network code to make the query in.
+      group_by: list The attributes selected by the statement, in order.
+      select_statement: str PQL select statement, without LIMIT or OFFSET.
+
+    Returns:
+      dict The aggregate, see Aggregate.
+    """
+    rows = (
+        [_GroupValue(_PQLValue(value)) for value in row['values']]
+        for page in self.GetAllPQLRows(network_code, select_statement)
+        for row in page)
+    result = _CountGroups(group_by, rows)
+    result['source'] = 'pql'
+    return result
+
+  def CountResults(self, method_name, network_code, where_clause=''):
+    """Returns the number of entities matching a where clause.
+
+    Only a single entity is requested, the count is the page's total result
+    set size.
+
+    Args:
+      method_name: str Name of an entity method, such as 'GetLineItems'.
+      network_code: str Network code to count entities in.
+      where_clause: str PQL where clause, without LIMIT or OFFSET.
+                    Defaults to all entities.
+
+    Returns:
+      int The number of entities.
+    """
+    cache_key = _QueryCacheKey('count', self.user, network_code, method_name,
+                               _CanonicalClause(method_name, where_clause))
+    count = memcache.get(cache_key)
+    if count is not None:
+      return count
+
+    service_name, getter_name = _METHOD_SERVICES[method_name]
+    getter_func = getattr(self._GetService(service_name), getter_name)
+    self._WaitForCredentials()
+    self.client.network_code = network_code
+
+    @retry(HTTPException)
+    def GetCount():
+      statement = FilterStatement(where_clause, limit=1)
+      return getter_func(statement.ToStatement())['totalResultSetSize']
+
+    count = GetCount()
+    memcache.set(cache_key, count, time=_AGGREGATE_CACHE_SECONDS)
+    return count
+
+  def DigestEntities(self, method_name, network_code, where_clause='',
+                     key_attributes=('id',),
+                     ignored_fields=entity_diff.VOLATILE_FIELDS):
+    """Pages through entities, keeping only a digest of each.
+
+    Args:
+      method_name: str Name of an entity method, such as 'GetLineItems'.
+      network_code: str Network code to look up entities in.
+      where_clause: str PQL where clause, without LIMIT or OFFSET.
+                    Defaults to all entities.
+      key_attributes: tuple The attributes identifying an entity, see
+                      GetKeyAttributes.
+      ignored_fields: set The fields left out of the digests.
+
+    Returns:
+      dict The digests, by entity key.
+
+    Raises:
+      DuplicateKeyError: Several entities have the same key.
+    """
+    digests = {}
+    duplicate_keys = set()
+    for page in self.GetAllResults(method_name, network_code, where_clause):
+      for entity in page:
+        fields = entity_diff.NormalizeEntity(entity, ignored_fields)
+        key = _EntityKey(fields, key_attributes)
+        if key in digests:
+          duplicate_keys.add(key)
+        digests[key] = entity_diff.DigestEntity(fields)
+    if duplicate_keys:
+      raise entity_diff.DuplicateKeyError(sorted(duplicate_keys))
+    return digests
+
+  def DiffEntities(self, method_name, left_network_code, right_network_code,
+                   where_clause='', key_attributes=('id',),
+                   ignored_fields=entity_diff.VOLATILE_FIELDS,
+                   left_digests=None):
+    """Compares the entities matching a where clause on two sides.
+
+    Args:
+      method_name: str Name of an entity method, such as 'GetLineItems'.
+      left_network_code: str Network code of the left side.
+      right_network_code: str Network code of the right side.
+      where_clause: str PQL where clause, without LIMIT or OFFSET.
+                    Defaults to all entities.
+      key_attributes: tuple The attributes matching entities of both sides,
+                      see GetKeyAttributes.
+      ignored_fields: set The fields left out of the comparison.
+      left_digests: dict Digests of the left side, by entity key, from an
+                    earlier snapshot of the left network. The left side is
+                    then not fetched, and since its entities are not known
+                    anymore, no changed fields are listed.
+
+    Returns:
+      dict The keys of the added and removed entities, the changed entities
+      with their changed fields, if known, and the number of entities of
+      each side and of unchanged entities.
+
+    Raises:
+      DuplicateKeyError: Several entities of a side have the same key.
+    """
+    compare_fields = left_digests is None
+    if compare_fields:
+      left_digests = self.DigestEntities(method_name, left_network_code,
+                                         where_clause, key_attributes,
+                                         ignored_fields)
+    right_digests = self.DigestEntities(method_name, right_network_code,
+                                        where_clause, key_attributes,
+                                        ignored_fields)
+    added, removed, changed = entity_diff.DiffDigests(left_digests,
+                                                      right_digests)
+
+    fields_by_key = {}
+    if compare_fields and changed:
+      keys = changed[:_MAX_FIELD_DIFFS]
+      left_entities = self._GetEntitiesByKey(
+          method_name, left_network_code, key_attributes, ignored_fields, keys)
+      right_entities = self._GetEntitiesByKey(
+          method_name, right_network_code, key_attributes, ignored_fields,
+          keys)
+      for key in keys:
+        if key in left_entities and key in right_entities:
+          fields_by_key[key] = entity_diff.DiffFields(left_entities[key],
+                                                      right_entities[key])
+    return {
+        'added': added,
+        'removed': removed,
+        'changed': [{
+            'key': key,
+            'fields': fields_by_key.get(key),
+        } for key in changed],
+        'leftCount': len(left_digests),
+        'rightCount': len(right_digests),
+        'unchangedCount': len(left_digests) - len(removed) - len(changed),
+    }
+
+  def _GetEntitiesByKey(self, method_name, network_code, key_attributes,
+                        ignored_fields, keys):
+    """Fetches entities by their keys.
+
+    Entities are selected by their first key attribute, _ACTION_CHUNK_SIZE
+    values per request, and those with other keys are dropped.
+
+    Args:
+      method_name: str Name of an entity method, such as 'GetLineItems'.
+      network_code: str Network code to look up entities in.
+      key_attributes: tuple The attributes identifying an entity.
+      ignored_fields: set The fields to leave out of the entities.
+      keys: list The entity keys.
+
+    Returns:
+      dict The normalized entities that were found, by entity key.
+    """
+    wanted = set(keys)
+    if len(key_attributes) > 1:
+      values = sorted(set(key[0] for key in keys))
+    else:
+      values = sorted(wanted)
+    entities = {}
+    for start in range(0, len(values), _ACTION_CHUNK_SIZE):
+      condition = 'WHERE %s IN (%s)' % (key_attributes[0], ', '.join(
+          _PQLLiteral(value)
+          for value in values[start:start + _ACTION_CHUNK_SIZE]))
+      for page in self.GetAllResults(method_name, network_code, condition):
+        for entity in page:
+          fields = entity_diff.NormalizeEntity(entity, ignored_fields)
+          key = _EntityKey(fields, key_attributes)
+          if key in wanted:
+            entities[key] = fields
+    return entities
+
+  def PerformAction(self, method_name, network_code, action, ids=None,
+                    where_clause=None):
+    """Performs an action on many entities, in concurrent chunks.
+
+    The entities are split into statements of the form WHERE id IN (...),
+    which run at most _MAX_CONCURRENT_CALLS at a time. A chunk that fails
+    does not stop the others.
+
+    Args:
+      method_name: str Name of an entity method in ACTION_SERVICES, such as
+                   'GetLineItems'.
+      network_code: str Network code of the entities.
+      action: str The action type, such as 'PauseLineItems'.
+      ids: list Ids of the entities to act on. LICAs have no ids of their
+           own and must be selected with a where clause.
+      where_clause: str PQL where clause selecting the entities to act on,
+                    used if ids is None.
+
+    Returns:
+      dict Dict including the total number of changed entities, the number
+      of failed chunks and, for every chunk, its statement, its number of
+      changed entities and its error, if any.
+    """
+    service_name, perform_name = ACTION_SERVICES[method_name]
+    perform_func = getattr(self._GetService(service_name), perform_name)
+    if ids is None:
+      statements = self._GetActionStatements(method_name, network_code,
+                                             where_clause)
+    else:
+      statements = ['WHERE ' + condition
+                    for condition in _GetIdConditions('id', sorted(set(ids)))]
+    self._WaitForCredentials()
+    self.client.network_code = network_code
+
+    @retry(HTTPException)
+    def PerformChunk(query):
+      # actions apply to every match, so the statement has no LIMIT
+      result = perform_func({'xsi_type': action}, {'query': query})
+      return result['numChanges'] if result else 0
+
+    futures = [self._pool.Submit(PerformChunk, query) for query in statements]
+    chunks = []
+    for query, future in zip(statements, futures):
+      chunk = {'query': query, 'numChanges': 0, 'error': None}
+      try:
+        chunk['numChanges'] = future.Result()
+      except Exception, e:  # pylint: disable=broad-except
+        chunk['error'] = str(e)
+      chunks.append(chunk)
 
-    total_result_set_size = response['totalResultSetSize']
-    results = response['results'] if total_result_set_size > 0 else []
     return {
-        'results': results,
-        'totalResultSetSize': total_result_set_size,
+        'action': action,
+        'numChanges': sum(chunk['numChanges'] for chunk in chunks),
+        'failedChunks': len([chunk for chunk in chunks if chunk['error']]),
+        'chunks': chunks,
     }
+
+  def _GetActionStatements(self, method_name, network_code, where_clause):
+    """Resolves a where clause into chunked statements on entity ids.
+
+    Args:
+      method_name: str Name of an entity method in ACTION_SERVICES.
+      network_code: str Network code of the entities.
+      where_clause: str PQL where clause selecting the entities.
+
+    Returns:
+      list The where clauses of the chunks.
+    """
+    pages = self.GetAllResults(method_name, network_code, where_clause)
+    if method_name != 'GetLICAs':
+      ids = sorted(set(entity['id'] for page in pages for entity in page))
+      return ['WHERE ' + condition for condition in _GetIdConditions('id', ids)]
+
+    # LICAs are identified by their line item and creative, so chunk the
+    # creatives of each line item
+    creative_ids = {}
+    for page in pages:
+      for lica in page:
+        creative_ids.setdefault(lica['lineItemId'], set()).add(
+            lica['creativeId'])
+    statements = []
+    for line_item_id in sorted(creative_ids):
+      statements.extend(
+          'WHERE lineItemId = %d AND %s' % (line_item_id, condition)
+          for condition in _GetIdConditions(
+              'creativeId', sorted(creative_ids[line_item_id])))
+    return statements
+
+  def RunReportJob(self, network_code, report_query):
+    """Starts running a report.
+
+    Not retried, since a call that failed in transit may still have started
+    a job, and a retry would start a second one.
+
+    Args:
+      network_code: str Network code to run the report in.
+      report_query: dict The ReportQuery, with its dimensions, columns and
+                    date range.
+
+    Returns:
+      int The id of the report job.
+    """
+    report_service = self._GetService('ReportService')
+    self._WaitForCredentials()
+    self.client.network_code = network_code
+    return report_service.runReportJob({'reportQuery': report_query})['id']
+
+  @retry(HTTPException)
+  def GetReportJobStatus(self, network_code, report_job_id):
+    """Returns the status of a report job.
+
+    Args:
+      network_code: str Network code the report runs in.
+      report_job_id: int The id of the report job.
+
+    Returns:
+      str COMPLETED, FAILED or IN_PROGRESS.
+    """
+    report_service = self._GetService('ReportService')
+    self._WaitForCredentials()
+    self.client.network_code = network_code
+    return report_service.getReportJobStatus(report_job_id)
+
+  def WaitForReportJob(self, network_code, report_job_id, timeout):
+    """Polls a report job until it is done or the timeout has passed.
+
+    Polls are frequent at first, so small reports are picked up quickly, and
+    back off for reports that take longer.
+
+    Args:
+      network_code: str Network code the report runs in.
+      report_job_id: int The id of the report job.
+      timeout: float Number of seconds to wait at most.
+
+    Returns:
+      str The last status, which is IN_PROGRESS if the timeout has passed.
+    """
+    deadline = time.time() + timeout
+    delay = _REPORT_POLL_INITIAL_DELAY
+    while True:
+      status = self.GetReportJobStatus(network_code, report_job_id)
+      remaining = deadline - time.time()
+      if status != 'IN_PROGRESS' or remaining <= 0:
+        return status
+      time.sleep(min(delay, remaining))
+      delay = min(delay * _REPORT_POLL_BACKOFF, _REPORT_POLL_MAX_DELAY)
+
+  def DownloadReport(self, network_code, report_job_id):
+    """Downloads a completed report as a gzipped CSV, chunk by chunk.
+
+    The download keeps its upstream_scheduler slot until the chunks have all
+    been read or the iterator is closed.
+
+    Args:
+      network_code: str Network code the report ran in.
+      report_job_id: int The id of the completed report job.
+
+    Returns:
+      iterator Yields the chunks of the compressed report.
+    """
+    report_service = self._GetService('ReportService')
+    self._WaitForCredentials()
+    self.client.network_code = network_code
+    url = retry(HTTPException)(report_service.getReportDownloadUrlWithOptions)(
+        report_job_id, {
+            'exportFormat': 'CSV_DUMP',
+            'includeReportProperties': False,
+            'includeTotalsRow': False,
+            'useGzipCompression': True,
+        })
+
+    return self._ScheduleStream(_IterDownload, url)
+
+  def GetDeliveryForecasts(self, network_code, line_item_ids):
+    """Returns delivery forecasts for existing line items.
+
+    The line items are forecast _FORECAST_BATCH_SIZE at a time, with the
+    batches running concurrently.
+
+    Args:
+      network_code: str Network code of the line items.
+      line_item_ids: list The line item ids.
+
+    Returns:
+      dict The serialized LineItemDeliveryForecast of each line item, by id.
+      Line items whose batch failed have a dict with only an error message.
+    """
+    forecast_service = self._GetService('ForecastService')
+    self._WaitForCredentials()
+    self.client.network_code = network_code
+
+    @retry(HTTPException)
+    def ForecastBatch(batch_ids):
+      forecast = forecast_service.getDeliveryForecastByIds(
+          batch_ids, {'ignoredLineItemIds': []})
+      return forecast['lineItemDeliveryForecasts'] or []
+
+    line_item_ids = sorted(set(line_item_ids))
+    futures = [
+        self._pool.Submit(ForecastBatch,
+                          line_item_ids[start:start + _FORECAST_BATCH_SIZE])
+        for start in range(0, len(line_item_ids), _FORECAST_BATCH_SIZE)
+    ]
+    forecasts = {}
+    for start, future in zip(range(0, len(line_item_ids), _FORECAST_BATCH_SIZE),
+                             futures):
+      error = future.Exception()
+      if error:
+        forecasts.update(
+            (line_item_id, {'error': str(error)})
+            for line_item_id in line_item_ids[start:start +
+                                              _FORECAST_BATCH_SIZE])
+        continue
+      for forecast in future.Result():
+        forecasts[forecast['lineItemId']] = serialize_object(forecast)
+    return forecasts
+
+  def GetAvailabilityForecasts(self, network_code, line_items):
+    """Returns availability forecasts for existing line items.
+
+    Forecasts of a line item that has not been modified since it was last
+    forecast are reused for a few minutes.
+
+    Args:
+      network_code: str Network code of the line items.
+      line_items: list The LineItem objects, with their id and
+                  lastModifiedDateTime.
+
+    Returns:
+      dict The serialized AvailabilityForecast of each line item, by id.
+      Line items that could not be forecast have a dict with only an error
+      message.
+    """
+    forecast_service = self._GetService('ForecastService')
+
+    @retry(HTTPException)
+    def Forecast(line_item_id):
+      return serialize_object(forecast_service.getAvailabilityForecastById(
+          line_item_id, _FORECAST_OPTIONS))
+
+    keys = dict(
+        (line_item['id'],
+         (line_item['id'], serialize_object(line_item['lastModifiedDateTime'])))
+        for line_item in line_items)
+    forecasts = self._GetCachedForecasts(
+        network_code, 'availability', keys.values(),
+        lambda key: Forecast(key[0]))
+    return dict((line_item_id, forecasts[_ForecastCacheKey(
+        self.user, network_code, 'availability', key)])
+                for line_item_id, key in keys.iteritems())
+
+  def GetProspectiveAvailabilityForecasts(self, network_code,
+                                          prospective_line_items):
+    """Returns availability forecasts for line items that do not exist yet.
+
+    Identical prospective line items are forecast only once, and their
+    forecasts are reused for a few minutes.
+
+    Args:
+      network_code: str Network code to forecast in.
+      prospective_line_items: list The ProspectiveLineItem dicts.
+
+    Returns:
+      list The serialized AvailabilityForecast of each prospective line item,
+      in the same order. Line items that could not be forecast have a dict
+      with only an error message.
+    """
+    forecast_service = self._GetService('ForecastService')
+
+    @retry(HTTPException)
+    def Forecast(prospective_line_item):
+      return serialize_object(forecast_service.getAvailabilityForecast(
+          prospective_line_item, _FORECAST_OPTIONS))
+
+    forecasts = self._GetCachedForecasts(
+        network_code, 'prospective', prospective_line_items, Forecast)
+    return [
+        forecasts[_ForecastCacheKey(self.user, network_code, 'prospective',
+                                    item)]
+        for item in prospective_line_items
+    ]
+
+  def _GetCachedForecasts(self, network_code, kind, inputs, forecast_func):
+    """Forecasts distinct inputs concurrently, reusing cached forecasts.
+
+    An input whose forecast fails gets a dict with only the error message,
+    which is not cached, so that it is forecast again next time.
+
+    Args:
+      network_code: str Network code to forecast in.
+      kind: str The kind of forecast, part of the cache key.
+      inputs: list JSON-serializable inputs of forecast_func.
+      forecast_func: func Function forecasting a single input.
+
+    Returns:
+      dict The forecasts, by their cache key.
+    """
+    distinct_inputs = dict(
+        (_ForecastCacheKey(self.user, network_code, kind, item), item)
+        for item in inputs)
+    forecasts = memcache.get_multi(distinct_inputs.keys())
+    missing = [key for key in distinct_inputs if key not in forecasts]
+    if missing:
+      self._WaitForCredentials()
+      self.client.network_code = network_code
+      futures = [
+          self._pool.Submit(forecast_func, distinct_inputs[key])
+          for key in missing
+      ]
+      new_forecasts = {}
+      for key, future in zip(missing, futures):
+        error = future.Exception()
+        if error:
+          forecasts[key] = {'error': str(error)}
+        else:
+          new_forecasts[key] = future.Result()
+      memcache.set_multi(new_forecasts, time=_FORECAST_CACHE_SECONDS)
+      forecasts.update(new_forecasts)
+    return forecasts
+
+  def FanOut(self, method_name, network_codes, where_clause='', limit=None,
+             offset=0, timeout=None):
+    """Runs an entity method against several networks concurrently.
+
+    Args:
+      method_name: str Name of an entity method, such as 'GetAdUnits'.
+      network_codes: list The network codes to query.
+      where_clause: str PQL where clause, or a select statement for
+                    GetPQLSelection. Defaults to all entities.
+      limit: int Maximum number of entities per network. Defaults to the
+             page limit of each network, see GetPageLimit.
+      offset: int Number of matching entities to skip in each network.
+      timeout: float Number of seconds to wait for each network, from when
+               its call starts. Networks that have not answered by then, or
+               whose call has not started by then for lack of a free
+               worker, are reported as timed out. Defaults to no limit.
+
+    Yields:
+      tuple A tuple of (network code, the method's result or None, error
+      message or None) for each network, in the order they answer.
+    """
+    # resolve the service and credentials once, for all networks
+    self._GetService(_METHOD_SERVICES[method_name][0])
+    self._WaitForCredentials()
+    method = getattr(self, method_name)
+
+    def Query(network_code):
+      self.client.SetThreadNetworkCode(network_code)
+      # the transport ends the network's calls when its time is up, so no
+      # call outlives the fan-out
+      if timeout is not None:
+        SetThreadDeadline(time.time() + timeout)
+      try:
+        return method(network_code, FilterStatement(
+            where_clause,
+            limit=limit or self.GetPageLimit(method_name, network_code),
+            offset=offset))
+      finally:
+        SetThreadDeadline(None)
+        self.client.SetThreadNetworkCode(None)
+
+    pool = WorkerPool(max(1, min(len(network_codes), _MAX_FANOUT_CALLS)))
+    network_code_by_future = dict(
+        (pool.Submit(Query, network_code), network_code)
+        for network_code in network_codes)
+    pending = set(network_code_by_future)
+    start_timeout = timeout
+    try:
+      while pending:
+        try:
+          for future in AsCompleted(list(pending), start_timeout):
+            pending.discard(future)
+            error = future.Exception()
+            if isinstance(error, (Timeout, CancelledError)):
+              yield (network_code_by_future[future], None,
+                     'No answer within %s seconds' % timeout)
+            elif error:
+              yield network_code_by_future[future], None, str(error)
+            else:
+              yield network_code_by_future[future], future.Result(), None
+        except TimeoutError:
+          # the calls that have started end by their own deadline
+          for future in pending:
+            pool.Cancel(future)
+          start_timeout = None
+    finally:
+      # the caller stopped early, so wait for the calls that have started
+      for future in pending:
+        pool.Cancel(future)
+      for future in pending:
+        future.Exception()
+
+  def SearchNames(self, network_code, method_names, prefix, limit,
+                  timeout=None):
+    """Looks up entities of several methods by the start of their names.
+
+    The methods are queried concurrently with a name LIKE statement. Unlike
+    name_index, which matches the start of any word, only names starting
+    with the prefix are found.
+
+    Args:
+      network_code: str Network code to use when looking up entities.
+      method_names: list Names of entity methods, such as 'GetLineItems'.
+      prefix: str The start of the names.
+      limit: int Maximum number of entities per method.
+      timeout: float Number of seconds each method's call may take. Methods
+               that have not answered or started by then are reported as
+               timed out. Defaults to no limit.
+
+    Yields:
+      tuple A tuple of (method name, list of (id, name) pairs or None, error
+      message or None) for each method, in the order they answer.
+    """
+    where_clause = 'WHERE name LIKE %s' % _PQLLiteral(
+        prefix.replace('%', '') + '%')
+    # the workers all use the refreshed access token
+    self._WaitForCredentials()
+
+    def Query(method_name):
+      # the transport ends the method's calls when its time is up, so no
+      # call outlives the search
+      if timeout is not None:
+        SetThreadDeadline(time.time() + timeout)
+      try:
+        return_obj = getattr(self, method_name)(
+            network_code, FilterStatement(where_clause, limit=limit))
+      finally:
+        SetThreadDeadline(None)
+      return [(entity['id'], entity['name'])
+              for entity in return_obj['results']]
+
+    method_name_by_future = dict(
+        (self._pool.Submit(Query, method_name), method_name)
+        for method_name in method_names)
+    pending = set(method_name_by_future)
+    start_timeout = timeout
+    try:
+      while pending:
+        try:
+          for future in AsCompleted(list(pending), start_timeout):
+            pending.discard(future)
+            error = future.Exception()
+            if isinstance(error, (Timeout, CancelledError)):
+              yield (method_name_by_future[future], None,
+                     'No answer within %s seconds' % timeout)
+            elif error:
+              yield method_name_by_future[future], None, str(error)
+            else:
+              yield method_name_by_future[future], future.Result(), None
+        except TimeoutError:
+          # the calls that have started end by their own deadline
+          for future in pending:
+            self._pool.Cancel(future)
+          start_timeout = None
+    finally:
+      # the caller stopped early, so wait for the calls that have started
+      for future in pending:
+        self._pool.Cancel(future)
+      for future in pending:
+        future.Exception()
+
+def GetKeyAttributes(method_name, key_attribute=None):
+  """Returns the attributes identifying the entities of a method.
+
+  Args:
+    method_name: str Name of an entity method, such as 'GetLineItems'.
+    key_attribute: str Attribute to identify entities by instead of their
+                   id, such as 'name' to match entities of two networks.
+                   Ignored for entities without an id.
+
+  Returns:
+    tuple The attribute names.
+  """
+  if method_name in _ENTITY_KEY_ATTRIBUTES:
+    return _ENTITY_KEY_ATTRIBUTES[method_name]
+  return (key_attribute or 'id',)
+
+
+def _IterDownload(url):
+  """Downloads a file from a URL, chunk by chunk.
+
+  Args:
+    url: str The URL.
+
+  Yields:
+    str The next chunk of the file, as sent, without decoding.
+  """
+  response = GetSession().get(url, stream=True)
+  try:
+    response.raise_for_status()
+    # the report is decompressed by the caller, not by requests
+    for chunk in response.raw.stream(_REPORT_DOWNLOAD_CHUNK_SIZE,
+                                     decode_content=False):
+      yield chunk
+  finally:
+    response.close()
+
+
+def _EntityKey(fields, key_attributes):
+  """Returns the key of a normalized entity, a tuple for several attributes."""
+  if len(key_attributes) == 1:
+    return fields.get(key_attributes[0])
+  return tuple(fields.get(attribute) for attribute in key_attributes)
+
+
+def _PQLLiteral(value):
+  """Returns a number or string as a PQL literal."""
+  if isinstance(value, basestring):
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+  return str(value)
+
+
+def _ForecastCacheKey(user, network_code, kind, item):
+  """Returns the memcache key of a user's forecast of the given input.
+
+  Args:
+    user: AppUser The user the forecast is made for, if any. Forecasts
+          depend on what the user may see, so each user has their own.
+    network_code: str Network code the forecast is made in.
+    kind: str The kind of forecast.
+    item: The JSON-serializable input of the forecast.
+
+  Returns:
+    str The key.
+  """
+  digest = hashlib.sha1(json.dumps(
+      [user.email if user else None, network_code, kind, item],
+      sort_keys=True, default=str)).hexdigest()
+  return 'forecast:%s:%s' % (kind, digest)
+
+
+def _QueryCacheKey(kind, user, network_code, *args):
+  """Returns the memcache key of a user's query's result.
+
+  Args:
+    kind: str The kind of query, such as 'count'.
+    user: AppUser The user the query is made for, if any. Users may see
+          different entities of a network, so each user has their own.
+    network_code: str Network code the query is made in.
+    *args: The JSON-serializable arguments of the query.
+
+  Returns:
+    str The key.
+  """
+  digest = hashlib.sha1(json.dumps(
+      [user.email if user else None, network_code, kind] + list(args),
+      sort_keys=True)).hexdigest()
+  return '%s:%s' % (kind, digest)
+
+
+def _CanonicalClause(method_name, where_clause):
+  """Returns the canonical form of a where clause, for use in cache keys.
+
+  Args:
+    method_name: str Name of the entity method the clause is for.
+    where_clause: str The where clause.
+
+  Returns:
+    str The canonical clause, or the clause itself if it is not valid.
+  """
+  try:
+    return pql_parser.FormatStatement(
+        pql_parser.ParseFilter(where_clause, method_name))
+  except pql_parser.InvalidStatementError:
+    return where_clause
+
+
+def _CountGroups(group_by, rows):
+  """Counts rows of values, up to _MAX_AGGREGATE_ENTITIES of them.
+
+  Args:
+    group_by: list The attribute of each value of the rows.
+    rows: iterable The rows, as lists of hashable values.
+
+  Returns:
+    dict The aggregate, see APIHandler.Aggregate, without its source.
+  """
+  counts = {}
+  counted = 0
+  complete = True
+  for row in rows:
+    if counted == _MAX_AGGREGATE_ENTITIES:
+      complete = False
+      break
+    key = tuple(row)
+    counts[key] = counts.get(key, 0) + 1
+    counted += 1
+
+  groups = []
+  for key, count in sorted(counts.iteritems(), key=lambda item: -item[1]):
+    group = dict(zip(group_by, key))
+    group['count'] = count
+    groups.append(group)
+  return {
+      'groupBy': group_by,
+      'groups': groups,
+      'totalResultSetSize': counted,
+      'complete': complete,
+  }
+
+
+def _GroupValue(value):
+  """Returns a hashable and JSON-serializable form of an attribute value.
+
+  Args:
+    value: The value, such as a string or a zeep object.
+
+  Returns:
+    The value itself if it is a scalar, otherwise its JSON encoding.
+  """
+  if value is None or isinstance(value, (basestring, bool, int, long, float)):
+    return value
+  return json.dumps(serialize_object(value), sort_keys=True, default=str)
+
+
+def _PQLValue(value):
+  """Returns the value of a PQL Value object, with numbers as integers.
+
+  Args:
+    value: The Value object of a column of a PQL row.
+
+  Returns:
+    The value, typed like the attribute of the entity.
+  """
+  if value is None:
+    return None
+  value = value['value']
+  # NumberValues are returned as strings
+  if isinstance(value, basestring) and re.match(r'^-?\d+$', value):
+    return int(value)
+  return value
+
+
+def _GetIdConditions(attribute, ids):
+  """Returns conditions selecting the given ids, _ACTION_CHUNK_SIZE at once.
+
+  Args:
+    attribute: str The id attribute, such as 'id' or 'creativeId'.
+    ids: list The ids.
+
+  Returns:
+    list The conditions, such as 'id IN (1, 2)'.
+  """
+  return [
+      '%s IN (%s)' % (attribute, ', '.join(
+          str(int(entity_id))
+          for entity_id in ids[start:start + _ACTION_CHUNK_SIZE]))
+      for start in range(0, len(ids), _ACTION_CHUNK_SIZE)
+  ]
@@ -0,0 +1,526 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the DFP API handler."""
+
+import re
+import threading
+import time
+import unittest
+
+import api_handler
+from api_handler import APIHandler
+import entity_diff
+import mock
+import requests
+import upstream_scheduler
+
+from google.appengine.ext import testbed
+
+
+class APIHandlerTest(unittest.TestCase):
+  """Tests for api_handler.py."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+
+    self.handler = APIHandler('client_id', 'client_secret', None, 'test')
+    self.service = mock.MagicMock()
+    for service_name in ('LineItemService',
+                         'LineItemCreativeAssociationService'):
+      self.handler._services[service_name] = self.service
+
+    def perform(unused_action, statement):
+      ids = re.search(r'IN \((.*)\)', statement['query']).group(1)
+      return {'numChanges': len(ids.split(', '))}
+    self.service.performLineItemAction.side_effect = perform
+    self.service.performLineItemCreativeAssociationAction.side_effect = perform
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testPerformActionOnIds(self):
+    with mock.patch.object(api_handler, '_ACTION_CHUNK_SIZE', 2):
+      result = self.handler.PerformAction('GetLineItems', '1234',
+                                          'PauseLineItems', ids=[5, 1, 3, 1])
+
+    self.assertEqual(3, result['numChanges'])
+    self.assertEqual(0, result['failedChunks'])
+    self.assertEqual(['WHERE id IN (1, 3)', 'WHERE id IN (5)'],
+                     [chunk['query'] for chunk in result['chunks']])
+    self.service.performLineItemAction.assert_any_call(
+        {'xsi_type': 'PauseLineItems'}, {'query': 'WHERE id IN (5)'})
+    self.assertEqual('1234', self.handler.client.network_code)
+
+  def testPerformActionReportsFailedChunks(self):
+    def perform(unused_action, statement):
+      if '3' in statement['query']:
+        raise ValueError('failed')
+      return {'numChanges': 2}
+    self.service.performLineItemAction.side_effect = perform
+
+    with mock.patch.object(api_handler, '_ACTION_CHUNK_SIZE', 2):
+      result = self.handler.PerformAction('GetLineItems', '1234',
+                                          'PauseLineItems', ids=[1, 2, 3, 4])
+
+    self.assertEqual(2, result['numChanges'])
+    self.assertEqual(1, result['failedChunks'])
+    self.assertEqual([None, 'failed'],
+                     [chunk['error'] for chunk in result['chunks']])
+
+  def testPerformActionOnWhereClause(self):
+    self.service.getLineItemsByStatement.return_value = {
+        'totalResultSetSize': 3,
+        'results': [{'id': 7}, {'id': 8}, {'id': 9}],
+    }
+
+    result = self.handler.PerformAction('GetLineItems', '1234',
+                                        'ArchiveLineItems',
+                                        where_clause="WHERE status = 'PAUSED'")
+
+    self.assertEqual(3, result['numChanges'])
+    self.assertEqual(['WHERE id IN (7, 8, 9)'],
+                     [chunk['query'] for chunk in result['chunks']])
+    query = self.service.getLineItemsByStatement.call_args[0][0]['query']
+    self.assertTrue(query.startswith("WHERE status = 'PAUSED' LIMIT"))
+
+  def testPerformActionOnLICAs(self):
+    self.service.getLineItemCreativeAssociationsByStatement.return_value = {
+        'totalResultSetSize': 3,
+        'results': [
+            {'lineItemId': 2, 'creativeId': 20},
+            {'lineItemId': 1, 'creativeId': 11},
+            {'lineItemId': 1, 'creativeId': 10},
+        ],
+    }
+
+    result = self.handler.PerformAction(
+        'GetLICAs', '1234', 'DeactivateLineItemCreativeAssociations',
+        where_clause='WHERE lineItemId IN (1, 2)')
+
+    self.assertEqual(3, result['numChanges'])
+    self.assertEqual(['WHERE lineItemId = 1 AND creativeId IN (10, 11)',
+                      'WHERE lineItemId = 2 AND creativeId IN (20)'],
+                     [chunk['query'] for chunk in result['chunks']])
+
+  def testAggregateEntities(self):
+    orders = mock.MagicMock()
+    self.handler._services['OrderService'] = orders
+    entities = [mock.Mock(status=status, advertiserId=advertiser_id)
+                for status, advertiser_id in [('APPROVED', 1), ('DRAFT', 1),
+                                              ('APPROVED', 1), ('DRAFT', 2),
+                                              ('APPROVED', 1)]]
+    orders.getOrdersByStatement.side_effect = lambda statement: {
+        'totalResultSetSize': len(entities),
+        'results': entities,
+    }
+
+    result = self.handler.Aggregate('GetOrders', '1234',
+                                    ['status', 'advertiserId'])
+
+    self.assertEqual('entities', result['source'])
+    self.assertEqual(5, result['totalResultSetSize'])
+    self.assertTrue(result['complete'])
+    self.assertEqual(
+        {'status': 'APPROVED', 'advertiserId': 1, 'count': 3},
+        result['groups'][0])
+    self.assertEqual(3, len(result['groups']))
+
+    # identical queries are answered from the cache
+    self.assertEqual(result, self.handler.Aggregate(
+        'GetOrders', '1234', ['status', 'advertiserId']))
+    self.assertEqual(1, orders.getOrdersByStatement.call_count)
+
+  def testAggregateIncomplete(self):
+    orders = mock.MagicMock()
+    self.handler._services['OrderService'] = orders
+    orders.getOrdersByStatement.return_value = {
+        'totalResultSetSize': 3,
+        'results': [mock.Mock(status='DRAFT')] * 3,
+    }
+
+    with mock.patch.object(api_handler, '_MAX_AGGREGATE_ENTITIES', 2):
+      result = self.handler.Aggregate('GetOrders', '1234', ['status'])
+
+    self.assertFalse(result['complete'])
+    self.assertEqual([{'status': 'DRAFT', 'count': 2}], result['groups'])
+
+  def testAggregatePQL(self):
+    def row(*values):
+      return {'values': [{'value': value} for value in values]}
+    pql_service = mock.MagicMock()
+    pql_service.select.__name__ = 'select'
+    self.handler._services['PublisherQueryLanguageService'] = pql_service
+    pql_service.select.return_value = {'rows': [
+        row('PAUSED', '10'), row('READY', '10'), row('PAUSED', '10'),
+    ]}
+
+    result = self.handler.Aggregate('GetLineItems', '1234',
+                                    ['status', 'orderId'], 'WHERE id != 0')
+
+    self.assertEqual('pql', result['source'])
+    self.assertEqual([{'status': 'PAUSED', 'orderId': 10, 'count': 2},
+                      {'status': 'READY', 'orderId': 10, 'count': 1}],
+                     result['groups'])
+    query = pql_service.select.call_args[0][0]['query']
+    self.assertTrue(
+        query.startswith('SELECT Status, OrderId FROM Line_Item WHERE id != 0'))
+    self.service.getLineItemsByStatement.assert_not_called()
+
+  def testAggregatePQLFallsBackToEntities(self):
+    pql_service = mock.MagicMock()
+    pql_service.select.__name__ = 'select'
+    self.handler._services['PublisherQueryLanguageService'] = pql_service
+    pql_service.select.side_effect = api_handler.Fault('unknown column')
+    self.service.getLineItemsByStatement.return_value = {
+        'totalResultSetSize': 1,
+        'results': [mock.Mock(status='PAUSED')],
+    }
+
+    result = self.handler.Aggregate('GetLineItems', '1234', ['status'],
+                                    "WHERE name LIKE 'a%'")
+
+    self.assertEqual('entities', result['source'])
+    self.assertEqual([{'status': 'PAUSED', 'count': 1}], result['groups'])
+
+  def testCountResults(self):
+    self.service.getLineItemsByStatement.return_value = {
+        'totalResultSetSize': 1234,
+        'results': [{'id': 1}],
+    }
+
+    self.assertEqual(1234, self.handler.CountResults('GetLineItems', '1234'))
+    self.assertEqual(1234, self.handler.CountResults('GetLineItems', '1234'))
+
+    self.assertEqual(1, self.service.getLineItemsByStatement.call_count)
+    query = self.service.getLineItemsByStatement.call_args[0][0]['query']
+    self.assertEqual('LIMIT 1 OFFSET 0', query.strip())
+
+  def testDiffEntities(self):
+    networks = {
+        '1': [{'id': 1, 'name': 'a', 'status': 'PAUSED', 'stats': 5},
+              {'id': 2, 'name': 'b', 'status': 'READY', 'stats': 5},
+              {'id': 3, 'name': 'c', 'status': 'READY', 'stats': 5}],
+        '2': [{'id': 1, 'name': 'a', 'status': 'READY', 'stats': 9},
+              {'id': 2, 'name': 'b', 'status': 'READY', 'stats': 9},
+              {'id': 4, 'name': 'd', 'status': 'READY', 'stats': 9}],
+    }
+
+    def get_line_items(statement):
+      entities = networks[self.handler.client.network_code]
+      ids = re.search(r'id IN \((.*)\)', statement['query'])
+      if ids:
+        entities = [entity for entity in entities
+                    if str(entity['id']) in ids.group(1).split(', ')]
+      return {'totalResultSetSize': len(entities), 'results': entities}
+    self.service.getLineItemsByStatement.side_effect = get_line_items
+
+    result = self.handler.DiffEntities('GetLineItems', '1', '2')
+
+    self.assertEqual([4], result['added'])
+    self.assertEqual([3], result['removed'])
+    self.assertEqual([{
+        'key': 1,
+        'fields': [{'path': 'status', 'left': 'PAUSED', 'right': 'READY'}],
+    }], result['changed'])
+    self.assertEqual((3, 3, 1), (result['leftCount'], result['rightCount'],
+                                 result['unchangedCount']))
+
+    # a snapshot of the left side only tells which entities changed
+    left_digests = self.handler.DigestEntities('GetLineItems', '1')
+    result = self.handler.DiffEntities('GetLineItems', '1', '2',
+                                       left_digests=left_digests)
+    self.assertEqual([{'key': 1, 'fields': None}], result['changed'])
+
+  def testDigestEntitiesRejectsDuplicateKeys(self):
+    self.service.getLineItemsByStatement.return_value = {
+        'totalResultSetSize': 3,
+        'results': [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'},
+                    {'id': 3, 'name': 'a'}],
+    }
+
+    with self.assertRaises(entity_diff.DuplicateKeyError) as context:
+      self.handler.DigestEntities('GetLineItems', '1', key_attributes=('name',))
+    self.assertEqual(['a'], context.exception.keys)
+    self.assertEqual(3, len(self.handler.DigestEntities('GetLineItems', '1')))
+
+  def testWaitForReportJobBacksOff(self):
+    report_service = mock.MagicMock()
+    report_service.getReportJobStatus.side_effect = (
+        ['IN_PROGRESS'] * 4 + ['COMPLETED'])
+    self.handler._services['ReportService'] = report_service
+
+    with mock.patch.object(api_handler.time, 'sleep') as sleep:
+      self.assertEqual('COMPLETED',
+                       self.handler.WaitForReportJob('1234', 99, 60))
+
+    delays = [call[0][0] for call in sleep.call_args_list]
+    self.assertEqual(4, len(delays))
+    self.assertEqual(api_handler._REPORT_POLL_INITIAL_DELAY, delays[0])
+    self.assertTrue(all(x < y for x, y in zip(delays, delays[1:])))
+    report_service.getReportJobStatus.assert_called_with(99)
+
+  def testWaitForReportJobTimeout(self):
+    report_service = mock.MagicMock()
+    report_service.getReportJobStatus.return_value = 'IN_PROGRESS'
+    self.handler._services['ReportService'] = report_service
+
+    self.assertEqual('IN_PROGRESS',
+                     self.handler.WaitForReportJob('1234', 99, 0))
+    self.assertEqual(1, report_service.getReportJobStatus.call_count)
+
+  def testCountResultsIsCachedPerUser(self):
+    self.service.getLineItemsByStatement.return_value = {
+        'totalResultSetSize': 7}
+    self.handler.user = mock.MagicMock(email='a@example.com')
+
+    self.assertEqual(7, self.handler.CountResults('GetLineItems', '1234'))
+    self.assertEqual(7, self.handler.CountResults('GetLineItems', '1234'))
+    self.assertEqual(1, self.service.getLineItemsByStatement.call_count)
+
+    self.handler.user = mock.MagicMock(email='b@example.com')
+    self.service.getLineItemsByStatement.return_value = {
+        'totalResultSetSize': 3}
+    self.assertEqual(3, self.handler.CountResults('GetLineItems', '1234'))
+    self.assertEqual(2, self.service.getLineItemsByStatement.call_count)
+
+  def testGetDeliveryForecastsInBatches(self):
+    forecast_service = mock.MagicMock()
+    forecast_service.getDeliveryForecastByIds.side_effect = (
+        lambda ids, unused_options: {'lineItemDeliveryForecasts': [
+            {'lineItemId': i, 'predictedDeliveryUnits': i * 10} for i in ids
+        ]})
+    self.handler._services['ForecastService'] = forecast_service
+
+    with mock.patch.object(api_handler, '_FORECAST_BATCH_SIZE', 2):
+      forecasts = self.handler.GetDeliveryForecasts('1234', [3, 1, 2, 1])
+
+    self.assertEqual([1, 2, 3], sorted(forecasts))
+    self.assertEqual(30, forecasts[3]['predictedDeliveryUnits'])
+    self.assertEqual(2, forecast_service.getDeliveryForecastByIds.call_count)
+
+  def testGetAvailabilityForecastsReusesForecasts(self):
+    forecast_service = mock.MagicMock()
+    forecast_service.getAvailabilityForecastById.side_effect = (
+        lambda line_item_id, unused_options: {'availableUnits': line_item_id})
+    self.handler._services['ForecastService'] = forecast_service
+    line_items = [{'id': 1, 'lastModifiedDateTime': 'a'},
+                  {'id': 2, 'lastModifiedDateTime': 'a'}]
+
+    forecasts = self.handler.GetAvailabilityForecasts('1234', line_items)
+    self.assertEqual({1: {'availableUnits': 1}, 2: {'availableUnits': 2}},
+                     forecasts)
+    self.assertEqual(2, forecast_service.getAvailabilityForecastById.call_count)
+
+    # only the modified line item is forecast again
+    line_items[1]['lastModifiedDateTime'] = 'b'
+    self.handler.GetAvailabilityForecasts('1234', line_items)
+    self.assertEqual(3, forecast_service.getAvailabilityForecastById.call_count)
+    forecast_service.getAvailabilityForecastById.assert_called_with(
+        2, api_handler._FORECAST_OPTIONS)
+
+  def testGetProspectiveAvailabilityForecastsDeduplicates(self):
+    forecast_service = mock.MagicMock()
+    forecast_service.getAvailabilityForecast.side_effect = (
+        lambda item, unused_options: {'availableUnits': item['lineItem']['x']})
+    self.handler._services['ForecastService'] = forecast_service
+
+    forecasts = self.handler.GetProspectiveAvailabilityForecasts(
+        '1234', [{'lineItem': {'x': 1}}, {'lineItem': {'x': 2}},
+                 {'lineItem': {'x': 1}}])
+
+    self.assertEqual([1, 2, 1],
+                     [forecast['availableUnits'] for forecast in forecasts])
+    self.assertEqual(2, forecast_service.getAvailabilityForecast.call_count)
+
+  def testGetProspectiveAvailabilityForecastsErrors(self):
+    forecast_service = mock.MagicMock()
+
+    def Forecast(item, unused_options):
+      if item['lineItem']['x'] == 2:
+        raise ValueError('Invalid line item')
+      return {'availableUnits': item['lineItem']['x']}
+    forecast_service.getAvailabilityForecast.side_effect = Forecast
+    self.handler._services['ForecastService'] = forecast_service
+    items = [{'lineItem': {'x': 1}}, {'lineItem': {'x': 2}}]
+
+    forecasts = self.handler.GetProspectiveAvailabilityForecasts('1234', items)
+    self.assertEqual([{'availableUnits': 1}, {'error': 'Invalid line item'}],
+                     forecasts)
+
+    # only the successful forecast is cached
+    self.handler.GetProspectiveAvailabilityForecasts('1234', items)
+    self.assertEqual(3, forecast_service.getAvailabilityForecast.call_count)
+
+    # other users do not share the cached forecasts
+    self.handler.user = mock.MagicMock(email='other@example.com')
+    self.handler.GetProspectiveAvailabilityForecasts('1234', items[:1])
+    self.assertEqual(4, forecast_service.getAvailabilityForecast.call_count)
+
+  def testFanOutUsesEachNetworkCode(self):
+    user_service = mock.MagicMock()
+    self.handler._services['UserService'] = user_service
+
+    def get_users(unused_statement):
+      network_code = self.handler.client.network_code
+      if network_code == '3':
+        raise ValueError('no access')
+      return {'totalResultSetSize': 1, 'results': [network_code]}
+    user_service.getUsersByStatement.side_effect = get_users
+
+    answers = sorted(self.handler.FanOut('GetUsers', ['1', '2', '3'],
+                                         'WHERE id != 0', timeout=5))
+
+    self.assertEqual([
+        ('1', {'totalResultSetSize': 1, 'results': ['1']}, None),
+        ('2', {'totalResultSetSize': 1, 'results': ['2']}, None),
+        ('3', None, 'no access'),
+    ], answers)
+
+  def testServiceCallsAreScheduled(self):
+    user_service = mock.MagicMock()
+    user_service.getUsersByStatement.return_value = {
+        'totalResultSetSize': 0,
+        'results': [],
+    }
+    self.handler._services['UserService'] = user_service
+    self.handler.user = mock.MagicMock(email='user@example.com')
+    self.handler.priority = upstream_scheduler.BULK
+    scheduler = mock.MagicMock()
+    scheduler.Run.side_effect = (
+        lambda unused_user_key, unused_priority, func, *args: func(*args))
+
+    with mock.patch.object(upstream_scheduler, 'GetScheduler',
+                           return_value=scheduler):
+      self.handler.GetUsers('1234')
+
+    self.assertEqual(1, scheduler.Run.call_count)
+    self.assertEqual(('user@example.com', upstream_scheduler.BULK),
+                     scheduler.Run.call_args[0][:2])
+    self.assertEqual(1, user_service.getUsersByStatement.call_count)
+
+  def testPageTimeExcludesSchedulerWait(self):
+    user_service = mock.MagicMock()
+    user_service.getUsersByStatement.return_value = {
+        'totalResultSetSize': 2,
+        'results': [{'id': 1}, {'id': 2}],
+    }
+    self.handler._services['UserService'] = user_service
+    self.handler.page_limit = 2
+    scheduler = upstream_scheduler.UpstreamScheduler(max_calls=1)
+    admitted = threading.Event()
+    done = threading.Event()
+
+    def busy():
+      admitted.set()
+      done.wait()
+    thread = threading.Thread(target=scheduler.Run,
+                              args=('other@example.com',
+                                    upstream_scheduler.INTERACTIVE, busy))
+    thread.start()
+    admitted.wait()
+    threading.Timer(0.2, done.set).start()
+
+    with mock.patch.object(upstream_scheduler, 'GetScheduler',
+                           return_value=scheduler):
+      with mock.patch.object(api_handler.page_sizer,
+                             'RecordPage') as record_page:
+        self.handler.GetUsers('1234')
+    thread.join()
+
+    # the call waited for the other one's slot, which is not its latency
+    self.assertEqual(1, record_page.call_count)
+    self.assertTrue(record_page.call_args[0][3] < 0.1)
+
+  def testFanOutTimeout(self):
+    user_service = mock.MagicMock()
+    self.handler._services['UserService'] = user_service
+    called = []
+    deadlines = {}
+
+    def get_users(unused_statement):
+      network_code = self.handler.client.network_code
+      called.append(network_code)
+      deadline = api_handler.GetThreadDeadline()
+      deadlines[network_code] = deadline - time.time()
+      if network_code == '2':
+        # a slow call, which the transport ends at the deadline
+        time.sleep(max(0, deadline - time.time()) + 0.1)
+        raise requests.exceptions.Timeout()
+      return {'totalResultSetSize': 0, 'results': []}
+    user_service.getUsersByStatement.side_effect = get_users
+
+    with mock.patch.object(api_handler, '_MAX_FANOUT_CALLS', 1):
+      answers = list(self.handler.FanOut('GetUsers', ['1', '2', '3'],
+                                         timeout=0.1))
+
+    self.assertEqual(['1', '3', '2'], [answer[0] for answer in answers])
+    self.assertEqual(None, answers[0][2])
+    # the third network is cancelled as it had no worker in time
+    self.assertTrue(answers[1][2].startswith('No answer'))
+    self.assertTrue(answers[2][2].startswith('No answer'))
+    self.assertEqual(['1', '2'], called)
+    # each network's clock starts with its call
+    self.assertTrue(0.05 < deadlines['2'] <= 0.1)
+    self.assertEqual(None, api_handler.GetThreadDeadline())
+
+  def testSearchNames(self):
+    order_service = mock.MagicMock()
+    order_service.getOrdersByStatement.return_value = {
+        'totalResultSetSize': 1,
+        'results': [{'id': 1, 'name': "Bob's order"}],
+    }
+    self.handler._services['OrderService'] = order_service
+    self.service.getLineItemsByStatement.side_effect = ValueError('failed')
+
+    answers = sorted(self.handler.SearchNames(
+        '1234', ['GetOrders', 'GetLineItems'], "Bob's%", 5, timeout=5))
+
+    self.assertEqual([
+        ('GetLineItems', None, 'failed'),
+        ('GetOrders', [(1, "Bob's order")], None),
+    ], answers)
+    self.assertEqual(
+        "WHERE name LIKE 'Bob\\'s%' LIMIT 5 OFFSET 0",
+        order_service.getOrdersByStatement.call_args[0][0]['query'])
+
+
+  def testSearchNamesTimeout(self):
+    order_service = mock.MagicMock()
+    order_service.getOrdersByStatement.return_value = {
+        'totalResultSetSize': 0, 'results': []}
+    self.handler._services['OrderService'] = order_service
+    deadlines = []
+
+    def get_line_items(unused_statement):
+      deadline = api_handler.GetThreadDeadline()
+      deadlines.append(deadline - time.time())
+      # a slow call, which the transport ends at the deadline
+      time.sleep(max(0, deadline - time.time()) + 0.1)
+      raise requests.exceptions.Timeout()
+    self.service.getLineItemsByStatement.side_effect = get_line_items
+
+    answers = list(self.handler.SearchNames(
+        '1234', ['GetOrders', 'GetLineItems'], 'Bob', 5, timeout=0.1))
+
+    self.assertEqual(('GetOrders', [], None), answers[0])
+    self.assertEqual('GetLineItems', answers[1][0])
+    self.assertTrue(answers[1][2].startswith('No answer'))
+    self.assertTrue(0.05 < deadlines[0] <= 0.1)
+    self.assertEqual(None, api_handler.GetThreadDeadline())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,189 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bundled, minified and fingerprinted static assets.
+
+Pages load the playground's own scripts and style sheets as one bundle of
+each. Running this module as a script concatenates and minifies the files of
+each bundle into static/dist/, with a hash of the content in the file name,
+and writes a manifest of the names. Since a changed file gets a new name,
+app.yaml serves static/dist/ with year-long immutable cache headers, and
+repeat page loads request no assets at all. Without a manifest, pages load
+the source files from static/js/ and static/css/ as before.
+
+Usage:
+  python assets.py
+"""
+
+import hashlib
+import json
+import os
+import re
+
+# Source files of each bundle, relative to static/, in load order.
+BUNDLES = {
+    'app.css': [
+        'css/mdl-accordion.css',
+        'css/md-data-table.css',
+        'css/style.css',
+    ],
+    'app.js': [
+        'js/mdl-accordion.js',
+        'js/md-data-table.js',
+        'js/app.js',
+    ],
+}
+
+_STATIC_PATH = os.path.join(os.path.dirname(__file__), 'static')
+_DIST_DIRECTORY = 'dist'
+_MANIFEST_NAME = 'manifest.json'
+# Hex digits of the content hash in bundle file names.
+_HASH_LENGTH = 10
+
+_manifest = None
+
+
+def AssetUrls(bundle_name):
+  """Returns the URLs to load a bundle from, for use in templates.
+
+  Args:
+    bundle_name: str The bundle's name, a key of BUNDLES.
+
+  Returns:
+    list The URL of the built bundle, or the URLs of its source files if no
+    bundles were built.
+  """
+  global _manifest
+  if _manifest is None:
+    _manifest = _LoadManifest(_STATIC_PATH)
+  if bundle_name in _manifest:
+    return ['/static/%s/%s' % (_DIST_DIRECTORY, _manifest[bundle_name])]
+  return ['/static/%s' % path for path in BUNDLES[bundle_name]]
+
+
+def _LoadManifest(static_path):
+  """Returns the built bundle file names, by bundle name."""
+  try:
+    with open(os.path.join(static_path, _DIST_DIRECTORY, _MANIFEST_NAME)) as f:
+      return json.load(f)
+  except IOError:
+    return {}
+
+
+def MinifyJS(source):
+  """Removes comments, indentation and blank lines from a script.
+
+  Only whole line comments are removed and line breaks are kept, so this
+  never changes what a script does, even where it relies on automatic
+  semicolon insertion. Block comments with a @license are kept.
+
+  Args:
+    source: str The script.
+
+  Returns:
+    str The minified script.
+  """
+  lines = []
+  comment = None
+  for line in source.splitlines():
+    line = line.strip()
+    if comment is not None:
+      comment.append(line)
+      if '*/' not in line:
+        continue
+      line = line[line.index('*/') + 2:].strip()
+      if any('@license' in comment_line for comment_line in comment):
+        lines.extend(comment)
+      comment = None
+    elif line.startswith('/*'):
+      comment = [line]
+      if '*/' not in line[2:]:
+        continue
+      line = line[line.index('*/', 2) + 2:].strip()
+      if '@license' in comment[0]:
+        lines.extend(comment)
+      comment = None
+    if line and not line.startswith('//'):
+      lines.append(line)
+  return '\n'.join(lines) + '\n'
+
+
+def MinifyCSS(source):
+  """Removes comments and redundant whitespace from a style sheet.
+
+  Args:
+    source: str The style sheet.
+
+  Returns:
+    str The minified style sheet.
+  """
+  parts = []
+  # strings are kept as they are, everything between them is minified
+  for index, part in enumerate(
+      re.split(r'("(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')', source)):
+    if index % 2:
+      parts.append(part)
+      continue
+    part = re.sub(r'/\*.*?\*/', '', part, flags=re.DOTALL)
+    part = re.sub(r'\s+', ' ', part)
+    part = re.sub(r' ?([{};,>]) ?', r'\1', part).replace(': ', ':')
+    parts.append(part.replace(';}', '}'))
+  return ''.join(parts).strip() + '\n'
+
+
+def BuildBundles(static_path=_STATIC_PATH):
+  """Builds every bundle into static/dist/ and writes the manifest.
+
+  Files of earlier builds are removed.
+
+  Args:
+    static_path: str The static file directory.
+
+  Returns:
+    dict The built bundle file names, by bundle name.
+  """
+  dist_path = os.path.join(static_path, _DIST_DIRECTORY)
+  if not os.path.isdir(dist_path):
+    os.makedirs(dist_path)
+  manifest = {}
+  for bundle_name, paths in sorted(BUNDLES.iteritems()):
+    minify = MinifyCSS if bundle_name.endswith('.css') else MinifyJS
+    sources = []
+    for path in paths:
+      with open(os.path.join(static_path, path)) as f:
+        sources.append(minify(f.read()))
+    if bundle_name.endswith('.js'):
+      # a semicolon before each script keeps it from running into the one
+      # before, and keeps a file level 'use strict' directive of the first
+      # script from applying to the whole bundle
+      sources = [';' + source for source in sources]
+    content = ''.join(sources)
+    base, extension = os.path.splitext(bundle_name)
+    file_name = '%s.%s%s' % (
+        base, hashlib.sha1(content).hexdigest()[:_HASH_LENGTH], extension)
+    with open(os.path.join(dist_path, file_name), 'w') as f:
+      f.write(content)
+    manifest[bundle_name] = file_name
+
+  for file_name in os.listdir(dist_path):
+    if file_name not in manifest.values():
+      os.remove(os.path.join(dist_path, file_name))
+  with open(os.path.join(dist_path, _MANIFEST_NAME), 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+  return manifest
+
+
+if __name__ == '__main__':
+  for name, built_name in sorted(BuildBundles().iteritems()):
+    print '%s -> static/%s/%s' % (name, _DIST_DIRECTORY, built_name)
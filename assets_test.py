@@ -0,0 +1,108 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the static asset bundles."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import assets
+from assets import AssetUrls
+from assets import BuildBundles
+from assets import MinifyCSS
+from assets import MinifyJS
+import mock
+
+
+class AssetsTest(unittest.TestCase):
+  """Tests for assets.py."""
+
+  def setUp(self):
+    self.static_path = tempfile.mkdtemp()
+    os.makedirs(os.path.join(self.static_path, 'js'))
+    self.bundles_patcher = mock.patch.object(assets, 'BUNDLES', {
+        'app.js': ['js/a.js', 'js/b.js'],
+    })
+    self.bundles_patcher.start()
+    self._WriteScript('a.js', "'use strict';\nvar a = 1\n")
+    self._WriteScript('b.js', 'var b = 2;\n')
+
+  def tearDown(self):
+    self.bundles_patcher.stop()
+    assets._manifest = None
+    shutil.rmtree(self.static_path)
+
+  def _WriteScript(self, name, source):
+    with open(os.path.join(self.static_path, 'js', name), 'w') as f:
+      f.write(source)
+
+  def testMinifyJS(self):
+    source = '\n'.join([
+        '/**',
+        ' * @license MIT',
+        ' */',
+        '/* Explains the function.',
+        ' */',
+        'function f() {',
+        '  // a comment',
+        "  return 'http://example.com/*';  // kept",
+        '',
+        '  /* inline */ var x = /a*/;',
+        '}',
+    ])
+
+    self.assertEqual('\n'.join([
+        '/**',
+        '* @license MIT',
+        '*/',
+        'function f() {',
+        "return 'http://example.com/*';  // kept",
+        'var x = /a*/;',
+        '}',
+    ]) + '\n', MinifyJS(source))
+
+  def testMinifyCSS(self):
+    source = ('/* header */\n.a > .b,\n.c:hover {\n  color: red;\n'
+              '  content: "a ,  b";\n}\n')
+
+    self.assertEqual('.a>.b,.c:hover{color:red;content:"a ,  b"}\n',
+                     MinifyCSS(source))
+
+  def testBuildBundles(self):
+    manifest = BuildBundles(self.static_path)
+    dist_path = os.path.join(self.static_path, 'dist')
+    with open(os.path.join(dist_path, manifest['app.js'])) as f:
+      self.assertEqual(";'use strict';\nvar a = 1\n;var b = 2;\n", f.read())
+
+    # a changed file changes the bundle's name, and old bundles are removed
+    self._WriteScript('b.js', 'var b = 3;\n')
+    rebuilt_manifest = BuildBundles(self.static_path)
+    self.assertNotEqual(manifest['app.js'], rebuilt_manifest['app.js'])
+    self.assertEqual(sorted([rebuilt_manifest['app.js'], 'manifest.json']),
+                     sorted(os.listdir(dist_path)))
+
+    with mock.patch.object(assets, '_STATIC_PATH', self.static_path):
+      self.assertEqual(['/static/dist/%s' % rebuilt_manifest['app.js']],
+                       AssetUrls('app.js'))
+
+  def testAssetUrlsWithoutBuild(self):
+    with mock.patch.object(assets, '_STATIC_PATH', self.static_path):
+      self.assertEqual(['/static/js/a.js', '/static/js/b.js'],
+                       AssetUrls('app.js'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,207 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the memory of serialized entities and their compact records.
+
+Line items and ad units with the fields of the DFP API are generated, each
+with its own copies of its strings as if parsed from a response, and kept as
+the OrderedDicts zeep serializes them to and as entity_store records. The
+deep size of each form, counting every object once, is reported per entity,
+along with the time taken to make and to expand the records. Run from the
+project root with the libraries in lib importable, for example:
+
+  PYTHONPATH=lib:$APPENGINE_SDK python benchmarks/entity_store_benchmark.py
+"""
+
+import argparse
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=g-import-not-at-top,g-bad-import-order
+import entity_store
+# pylint: enable=g-import-not-at-top,g-bad-import-order
+
+_LINE_ITEM_STATUSES = ('DELIVERING', 'READY', 'PAUSED', 'COMPLETED', 'DRAFT')
+_AD_UNIT_STATUSES = ('ACTIVE', 'INACTIVE', 'ARCHIVED')
+
+
+def _Copy(value):
+  """Returns a new string object equal to value, as a parser would."""
+  return ''.join(list(value))
+
+
+def _Money(micro_amount):
+  return collections.OrderedDict([
+      ('currencyCode', _Copy('USD')), ('microAmount', micro_amount)])
+
+
+def _LineItem(line_item_id, rng):
+  targeting = collections.OrderedDict([
+      ('geoTargeting', collections.OrderedDict([
+          ('targetedLocations', [
+              collections.OrderedDict([
+                  ('id', rng.randint(1000, 3000000)),
+                  ('type', _Copy('COUNTRY')),
+                  ('canonicalParentId', None),
+                  ('displayName', _Copy('Country %d' % rng.randint(1, 200))),
+              ]) for _ in range(rng.randint(1, 5))]),
+          ('excludedLocations', []),
+      ])),
+      ('inventoryTargeting', collections.OrderedDict([
+          ('targetedAdUnits', [
+              collections.OrderedDict([
+                  ('adUnitId', str(rng.randint(1, 100000))),
+                  ('includeDescendants', True),
+              ]) for _ in range(rng.randint(1, 10))]),
+          ('excludedAdUnits', []),
+          ('targetedPlacementIds', []),
+      ])),
+  ])
+  return collections.OrderedDict([
+      ('orderId', rng.randint(1, 100000)),
+      ('id', line_item_id),
+      ('name', _Copy('Line item %d' % line_item_id)),
+      ('externalId', None),
+      ('orderName', _Copy('Order %d' % rng.randint(1, 1000))),
+      ('startDateTime', collections.OrderedDict([
+          ('date', collections.OrderedDict([
+              ('year', 2019), ('month', rng.randint(1, 12)), ('day', 1)])),
+          ('hour', 0), ('minute', 0), ('second', 0),
+          ('timeZoneId', _Copy('America/New_York'))])),
+      ('startDateTimeType', _Copy('USE_START_DATE_TIME')),
+      ('autoExtensionDays', 0),
+      ('unlimitedEndDateTime', False),
+      ('creativeRotationType', _Copy('EVEN')),
+      ('deliveryRateType', _Copy('EVENLY')),
+      ('lineItemType', _Copy('STANDARD')),
+      ('priority', 8),
+      ('costPerUnit', _Money(rng.randint(1, 10) * 1000000)),
+      ('costType', _Copy('CPM')),
+      ('discountType', _Copy('PERCENTAGE')),
+      ('discount', 0.0),
+      ('contractedUnitsBought', 0),
+      ('creativePlaceholders', [collections.OrderedDict([
+          ('size', collections.OrderedDict([
+              ('width', 300), ('height', 250), ('isAspectRatio', False)])),
+          ('expectedCreativeCount', 1),
+          ('creativeSizeType', _Copy('PIXEL')),
+      ])]),
+      ('environmentType', _Copy('BROWSER')),
+      ('companionDeliveryOption', _Copy('UNKNOWN')),
+      ('allowOverbook', False),
+      ('skipInventoryCheck', False),
+      ('reserveAtCreation', False),
+      ('status', _Copy(rng.choice(_LINE_ITEM_STATUSES))),
+      ('reservationStatus', _Copy('RESERVED')),
+      ('isArchived', False),
+      ('webPropertyCode', None),
+      ('appliedLabels', []),
+      ('isMissingCreatives', False),
+      ('lastModifiedByApp', _Copy('Goog_DFPUI')),
+      ('notes', None),
+      ('targeting', targeting),
+  ])
+
+
+def _AdUnit(ad_unit_id, rng):
+  return collections.OrderedDict([
+      ('id', str(ad_unit_id)),
+      ('parentId', str(rng.randint(1, 1000))),
+      ('hasChildren', rng.random() < 0.2),
+      ('parentPath', []),
+      ('name', _Copy('ad_unit_%d' % ad_unit_id)),
+      ('description', None),
+      ('targetWindow', _Copy('BLANK')),
+      ('status', _Copy(rng.choice(_AD_UNIT_STATUSES))),
+      ('adUnitCode', _Copy('ca-pub-%d' % ad_unit_id)),
+      ('adUnitSizes', [collections.OrderedDict([
+          ('size', collections.OrderedDict([
+              ('width', 728), ('height', 90), ('isAspectRatio', False)])),
+          ('environmentType', _Copy('BROWSER')),
+          ('fullDisplayString', _Copy('728x90')),
+      ])]),
+      ('isInterstitial', False),
+      ('isNative', False),
+      ('isFluid', False),
+      ('explicitlyTargeted', False),
+      ('appliedLabels', []),
+      ('lastModifiedDateTime', None),
+      ('smartSizeMode', _Copy('NONE')),
+      ('isSetTopBoxEnabled', False),
+  ])
+
+
+def _DeepSize(root):
+  """Returns the bytes of an object and all objects it refers to, once each."""
+  seen = set()
+  size = 0
+  stack = [root]
+  while stack:
+    value = stack.pop()
+    if id(value) in seen or isinstance(value, type):
+      continue
+    seen.add(id(value))
+    size += sys.getsizeof(value)
+    if isinstance(value, dict):
+      stack.extend(value.keys())
+      stack.extend(value.values())
+    elif isinstance(value, (list, tuple)):
+      stack.extend(value)
+    elif isinstance(value, entity_store.CompactRecord):
+      stack.extend(getattr(value, slot) for slot in type(value).__slots__)
+    elif hasattr(value, '__dict__'):
+      stack.append(value.__dict__)
+  return size
+
+
+def _Measure(name, make_entity, count, rng):
+  """Prints the memory and the conversion times of one entity type."""
+  entities = [make_entity(i, rng) for i in range(1, count + 1)]
+  dict_size = _DeepSize(entities)
+
+  start = time.time()
+  records = [entity_store.CompactEntity(entity, name) for entity in entities]
+  compact_seconds = time.time() - start
+  record_size = _DeepSize(records)
+
+  start = time.time()
+  for record in records:
+    record.ToDict()
+  expand_seconds = time.time() - start
+
+  print('%-9s dicts %6d B/entity, records %6d B/entity (%.1fx smaller); '
+        'compact %5.1f us, expand %5.1f us per entity' % (
+            name, dict_size / count, record_size / count,
+            float(dict_size) / record_size,
+            compact_seconds * 1e6 / count, expand_seconds * 1e6 / count))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--entities', type=int, default=10000)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  _Measure('LineItem', _LineItem, args.entities, rng)
+  _Measure('AdUnit', _AdUnit, args.entities, rng)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,97 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures name_index searches over the names of a large network.
+
+Names are generated from a vocabulary the way trafficked names are formed,
+such as 'Acme_Summer_Sale_300x250 2019 #1234', an in-memory PrefixIndex is
+built of them, and queries of one or two words are searched as if typed one
+letter at a time. The build time and the latency percentiles of the searches
+are reported. Run from the project root with the libraries in lib
+importable, for example:
+
+  PYTHONPATH=lib:$APPENGINE_SDK python benchmarks/name_index_benchmark.py
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=g-import-not-at-top,g-bad-import-order
+from name_index import PrefixIndex
+# pylint: enable=g-import-not-at-top,g-bad-import-order
+
+_SIZES = ('300x250', '728x90', '160x600', '320x50', '970x250', 'Native')
+
+
+def _Vocabulary(rng, size):
+  """Returns made up words of 3 to 10 letters."""
+  letters = 'abcdefghijklmnopqrstuvwxyz'
+  return [''.join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+          for _ in range(size)]
+
+
+def _Name(rng, vocabulary, entity_id):
+  words = [rng.choice(vocabulary).capitalize()
+           for _ in range(rng.randint(1, 4))]
+  return '%s_%s %d #%d' % ('_'.join(words), rng.choice(_SIZES),
+                           rng.randint(2015, 2019), entity_id)
+
+
+def _Percentile(values, fraction):
+  return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--entities', type=int, default=300000)
+  parser.add_argument('--vocabulary', type=int, default=20000)
+  parser.add_argument('--queries', type=int, default=200)
+  parser.add_argument('--limit', type=int, default=10)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  vocabulary = _Vocabulary(rng, args.vocabulary)
+  entries = [(entity_id, _Name(rng, vocabulary, entity_id))
+             for entity_id in range(1, args.entities + 1)]
+
+  start = time.time()
+  index = PrefixIndex(entries)
+  build_seconds = time.time() - start
+  print('%d names, %d distinct words: built in %.1f s' % (
+      len(entries), len(index.words), build_seconds))
+
+  latencies = []
+  for _ in range(args.queries):
+    # a query as typed, letter by letter, of one or two words of a name
+    words = rng.choice(entries)[1].split('_')
+    query = ' '.join(words[:rng.randint(1, min(2, len(words)))])
+    for length in range(1, len(query) + 1):
+      start = time.time()
+      index.Search(query[:length], args.limit)
+      latencies.append((time.time() - start) * 1000)
+  latencies.sort()
+  print('%d searches: p50 %.2f ms, p95 %.2f ms, p99 %.2f ms, max %.2f ms' % (
+      len(latencies), _Percentile(latencies, 0.5),
+      _Percentile(latencies, 0.95), _Percentile(latencies, 0.99),
+      latencies[-1]))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,176 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares sequential and pipelined request handling in APIHandler.
+
+Each stage of an API request is replaced by a sleep of a configurable
+latency: the user lookup, the access token refresh, resolving the service
+(WSDL download and parsing) and the SOAP call itself. The sequential run
+performs them one after another, as APIViewHandler.get used to. The pipelined
+run uses APIHandler.Prefetch and SetUser like APIViewHandler.get does now.
+Paging through several pages with GetAllResults is measured the same way.
+Run from the project root with the libraries in lib importable, for example:
+
+  PYTHONPATH=lib:$APPENGINE_SDK python benchmarks/pipeline_benchmark.py
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=g-import-not-at-top,g-bad-import-order
+import mock
+import api_handler
+# pylint: enable=g-import-not-at-top,g-bad-import-order
+
+
+class _Latencies(object):
+  """Simulated latency of each stage, in seconds."""
+
+  def __init__(self, args):
+    self.user_lookup = args.user_lookup_ms / 1000.0
+    self.token_refresh = args.token_refresh_ms / 1000.0
+    self.service = args.service_ms / 1000.0
+    self.call = args.call_ms / 1000.0
+
+
+def _Patches(latencies, total_result_set_size):
+  """Returns patches that replace the DFP API with sleeps."""
+
+  class FakeService(object):
+
+    def getUsersByStatement(self, statement):  # pylint: disable=invalid-name
+      time.sleep(latencies.call)
+      limit = statement['query'].split('LIMIT ')[1].split()[0]
+      return {
+          'totalResultSetSize': total_result_set_size,
+          'results': [None] * int(limit),
+      }
+
+  class FakeClient(object):
+
+    def __init__(self, oauth2_client, *unused_args, **unused_kwargs):
+      self.oauth2_client = oauth2_client
+      self.network_code = None
+
+    def GetService(self, unused_service_name):
+      time.sleep(latencies.service)
+      return FakeService()
+
+  class FakeCredentials(object):
+
+    def __init__(self, *unused_args):
+      pass
+
+    def CreateHttpHeader(self):
+      time.sleep(latencies.token_refresh)
+
+  class FakeStatement(object):
+
+    def __init__(self, where_clause='', limit=None, offset=0):
+      self.where_clause = where_clause
+      self.limit = limit
+      self.offset = offset
+
+    def ToStatement(self):
+      return {'query': '%s LIMIT %d OFFSET %d' % (
+          self.where_clause, self.limit, self.offset)}
+
+  return [
+      mock.patch.object(api_handler, '_NetworkScopedClient', FakeClient),
+      mock.patch.object(api_handler, 'PooledRefreshTokenClient',
+                        FakeCredentials),
+      mock.patch.object(api_handler, 'FilterStatement', FakeStatement),
+      mock.patch.object(api_handler, 'InstallSharedTransport', lambda: None),
+  ]
+
+
+def _Sequential(latencies):
+  time.sleep(latencies.user_lookup)
+  user = mock.MagicMock()
+  time.sleep(latencies.token_refresh)
+  handler = api_handler.APIHandler('id', 'secret', None, 'benchmark')
+  handler.user = user
+  handler.client.oauth2_client = mock.MagicMock()
+  handler.GetUsers('1234', api_handler.FilterStatement('', limit=25))
+
+
+def _Pipelined(latencies):
+  handler = api_handler.APIHandler('id', 'secret', None, 'benchmark')
+  handler.Prefetch('GetUsers')
+  time.sleep(latencies.user_lookup)
+  handler.SetUser(mock.MagicMock())
+  handler.GetUsers('1234', api_handler.FilterStatement('', limit=25))
+
+
+def _PagesSequential(unused_latencies, pages):
+  handler = api_handler.APIHandler('id', 'secret', mock.MagicMock(),
+                                   'benchmark')
+  for page in range(pages):
+    handler.GetUsers('1234', api_handler.FilterStatement(
+        '', limit=25, offset=page * 25))
+
+
+def _PagesConcurrent(unused_latencies, pages):
+  handler = api_handler.APIHandler('id', 'secret', mock.MagicMock(),
+                                   'benchmark')
+  for _ in handler.GetAllResults('GetUsers', '1234', page_size=25,
+                                 limit=pages * 25):
+    pass
+
+
+def _Time(func, repetitions, *args):
+  start = time.time()
+  for _ in range(repetitions):
+    func(*args)
+  return (time.time() - start) / repetitions * 1000
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--user-lookup-ms', type=float, default=30)
+  parser.add_argument('--token-refresh-ms', type=float, default=80)
+  parser.add_argument('--service-ms', type=float, default=150)
+  parser.add_argument('--call-ms', type=float, default=200)
+  parser.add_argument('--pages', type=int, default=8)
+  parser.add_argument('--repetitions', type=int, default=5)
+  args = parser.parse_args()
+  latencies = _Latencies(args)
+
+  patches = _Patches(latencies, total_result_set_size=args.pages * 25)
+  for patch in patches:
+    patch.start()
+  try:
+    sequential = _Time(_Sequential, args.repetitions, latencies)
+    pipelined = _Time(_Pipelined, args.repetitions, latencies)
+    print('single page:  sequential %7.1f ms, pipelined %7.1f ms (-%.0f%%)' % (
+        sequential, pipelined, 100 * (1 - pipelined / sequential)))
+
+    sequential = _Time(_PagesSequential, args.repetitions, latencies,
+                       args.pages)
+    concurrent = _Time(_PagesConcurrent, args.repetitions, latencies,
+                       args.pages)
+    print('%d pages:      sequential %7.1f ms, concurrent %7.1f ms (-%.0f%%)'
+          % (args.pages, sequential, concurrent,
+             100 * (1 - concurrent / sequential)))
+  finally:
+    for patch in patches:
+      patch.stop()
+
+
+if __name__ == '__main__':
+  main()
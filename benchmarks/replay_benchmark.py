@@ -0,0 +1,291 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Replays recorded API traffic against the WSGI app, without the network.
+
+The cassette is the JSONL file served by /tasks/traffic while
+traffic_recorder.RECORD_TRAFFIC is set. Its API requests are sent to
+dfp_playground.app at the times they were recorded, divided by --speed, so
+a speed of 2 replays at twice the real concurrency. Upstream requests are
+answered with the recorded responses after their recorded latency, scaled by
+--upstream-latency, and access token refreshes with a dummy token. The app
+runs against App Engine testbed stubs as a user with a refresh token.
+
+The throughput and the latency of each route are printed, and can be saved
+with --output. Given the results of an earlier run as --baseline, for example
+of the previous commit, slower routes and lower throughput are reported as
+regressions and the exit status is 1. Run from the project root with the
+libraries in lib and the App Engine SDK importable, for example:
+
+  PYTHONPATH=lib:$APPENGINE_SDK python benchmarks/replay_benchmark.py \\
+      cassette.jsonl --output results.json --baseline previous.json
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib
+from urlparse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=g-import-not-at-top,g-bad-import-order
+import http_transport
+from models import AppCredential
+from models import AppUser
+from parallel import WorkerPool
+from requests.adapters import HTTPAdapter
+import traffic_recorder
+
+from google.appengine.api import users
+from google.appengine.ext import testbed
+# pylint: enable=g-import-not-at-top,g-bad-import-order
+
+_USER_EMAIL = 'replay@example.com'
+_TOKEN_HOSTS = frozenset(['accounts.google.com', 'oauth2.googleapis.com'])
+_TOKEN_RESPONSE = json.dumps({
+    'access_token': 'replay',
+    'expires_in': 3600,
+    'token_type': 'Bearer',
+})
+# Changes smaller than this many milliseconds are not reported, whatever
+# the threshold.
+_MIN_REGRESSION_MS = 5
+
+
+class _ReplayAdapter(HTTPAdapter):
+  """Answers upstream requests with recorded responses."""
+
+  def __init__(self, upstream, latency_scale):
+    super(_ReplayAdapter, self).__init__()
+    self._lock = threading.Lock()
+    self._responses = dict(
+        (key, itertools.cycle(records))
+        for key, records in upstream.iteritems())
+    self._latency_scale = latency_scale
+    self.misses = 0
+
+  def send(self, request, **unused_kwargs):
+    """Returns the recorded response to a request."""
+    if urlparse(request.url).hostname in _TOKEN_HOSTS:
+      return self.build_response(request, traffic_recorder.BufferedResponseBody(
+          _TOKEN_RESPONSE, 200, 'application/json'))
+    key = traffic_recorder.UpstreamKey(request.method, request.url,
+                                       request.body, anonymize=False)
+    with self._lock:
+      responses = self._responses.get(key)
+      record = next(responses) if responses else None
+      if record is None:
+        self.misses += 1
+    if record is None:
+      return self.build_response(request, traffic_recorder.BufferedResponseBody(
+          'Not recorded', 404, 'text/plain'))
+    time.sleep(record['seconds'] * self._latency_scale)
+    return self.build_response(request, traffic_recorder.BufferedResponseBody(
+        traffic_recorder.DecodeBody(record), record['status'],
+        record['contentType']))
+
+
+def _LoadCassette(path):
+  """Returns a cassette's API requests and upstream responses by key."""
+  api_requests = []
+  upstream = collections.defaultdict(list)
+  with open(path) as f:
+    for line in f:
+      if not line.strip():
+        continue
+      record = json.loads(line)
+      if record['type'] == 'request':
+        api_requests.append(record)
+      else:
+        upstream[record['key']].append(record)
+  api_requests.sort(key=lambda record: record['started'])
+  for records in upstream.itervalues():
+    records.sort(key=lambda record: record['started'])
+  return api_requests, upstream
+
+
+def _SetUpApp(upstream, latency_scale):
+  """Sets up the stubs, the user and the upstream responses.
+
+  Returns:
+    tuple The testbed and the replay adapter.
+  """
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_datastore_v3_stub()
+  bed.init_memcache_stub()
+  bed.init_taskqueue_stub()
+  bed.init_urlfetch_stub()
+  bed.init_user_stub()
+  bed.init_app_identity_stub()
+  bed.setup_env(USER_EMAIL=_USER_EMAIL, USER_ID='1', USER_IS_ADMIN='0',
+                overwrite=True)
+  AppCredential(client_id='replay', client_secret='replay').put()
+  AppUser(user=users.User(_USER_EMAIL), email=_USER_EMAIL,
+          refresh_token='replay').put()
+
+  adapter = _ReplayAdapter(upstream, latency_scale)
+  session = http_transport.GetSession()
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+  return bed, adapter
+
+
+def _RouteName(record):
+  """Returns a request's route, its method and path without entity ids."""
+  return '%s %s' % (record['method'], re.sub(r'/[\d,]+(?=/|$)', '/<ids>',
+                                             record['path']))
+
+
+def _Replay(app, record):
+  """Sends a recorded request to the app.
+
+  Returns:
+    tuple The response status and the milliseconds it took.
+  """
+  params = urllib.urlencode([(name.encode('utf-8'), value.encode('utf-8'))
+                             for name, value in record['params']])
+  start = time.time()
+  if record['method'] == 'GET':
+    response = app.get_response(
+        '%s?%s' % (record['path'], params) if params else record['path'])
+  else:
+    response = app.get_response(
+        record['path'], method=record['method'], body=params,
+        content_type='application/x-www-form-urlencoded')
+  return response.status_int, (time.time() - start) * 1000
+
+
+def _Percentile(values, fraction):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _Run(api_requests, speed, max_concurrency):
+  """Replays the requests on their recorded schedule.
+
+  Returns:
+    tuple The seconds the replay took and the (route, recorded status,
+    status, milliseconds) tuple of each request.
+  """
+  import dfp_playground  # pylint: disable=g-import-not-at-top
+  pool = WorkerPool(max_concurrency)
+  first_started = api_requests[0]['started']
+  start = time.time()
+  futures = []
+  for record in api_requests:
+    delay = start + (record['started'] - first_started) / speed - time.time()
+    if delay > 0:
+      time.sleep(delay)
+    futures.append((record, pool.Submit(_Replay, dfp_playground.app, record)))
+  outcomes = []
+  for record, future in futures:
+    status, milliseconds = future.Result()
+    outcomes.append((_RouteName(record), record['status'], status,
+                     milliseconds))
+  return time.time() - start, outcomes
+
+
+def _Summarize(seconds, outcomes, misses):
+  """Returns the results of a replay."""
+  latencies = collections.defaultdict(list)
+  for route, _, _, milliseconds in outcomes:
+    latencies[route].append(milliseconds)
+  return {
+      'requests': len(outcomes),
+      'seconds': seconds,
+      'throughput': len(outcomes) / seconds,
+      'upstreamMisses': misses,
+      'statusMismatches': sum(1 for _, recorded, status, _ in outcomes
+                              if recorded != status),
+      'routes': dict((route, {
+          'count': len(values),
+          'p50': _Percentile(values, 0.5),
+          'p95': _Percentile(values, 0.95),
+          'max': max(values),
+      }) for route, values in latencies.iteritems()),
+  }
+
+
+def _Regressions(results, baseline, threshold):
+  """Lists how the results are worse than the baseline's."""
+  regressions = []
+  if results['throughput'] < baseline['throughput'] * (1 - threshold):
+    regressions.append('throughput %.1f/s, was %.1f/s' % (
+        results['throughput'], baseline['throughput']))
+  for route, stats in sorted(results['routes'].iteritems()):
+    baseline_stats = baseline['routes'].get(route)
+    if not baseline_stats:
+      continue
+    for percentile in ('p50', 'p95'):
+      now, before = stats[percentile], baseline_stats[percentile]
+      if now > before * (1 + threshold) and now - before > _MIN_REGRESSION_MS:
+        regressions.append('%s %s %.1f ms, was %.1f ms' % (
+            route, percentile, now, before))
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('cassette')
+  parser.add_argument('--speed', type=float, default=1.0,
+                      help='multiple of the recorded request rate')
+  parser.add_argument('--upstream-latency', type=float, default=1.0,
+                      help='multiple of the recorded upstream latency')
+  parser.add_argument('--max-concurrency', type=int, default=100)
+  parser.add_argument('--output', help='file to save the results to')
+  parser.add_argument('--baseline', help='results of an earlier run')
+  parser.add_argument('--threshold', type=float, default=0.1,
+                      help='relative change reported as a regression')
+  args = parser.parse_args()
+
+  api_requests, upstream = _LoadCassette(args.cassette)
+  if not api_requests:
+    sys.exit('The cassette has no API requests')
+  bed, adapter = _SetUpApp(upstream, args.upstream_latency)
+  try:
+    seconds, outcomes = _Run(api_requests, args.speed, args.max_concurrency)
+  finally:
+    bed.deactivate()
+  results = _Summarize(seconds, outcomes, adapter.misses)
+
+  print('%d requests in %.1f s, %.1f requests/s, %d upstream misses, '
+        '%d status mismatches' % (
+            results['requests'], results['seconds'], results['throughput'],
+            results['upstreamMisses'], results['statusMismatches']))
+  for route, stats in sorted(results['routes'].iteritems()):
+    print('  %-45s %5d  p50 %8.1f ms  p95 %8.1f ms  max %8.1f ms' % (
+        route, stats['count'], stats['p50'], stats['p95'], stats['max']))
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      regressions = _Regressions(results, json.load(f), args.threshold)
+    for regression in regressions:
+      print('REGRESSION: %s' % regression)
+    if regressions:
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,127 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks RevokeOldCredentials against synthetic users.
+
+The users are written to the datastore testbed stub, and revocation requests
+to Google are replaced by futures that resolve immediately, so only the
+datastore side of the cron is measured. The previous fetch-everything
+implementation is run on the same data for comparison. Run from the project
+root with the App Engine SDK importable, for example:
+
+  PYTHONPATH=lib:$APPENGINE_SDK python benchmarks/revoke_benchmark.py
+"""
+
+import argparse
+import datetime
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=g-import-not-at-top,g-bad-import-order
+import mock
+from models import AppUser
+import ndb_handler
+
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+# pylint: enable=g-import-not-at-top,g-bad-import-order
+
+_WRITE_BATCH_SIZE = 500
+
+
+def _FetchAllRevoke():
+  """The original implementation, which loads every expired user at once."""
+  users_with_expired_tokens = AppUser.query(
+      AppUser.date_acquired <=
+      datetime.datetime.now() - datetime.timedelta(30)).fetch()
+  for expired_user in users_with_expired_tokens:
+    expired_user.refresh_token = None
+  ndb.put_multi(users_with_expired_tokens)
+  return len(users_with_expired_tokens), True
+
+
+def _RevokeTokenAsync(unused_refresh_token):
+  future = ndb.Future()
+  future.set_result(True)
+  return future
+
+
+def _CreateUsers(count):
+  """Writes count users whose tokens have expired."""
+  AppUser.date_acquired._auto_now = False
+  acquired = datetime.datetime(2000, 1, 1)
+  for start in range(0, count, _WRITE_BATCH_SIZE):
+    ndb.put_multi([
+        AppUser(user=users.User('user%d@example.com' % i),
+                email='user%d@example.com' % i,
+                refresh_token='token%d' % i,
+                date_acquired=acquired + datetime.timedelta(seconds=i))
+        for i in range(start, min(count, start + _WRITE_BATCH_SIZE))
+    ])
+  AppUser.date_acquired._auto_now = True
+  ndb.get_context().clear_cache()
+
+
+def _Run(name, revoke_func, user_count):
+  """Runs revoke_func on a fresh datastore and prints its cost."""
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_datastore_v3_stub(
+      consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+          probability=1))
+  bed.init_memcache_stub()
+  try:
+    _CreateUsers(user_count)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    revoked_count = 0
+    finished = False
+    calls = 0
+    while not finished:
+      count, finished = revoke_func()
+      revoked_count = count
+      calls += 1
+    elapsed = time.time() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('%-12s revoked %7d in %7.2f s (%8.0f users/s, %d call(s)), '
+          'peak RSS grew by %d KiB' % (
+              name, revoked_count, elapsed, revoked_count / elapsed, calls,
+              rss_after - rss_before))
+  finally:
+    bed.deactivate()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--users', type=int, default=100000,
+                      help='Number of synthetic users with expired tokens.')
+  parser.add_argument('--time-budget', type=int, default=60,
+                      help='Seconds per RevokeOldCredentials call.')
+  args = parser.parse_args()
+
+  # Peak RSS only grows, so the paged implementation is measured first.
+  with mock.patch.object(ndb_handler, '_RevokeTokenAsync', _RevokeTokenAsync):
+    _Run('paged', lambda: ndb_handler.RevokeOldCredentials(args.time_budget),
+         args.users)
+  _Run('fetch-all', _FetchAllRevoke, args.users)
+
+
+if __name__ == '__main__':
+  main()
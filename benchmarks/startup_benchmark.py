@@ -0,0 +1,122 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the cold import cost of the DFP Playground's modules.
+
+Each module is imported in a fresh interpreter, so the numbers include
+everything the module pulls in transitively, just like on a new instance.
+Run from the project root with the third-party libraries and the App Engine
+SDK importable, for example:
+
+  PYTHONPATH=lib:$APPENGINE_SDK python benchmarks/startup_benchmark.py
+
+Results are printed as a table and, with --output, written as JSON so they
+can be compared between commits.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Third-party modules first, then the playground's own, from the bottom up.
+_MODULES = [
+    'webapp2',
+    'jinja2',
+    'oauth2client.client',
+    'zeep',
+    'googleads.ad_manager',
+    'models',
+    'ndb_handler',
+    'utils',
+    'response_encoding',
+    'template_loader',
+    'api_handler',
+    'views',
+    'dfp_playground',
+]
+
+_TIMER_SCRIPT = '''
+import sys
+import time
+sys.path.insert(0, %(root)r)
+sys.path.insert(0, %(lib)r)
+start = time.time()
+import %(module)s
+print(time.time() - start)
+'''
+
+
+def MeasureImport(module, repetitions):
+  """Imports a module in fresh interpreters and times it.
+
+  Args:
+    module: str The dotted module name.
+    repetitions: int How many fresh interpreters to use.
+
+  Returns:
+    list The import times in seconds, or None if the module failed to import.
+  """
+  script = _TIMER_SCRIPT % {
+      'root': _PROJECT_ROOT,
+      'lib': os.path.join(_PROJECT_ROOT, 'lib'),
+      'module': module,
+  }
+  timings = []
+  for _ in range(repetitions):
+    process = subprocess.Popen([sys.executable, '-c', script],
+                               cwd=_PROJECT_ROOT,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode:
+      sys.stderr.write('Failed to import %s:\n%s\n' % (module, stderr))
+      return None
+    timings.append(float(stdout.strip().splitlines()[-1]))
+  return timings
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--repetitions', type=int, default=5,
+                      help='Fresh interpreters per module.')
+  parser.add_argument('--output', help='Write the results as JSON to a file.')
+  parser.add_argument('modules', nargs='*', default=_MODULES,
+                      help='Modules to measure. Defaults to all of them.')
+  args = parser.parse_args()
+
+  results = {}
+  print('%-24s %10s %10s' % ('module', 'median ms', 'max ms'))
+  for module in args.modules:
+    timings = MeasureImport(module, args.repetitions)
+    if timings is None:
+      continue
+    timings.sort()
+    results[module] = {
+        'median_ms': timings[len(timings) // 2] * 1000,
+        'max_ms': timings[-1] * 1000,
+    }
+    print('%-24s %10.1f %10.1f' % (module, results[module]['median_ms'],
+                                   results[module]['max_ms']))
+
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
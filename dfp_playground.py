@@ -23,14 +23,25 @@ import sys
 # Prepend lib directory that contains third-party libraries to the system path
 sys.path.insert(0, os.path.join(os.path.abspath('.'), 'lib'))
 
+from views import APIActionHandler
 from views import APIViewHandler
+from views import DownloadTrafficRecords
+from views import ForecastHandler
+from views import LoadReferenceData
 from views import Login
 from views import LoginCallback
 from views import LoginErrorPage
 from views import MainPage
 from views import MakeTestNetworkPage
 from views import PutCredentials
+from views import RefreshNetworkList
+from views import RefreshSavedQueries
+from views import ReportHandler
 from views import RevokeOldRefreshTokens
+from views import SavedQueryHandler
+from views import SearchHandler
+from views import StatsPage
+from views import SyncNameIndex
 import webapp2
 
 VERSION = '1.0.10'
@@ -43,7 +54,37 @@ app = webapp2.WSGIApplication(
         webapp2.Route('/login/error', LoginErrorPage),
         webapp2.Route('/tasks/revoke', RevokeOldRefreshTokens),
         webapp2.Route('/make-test-network', MakeTestNetworkPage),
+        webapp2.Route('/api/forecasts', handler=ForecastHandler),
+        webapp2.Route('/api/reports', handler=ReportHandler),
+        webapp2.Route(r'/api/reports/<report_job_id:\d+>',
+                      handler=ReportHandler),
+        webapp2.Route('/api/saved-queries', handler=SavedQueryHandler),
+        webapp2.Route(r'/api/saved-queries/<saved_query_id:\d+>',
+                      handler=SavedQueryHandler, methods=['GET', 'DELETE']),
+        webapp2.Route(r'/api/saved-queries/<saved_query_id:\d+>/refresh',
+                      handler=SavedQueryHandler, handler_method='refresh',
+                      methods=['POST']),
+        webapp2.Route('/api/search', handler=SearchHandler, methods=['GET']),
         webapp2.Route('/api/<method>', handler=APIViewHandler),
-        webapp2.Route('/tasks/put-credentials', PutCredentials)
+        webapp2.Route('/api/<method>/actions', handler=APIActionHandler),
+        webapp2.Route('/api/<method>/fanout', handler=APIViewHandler,
+                      handler_method='fan_out', methods=['GET']),
+        webapp2.Route('/api/<method>/aggregate', handler=APIViewHandler,
+                      handler_method='aggregate', methods=['GET']),
+        webapp2.Route('/api/<method>/count', handler=APIViewHandler,
+                      handler_method='count', methods=['GET']),
+        webapp2.Route('/api/<method>/diff', handler=APIViewHandler,
+                      handler_method='diff', methods=['GET']),
+        webapp2.Route('/api/<method>/snapshots', handler=APIViewHandler,
+                      handler_method='snapshot', methods=['POST']),
+        webapp2.Route(r'/api/<method>/<ids:\d+(?:,\d+)*>',
+                      handler=APIViewHandler),
+        webapp2.Route('/tasks/put-credentials', PutCredentials),
+        webapp2.Route('/tasks/stats', StatsPage),
+        webapp2.Route('/tasks/traffic', DownloadTrafficRecords),
+        webapp2.Route('/tasks/reference-data', LoadReferenceData),
+        webapp2.Route('/tasks/networks', RefreshNetworkList),
+        webapp2.Route('/tasks/saved-queries', RefreshSavedQueries),
+        webapp2.Route('/tasks/name-index', SyncNameIndex),
     ],
     debug=True)
@@ -0,0 +1,136 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Comparison of two sets of entities.
+
+Each side is reduced to a digest per entity while it is paged through, so
+comparing collections of hundreds of thousands of entities takes memory in
+proportion to their number, not their size. Digests ignore fields that
+change without anyone editing the entity, such as delivery statistics.
+Field level differences are only computed for the few entities whose
+digests differ, from entities fetched again for that purpose.
+"""
+
+import hashlib
+import json
+
+from zeep.helpers import serialize_object
+
+# Fields that change without the entity being edited, left out of digests.
+VOLATILE_FIELDS = frozenset([
+    'deliveryData',
+    'deliveryIndicator',
+    'lastModifiedDateTime',
+    'stats',
+    'totalClicksDelivered',
+    'totalImpressionsDelivered',
+    'totalViewableImpressionsDelivered',
+])
+
+# Hex digits kept of each digest. 64 bits make collisions between the
+# versions of an entity vanishingly unlikely and halve the stored size.
+_DIGEST_LENGTH = 16
+
+
+class DuplicateKeyError(Exception):
+  """Raised when several entities of one side have the same key.
+
+  Such entities cannot be told apart, so they cannot be compared.
+
+  Attributes:
+    keys: list The keys shared by several entities.
+  """
+
+  def __init__(self, keys):
+    super(DuplicateKeyError, self).__init__(
+        '%d keys are shared by several entities' % len(keys))
+    self.keys = keys
+
+
+def NormalizeEntity(entity, ignored_fields=VOLATILE_FIELDS):
+  """Returns an entity as plain data, without the ignored fields.
+
+  Args:
+    entity: The zeep data object or dict.
+    ignored_fields: set Names of top level fields to leave out.
+
+  Returns:
+    dict The entity's fields.
+  """
+  fields = serialize_object(entity)
+  return dict((name, value) for name, value in fields.iteritems()
+              if name not in ignored_fields)
+
+
+def DigestEntity(fields):
+  """Returns a digest of a normalized entity.
+
+  Args:
+    fields: dict The entity, as returned by NormalizeEntity.
+
+  Returns:
+    str The digest, equal for entities with equal fields.
+  """
+  encoded = json.dumps(fields, sort_keys=True, separators=(',', ':'),
+                       default=str)
+  return hashlib.sha1(encoded).hexdigest()[:_DIGEST_LENGTH]
+
+
+def DiffDigests(left, right):
+  """Compares two sets of entity digests.
+
+  Args:
+    left: dict The digests of the left side's entities, by entity key.
+    right: dict The digests of the right side's entities, by entity key.
+
+  Returns:
+    tuple A tuple of the sorted keys of the entities only on the right
+    (added), only on the left (removed) and on both sides with different
+    digests (changed).
+  """
+  added = sorted(key for key in right if key not in left)
+  removed = sorted(key for key in left if key not in right)
+  changed = sorted(key for key, digest in left.iteritems()
+                   if key in right and right[key] != digest)
+  return added, removed, changed
+
+
+def DiffFields(left, right, path=''):
+  """Lists the differing fields of two normalized entities.
+
+  Nested objects are compared field by field, lists as a whole.
+
+  Args:
+    left: dict The left side's entity, as returned by NormalizeEntity.
+    right: dict The right side's entity.
+    path: str Path of the compared objects, for nested objects.
+
+  Returns:
+    list Dicts of the dotted path of each differing field and its left and
+    right values, with None for a missing field.
+  """
+  differences = []
+  for name in sorted(set(left) | set(right)):
+    left_value = left.get(name)
+    right_value = right.get(name)
+    field_path = '%s.%s' % (path, name) if path else name
+    if isinstance(left_value, dict) and isinstance(right_value, dict):
+      differences.extend(DiffFields(left_value, right_value, field_path))
+    elif left_value != right_value:
+      differences.append({
+          'path': field_path,
+          'left': left_value,
+          'right': right_value,
+      })
+  return differences
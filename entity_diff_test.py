@@ -0,0 +1,61 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for entity set comparison."""
+
+import unittest
+
+from entity_diff import DiffDigests
+from entity_diff import DiffFields
+from entity_diff import DigestEntity
+from entity_diff import NormalizeEntity
+
+
+class EntityDiffTest(unittest.TestCase):
+  """Tests for entity_diff.py."""
+
+  def testDigestIgnoresVolatileFields(self):
+    entity = {'id': 1, 'name': 'a', 'stats': {'impressionsDelivered': 5}}
+    delivered = dict(entity, stats={'impressionsDelivered': 6})
+    renamed = dict(entity, name='b')
+
+    self.assertEqual(DigestEntity(NormalizeEntity(entity)),
+                     DigestEntity(NormalizeEntity(delivered)))
+    self.assertNotEqual(DigestEntity(NormalizeEntity(entity)),
+                        DigestEntity(NormalizeEntity(renamed)))
+    self.assertNotEqual(
+        DigestEntity(NormalizeEntity(entity, ignored_fields=())),
+        DigestEntity(NormalizeEntity(delivered, ignored_fields=())))
+
+  def testDiffDigests(self):
+    left = {1: 'aa', 2: 'bb', 3: 'cc'}
+    right = {2: 'bb', 3: 'cd', 5: 'ee', 4: 'dd'}
+
+    self.assertEqual(([4, 5], [1], [3]), DiffDigests(left, right))
+
+  def testDiffFields(self):
+    left = {'id': 1, 'budget': {'currencyCode': 'USD', 'microAmount': 1},
+            'labels': [1, 2], 'notes': 'x'}
+    right = {'id': 1, 'budget': {'currencyCode': 'USD', 'microAmount': 2},
+             'labels': [2, 1]}
+
+    self.assertEqual([
+        {'path': 'budget.microAmount', 'left': 1, 'right': 2},
+        {'path': 'labels', 'left': [1, 2], 'right': [2, 1]},
+        {'path': 'notes', 'left': 'x', 'right': None},
+    ], DiffFields(left, right))
+
+
+if __name__ == '__main__':
+  unittest.main()
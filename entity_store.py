@@ -0,0 +1,200 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact in-process representation of entities and rows.
+
+Serialized entities are OrderedDicts, each with its own hash table and linked
+list, and every entity holds its own copies of the same enum strings, such as
+'DELIVERING' or 'USD'. Kept in memory in large numbers, for example by an
+instance-wide cache, they cost several times the size of their data.
+
+A compact record keeps an entity's top level fields in the __slots__ of a
+record class made for its type and fields, which all entities of the type
+share. Enum strings are interned, so all records refer to one copy of each.
+Nested objects and lists, such as targeting or stats, are rarely all read,
+so they are kept as JSON, compressed if large, and decoded whenever they are
+read. Records are meant for in-process caches only; their classes are made
+at run time, so they cannot be pickled.
+
+benchmarks/entity_store_benchmark.py measures the bytes per entity of both
+forms.
+"""
+
+import collections
+import json
+import operator
+import re
+import zlib
+
+# Nested values whose JSON is longer than this many bytes are compressed.
+_COMPRESS_THRESHOLD = 512
+# Strings interned as enum values, such as 'DELIVERING', 'COMPUTER' or 'USD'.
+_ENUM_PATTERN = re.compile(r'^[A-Z][A-Z0-9_]*$')
+# Number of distinct values interned at most. Further values are kept as
+# they are, which bounds the memory of the instance-wide table.
+_MAX_INTERNED_VALUES = 100000
+_FIELD_PATTERN = re.compile(r'^[a-zA-Z]\w*$')
+
+_interned_values = {}
+_record_classes = {}
+
+
+class _PackedValue(str):
+  """A nested object or list, as JSON until it is read."""
+  __slots__ = ()
+
+  def Decode(self):
+    return json.loads(self, object_pairs_hook=collections.OrderedDict)
+
+
+class _CompressedValue(str):
+  """A large nested object or list, as compressed JSON until it is read."""
+  __slots__ = ()
+
+  def Decode(self):
+    return json.loads(zlib.decompress(self),
+                      object_pairs_hook=collections.OrderedDict)
+
+
+class CompactRecord(object):
+  """Base class of the compact records of entities.
+
+  CompactEntity makes a subclass per entity type and set of fields, whose
+  fields are read like those of the zeep object, such as record.status.
+  Nested objects and lists are decoded anew on every read.
+  """
+  __slots__ = ()
+  # Names of the fields, in the order of the serialized entity.
+  FIELDS = ()
+  TYPE_NAME = None
+
+  def __init__(self, values):
+    for slot, value in zip(self.__slots__, values):
+      setattr(self, slot, value)
+
+  def ToDict(self):
+    """Returns the entity as serialized by zeep.
+
+    Returns:
+      collections.OrderedDict The fields, in their original order.
+    """
+    return collections.OrderedDict(
+        (field, getattr(self, field)) for field in self.FIELDS)
+
+  def __repr__(self):
+    return '<%s %s>' % (type(self).__name__, getattr(self, 'id', ''))
+
+
+def Intern(value):
+  """Returns the instance-wide copy of a value.
+
+  Args:
+    value: A hashable value, such as a string.
+
+  Returns:
+    A value equal to the given one, the same object for all equal values
+    as long as the table of interned values is not full.
+  """
+  interned = _interned_values.get(value)
+  if interned is not None:
+    return interned
+  if len(_interned_values) >= _MAX_INTERNED_VALUES:
+    return value
+  return _interned_values.setdefault(value, value)
+
+
+def CompactEntity(entity, type_name=None):
+  """Returns the compact record of an entity.
+
+  Args:
+    entity: The zeep data object, or the dict it was serialized to.
+    type_name: str Name of the entity's type, such as 'LineItem'. Defaults
+               to the class name of the zeep data object.
+
+  Returns:
+    CompactRecord The record.
+
+  Raises:
+    ValueError: A field name is not an identifier.
+  """
+  if not isinstance(entity, dict):
+    # pylint: disable=g-import-not-at-top
+    from zeep.helpers import serialize_object
+    # pylint: enable=g-import-not-at-top
+    type_name = type_name or type(entity).__name__
+    entity = serialize_object(entity)
+  fields = tuple(entity)
+  record_class = _RecordClass(type_name or 'Entity', fields)
+  return record_class([_CompactValue(entity[field]) for field in fields])
+
+
+def CompactRow(row):
+  """Returns a row of plain values as a tuple with its enum strings interned.
+
+  Args:
+    row: list The values.
+
+  Returns:
+    tuple The values.
+  """
+  return tuple(_InternEnum(value) for value in row)
+
+
+def _RecordClass(type_name, fields):
+  """Returns the record class for entities of a type with the given fields."""
+  key = (type_name, fields)
+  record_class = _record_classes.get(key)
+  if record_class is not None:
+    return record_class
+  for field in fields:
+    if not _FIELD_PATTERN.match(field) or hasattr(CompactRecord, field):
+      raise ValueError('Not a record field name: %r' % field)
+  namespace = {
+      '__slots__': tuple('_' + field for field in fields),
+      'FIELDS': fields,
+      'TYPE_NAME': type_name,
+  }
+  for field in fields:
+    namespace[field] = property(_FieldReader('_' + field))
+  record_class = type(str('%sRecord' % type_name), (CompactRecord,),
+                      namespace)
+  return _record_classes.setdefault(key, record_class)
+
+
+def _FieldReader(slot):
+  """Returns a function reading a field from its slot."""
+  read_slot = operator.attrgetter(slot)
+
+  def ReadField(record):
+    value = read_slot(record)
+    if isinstance(value, (_PackedValue, _CompressedValue)):
+      return value.Decode()
+    return value
+  return ReadField
+
+
+def _CompactValue(value):
+  """Returns the compact form of a field's value."""
+  if isinstance(value, (dict, list)):
+    encoded = json.dumps(value, separators=(',', ':'), default=str)
+    if len(encoded) > _COMPRESS_THRESHOLD:
+      return _CompressedValue(zlib.compress(encoded))
+    return _PackedValue(encoded)
+  return _InternEnum(value)
+
+
+def _InternEnum(value):
+  if isinstance(value, basestring) and _ENUM_PATTERN.match(value):
+    return Intern(value)
+  return value
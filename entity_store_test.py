@@ -0,0 +1,95 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the compact entity representation."""
+
+import collections
+import unittest
+
+from entity_store import CompactEntity
+from entity_store import CompactRow
+
+
+def _LineItem(line_item_id, status, targeting=None):
+  return collections.OrderedDict([
+      ('id', line_item_id),
+      ('name', 'Line item %d' % line_item_id),
+      # a new string object per entity, as when parsed from a response
+      ('status', ''.join(status)),
+      ('costPerUnit', collections.OrderedDict([
+          ('currencyCode', 'USD'), ('microAmount', 2000000)])),
+      ('targeting', targeting),
+      ('appliedLabels', []),
+  ])
+
+
+class EntityStoreTest(unittest.TestCase):
+  """Tests for entity_store.py."""
+
+  def testRoundTrip(self):
+    line_item = _LineItem(1, 'READY')
+    record = CompactEntity(line_item, 'LineItem')
+
+    self.assertEqual(line_item, record.ToDict())
+    self.assertEqual(list(line_item), list(record.ToDict()))
+    self.assertEqual(1, record.id)
+    self.assertEqual('READY', record.status)
+    self.assertEqual({'currencyCode': 'USD', 'microAmount': 2000000},
+                     record.costPerUnit)
+    self.assertEqual(None, record.targeting)
+    self.assertEqual([], record.appliedLabels)
+    self.assertEqual('LineItem', record.TYPE_NAME)
+
+  def testLargeNestedValuesAreCompressed(self):
+    targeting = {
+        'geoTargeting': {
+            'targetedLocations': [{'id': i, 'type': 'CITY'}
+                                  for i in range(100)],
+        },
+    }
+    record = CompactEntity(_LineItem(1, 'READY', targeting), 'LineItem')
+
+    # pylint: disable=protected-access
+    self.assertLess(len(record._targeting), 512)
+    self.assertEqual(targeting, record.targeting)
+
+  def testRecordsShareClassesAndEnumValues(self):
+    first = CompactEntity(_LineItem(1, 'DELIVERING'), 'LineItem')
+    second = CompactEntity(_LineItem(2, 'DELIVERING'), 'LineItem')
+
+    self.assertIs(type(first), type(second))
+    self.assertIs(first.status, second.status)
+    self.assertFalse(hasattr(first, '__dict__'))
+
+  def testOtherFieldsMakeOtherClass(self):
+    ad_unit = CompactEntity({'id': '1', 'name': 'Ad unit'}, 'AdUnit')
+    line_item = CompactEntity(_LineItem(1, 'READY'), 'LineItem')
+
+    self.assertIsNot(type(ad_unit), type(line_item))
+    self.assertEqual(('id', 'name'), ad_unit.FIELDS)
+
+  def testInvalidFieldName(self):
+    self.assertRaises(ValueError, CompactEntity, {'not a field': 1})
+    self.assertRaises(ValueError, CompactEntity, {'ToDict': 1})
+
+  def testCompactRow(self):
+    first = CompactRow([1, 'Paris', ''.join('CITY'), [2250]])
+    second = CompactRow([2, 'Lyon', ''.join('CITY'), [2250]])
+
+    self.assertEqual((1, 'Paris', 'CITY', [2250]), first)
+    self.assertIs(first[2], second[2])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,263 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process-wide pooled HTTP transport for DFP API and OAuth2 calls.
+
+The googleads library creates a new requests.Session for every service proxy
+it builds and for every access token refresh, so nearly every call pays for a
+new TCP and TLS handshake. This module keeps one keep-alive session for the
+whole process and makes both zeep and the OAuth2 client use it.
+"""
+
+import threading
+import time
+
+import google.auth.transport.requests
+import googleads.common
+from googleads.common import ZeepServiceProxy
+from googleads.oauth2 import GoogleRefreshTokenClient
+import requests
+from requests.adapters import HTTPAdapter
+import traffic_recorder
+from utils import lazy_singleton
+import zeep.cache
+import zeep.transports
+
+# Number of connections kept alive per host. The instance serves requests on
+# several threads, so this bounds the number of concurrent upstream calls per
+# host before requests wait for a free connection.
+POOL_SIZE = 20
+# Seconds to wait for a connection to be established.
+CONNECT_TIMEOUT = 10
+# Seconds to wait for a response. PQL selects and large get*ByStatement calls
+# can take a while, so this is more generous than the connect timeout.
+READ_TIMEOUT = 60
+# Whether to send requests through the App Engine URL Fetch service instead of
+# sockets. URL Fetch manages its own connections, so pooling does not apply,
+# and its quotas and deadlines apply instead of the Sockets API's. Sockets
+# also need GAE_USE_SOCKETS_HTTPLIB in app.yaml, see the README.
+USE_URLFETCH = False
+
+_last_response = threading.local()
+_thread_deadline = threading.local()
+
+
+class _InstrumentedHTTPAdapter(HTTPAdapter):
+  """HTTPAdapter with default timeouts and pool utilization counters."""
+
+  def __init__(self, *args, **kwargs):
+    super(_InstrumentedHTTPAdapter, self).__init__(*args, **kwargs)
+    self._stats_lock = threading.Lock()
+    self.in_flight = 0
+    self.peak_in_flight = 0
+    self.request_count = 0
+    self.error_count = 0
+    self.total_seconds = 0.0
+
+  def send(self, request, **kwargs):
+    """Sends a request, applying the default timeouts if none are given.
+
+    The timeouts are shortened to the thread's deadline, if any.
+    """
+    if kwargs.get('timeout') is None:
+      kwargs['timeout'] = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    deadline = GetThreadDeadline()
+    if deadline is not None:
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        raise requests.exceptions.Timeout('Deadline passed before sending',
+                                          request=request)
+      timeout = kwargs['timeout']
+      if isinstance(timeout, tuple):
+        kwargs['timeout'] = tuple(min(part, remaining) for part in timeout)
+      else:
+        kwargs['timeout'] = min(timeout, remaining)
+    with self._stats_lock:
+      self.in_flight += 1
+      self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+    start = time.time()
+    try:
+      response = super(_InstrumentedHTTPAdapter, self).send(request, **kwargs)
+      return traffic_recorder.RecordUpstream(request, response, start)
+    except requests.RequestException:
+      with self._stats_lock:
+        self.error_count += 1
+      raise
+    finally:
+      with self._stats_lock:
+        self.in_flight -= 1
+        self.request_count += 1
+        self.total_seconds += time.time() - start
+
+  def GetStats(self):
+    """Returns the adapter's counters and per-host pool utilization.
+
+    Returns:
+      dict The statistics.
+    """
+    pools = []
+    for key in list(self.poolmanager.pools.keys()):
+      pool = self.poolmanager.pools.get(key)
+      if pool is None:
+        continue
+      pools.append({
+          'host': pool.host,
+          'connections_created': pool.num_connections,
+          'requests': pool.num_requests,
+          'idle_connections': pool.pool.qsize() if pool.pool else 0,
+          'max_connections': POOL_SIZE,
+      })
+    with self._stats_lock:
+      return {
+          'in_flight': self.in_flight,
+          'peak_in_flight': self.peak_in_flight,
+          'requests': self.request_count,
+          'errors': self.error_count,
+          'average_seconds': (self.total_seconds / self.request_count
+                              if self.request_count else 0.0),
+          'pools': pools,
+      }
+
+
+def _CreateAdapter():
+  """Creates the adapter mounted on the shared session.
+
+  Returns:
+    HTTPAdapter The adapter.
+  """
+  if USE_URLFETCH:
+    # pylint: disable=g-import-not-at-top
+    from requests_toolbelt.adapters import appengine
+    # pylint: enable=g-import-not-at-top
+    return appengine.AppEngineAdapter()
+  return _InstrumentedHTTPAdapter(
+      pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, pool_block=True)
+
+
+@lazy_singleton
+def GetSession():
+  """Returns the process-wide requests session.
+
+  Returns:
+    requests.Session The session.
+  """
+  session = requests.Session()
+  adapter = _CreateAdapter()
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+  return session
+
+
+def GetTransportStats():
+  """Returns pool utilization statistics of the shared session.
+
+  Returns:
+    dict The statistics, empty when requests go through URL Fetch.
+  """
+  adapter = GetSession().get_adapter('https://')
+  if isinstance(adapter, _InstrumentedHTTPAdapter):
+    return adapter.GetStats()
+  return {}
+
+
+class _SharedSessionZeepTransport(zeep.transports.Transport):
+  """A zeep transport that sends everything through the shared session.
+
+  It takes the same arguments as googleads' own transport, which it replaces.
+  """
+
+  def __init__(self, timeout, proxy_config, cache):
+    """Initializes a _SharedSessionZeepTransport.
+
+    Args:
+      timeout: int Timeout in seconds for loading WSDLs and for operations.
+      proxy_config: googleads.common.ProxyConfig Ignored, the shared session
+                    does not use a proxy.
+      cache: zeep.cache.Base Cache for WSDL and XSD documents, or
+             ZeepServiceProxy.NO_CACHE.
+    """
+    if not cache:
+      cache = zeep.cache.SqliteCache()
+    elif cache == ZeepServiceProxy.NO_CACHE:
+      cache = None
+    super(_SharedSessionZeepTransport, self).__init__(
+        cache=cache, timeout=timeout, operation_timeout=timeout,
+        session=GetSession())
+
+  def post(self, address, message, headers):
+    """Sends a SOAP request, noting the size of its response."""
+    response = super(_SharedSessionZeepTransport, self).post(
+        address, message, headers)
+    _last_response.size = len(response.content)
+    return response
+
+
+def SetThreadDeadline(deadline):
+  """Bounds the timeouts of the upstream requests made on the current thread.
+
+  Requests sent after the deadline fail right away with a Timeout. URL Fetch
+  requests, see USE_URLFETCH, are not bounded.
+
+  Args:
+    deadline: float The time, as returned by time.time(), by which requests
+              must have answered, or None to remove the bound.
+  """
+  _thread_deadline.deadline = deadline
+
+
+def GetThreadDeadline():
+  """Returns the current thread's deadline, see SetThreadDeadline.
+
+  Returns:
+    float The deadline, or None if the thread has none.
+  """
+  return getattr(_thread_deadline, 'deadline', None)
+
+
+def GetLastResponseSize():
+  """Returns the size of the current thread's last SOAP response.
+
+  Returns:
+    int The size of the response body in bytes, or None if the thread has
+    not made a SOAP request.
+  """
+  return getattr(_last_response, 'size', None)
+
+
+class PooledRefreshTokenClient(GoogleRefreshTokenClient):
+  """A GoogleRefreshTokenClient that refreshes through the shared session."""
+
+  def Refresh(self):
+    """Uses the refresh token to retrieve and set a new access token.
+
+    Raises:
+      google.auth.exceptions.RefreshError: If the refresh fails.
+    """
+    self.creds.refresh(
+        google.auth.transport.requests.Request(session=GetSession()))
+
+
+@lazy_singleton
+def InstallSharedTransport():
+  """Makes every zeep service proxy built by googleads use the shared session.
+
+  googleads constructs its transport internally, so this replaces the
+  transport class it uses. It is safe to call more than once.
+  """
+  if not hasattr(googleads.common, '_ZeepProxyTransport'):
+    # the class is private to googleads, see the pin in requirements.txt
+    raise ImportError('googleads %s has no _ZeepProxyTransport to replace' %
+                      googleads.common.VERSION)
+  # pylint: disable=protected-access
+  googleads.common._ZeepProxyTransport = _SharedSessionZeepTransport
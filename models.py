@@ -29,6 +29,160 @@ class AppUser(ndb.Model):
   date_acquired = ndb.DateTimeProperty(auto_now=True)
 
 
+class RevokeCheckpoint(ndb.Model):
+  """Implements RevokeCheckpoint.
+
+  The RevokeCheckpoint records how far a run of the credential revocation
+  cron has progressed, so a run that is interrupted or runs out of time can
+  resume where it stopped. It exists only while a run is in progress.
+  """
+  cutoff = ndb.DateTimeProperty(required=True)
+  cursor = ndb.StringProperty(required=False, indexed=False)
+  revoked_count = ndb.IntegerProperty(default=0, indexed=False)
+  started = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class ReferenceTable(ndb.Model):
+  """Implements ReferenceTable.
+
+  The ReferenceTable is the local copy of a PQL table whose contents are the
+  same for every network and rarely change, such as Browser or Geo_Target.
+  Its id is the table name. The rows are stored in ReferenceTableChunk child
+  entities, which are written under a new version before the table points to
+  them, so readers never see a partially written copy.
+  """
+  columns = ndb.StringProperty(repeated=True, indexed=False)
+  row_count = ndb.IntegerProperty(default=0, indexed=False)
+  chunk_count = ndb.IntegerProperty(default=0, indexed=False)
+  version = ndb.IntegerProperty(default=0, indexed=False)
+  refreshed = ndb.DateTimeProperty(required=True, indexed=False)
+
+
+class ReferenceTableChunk(ndb.Model):
+  """Implements ReferenceTableChunk.
+
+  The ReferenceTableChunk holds consecutive rows of a ReferenceTable, each row
+  being a list of values in the order of the table's columns. Instances keep
+  their own copy of the rows, so chunks bypass the ndb caches.
+  """
+  _use_cache = False
+  _use_memcache = False
+
+  rows = ndb.JsonProperty(compressed=True)
+
+
+class EntitySnapshot(ndb.Model):
+  """Implements EntitySnapshot.
+
+  The EntitySnapshot records the state of a set of entities of a network at
+  one point in time, to be compared with their later state. Only a digest of
+  each entity is kept, in EntitySnapshotChunk child entities, along with how
+  the entities were selected, keyed and normalized. Its parent is the AppUser
+  who took it.
+  """
+  method_name = ndb.StringProperty(required=True, indexed=False)
+  network_code = ndb.StringProperty(required=True, indexed=False)
+  where_clause = ndb.StringProperty(default='', indexed=False)
+  key_attributes = ndb.StringProperty(repeated=True, indexed=False)
+  ignored_fields = ndb.StringProperty(repeated=True, indexed=False)
+  entity_count = ndb.IntegerProperty(default=0, indexed=False)
+  chunk_count = ndb.IntegerProperty(default=0, indexed=False)
+  created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class EntitySnapshotChunk(ndb.Model):
+  """Implements EntitySnapshotChunk.
+
+  The EntitySnapshotChunk holds part of an EntitySnapshot's digests, as a
+  list of [entity key, digest] pairs. Chunks bypass the ndb caches.
+  """
+  _use_cache = False
+  _use_memcache = False
+
+  digests = ndb.JsonProperty(compressed=True)
+
+
+class SavedQuery(ndb.Model):
+  """Implements SavedQuery.
+
+  The SavedQuery is a where clause of an entity method that a user runs
+  often. The entities it matched when it was last refreshed are stored in
+  SavedQueryChunk child entities, see saved_queries. Like those of a
+  ReferenceTable, they are written under a new version before the query
+  points to them. Its parent is the AppUser who saved it.
+  """
+  name = ndb.StringProperty(required=True, indexed=False)
+  method_name = ndb.StringProperty(required=True, indexed=False)
+  network_code = ndb.StringProperty(required=True, indexed=False)
+  where_clause = ndb.StringProperty(default='', indexed=False)
+  refresh_minutes = ndb.IntegerProperty(required=True, indexed=False)
+  next_refresh = ndb.DateTimeProperty(required=True)
+  refresh_requested = ndb.DateTimeProperty(indexed=False)
+  refreshed = ndb.DateTimeProperty(indexed=False)
+  error = ndb.StringProperty(indexed=False)
+  result_count = ndb.IntegerProperty(default=0, indexed=False)
+  truncated = ndb.BooleanProperty(default=False, indexed=False)
+  chunk_count = ndb.IntegerProperty(default=0, indexed=False)
+  version = ndb.IntegerProperty(default=0, indexed=False)
+  created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class SavedQueryChunk(ndb.Model):
+  """Implements SavedQueryChunk.
+
+  The SavedQueryChunk holds consecutive entities of a SavedQuery's results,
+  serialized as for API responses. Chunks bypass the ndb caches.
+  """
+  _use_cache = False
+  _use_memcache = False
+
+  entities = ndb.JsonProperty(compressed=True)
+
+
+class NameIndex(ndb.Model):
+  """Implements NameIndex.
+
+  The NameIndex holds the ids and names of the entities of one entity method
+  in one network, which name_index searches as users type. Its parent is the
+  AppUser whose credentials sync it, and who alone searches it, since users
+  may see different entities of a network. Its id is the network code and
+  the method name, joined by a colon. The entries are
+  stored in NameIndexChunk child entities, which are written under a new
+  version before the index points to them, like those of a ReferenceTable.
+  """
+  network_code = ndb.StringProperty(required=True, indexed=False)
+  method_name = ndb.StringProperty(required=True, indexed=False)
+  entry_count = ndb.IntegerProperty(default=0, indexed=False)
+  chunk_count = ndb.IntegerProperty(default=0, indexed=False)
+  version = ndb.IntegerProperty(default=0, indexed=False)
+  # The latest lastModifiedDateTime of the indexed entities, as a PQL
+  # literal, from which the next sync continues.
+  last_modified = ndb.StringProperty(indexed=False)
+  synced = ndb.DateTimeProperty(required=True, indexed=False)
+  full_synced = ndb.DateTimeProperty(required=True, indexed=False)
+
+
+class NameIndexChunk(ndb.Model):
+  """Implements NameIndexChunk.
+
+  The NameIndexChunk holds consecutive entries of a NameIndex, each an
+  [id, name] pair. Chunks bypass the ndb caches.
+  """
+  _use_cache = False
+  _use_memcache = False
+
+  entries = ndb.JsonProperty(compressed=True)
+
+
+class TrafficRecord(ndb.Model):
+  """Implements TrafficRecord.
+
+  The TrafficRecord holds one recorded API request or upstream response,
+  see traffic_recorder. Records are only written while traffic is recorded.
+  """
+  data = ndb.JsonProperty(indexed=False)
+  created = ndb.DateTimeProperty(auto_now_add=True)
+
 
 class AppCredential(ndb.Model):
   """Implements AppCredential.
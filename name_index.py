@@ -0,0 +1,288 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Search-as-you-type over the names of a network's entities.
+
+Finding an entity by name through the DFP API takes a LIKE query and a round
+trip per service. Instead, the ids and names of the entities of each service
+in SEARCH_METHODS are kept per network in the datastore, see NameIndex, and
+each instance builds a prefix index of them in memory: the sorted distinct
+words of all names, each with the positions of the names it occurs in. A
+search looks up the names with a word starting with each word of the query
+by bisecting the sorted words, which takes a few milliseconds even for
+hundreds of thousands of names.
+
+Users may see different entities of the same network, so each user has their
+own indexes. An index is synced by a task queue request made with its user's
+credentials when the user first searches the network, and again by searches
+once it is older than SYNC_INTERVAL. Syncs only read the entities modified
+since the previous one, except for a full sync every FULL_SYNC_INTERVAL,
+which drops deleted entities. Until a service's index exists, its entities
+are searched with a live name LIKE query, see APIHandler.SearchNames.
+"""
+
+import array
+import bisect
+import collections
+import datetime
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+
+from ndb_handler import ReplaceNameIndex
+from ndb_handler import RetrieveNameIndexEntries
+from ndb_handler import RetrieveNameIndexes
+
+from google.appengine.api import taskqueue
+
+# Entity methods whose entities are searched, in the order of the results.
+SEARCH_METHODS = ('GetAdUnits', 'GetPlacements', 'GetOrders', 'GetLineItems',
+                  'GetCompanies', 'GetCreatives')
+# Age after which an index is synced again, and after which a sync reads all
+# entities rather than the recently modified ones.
+SYNC_INTERVAL = datetime.timedelta(minutes=15)
+FULL_SYNC_INTERVAL = datetime.timedelta(days=1)
+SYNC_URL = '/tasks/name-index'
+
+# Number of matching names of the query's most selective word that are
+# ranked. Very short queries match more names than are worth ranking.
+_MAX_CANDIDATES = 2000
+# Number of in-memory indexes kept per instance, the least recently used
+# being dropped first.
+_MAX_CACHED_INDEXES = 24
+# Words are letters and digits, so names such as 'homepage_top_728x90' have
+# several words.
+_WORD_PATTERN = re.compile(r'[^\W_]+', re.UNICODE)
+
+# Instance-wide prefix indexes, by the key of their NameIndex, as
+# (version, index).
+_indexes_lock = threading.Lock()
+_indexes = collections.OrderedDict()
+
+
+class PrefixIndex(object):
+  """In-memory index of names by the prefixes of their words."""
+
+  def __init__(self, entries):
+    """Initializes a PrefixIndex.
+
+    Args:
+      entries: list The entries, each an (id, name) pair.
+    """
+    self.ids = []
+    self.names = []
+    positions = collections.defaultdict(list)
+    for position, (entity_id, name) in enumerate(entries):
+      self.ids.append(entity_id)
+      self.names.append(name)
+      for word in set(_Words(name)):
+        positions[word].append(position)
+    self.words = sorted(positions)
+    self.positions = [array.array('i', positions[word]) for word in self.words]
+
+  def Search(self, query, limit):
+    """Returns the entries whose names have words starting with the query's.
+
+    Names starting with the query rank first, then names with a word equal
+    to one of the query's, then shorter names.
+
+    Args:
+      query: str The query, such as 'summer camp'.
+      limit: int Maximum number of entries to return.
+
+    Returns:
+      list The best matching entries, each an (id, name) pair.
+    """
+    query_words = _Words(query)
+    if not query_words:
+      return []
+    # the longest word usually matches the fewest names
+    query_words.sort(key=len, reverse=True)
+    candidates = self._Lookup(query_words[0])
+    other_words = query_words[1:]
+    if other_words:
+      candidates = [
+          position for position in candidates
+          if _HasPrefixes(_Words(self.names[position]), other_words)
+      ]
+
+    lower_query = query.strip().lower()
+    exact_matches = set()
+    for word in query_words:
+      index = bisect.bisect_left(self.words, word)
+      if index < len(self.words) and self.words[index] == word:
+        exact_matches.update(self.positions[index])
+
+    def RankKey(position):
+      name = self.names[position]
+      lower_name = name.lower()
+      if lower_name.startswith(lower_query):
+        rank = 0
+      elif position in exact_matches:
+        rank = 1
+      else:
+        rank = 2
+      return (rank, len(name), lower_name)
+
+    return [(self.ids[position], self.names[position])
+            for position in heapq.nsmallest(limit, candidates, key=RankKey)]
+
+  def _Lookup(self, prefix):
+    """Returns positions of names with a word starting with prefix."""
+    candidates = set()
+    index = bisect.bisect_left(self.words, prefix)
+    while (index < len(self.words) and
+           self.words[index].startswith(prefix) and
+           len(candidates) < _MAX_CANDIDATES):
+      candidates.update(itertools.islice(self.positions[index],
+                                         _MAX_CANDIDATES - len(candidates)))
+      index += 1
+    return candidates
+
+
+def Search(network_code, query, limit, user, method_names=SEARCH_METHODS):
+  """Searches the names of a network's entities.
+
+  Schedules syncing the indexes that do not exist yet or are out of date.
+
+  Args:
+    network_code: str The network code.
+    query: str The query, whose words are matched as word prefixes.
+    limit: int Maximum number of entities of each method.
+    user: AppUser The user searching, whose own indexes are searched and
+          whose credentials sync them.
+    method_names: list Names of the entity methods to search. Defaults to
+                  SEARCH_METHODS.
+
+  Returns:
+    tuple A tuple of a dict of the matching (id, name) pairs by method name,
+    and a list of the names of the methods that have no index yet.
+  """
+  now = datetime.datetime.now()
+  results = {}
+  unindexed = []
+  for method_name, name_index in zip(
+      method_names, RetrieveNameIndexes(user, network_code, method_names)):
+    if not name_index or now - name_index.synced > SYNC_INTERVAL:
+      _ScheduleSync(network_code, method_name, user)
+    if not name_index:
+      unindexed.append(method_name)
+    else:
+      results[method_name] = _GetPrefixIndex(name_index).Search(query, limit)
+  return results, unindexed
+
+
+def SyncIndex(api_handler, network_code, method_name):
+  """Updates a user's name index of an entity method in a network.
+
+  Args:
+    api_handler: APIHandler Handler of the user, whose credentials are used.
+    network_code: str The network code.
+    method_name: str Name of the entity method, one of SEARCH_METHODS.
+
+  Returns:
+    int The number of entities read.
+  """
+  user = api_handler.user
+  name_index = RetrieveNameIndexes(user, network_code, [method_name])[0]
+  full_sync = (
+      not name_index or not name_index.last_modified or
+      datetime.datetime.now() - name_index.full_synced > FULL_SYNC_INTERVAL)
+  entries = collections.OrderedDict()
+  last_modified = None
+  where_clause = ''
+  if not full_sync:
+    entries.update((entity_id, [entity_id, name])
+                   for entity_id, name in RetrieveNameIndexEntries(name_index))
+    last_modified = name_index.last_modified
+    # entities modified within the same second as the last one are read
+    # again rather than missed
+    where_clause = "WHERE lastModifiedDateTime >= '%s'" % last_modified
+
+  read_count = 0
+  for page in api_handler.GetAllResults(method_name, network_code,
+                                        where_clause):
+    for entity in page:
+      entries[entity['id']] = [entity['id'], entity['name'] or '']
+      last_modified = max(last_modified,
+                          _FormatDateTime(entity['lastModifiedDateTime']))
+    read_count += len(page)
+
+  ReplaceNameIndex(user, network_code, method_name, entries.values(),
+                   last_modified, full_sync)
+  logging.info('Synced name index of %s in network %s for %s: read %d '
+               'entities', method_name, network_code, user.email, read_count)
+  return read_count
+
+
+def _GetPrefixIndex(name_index):
+  """Returns the prefix index of a NameIndex, building it once per version."""
+  key = name_index.key
+  with _indexes_lock:
+    cached = _indexes.pop(key, None)
+    if cached and cached[0] == name_index.version:
+      _indexes[key] = cached
+      return cached[1]
+  prefix_index = PrefixIndex(RetrieveNameIndexEntries(name_index))
+  with _indexes_lock:
+    _indexes.pop(key, None)
+    _indexes[key] = (name_index.version, prefix_index)
+    while len(_indexes) > _MAX_CACHED_INDEXES:
+      _indexes.popitem(last=False)
+  return prefix_index
+
+
+def _ScheduleSync(network_code, method_name, user):
+  """Adds a task syncing a user's index, at most once per SYNC_INTERVAL."""
+  period = int(time.time() // SYNC_INTERVAL.total_seconds())
+  try:
+    taskqueue.add(
+        name='name-index-%s-%s-%s-%d' % (user.key.id(), network_code,
+                                         method_name, period),
+        url=SYNC_URL,
+        params={
+            'network_code': network_code,
+            'method': method_name,
+            'user': user.key.urlsafe(),
+        })
+  except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+    pass
+
+
+def _FormatDateTime(date_time):
+  """Returns a DateTime object as a PQL literal, or None if it is None.
+
+  The literal is in the DateTime's own time zone, the network's, in which
+  PQL interprets it.
+  """
+  if not date_time:
+    return None
+  date = date_time['date']
+  return '%04d-%02d-%02dT%02d:%02d:%02d' % (
+      date['year'], date['month'], date['day'], date_time['hour'],
+      date_time['minute'], date_time['second'])
+
+
+def _Words(text):
+  """Returns the lowercase words of a text."""
+  return _WORD_PATTERN.findall(text.lower())
+
+
+def _HasPrefixes(words, prefixes):
+  """Returns whether each prefix starts one of the words."""
+  return all(any(word.startswith(prefix) for word in words)
+             for prefix in prefixes)
@@ -0,0 +1,181 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the name index."""
+
+import datetime
+import unittest
+
+import mock
+from models import AppUser
+import name_index
+from name_index import PrefixIndex
+from name_index import Search
+from name_index import SyncIndex
+from ndb_handler import RetrieveNameIndexes
+
+from google.appengine.api import users
+from google.appengine.ext import testbed
+
+
+def _Entity(entity_id, name, minute):
+  return {
+      'id': entity_id,
+      'name': name,
+      'lastModifiedDateTime': {
+          'date': {'year': 2019, 'month': 3, 'day': 1},
+          'hour': 12,
+          'minute': minute,
+          'second': 0,
+          'timeZoneId': 'America/New_York',
+      },
+  }
+
+
+class PrefixIndexTest(unittest.TestCase):
+  """Tests for name_index.PrefixIndex."""
+
+  def setUp(self):
+    self.index = PrefixIndex([
+        (1, 'Summer Campaign 2019'),
+        (2, 'Camp'),
+        (3, 'Winter campaign'),
+        (4, 'campaign_summer_sale'),
+        (5, 'Homepage Leaderboard'),
+    ])
+
+  def testSearchRanksMatches(self):
+    self.assertEqual(
+        [(2, 'Camp'), (4, 'campaign_summer_sale'), (3, 'Winter campaign'),
+         (1, 'Summer Campaign 2019')],
+        self.index.Search('camp', 10))
+    self.assertEqual([(2, 'Camp')], self.index.Search('CAMP', 1))
+
+  def testSearchMatchesEveryWord(self):
+    self.assertEqual([(1, 'Summer Campaign 2019'),
+                      (4, 'campaign_summer_sale')],
+                     self.index.Search('summer camp', 10))
+    self.assertEqual([(1, 'Summer Campaign 2019')],
+                     self.index.Search('camp 20', 10))
+
+  def testSearchWithoutMatches(self):
+    self.assertEqual([], self.index.Search('autumn', 10))
+    self.assertEqual([], self.index.Search('  -- ', 10))
+    # words are matched from their start only
+    self.assertEqual([], self.index.Search('page', 10))
+
+
+class NameIndexTest(unittest.TestCase):
+  """Tests for name_index.py."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_taskqueue_stub()
+    self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+    self.user = AppUser(user=users.User('johndoe@gmail.com'),
+                        email='johndoe@gmail.com', refresh_token='token')
+    self.user.put()
+    self.api_handler = mock.MagicMock()
+    self.api_handler.user = self.user
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _SyncTasks(self):
+    return self.taskqueue_stub.get_filtered_tasks(url=name_index.SYNC_URL)
+
+  def testSearchSchedulesSyncOfMissingIndexes(self):
+    self.assertEqual(({}, ['GetOrders', 'GetLineItems']),
+                     Search('1234', 'camp', 10, self.user,
+                            ['GetOrders', 'GetLineItems']))
+    Search('1234', 'campaign', 10, self.user, ['GetOrders', 'GetLineItems'])
+
+    tasks = self._SyncTasks()
+    self.assertEqual(2, len(tasks))
+    self.assertEqual(['GetLineItems', 'GetOrders'],
+                     sorted(task.extract_params()['method'] for task in tasks))
+
+  def testSyncIndex(self):
+    self.api_handler.GetAllResults.return_value = iter([
+        [_Entity(1, 'Summer campaign', 5), _Entity(2, 'Winter campaign', 7)],
+        [_Entity(3, 'Homepage', 6)],
+    ])
+    self.assertEqual(3, SyncIndex(self.api_handler, '1234', 'GetOrders'))
+    self.api_handler.GetAllResults.assert_called_once_with('GetOrders', '1234',
+                                                           '')
+
+    results, unindexed = Search('1234', 'camp', 10, self.user, ['GetOrders'])
+    self.assertEqual([], unindexed)
+    self.assertEqual([(1, 'Summer campaign'), (2, 'Winter campaign')],
+                     results['GetOrders'])
+    # the index is up to date
+    self.assertEqual([], self._SyncTasks())
+
+    # later syncs read the entities modified since the last one
+    self.api_handler.GetAllResults.return_value = iter([
+        [_Entity(2, 'Spring campaign', 7), _Entity(4, 'Autumn camp', 9)],
+    ])
+    self.assertEqual(2, SyncIndex(self.api_handler, '1234', 'GetOrders'))
+    self.api_handler.GetAllResults.assert_called_with(
+        'GetOrders', '1234',
+        "WHERE lastModifiedDateTime >= '2019-03-01T12:07:00'")
+
+    results, _ = Search('1234', 'camp', 10, self.user, ['GetOrders'])
+    self.assertEqual([(4, 'Autumn camp'), (2, 'Spring campaign'),
+                      (1, 'Summer campaign')], results['GetOrders'])
+    index = RetrieveNameIndexes(self.user, '1234', ['GetOrders'])[0]
+    self.assertEqual(4, index.entry_count)
+    self.assertEqual('2019-03-01T12:09:00', index.last_modified)
+
+  def testFullSyncDropsDeletedEntities(self):
+    self.api_handler.GetAllResults.return_value = iter([
+        [_Entity(1, 'Summer campaign', 5), _Entity(2, 'Winter campaign', 7)],
+    ])
+    SyncIndex(self.api_handler, '1234', 'GetOrders')
+    index = RetrieveNameIndexes(self.user, '1234', ['GetOrders'])[0]
+    index.full_synced -= name_index.FULL_SYNC_INTERVAL + datetime.timedelta(1)
+    index.put()
+
+    self.api_handler.GetAllResults.return_value = iter([
+        [_Entity(2, 'Winter campaign', 7)],
+    ])
+    SyncIndex(self.api_handler, '1234', 'GetOrders')
+
+    self.api_handler.GetAllResults.assert_called_with('GetOrders', '1234', '')
+    results, _ = Search('1234', 'campaign', 10, self.user, ['GetOrders'])
+    self.assertEqual([(2, 'Winter campaign')], results['GetOrders'])
+
+  def testIndexesArePerUser(self):
+    self.api_handler.GetAllResults.return_value = iter([
+        [_Entity(1, 'Summer campaign', 5)],
+    ])
+    SyncIndex(self.api_handler, '1234', 'GetOrders')
+    other_user = AppUser(user=users.User('janedoe@gmail.com'),
+                         email='janedoe@gmail.com', refresh_token='token')
+    other_user.put()
+
+    self.assertEqual(({}, ['GetOrders']),
+                     Search('1234', 'camp', 10, other_user, ['GetOrders']))
+    tasks = self._SyncTasks()
+    self.assertEqual(1, len(tasks))
+    self.assertEqual(other_user.key.urlsafe(),
+                     tasks[0].extract_params()['user'])
+
+
+if __name__ == '__main__':
+  unittest.main()
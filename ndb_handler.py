@@ -14,15 +14,55 @@
 
 """Handlers for ndb operations."""
 
+import collections
 import datetime
 import logging
+import time
+import urllib
+
 from models import AppCredential
 from models import AppUser
+from models import EntitySnapshot
+from models import EntitySnapshotChunk
+from models import NameIndex
+from models import NameIndexChunk
+from models import ReferenceTable
+from models import ReferenceTableChunk
+from models import RevokeCheckpoint
+from models import SavedQuery
+from models import SavedQueryChunk
+from models import TrafficRecord
 
+from google.appengine.api import urlfetch
 from google.appengine.api import users
 from google.appengine.api.datastore_errors import BadArgumentError
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
+# Refresh tokens older than this are revoked.
+_REFRESH_TOKEN_MAX_AGE = datetime.timedelta(30)
+# Number of users read from the datastore per page.
+_REVOKE_PAGE_SIZE = 200
+# Number of pages whose writes and revocations may be in flight at once.
+_REVOKE_MAX_PENDING_PAGES = 2
+# Number of concurrent revocation requests made for a page.
+_REVOKE_MAX_CONCURRENT_REQUESTS = 50
+# Time after which a run checkpoints and stops, well within the 10 minute
+# deadline of cron and task queue requests.
+_REVOKE_TIME_BUDGET = 8 * 60
+_REVOKE_CHECKPOINT_ID = 'revoke'
+_TOKEN_REVOCATION_URL = 'https://accounts.google.com/o/oauth2/revoke'
+# Number of reference table rows stored per ReferenceTableChunk, which keeps
+# chunks well below the datastore's entity size limit.
+_REFERENCE_CHUNK_SIZE = 2000
+# Number of entity digests stored per EntitySnapshotChunk.
+_SNAPSHOT_CHUNK_SIZE = 20000
+# Number of entities stored per SavedQueryChunk. Entities are stored whole,
+# which leaves room for large ones such as line items with their targeting.
+_SAVED_QUERY_CHUNK_SIZE = 100
+# Number of [id, name] entries stored per NameIndexChunk.
+_NAME_INDEX_CHUNK_SIZE = 5000
+
 
 def InitUser(refresh_token=None):
   """Initialize application user.
@@ -38,9 +78,26 @@ def InitUser(refresh_token=None):
   Returns:
     AppUser instance of the application user.
   """
+  return InitUserAsync(refresh_token).get_result()
+
+
+@ndb.tasklet
+def InitUserAsync(refresh_token=None):
+  """Initialize application user asynchronously.
 
-  result = AppUser.query(
-      AppUser.user == users.get_current_user()).fetch(limit=1)
+  Like InitUser, but returns a future so that the caller can do other work
+  while the datastore query and write are in flight.
+
+  Args:
+    refresh_token: str A new refresh token received from the auth flow.
+                   Defaults to None.
+
+  Returns:
+    ndb.Future A future for the AppUser instance of the application user.
+  """
+  current_user = users.get_current_user()
+  result = yield AppUser.query(AppUser.user == current_user).fetch_async(
+      limit=1)
 
   if result:
     # app_user exists
@@ -51,26 +108,648 @@ def InitUser(refresh_token=None):
       app_user.date_acquired = datetime.datetime.now()
   else:
     app_user = AppUser(
-        user=users.get_current_user(),
-        email=users.get_current_user().email(),
+        user=current_user,
+        email=current_user.email(),
         refresh_token=refresh_token)
 
-  app_user.put()
-  return app_user
+  yield app_user.put_async()
+  raise ndb.Return(app_user)
+
+
+def RetrieveUserByKey(urlsafe_key):
+  """Retrieve an application user by key.
 
+  Used by task queue requests, which act on behalf of the user who caused
+  them but are not made with that user's session.
 
-def RevokeOldCredentials():
+  Args:
+    urlsafe_key: str The user's key, as returned by key.urlsafe().
+
+  Returns:
+    AppUser The user, or None if the user no longer exists.
+  """
+  return ndb.Key(urlsafe=urlsafe_key).get()
+
+
+def RevokeOldCredentials(time_budget=_REVOKE_TIME_BUDGET):
   """Revoke old credentials.
 
-  Find all users in the datastore with refresh tokens older than 30 days and
-  revokes them.
+  Find all users in the datastore with refresh tokens older than 30 days,
+  revoke the tokens with Google and remove them from the datastore.
+
+  Users are read page by page with a query cursor. The writes and revocation
+  requests for a page run asynchronously while the next page is read, with at
+  most _REVOKE_MAX_PENDING_PAGES pages in flight. After every completed page
+  the cursor is saved in a RevokeCheckpoint, so a run that stops early, either
+  because it ran out of time_budget or because it was interrupted, continues
+  from there on the next call. The checkpoint is removed once all users have
+  been processed.
+
+  Args:
+    time_budget: int Number of seconds after which to checkpoint and stop.
+
+  Returns:
+    tuple A tuple of (number of tokens revoked so far by the run, including
+    earlier calls it resumed from, whether all expired users have been
+    processed).
+  """
+  start_time = time.time()
+  checkpoint = RevokeCheckpoint.get_by_id(_REVOKE_CHECKPOINT_ID)
+  if checkpoint:
+    logging.info('Resuming credential revocation started at %s',
+                 checkpoint.started)
+  else:
+    checkpoint = RevokeCheckpoint(
+        id=_REVOKE_CHECKPOINT_ID,
+        cutoff=datetime.datetime.now() - _REFRESH_TOKEN_MAX_AGE)
+    checkpoint.put()
+
+  query = AppUser.query(AppUser.date_acquired <= checkpoint.cutoff)
+  cursor = Cursor(urlsafe=checkpoint.cursor) if checkpoint.cursor else None
+  pending_pages = collections.deque()
+  more = True
+
+  def CompleteOldestPage():
+    """Waits for the oldest pending page and checkpoints past it."""
+    page_future, page_cursor = pending_pages.popleft()
+    checkpoint.revoked_count += page_future.get_result()
+    checkpoint.cursor = page_cursor.urlsafe() if page_cursor else None
+    checkpoint.put()
+
+  while more and time.time() - start_time < time_budget:
+    expired_users, cursor, more = query.fetch_page(
+        _REVOKE_PAGE_SIZE, start_cursor=cursor)
+    if not expired_users:
+      more = False
+      break
+    pending_pages.append((_RevokePageAsync(expired_users), cursor))
+    if len(pending_pages) >= _REVOKE_MAX_PENDING_PAGES:
+      CompleteOldestPage()
+  while pending_pages:
+    CompleteOldestPage()
+
+  revoked_count = checkpoint.revoked_count
+  if more:
+    logging.info('Revoked %d credentials so far, stopping at checkpoint',
+                 revoked_count)
+  else:
+    logging.info('Revoked %d credentials', revoked_count)
+    checkpoint.key.delete()
+  return revoked_count, not more
+
+
+@ndb.tasklet
+def _RevokePageAsync(expired_users):
+  """Revokes the refresh tokens of a page of users.
+
+  Args:
+    expired_users: list AppUser instances whose tokens have expired.
+
+  Returns:
+    int The number of tokens that were removed.
   """
-  users_with_expired_tokens = AppUser.query(
-      AppUser.date_acquired <=
-      datetime.datetime.now() - datetime.timedelta(30)).fetch()
-  for expired_user in users_with_expired_tokens:
+  refresh_tokens = [
+      expired_user.refresh_token for expired_user in expired_users
+      if expired_user.refresh_token
+  ]
+  for expired_user in expired_users:
     expired_user.refresh_token = None
-  ndb.put_multi(users_with_expired_tokens)
+
+  put_future = ndb.put_multi_async(expired_users)
+  for i in range(0, len(refresh_tokens), _REVOKE_MAX_CONCURRENT_REQUESTS):
+    yield [
+        _RevokeTokenAsync(refresh_token) for refresh_token in
+        refresh_tokens[i:i + _REVOKE_MAX_CONCURRENT_REQUESTS]
+    ]
+  yield put_future
+  raise ndb.Return(len(refresh_tokens))
+
+
+@ndb.tasklet
+def _RevokeTokenAsync(refresh_token):
+  """Revokes a refresh token with Google's OAuth2 server.
+
+  Failures are logged and otherwise ignored, since the token is removed from
+  the datastore either way.
+
+  Args:
+    refresh_token: str The refresh token to revoke.
+
+  Returns:
+    bool Whether the token is no longer valid.
+  """
+  try:
+    result = yield ndb.get_context().urlfetch(
+        _TOKEN_REVOCATION_URL,
+        payload=urllib.urlencode({'token': refresh_token}),
+        method='POST',
+        headers={'Content-Type': 'application/x-www-form-urlencoded'},
+        deadline=10)
+  except urlfetch.Error, e:
+    logging.warning('Could not revoke refresh token: %s', e)
+    raise ndb.Return(False)
+
+  # 400 means that the token had already expired or been revoked
+  if result.status_code not in (200, 400):
+    logging.warning('Could not revoke refresh token: HTTP %d',
+                    result.status_code)
+    raise ndb.Return(False)
+  raise ndb.Return(True)
+
+
+def RetrieveReferenceTable(name):
+  """Retrieve the local copy of a reference table, without its rows.
+
+  Args:
+    name: str The PQL table name, such as 'Browser'.
+
+  Returns:
+    ReferenceTable The table, or None if it has not been loaded yet.
+  """
+  return ReferenceTable.get_by_id(name)
+
+
+def RetrieveReferenceRows(table):
+  """Retrieve the rows of a reference table.
+
+  Args:
+    table: ReferenceTable The table returned by RetrieveReferenceTable.
+
+  Returns:
+    list The rows, each a list of values in the order of table.columns.
+  """
+  chunks = ndb.get_multi([
+      _ReferenceChunkKey(table.key, table.version, index)
+      for index in range(table.chunk_count)
+  ])
+  rows = []
+  for chunk in chunks:
+    if chunk is None:
+      # the copy was replaced while it was being read
+      current_table = RetrieveReferenceTable(table.key.id())
+      if not current_table or current_table.version == table.version:
+        return []
+      return RetrieveReferenceRows(current_table)
+    rows.extend(chunk.rows)
+  return rows
+
+
+def ReplaceReferenceTable(name, columns, rows):
+  """Replace the local copy of a reference table.
+
+  The rows are written under a new version first and the table is switched
+  over to them afterwards, so concurrent readers see either the old or the
+  new copy. The chunks of the old copy are deleted last.
+
+  Args:
+    name: str The PQL table name, such as 'Browser'.
+    columns: list The column names.
+    rows: list The rows, each a list of values in the order of columns.
+
+  Returns:
+    ReferenceTable The new table.
+  """
+  table_key = ndb.Key(ReferenceTable, name)
+  old_table = table_key.get()
+  version = old_table.version + 1 if old_table else 1
+  chunk_count = 0
+  for start in range(0, len(rows), _REFERENCE_CHUNK_SIZE):
+    ReferenceTableChunk(
+        key=_ReferenceChunkKey(table_key, version, chunk_count),
+        rows=rows[start:start + _REFERENCE_CHUNK_SIZE]).put()
+    chunk_count += 1
+
+  table = ReferenceTable(
+      key=table_key,
+      columns=columns,
+      row_count=len(rows),
+      chunk_count=chunk_count,
+      version=version,
+      refreshed=datetime.datetime.now())
+  table.put()
+
+  if old_table:
+    ndb.delete_multi([
+        _ReferenceChunkKey(table_key, old_table.version, index)
+        for index in range(old_table.chunk_count)
+    ])
+  return table
+
+
+def _ReferenceChunkKey(table_key, version, index):
+  return ndb.Key(ReferenceTableChunk, '%d-%d' % (version, index),
+                 parent=table_key)
+
+
+def CreateEntitySnapshot(user, method_name, network_code, where_clause,
+                         key_attributes, ignored_fields, digests):
+  """Store the digests of a set of entities as a new snapshot.
+
+  Args:
+    user: AppUser The user taking the snapshot.
+    method_name: str Name of the entity method, such as 'GetLineItems'.
+    network_code: str Network code the entities are in.
+    where_clause: str PQL where clause that selected the entities.
+    key_attributes: list The attributes identifying an entity.
+    ignored_fields: list The fields left out of the digests.
+    digests: dict The digests, by entity key.
+
+  Returns:
+    EntitySnapshot The new snapshot.
+  """
+  snapshot_id, _ = EntitySnapshot.allocate_ids(1, parent=user.key)
+  snapshot_key = ndb.Key(EntitySnapshot, snapshot_id, parent=user.key)
+  pairs = [[key, digest] for key, digest in digests.iteritems()]
+  chunks = [
+      EntitySnapshotChunk(
+          key=ndb.Key(EntitySnapshotChunk, index + 1, parent=snapshot_key),
+          digests=pairs[start:start + _SNAPSHOT_CHUNK_SIZE])
+      for index, start in enumerate(range(0, len(pairs),
+                                          _SNAPSHOT_CHUNK_SIZE))
+  ]
+  ndb.put_multi(chunks)
+
+  # the chunks are written first, so a snapshot is never seen incomplete
+  snapshot = EntitySnapshot(
+      key=snapshot_key,
+      method_name=method_name,
+      network_code=network_code,
+      where_clause=where_clause,
+      key_attributes=list(key_attributes),
+      ignored_fields=sorted(ignored_fields),
+      entity_count=len(pairs),
+      chunk_count=len(chunks))
+  snapshot.put()
+  return snapshot
+
+
+def RetrieveEntitySnapshot(user, snapshot_id):
+  """Retrieve one of a user's snapshots, without its digests.
+
+  Args:
+    user: AppUser The user who took the snapshot.
+    snapshot_id: int The snapshot's id.
+
+  Returns:
+    EntitySnapshot The snapshot, or None if the user has no such snapshot.
+  """
+  return EntitySnapshot.get_by_id(snapshot_id, parent=user.key)
+
+
+def RetrieveSnapshotDigests(snapshot):
+  """Retrieve the digests of a snapshot.
+
+  Args:
+    snapshot: EntitySnapshot The snapshot.
+
+  Returns:
+    dict The digests, by entity key. Keys of several attributes are tuples.
+  """
+  chunks = ndb.get_multi([
+      ndb.Key(EntitySnapshotChunk, index + 1, parent=snapshot.key)
+      for index in range(snapshot.chunk_count)
+  ])
+  digests = {}
+  for chunk in chunks:
+    for key, digest in chunk.digests:
+      digests[tuple(key) if isinstance(key, list) else key] = digest
+  return digests
+
+
+def CreateSavedQuery(user, name, method_name, network_code, where_clause,
+                     refresh_minutes):
+  """Store a new saved query, which is due to be refreshed right away.
+
+  Args:
+    user: AppUser The user saving the query.
+    name: str The query's name.
+    method_name: str Name of the entity method, such as 'GetLineItems'.
+    network_code: str Network code to run the query in.
+    where_clause: str PQL where clause selecting the entities.
+    refresh_minutes: int Minutes between background refreshes.
+
+  Returns:
+    SavedQuery The new query, without results.
+  """
+  saved_query = SavedQuery(
+      parent=user.key,
+      name=name,
+      method_name=method_name,
+      network_code=network_code,
+      where_clause=where_clause,
+      refresh_minutes=refresh_minutes,
+      next_refresh=datetime.datetime.now())
+  saved_query.put()
+  return saved_query
+
+
+def RetrieveSavedQueries(user):
+  """Retrieve a user's saved queries, without their results.
+
+  Args:
+    user: AppUser The user.
+
+  Returns:
+    list The SavedQuery entities, sorted by name.
+  """
+  return sorted(SavedQuery.query(ancestor=user.key).fetch(),
+                key=lambda saved_query: saved_query.name.lower())
+
+
+def RetrieveSavedQuery(user, saved_query_id):
+  """Retrieve one of a user's saved queries, without its results.
+
+  Args:
+    user: AppUser The user who saved the query.
+    saved_query_id: int The query's id.
+
+  Returns:
+    SavedQuery The query, or None if the user has no such query.
+  """
+  return SavedQuery.get_by_id(saved_query_id, parent=user.key)
+
+
+def RetrieveDueSavedQueries(limit):
+  """Retrieve saved queries of any user whose refresh is due.
+
+  Args:
+    limit: int Maximum number of queries to retrieve.
+
+  Returns:
+    list The SavedQuery entities.
+  """
+  return SavedQuery.query(
+      SavedQuery.next_refresh <= datetime.datetime.now()).fetch(limit)
+
+
+def RequestSavedQueryRefreshes(saved_queries):
+  """Record that saved queries are being refreshed.
+
+  Their next background refresh becomes due refresh_minutes from now.
+
+  Args:
+    saved_queries: list The SavedQuery entities, which are modified.
+  """
+  now = datetime.datetime.now()
+  for saved_query in saved_queries:
+    saved_query.refresh_requested = now
+    saved_query.next_refresh = now + datetime.timedelta(
+        minutes=saved_query.refresh_minutes)
+  ndb.put_multi(saved_queries)
+
+
+def StoreSavedQueryResults(saved_query, pages, max_entities):
+  """Store the results of a saved query, replacing its previous ones.
+
+  The entities are written chunk by chunk as their pages arrive, under a new
+  version, and the query is switched over to them afterwards, so readers see
+  either the previous or the new results. The chunks of the previous results
+  are deleted last.
+
+  Args:
+    saved_query: SavedQuery The query, as it was when the refresh started.
+    pages: iterable Lists of entities, serialized as for API responses.
+    max_entities: int Maximum number of entities to store. Any further ones
+                  only mark the results as truncated.
+
+  Returns:
+    SavedQuery The refreshed query, or None if it was deleted meanwhile.
+  """
+  version = saved_query.version + 1
+  chunk_keys = []
+  buffered = []
+  result_count = 0
+  truncated = False
+
+  def PutChunk(entities):
+    chunk_key = _SavedQueryChunkKey(saved_query.key, version, len(chunk_keys))
+    SavedQueryChunk(key=chunk_key, entities=entities).put()
+    chunk_keys.append(chunk_key)
+
+  for page in pages:
+    if len(page) > max_entities - result_count:
+      truncated = True
+      page = page[:max_entities - result_count]
+    buffered.extend(page)
+    result_count += len(page)
+    while len(buffered) >= _SAVED_QUERY_CHUNK_SIZE:
+      PutChunk(buffered[:_SAVED_QUERY_CHUNK_SIZE])
+      del buffered[:_SAVED_QUERY_CHUNK_SIZE]
+  if buffered:
+    PutChunk(buffered)
+
+  current_query = saved_query.key.get()
+  if not current_query:
+    ndb.delete_multi(chunk_keys)
+    return None
+  old_chunk_keys = []
+  if current_query.version != version:
+    old_chunk_keys = [
+        _SavedQueryChunkKey(current_query.key, current_query.version, index)
+        for index in range(current_query.chunk_count)
+    ]
+  current_query.populate(
+      version=version,
+      chunk_count=len(chunk_keys),
+      result_count=result_count,
+      truncated=truncated,
+      refreshed=datetime.datetime.now(),
+      refresh_requested=None,
+      error=None)
+  current_query.put()
+  ndb.delete_multi(old_chunk_keys)
+  return current_query
+
+
+def RecordSavedQueryError(saved_query, error):
+  """Record that refreshing a saved query failed. Its results are kept.
+
+  Args:
+    saved_query: SavedQuery The query.
+    error: str Why the refresh failed.
+  """
+  current_query = saved_query.key.get()
+  if current_query:
+    current_query.error = error
+    current_query.refresh_requested = None
+    current_query.put()
+
+
+def RetrieveSavedQueryResults(saved_query, offset=0, limit=None):
+  """Retrieve stored results of a saved query.
+
+  Only the chunks holding the requested entities are read.
+
+  Args:
+    saved_query: SavedQuery The query.
+    offset: int Number of entities to skip. Defaults to 0.
+    limit: int Maximum number of entities. Defaults to all.
+
+  Returns:
+    list The entities, serialized as for API responses.
+  """
+  end = saved_query.result_count
+  if limit is not None:
+    end = min(end, offset + limit)
+  if offset >= end:
+    return []
+  first_index = offset // _SAVED_QUERY_CHUNK_SIZE
+  chunks = ndb.get_multi([
+      _SavedQueryChunkKey(saved_query.key, saved_query.version, index)
+      for index in range(first_index,
+                         (end - 1) // _SAVED_QUERY_CHUNK_SIZE + 1)
+  ])
+  entities = []
+  for chunk in chunks:
+    if chunk is None:
+      # the results were replaced while they were being read
+      current_query = saved_query.key.get()
+      if not current_query or current_query.version == saved_query.version:
+        return []
+      return RetrieveSavedQueryResults(current_query, offset, limit)
+    entities.extend(chunk.entities)
+  start = offset - first_index * _SAVED_QUERY_CHUNK_SIZE
+  return entities[start:start + end - offset]
+
+
+def DeleteSavedQuery(saved_query):
+  """Delete a saved query and its results.
+
+  Args:
+    saved_query: SavedQuery The query.
+  """
+  chunk_keys = SavedQueryChunk.query(ancestor=saved_query.key).fetch(
+      keys_only=True)
+  ndb.delete_multi(chunk_keys + [saved_query.key])
+
+
+def _SavedQueryChunkKey(saved_query_key, version, index):
+  return ndb.Key(SavedQueryChunk, '%d-%d' % (version, index),
+                 parent=saved_query_key)
+
+
+def RetrieveNameIndexes(user, network_code, method_names):
+  """Retrieve a user's name indexes of entity methods in a network.
+
+  Args:
+    user: AppUser The user.
+    network_code: str The network code.
+    method_names: list Names of entity methods, such as 'GetLineItems'.
+
+  Returns:
+    list The NameIndex of each method, without its entries, or None for
+    methods that have not been indexed yet.
+  """
+  return ndb.get_multi([
+      _NameIndexKey(user, network_code, method_name)
+      for method_name in method_names
+  ])
+
+
+def RetrieveNameIndexEntries(name_index):
+  """Retrieve the entries of a name index.
+
+  Args:
+    name_index: NameIndex The index returned by RetrieveNameIndexes.
+
+  Returns:
+    list The entries, each an [id, name] pair.
+  """
+  chunks = ndb.get_multi([
+      _NameIndexChunkKey(name_index.key, name_index.version, index)
+      for index in range(name_index.chunk_count)
+  ])
+  entries = []
+  for chunk in chunks:
+    if chunk is None:
+      # the index was replaced while it was being read
+      current_index = name_index.key.get()
+      if not current_index or current_index.version == name_index.version:
+        return []
+      return RetrieveNameIndexEntries(current_index)
+    entries.extend(chunk.entries)
+  return entries
+
+
+def ReplaceNameIndex(user, network_code, method_name, entries, last_modified,
+                     full_sync):
+  """Replace a user's name index of an entity method in a network.
+
+  Like ReplaceReferenceTable, the entries are written under a new version
+  before the index is switched over to them.
+
+  Args:
+    user: AppUser The user.
+    network_code: str The network code.
+    method_name: str Name of the entity method, such as 'GetLineItems'.
+    entries: list The entries, each an [id, name] pair.
+    last_modified: str The latest lastModifiedDateTime of the entities, as a
+                   PQL literal.
+    full_sync: bool Whether the entries were all read anew, rather than
+               updated with the entities modified since the last sync.
+
+  Returns:
+    NameIndex The new index.
+  """
+  index_key = _NameIndexKey(user, network_code, method_name)
+  old_index = index_key.get()
+  version = old_index.version + 1 if old_index else 1
+  chunk_count = 0
+  for start in range(0, len(entries), _NAME_INDEX_CHUNK_SIZE):
+    NameIndexChunk(
+        key=_NameIndexChunkKey(index_key, version, chunk_count),
+        entries=entries[start:start + _NAME_INDEX_CHUNK_SIZE]).put()
+    chunk_count += 1
+
+  now = datetime.datetime.now()
+  name_index = NameIndex(
+      key=index_key,
+      network_code=network_code,
+      method_name=method_name,
+      entry_count=len(entries),
+      chunk_count=chunk_count,
+      version=version,
+      last_modified=last_modified,
+      synced=now,
+      full_synced=now if full_sync or not old_index else old_index.full_synced)
+  name_index.put()
+
+  if old_index:
+    ndb.delete_multi([
+        _NameIndexChunkKey(index_key, old_index.version, index)
+        for index in range(old_index.chunk_count)
+    ])
+  return name_index
+
+
+def _NameIndexKey(user, network_code, method_name):
+  return ndb.Key(NameIndex, '%s:%s' % (network_code, method_name),
+                 parent=user.key)
+
+
+def _NameIndexChunkKey(index_key, version, index):
+  return ndb.Key(NameIndexChunk, '%d-%d' % (version, index), parent=index_key)
+
+
+def StoreTrafficRecords(records):
+  """Store recorded traffic.
+
+  Args:
+    records: list The records, as dicts.
+  """
+  if records:
+    ndb.put_multi([TrafficRecord(data=record) for record in records])
+
+
+def RetrieveTrafficRecords():
+  """Retrieve all recorded traffic, oldest first.
+
+  Returns:
+    iterator The records, as dicts.
+  """
+  for record in TrafficRecord.query().order(TrafficRecord.created).iter(
+      batch_size=100):
+    yield record.data
 
 
 def RetrieveAppCredential():
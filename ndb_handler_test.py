@@ -20,12 +20,30 @@ import unittest
 import mock
 from models import AppCredential
 from models import AppUser
+from models import ReferenceTableChunk
+from models import RevokeCheckpoint
+from models import SavedQueryChunk
+import ndb_handler
+from ndb_handler import CreateEntitySnapshot
+from ndb_handler import CreateSavedQuery
+from ndb_handler import DeleteSavedQuery
 from ndb_handler import InitUser
+from ndb_handler import InitUserAsync
 from ndb_handler import ReplaceAppCredential
+from ndb_handler import ReplaceReferenceTable
 from ndb_handler import RetrieveAppCredential
+from ndb_handler import RetrieveEntitySnapshot
+from ndb_handler import RetrieveReferenceRows
+from ndb_handler import RetrieveReferenceTable
+from ndb_handler import RetrieveSavedQuery
+from ndb_handler import RetrieveSavedQueryResults
+from ndb_handler import RetrieveSnapshotDigests
+from ndb_handler import RetrieveUserByKey
 from ndb_handler import RevokeOldCredentials
+from ndb_handler import StoreSavedQueryResults
 
 from google.appengine.api import users
+from google.appengine.ext import ndb
 from google.appengine.ext import testbed
 
 
@@ -58,7 +76,18 @@ class NdbHandlerTest(unittest.TestCase):
     app_credential = AppCredential(client_id='1', client_secret='secret')
     app_credential.put()
 
+    # don't contact Google's OAuth2 server when revoking tokens
+    def revoke_token_async(refresh_token):
+      future = ndb.Future()
+      future.set_result(True)
+      return future
+    self.revoke_token_patcher = mock.patch.object(
+        ndb_handler, '_RevokeTokenAsync',
+        mock.MagicMock(side_effect=revoke_token_async))
+    self.revoke_token_mock = self.revoke_token_patcher.start()
+
   def tearDown(self):
+    self.revoke_token_patcher.stop()
     self.testbed.deactivate()
 
   def testInitExistingUser(self):
@@ -73,6 +102,14 @@ class NdbHandlerTest(unittest.TestCase):
     self.assertTrue(new_app_user_ndb)
     self.assertEqual('new token', new_app_user_ndb.refresh_token)
 
+  def testInitUserAsync(self):
+    users.get_current_user = mock.MagicMock(return_value=self.new_app_user)
+    user_future = InitUserAsync('new token')
+    self.assertTrue(isinstance(user_future, ndb.Future))
+    self.assertEqual('new token', user_future.get_result().refresh_token)
+    self.assertEqual(1, AppUser.query(
+        AppUser.user == self.new_app_user).count())
+
   def testAppCredential(self):
     client_id, client_secret = RetrieveAppCredential()
     self.assertEqual('1', client_id)
@@ -104,5 +141,101 @@ class NdbHandlerTest(unittest.TestCase):
     user_ndb = InitUser()
     self.assertTrue(user_ndb.refresh_token)
 
+  def testRevokeOldUserCredentialsWithGoogle(self):
+    self.assertEqual((1, True), RevokeOldCredentials())
+    self.revoke_token_mock.assert_called_once_with('should not exist')
+    self.assertEqual(None, RevokeCheckpoint.get_by_id('revoke'))
+
+  def testResumeRevokeFromCheckpoint(self):
+    AppUser.date_acquired._auto_now = False  # override for testing purposes
+    for i in range(4):
+      AppUser(user=users.User('olduser%d@gmail.com' % i),
+              email='olduser%d@gmail.com' % i,
+              refresh_token='old token %d' % i,
+              date_acquired=datetime.datetime(2000, 1, 2 + i)).put()
+    AppUser.date_acquired._auto_now = True
+
+    with mock.patch.object(ndb_handler, '_REVOKE_PAGE_SIZE', 2):
+      # a budget of zero stops the run before its first page
+      self.assertEqual((0, False), RevokeOldCredentials(time_budget=0))
+      self.assertTrue(RevokeCheckpoint.get_by_id('revoke'))
+      self.assertEqual((5, True), RevokeOldCredentials())
+
+    self.assertEqual(5, self.revoke_token_mock.call_count)
+    self.assertEqual(None, RevokeCheckpoint.get_by_id('revoke'))
+
+  def testRetrieveUserByKey(self):
+    user_ndb = AppUser.query(AppUser.user == self.recent_user).get()
+    self.assertEqual(user_ndb, RetrieveUserByKey(user_ndb.key.urlsafe()))
+
+  def testReplaceReferenceTable(self):
+    rows = [[str(i), 'Name %d' % i] for i in range(5)]
+    with mock.patch.object(ndb_handler, '_REFERENCE_CHUNK_SIZE', 2):
+      ReplaceReferenceTable('Bandwidth_Group', ['Id', 'BandwidthName'], rows)
+      table = RetrieveReferenceTable('Bandwidth_Group')
+      self.assertEqual(3, table.chunk_count)
+      self.assertEqual(rows, RetrieveReferenceRows(table))
+
+      ReplaceReferenceTable('Bandwidth_Group', ['Id', 'BandwidthName'],
+                            rows[:1])
+      table = RetrieveReferenceTable('Bandwidth_Group')
+      self.assertEqual(2, table.version)
+      self.assertEqual(rows[:1], RetrieveReferenceRows(table))
+      # the chunks of the replaced copy are gone
+      self.assertEqual(1, ReferenceTableChunk.query().count())
+
+  def testCreateEntitySnapshot(self):
+    user_ndb = AppUser.query(AppUser.user == self.recent_user).get()
+    digests = {1: 'aa', 2: 'bb', 3: 'cc', (4, 5): 'dd'}
+    with mock.patch.object(ndb_handler, '_SNAPSHOT_CHUNK_SIZE', 3):
+      snapshot = CreateEntitySnapshot(user_ndb, 'GetLICAs', '1234',
+                                      'WHERE status = \'ACTIVE\'',
+                                      ('lineItemId', 'creativeId'),
+                                      frozenset(['stats']), digests)
+
+    snapshot = RetrieveEntitySnapshot(user_ndb, snapshot.key.id())
+    self.assertEqual(['lineItemId', 'creativeId'], snapshot.key_attributes)
+    self.assertEqual(4, snapshot.entity_count)
+    self.assertEqual(2, snapshot.chunk_count)
+    self.assertEqual(digests, RetrieveSnapshotDigests(snapshot))
+
+    # snapshots belong to the user who took them
+    other_user = AppUser(user=users.User('other@gmail.com'),
+                         email='other@gmail.com')
+    other_user.put()
+    self.assertEqual(None,
+                     RetrieveEntitySnapshot(other_user, snapshot.key.id()))
+
+  def testStoreSavedQueryResults(self):
+    user_ndb = AppUser.query(AppUser.user == self.recent_user).get()
+    saved_query = CreateSavedQuery(user_ndb, 'Active', 'GetLineItems', '1234',
+                                   'WHERE status = \'ACTIVE\'', 60)
+    pages = [[{'id': i} for i in range(start, start + 4)]
+             for start in range(0, 12, 4)]
+    with mock.patch.object(ndb_handler, '_SAVED_QUERY_CHUNK_SIZE', 3):
+      saved_query = StoreSavedQueryResults(saved_query, iter(pages), 10)
+      self.assertEqual(10, saved_query.result_count)
+      self.assertTrue(saved_query.truncated)
+      self.assertEqual(4, saved_query.chunk_count)
+      self.assertEqual(range(10), [
+          entity['id'] for entity in RetrieveSavedQueryResults(saved_query)])
+      self.assertEqual([4, 5, 6, 7], [
+          entity['id']
+          for entity in RetrieveSavedQueryResults(saved_query, 4, 4)])
+      self.assertEqual([], RetrieveSavedQueryResults(saved_query, 10, 4))
+
+      # the previous results are replaced
+      saved_query = StoreSavedQueryResults(saved_query, iter([[{'id': 20}]]),
+                                           10)
+    self.assertEqual(2, saved_query.version)
+    self.assertFalse(saved_query.truncated)
+    self.assertEqual([{'id': 20}], RetrieveSavedQueryResults(saved_query))
+    self.assertEqual(1, SavedQueryChunk.query().count())
+
+    DeleteSavedQuery(saved_query)
+    self.assertEqual(None, RetrieveSavedQuery(user_ndb, saved_query.key.id()))
+    self.assertEqual(0, SavedQueryChunk.query().count())
+
+
 if __name__ == '__main__':
   unittest.main()
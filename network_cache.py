@@ -0,0 +1,117 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per user cache of the networks a user has access to.
+
+Every page load asks for the user's networks, which rarely change. The list
+is kept in memcache, seeded when the user logs in, and served from there.
+A list older than FRESH_SECONDS is still served, and refreshed by a task
+queue request in the background. Making a test network invalidates it.
+"""
+
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+# Age after which a cached list is refreshed in the background.
+FRESH_SECONDS = 10 * 60
+REFRESH_URL = '/tasks/networks'
+
+# Seconds a cached list is kept for at most, stale or not.
+_CACHE_SECONDS = 24 * 60 * 60
+
+
+def GetNetworks(api_handler, user):
+  """Returns a user's networks, from the cache if possible.
+
+  Args:
+    api_handler: APIHandler Handler making calls as the user, used if the
+                 networks are not cached.
+    user: AppUser The user.
+
+  Returns:
+    list The networks, as serialized Network data objects.
+  """
+  cached = memcache.get(_CacheKey(user))
+  if cached is None:
+    return RefreshNetworks(api_handler, user)
+  if time.time() - cached['fetched'] > FRESH_SECONDS:
+    _ScheduleRefresh(user, cached['fetched'])
+  return cached['networks']
+
+
+def GetCachedNetworks(user):
+  """Returns a user's cached networks, without calling the DFP API.
+
+  Args:
+    user: AppUser The user.
+
+  Returns:
+    list The networks, or None if they are not cached.
+  """
+  cached = memcache.get(_CacheKey(user))
+  return cached['networks'] if cached else None
+
+
+def RefreshNetworks(api_handler, user):
+  """Fetches a user's networks from the DFP API and caches them.
+
+  Args:
+    api_handler: APIHandler Handler making calls as the user.
+    user: AppUser The user.
+
+  Returns:
+    list The networks, as serialized Network data objects.
+  """
+  # pylint: disable=g-import-not-at-top
+  from zeep.helpers import serialize_object
+  # pylint: enable=g-import-not-at-top
+  networks = [
+      serialize_object(network)
+      for network in api_handler.GetAllNetworks()['results'] or []
+  ]
+  memcache.set(_CacheKey(user), {
+      'networks': networks,
+      'fetched': time.time(),
+  }, time=_CACHE_SECONDS)
+  return networks
+
+
+def InvalidateNetworks(user):
+  """Drops a user's cached networks, for example after making a network.
+
+  Args:
+    user: AppUser The user.
+  """
+  memcache.delete(_CacheKey(user))
+
+
+def _CacheKey(user):
+  return 'networks:%s' % user.key.id()
+
+
+def _ScheduleRefresh(user, fetched):
+  """Adds a task refreshing a user's networks, once per cached list."""
+  try:
+    taskqueue.add(
+        name='networks-%s-%d' % (user.key.id(), int(fetched)),
+        url=REFRESH_URL,
+        params={'user': user.key.urlsafe()})
+  except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+    pass
+  except taskqueue.Error:
+    # the stale list is still served, the next request tries again
+    logging.exception('Could not schedule refreshing networks')
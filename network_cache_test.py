@@ -0,0 +1,101 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the per user network cache."""
+
+import unittest
+
+import mock
+from models import AppUser
+import network_cache
+from network_cache import GetCachedNetworks
+from network_cache import GetNetworks
+from network_cache import InvalidateNetworks
+from network_cache import RefreshNetworks
+
+from google.appengine.api import users
+from google.appengine.ext import testbed
+
+
+class NetworkCacheTest(unittest.TestCase):
+  """Tests for network_cache.py."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_taskqueue_stub()
+    self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+    self.user = AppUser(user=users.User('johndoe@gmail.com'),
+                        email='johndoe@gmail.com', refresh_token='token')
+    self.user.put()
+    self.api_handler = mock.MagicMock()
+    self.api_handler.GetAllNetworks.return_value = {
+        'results': [{'networkCode': '1234', 'displayName': 'Network'}],
+        'totalResultSetSize': 1,
+    }
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _RefreshTasks(self):
+    return self.taskqueue_stub.get_filtered_tasks(
+        url=network_cache.REFRESH_URL)
+
+  def testGetNetworksCachesList(self):
+    self.assertEqual(None, GetCachedNetworks(self.user))
+
+    networks = GetNetworks(self.api_handler, self.user)
+    self.assertEqual('1234', networks[0]['networkCode'])
+    self.assertEqual(networks, GetNetworks(self.api_handler, self.user))
+    self.assertEqual(networks, GetCachedNetworks(self.user))
+
+    self.assertEqual(1, self.api_handler.GetAllNetworks.call_count)
+    self.assertEqual([], self._RefreshTasks())
+
+  def testStaleListIsServedAndRefreshedOnce(self):
+    RefreshNetworks(self.api_handler, self.user)
+
+    later = network_cache.time.time() + network_cache.FRESH_SECONDS + 1
+    with mock.patch.object(network_cache.time, 'time', return_value=later):
+      self.assertEqual('1234', GetNetworks(self.api_handler,
+                                           self.user)[0]['networkCode'])
+      GetNetworks(self.api_handler, self.user)
+
+    self.assertEqual(1, self.api_handler.GetAllNetworks.call_count)
+    tasks = self._RefreshTasks()
+    self.assertEqual(1, len(tasks))
+    self.assertEqual(self.user.key.urlsafe(), tasks[0].extract_params()['user'])
+
+  def testInvalidateNetworks(self):
+    RefreshNetworks(self.api_handler, self.user)
+    InvalidateNetworks(self.user)
+
+    self.assertEqual(None, GetCachedNetworks(self.user))
+    GetNetworks(self.api_handler, self.user)
+    self.assertEqual(2, self.api_handler.GetAllNetworks.call_count)
+
+  def testUserWithoutNetworks(self):
+    self.api_handler.GetAllNetworks.return_value = {
+        'results': None,
+        'totalResultSetSize': 0,
+    }
+    self.assertEqual([], RefreshNetworks(self.api_handler, self.user))
+    self.assertEqual([], GetCachedNetworks(self.user))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,133 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Page sizes tuned per service and network from observed responses.
+
+A page of users is a few kilobytes and comes back quickly, while a page of
+line items with their targeting can take seconds. For every entity method
+and network, the seconds and bytes per entity of recent full pages are kept
+in memcache as moving averages, and the page size is chosen so that a page
+stays within _TARGET_PAGE_SECONDS and _TARGET_PAGE_BYTES. Page sizes grow
+by at most _MAX_GROWTH per page, are halved when a page times out, and stay
+between MIN_PAGE_SIZE and MAX_PAGE_SIZE.
+"""
+
+from google.appengine.api import memcache
+
+# Page size of methods and networks without statistics yet.
+DEFAULT_PAGE_SIZE = 25
+MIN_PAGE_SIZE = 10
+# The most entities the DFP API returns per call.
+MAX_PAGE_SIZE = 500
+
+# Seconds and bytes a page is tuned to take at most.
+_TARGET_PAGE_SECONDS = 3.0
+_TARGET_PAGE_BYTES = 2 * 1024 * 1024
+# Factor by which the page size grows at most per observed page. The
+# seconds per entity of small pages are inflated by each call's fixed
+# overhead, so the size approaches its target over a few pages.
+_MAX_GROWTH = 2.0
+# Weight of the latest page in the moving averages.
+_SMOOTHING = 0.3
+# Seconds for which statistics are kept after the last observed page.
+_STATS_SECONDS = 24 * 60 * 60
+
+
+def ClampPageSize(page_size):
+  """Returns a page size within the allowed bounds.
+
+  Args:
+    page_size: int The page size.
+
+  Returns:
+    int The page size, between MIN_PAGE_SIZE and MAX_PAGE_SIZE.
+  """
+  return max(MIN_PAGE_SIZE, min(MAX_PAGE_SIZE, int(page_size)))
+
+
+def GetPageSize(method_name, network_code):
+  """Returns the page size for a method's entities in a network.
+
+  Args:
+    method_name: str Name of an entity method, such as 'GetLineItems', or
+                 None for DEFAULT_PAGE_SIZE.
+    network_code: str The network code.
+
+  Returns:
+    int The page size.
+  """
+  if not method_name:
+    return DEFAULT_PAGE_SIZE
+  stats = memcache.get(_StatsKey(method_name, network_code))
+  return stats['pageSize'] if stats else DEFAULT_PAGE_SIZE
+
+
+def RecordPage(method_name, network_code, entity_count, seconds,
+               response_bytes=None):
+  """Updates the statistics of a method and network with a full page.
+
+  Pages that were not full are not representative, since the fixed
+  overhead of their call is spread over fewer entities.
+
+  Args:
+    method_name: str Name of an entity method, such as 'GetLineItems'.
+    network_code: str The network code.
+    entity_count: int Number of entities of the page.
+    seconds: float Seconds the call took.
+    response_bytes: int Size of the response, if known.
+  """
+  if entity_count <= 0:
+    return
+  key = _StatsKey(method_name, network_code)
+  stats = memcache.get(key) or {'pageSize': DEFAULT_PAGE_SIZE}
+  stats['secondsPerEntity'] = _Average(stats.get('secondsPerEntity'),
+                                       seconds / entity_count)
+  if response_bytes:
+    stats['bytesPerEntity'] = _Average(stats.get('bytesPerEntity'),
+                                       float(response_bytes) / entity_count)
+
+  target = _TARGET_PAGE_SECONDS / max(stats['secondsPerEntity'], 1e-6)
+  if stats.get('bytesPerEntity'):
+    target = min(target, _TARGET_PAGE_BYTES / stats['bytesPerEntity'])
+  stats['pageSize'] = ClampPageSize(
+      min(target, max(stats['pageSize'], entity_count) * _MAX_GROWTH))
+  memcache.set(key, stats, time=_STATS_SECONDS)
+
+
+def RecordTimeout(method_name, network_code, page_size):
+  """Halves the page size of a method and network after a timed out page.
+
+  Args:
+    method_name: str Name of an entity method, such as 'GetLineItems'.
+    network_code: str The network code.
+    page_size: int Size of the page that timed out.
+  """
+  key = _StatsKey(method_name, network_code)
+  stats = memcache.get(key) or {}
+  stats['pageSize'] = ClampPageSize(
+      min(page_size, stats.get('pageSize', page_size)) // 2)
+  # the next full pages start from the halved size
+  stats['secondsPerEntity'] = _TARGET_PAGE_SECONDS / stats['pageSize']
+  memcache.set(key, stats, time=_STATS_SECONDS)
+
+
+def _StatsKey(method_name, network_code):
+  return 'page-size:%s:%s' % (method_name, network_code)
+
+
+def _Average(average, value):
+  """Returns a moving average updated with a new value."""
+  if average is None:
+    return value
+  return average + _SMOOTHING * (value - average)
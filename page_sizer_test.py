@@ -0,0 +1,85 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the adaptive page sizes."""
+
+import unittest
+
+from page_sizer import ClampPageSize
+from page_sizer import DEFAULT_PAGE_SIZE
+from page_sizer import GetPageSize
+from page_sizer import MAX_PAGE_SIZE
+from page_sizer import MIN_PAGE_SIZE
+from page_sizer import RecordPage
+from page_sizer import RecordTimeout
+
+from google.appengine.ext import testbed
+
+
+class PageSizerTest(unittest.TestCase):
+  """Tests for page_sizer.py."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testDefaultPageSize(self):
+    self.assertEqual(DEFAULT_PAGE_SIZE, GetPageSize('GetUsers', '123'))
+    self.assertEqual(DEFAULT_PAGE_SIZE, GetPageSize(None, '123'))
+
+  def testClampPageSize(self):
+    self.assertEqual(MIN_PAGE_SIZE, ClampPageSize(1))
+    self.assertEqual(MAX_PAGE_SIZE, ClampPageSize(10000))
+    self.assertEqual(100, ClampPageSize(100))
+
+  def testFastPagesGrowGradually(self):
+    RecordPage('GetUsers', '123', 25, 0.1)
+    self.assertEqual(50, GetPageSize('GetUsers', '123'))
+    RecordPage('GetUsers', '123', 50, 0.2)
+    self.assertEqual(100, GetPageSize('GetUsers', '123'))
+    for _ in range(10):
+      RecordPage('GetUsers', '123', 100, 0.4)
+    self.assertEqual(MAX_PAGE_SIZE, GetPageSize('GetUsers', '123'))
+    # other methods and networks keep their own sizes
+    self.assertEqual(DEFAULT_PAGE_SIZE, GetPageSize('GetLineItems', '123'))
+    self.assertEqual(DEFAULT_PAGE_SIZE, GetPageSize('GetUsers', '456'))
+
+  def testSlowPagesShrink(self):
+    RecordPage('GetLineItems', '123', 25, 7.5)
+    self.assertEqual(10, GetPageSize('GetLineItems', '123'))
+
+  def testLargePagesShrink(self):
+    RecordPage('GetLineItems', '123', 25, 0.1, response_bytes=5 * 1024 * 1024)
+    self.assertEqual(10, GetPageSize('GetLineItems', '123'))
+    RecordPage('GetUsers', '123', 25, 0.1, response_bytes=2 * 1024 * 1024)
+    self.assertEqual(25, GetPageSize('GetUsers', '123'))
+
+  def testTimeoutHalvesPageSize(self):
+    RecordPage('GetOrders', '123', 25, 0.1)
+    RecordPage('GetOrders', '123', 50, 0.2)
+    self.assertEqual(100, GetPageSize('GetOrders', '123'))
+    RecordTimeout('GetOrders', '123', 100)
+    self.assertEqual(50, GetPageSize('GetOrders', '123'))
+    RecordTimeout('GetOrders', '123', 50)
+    RecordTimeout('GetOrders', '123', 25)
+    RecordTimeout('GetOrders', '123', 12)
+    self.assertEqual(MIN_PAGE_SIZE, GetPageSize('GetOrders', '123'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,247 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Thread-based futures for overlapping blocking upstream calls.
+
+App Engine does not allow threads to outlive the request that started them,
+so a WorkerPool starts its threads on demand and lets them exit as soon as its
+queue is empty instead of keeping them around. Callers must wait for the
+futures they submit before the request ends.
+
+ndb futures are bound to the thread that created them, so datastore work
+should stay on the request thread and use ndb's own async API.
+"""
+
+import collections
+import logging
+import Queue
+import sys
+import threading
+import time
+
+
+class TimeoutError(Exception):
+  """Raised when a future is not done within the given timeout."""
+
+
+class CancelledError(Exception):
+  """The exception of a future whose function was cancelled before it ran."""
+
+
+class Future(object):
+  """The result of a function that is run by a WorkerPool."""
+
+  def __init__(self):
+    self._done = threading.Event()
+    self._lock = threading.Lock()
+    self._result = None
+    self._exc_info = None
+    self._callbacks = []
+
+  def Done(self):
+    """Returns whether the function has finished."""
+    return self._done.is_set()
+
+  def Result(self, timeout=None):
+    """Waits for the function to finish and returns its result.
+
+    Args:
+      timeout: float Number of seconds to wait. Defaults to no limit.
+
+    Returns:
+      The function's return value.
+
+    Raises:
+      TimeoutError: The function did not finish in time.
+      Exception: Any exception raised by the function is re-raised.
+    """
+    if not self._done.wait(timeout):
+      raise TimeoutError('Future not done after %s seconds' % timeout)
+    if self._exc_info:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+  def Exception(self, timeout=None):
+    """Waits for the function to finish and returns its exception.
+
+    Args:
+      timeout: float Number of seconds to wait. Defaults to no limit.
+
+    Returns:
+      Exception The exception raised by the function, or None.
+
+    Raises:
+      TimeoutError: The function did not finish in time.
+    """
+    if not self._done.wait(timeout):
+      raise TimeoutError('Future not done after %s seconds' % timeout)
+    return self._exc_info[1] if self._exc_info else None
+
+  def AddDoneCallback(self, callback):
+    """Calls callback with this future once it is done.
+
+    Args:
+      callback: func Function taking the future as its only argument. It is
+                called immediately if the future is already done.
+    """
+    with self._lock:
+      if not self._done.is_set():
+        self._callbacks.append(callback)
+        return
+    callback(self)
+
+  def SetResult(self, result):
+    """Marks the future as done with the given result."""
+    self._result = result
+    self._Finish()
+
+  def SetException(self, exc_info):
+    """Marks the future as failed.
+
+    Args:
+      exc_info: tuple The exception as returned by sys.exc_info().
+    """
+    self._exc_info = exc_info
+    self._Finish()
+
+  def _Finish(self):
+    with self._lock:
+      self._done.set()
+      callbacks, self._callbacks = self._callbacks, []
+    for callback in callbacks:
+      try:
+        callback(self)
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Future callback failed')
+
+
+class WorkerPool(object):
+  """Runs functions on at most max_workers threads at a time."""
+
+  def __init__(self, max_workers):
+    """Initializes a WorkerPool.
+
+    Args:
+      max_workers: int Maximum number of functions running at once.
+    """
+    self.max_workers = max_workers
+    self._queue = collections.deque()
+    self._lock = threading.Lock()
+    self._worker_count = 0
+
+  def Submit(self, func, *args, **kwargs):
+    """Schedules func(*args, **kwargs) to run on a worker thread.
+
+    Args:
+      func: func The function to run.
+      *args: Positional arguments for func.
+      **kwargs: Keyword arguments for func.
+
+    Returns:
+      Future The future result of the function.
+    """
+    future = Future()
+    with self._lock:
+      self._queue.append((future, func, args, kwargs))
+      start_worker = self._worker_count < self.max_workers
+      if start_worker:
+        self._worker_count += 1
+    if start_worker:
+      worker = threading.Thread(target=self._Work)
+      worker.daemon = True
+      worker.start()
+    return future
+
+  def Cancel(self, future):
+    """Cancels a function that has not started running yet.
+
+    A cancelled future is done, with a CancelledError as its exception.
+
+    Args:
+      future: Future The future returned by Submit.
+
+    Returns:
+      bool Whether the function was cancelled. Functions that are running or
+      have finished cannot be.
+    """
+    with self._lock:
+      for index, (queued_future, _, _, _) in enumerate(self._queue):
+        if queued_future is future:
+          del self._queue[index]
+          break
+      else:
+        return False
+    try:
+      raise CancelledError('Cancelled before it started')
+    except CancelledError:
+      future.SetException(sys.exc_info())
+    return True
+
+  def Map(self, func, items):
+    """Schedules func(item) for every item.
+
+    Args:
+      func: func The function to run.
+      items: iterable The arguments.
+
+    Returns:
+      list The futures, in the order of items.
+    """
+    return [self.Submit(func, item) for item in items]
+
+  def _Work(self):
+    """Runs queued functions until the queue is empty."""
+    while True:
+      with self._lock:
+        if not self._queue:
+          self._worker_count -= 1
+          return
+        future, func, args, kwargs = self._queue.popleft()
+      try:
+        result = func(*args, **kwargs)
+      except Exception:  # pylint: disable=broad-except
+        future.SetException(sys.exc_info())
+      else:
+        future.SetResult(result)
+
+
+def AsCompleted(futures, timeout=None):
+  """Yields futures as they finish.
+
+  Args:
+    futures: list The futures to wait for.
+    timeout: float Number of seconds to wait for all of them. Defaults to no
+             limit.
+
+  Yields:
+    Future The next future to finish.
+
+  Raises:
+    TimeoutError: Not all futures finished in time.
+  """
+  done_queue = Queue.Queue()
+  for future in futures:
+    future.AddDoneCallback(done_queue.put)
+
+  deadline = time.time() + timeout if timeout is not None else None
+  for _ in range(len(futures)):
+    remaining = None
+    if deadline is not None:
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        raise TimeoutError('Futures not done after %s seconds' % timeout)
+    try:
+      yield done_queue.get(timeout=remaining)
+    except Queue.Empty:
+      raise TimeoutError('Futures not done after %s seconds' % timeout)
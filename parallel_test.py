@@ -0,0 +1,110 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the thread-based futures used in the DFP Playground."""
+
+import threading
+import time
+import unittest
+
+from parallel import AsCompleted
+from parallel import CancelledError
+from parallel import TimeoutError
+from parallel import WorkerPool
+
+
+class ParallelTest(unittest.TestCase):
+  """Tests for parallel.py."""
+
+  def setUp(self):
+    self.pool = WorkerPool(3)
+
+  def testResult(self):
+    future = self.pool.Submit(lambda x, y: x + y, 1, y=2)
+    self.assertEqual(3, future.Result(timeout=5))
+    self.assertTrue(future.Done())
+    self.assertEqual(None, future.Exception())
+
+  def testException(self):
+    def fail():
+      raise ValueError('failed')
+    future = self.pool.Submit(fail)
+    self.assertRaises(ValueError, future.Result, 5)
+    self.assertTrue(isinstance(future.Exception(), ValueError))
+
+  def testTimeout(self):
+    release = threading.Event()
+    future = self.pool.Submit(release.wait)
+    self.assertRaises(TimeoutError, future.Result, 0.01)
+    release.set()
+    future.Result(timeout=5)
+
+  def testMaxWorkers(self):
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def work(unused_item):
+      with lock:
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+      time.sleep(0.01)
+      with lock:
+        running[0] -= 1
+
+    for future in self.pool.Map(work, range(12)):
+      future.Result(timeout=5)
+    self.assertEqual(3, peak[0])
+
+  def testCancel(self):
+    pool = WorkerPool(1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def wait():
+      started.set()
+      release.wait(5)
+    running = pool.Submit(wait)
+    queued = pool.Submit(lambda: 'ran')
+    started.wait(5)
+
+    self.assertTrue(pool.Cancel(queued))
+    self.assertTrue(queued.Done())
+    self.assertTrue(isinstance(queued.Exception(), CancelledError))
+    self.assertRaises(CancelledError, queued.Result)
+    self.assertFalse(pool.Cancel(running))
+    release.set()
+    running.Result(timeout=5)
+    self.assertFalse(pool.Cancel(running))
+
+  def testAsCompletedYieldsInCompletionOrder(self):
+    slow_release = threading.Event()
+    slow = self.pool.Submit(slow_release.wait)
+    fast = self.pool.Submit(lambda: 'fast')
+
+    completed = AsCompleted([slow, fast], timeout=5)
+    self.assertIs(fast, next(completed))
+    slow_release.set()
+    self.assertIs(slow, next(completed))
+    self.assertRaises(StopIteration, next, completed)
+
+  def testAsCompletedTimeout(self):
+    release = threading.Event()
+    future = self.pool.Submit(release.wait)
+    self.assertRaises(TimeoutError, list, AsCompleted([future], timeout=0.01))
+    release.set()
+
+
+if __name__ == '__main__':
+  unittest.main()
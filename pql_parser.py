@@ -0,0 +1,460 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local parsing and validation of PQL statements.
+
+Statements are checked here before they are sent to the DFP API, so that
+syntax errors and unknown columns are reported with their position instead
+of costing an upstream round trip. FormatStatement writes a parsed statement
+in a canonical form that is the same for clauses differing only in
+whitespace, keyword case or column name case, for use in cache keys. Parsed
+statements are memoized, since the same few clauses are sent over and over
+while paging.
+"""
+
+import collections
+import re
+
+from utils import lru_cache
+
+# Columns that statements of each entity method can filter and order on, in
+# their canonical spelling. PQL column names are case-insensitive.
+SERVICE_COLUMNS = {
+    'GetUsers': ('email', 'id', 'name', 'roleId', 'roleName', 'status'),
+    'GetAdUnits': ('adUnitCode', 'id', 'name', 'parentId', 'status',
+                   'lastModifiedDateTime'),
+    'GetCompanies': ('id', 'name', 'type', 'lastModifiedDateTime'),
+    'GetCreatives': ('advertiserId', 'height', 'id', 'name', 'width',
+                     'lastModifiedDateTime'),
+    'GetCreativeTemplates': ('id', 'name', 'type', 'status'),
+    'GetCustomTargetingKeys': ('id', 'name', 'displayName', 'type'),
+    'GetCustomTargetingValues': ('customTargetingKeyId', 'id', 'name',
+                                 'displayName', 'matchType'),
+    'GetLICAs': ('creativeId', 'manualCreativeRotationWeight',
+                 'destinationUrl', 'lineItemId', 'status',
+                 'lastModifiedDateTime'),
+    'GetOrders': ('advertiserId', 'endDateTime', 'id', 'name',
+                  'salespersonId', 'startDateTime', 'status', 'traffickerId',
+                  'lastModifiedDateTime'),
+    'GetLineItems': ('costType', 'creationDateTime', 'deliveryRateType',
+                     'endDateTime', 'externalId', 'id', 'isMissingCreatives',
+                     'isSetTopBoxEnabled', 'lastModifiedDateTime',
+                     'lineItemType', 'name', 'orderId', 'startDateTime',
+                     'status', 'targeting', 'unitsBought'),
+    'GetPlacements': ('description', 'id', 'name', 'placementCode', 'status',
+                      'lastModifiedDateTime'),
+}
+
+# Number of parsed statements kept by each of the parse functions.
+_PARSE_CACHE_SIZE = 512
+
+_TOKEN_PATTERN = re.compile(r"""\s*(?:
+    (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|
+    (?P<number>-?\d+(?:\.\d+)?)|
+    (?P<bind>:\w+)|
+    (?P<operator><=|>=|!=|<>|=|<|>|,|\(|\))|
+    (?P<word>[A-Za-z_]\w*))""", re.VERBOSE)
+_COMPARISONS = ('=', '!=', '<', '<=', '>', '>=')
+_KEYWORDS = frozenset([
+    'AND', 'ASC', 'BY', 'DESC', 'FALSE', 'FROM', 'IN', 'IS', 'LIKE', 'LIMIT',
+    'NOT', 'NULL', 'OFFSET', 'OR', 'ORDER', 'SELECT', 'TRUE', 'WHERE'
+])
+
+# A parsed statement. columns and table are only set for selects. where is
+# None or a Condition, Junction or Negation, and order_by a tuple of
+# (column, descending) tuples. Parsed statements are shared by all callers.
+Statement = collections.namedtuple(
+    'Statement', ['columns', 'table', 'where', 'order_by', 'limit', 'offset'])
+# A condition on a column. operand is a Value for comparisons and LIKE, a tuple
+# of Values for IN and None for IS NULL.
+Condition = collections.namedtuple('Condition',
+                                   ['column', 'operator', 'operand'])
+# Conditions combined by 'AND' or 'OR'.
+Junction = collections.namedtuple('Junction', ['operator', 'operands'])
+Negation = collections.namedtuple('Negation', ['operand'])
+# A literal or bind variable, with its kind ('string', 'number', 'boolean' or
+# 'bind') and its text as written.
+Value = collections.namedtuple('Value', ['kind', 'text'])
+# Predicates that every result of a statement satisfies. equalities maps
+# columns to the frozenset of values they can have, ranges maps columns to
+# their inclusive (lowest, highest) integer bounds, either of which can be
+# None.
+Predicates = collections.namedtuple('Predicates', ['equalities', 'ranges'])
+
+
+class InvalidStatementError(Exception):
+  """Raised when a statement is not valid PQL.
+
+  Attributes:
+    position: int Offset in the statement at which the error was found.
+  """
+
+  def __init__(self, message, position):
+    super(InvalidStatementError, self).__init__(
+        '%s at position %d' % (message, position))
+    self.position = position
+
+
+@lru_cache(_PARSE_CACHE_SIZE)
+def ParseFilter(clause, method_name=None):
+  """Parses the filter statement of a get*ByStatement call.
+
+  Args:
+    clause: str The statement, such as "WHERE status = 'ACTIVE' LIMIT 10".
+    method_name: str Name of the entity method the statement is for, such as
+                 'GetLineItems'. If given, its columns are validated against
+                 SERVICE_COLUMNS.
+
+  Returns:
+    Statement The parsed statement, without columns and table.
+
+  Raises:
+    InvalidStatementError: The statement is not valid.
+  """
+  return _StatementParser(clause, SERVICE_COLUMNS.get(method_name)).Parse()
+
+
+@lru_cache(_PARSE_CACHE_SIZE)
+def ParseSelect(query):
+  """Parses a PQL select statement.
+
+  Args:
+    query: str The statement, such as 'SELECT Id FROM Browser WHERE Id = 1'.
+
+  Returns:
+    Statement The parsed statement, with lower case column and table names.
+
+  Raises:
+    InvalidStatementError: The statement is not valid.
+  """
+  return _StatementParser(query, None).Parse(select=True)
+
+
+def FormatStatement(statement):
+  """Writes a parsed statement in its canonical form.
+
+  Keywords are upper case, column names are spelled as in SERVICE_COLUMNS
+  or lower case, '<>' is written as '!=', orderings always have a direction
+  and redundant parentheses are dropped. Literals are kept as written.
+
+  Args:
+    statement: Statement The parsed statement.
+
+  Returns:
+    str The canonical statement.
+  """
+  parts = []
+  if statement.table:
+    parts.append('SELECT %s FROM %s' % (', '.join(statement.columns),
+                                        statement.table))
+  if statement.where:
+    parts.append('WHERE %s' % _FormatExpression(statement.where))
+  if statement.order_by:
+    parts.append('ORDER BY %s' % ', '.join(
+        '%s %s' % (column, 'DESC' if descending else 'ASC')
+        for column, descending in statement.order_by))
+  if statement.limit is not None:
+    parts.append('LIMIT %d' % statement.limit)
+  if statement.offset is not None:
+    parts.append('OFFSET %d' % statement.offset)
+  return ' '.join(parts)
+
+
+def ExtractPredicates(statement):
+  """Returns the equality and integer range predicates of a statement.
+
+  Only conditions that every result must satisfy are considered, that is the
+  statement's top level conditions combined with AND, and only literal
+  operands.
+
+  Args:
+    statement: Statement The parsed statement.
+
+  Returns:
+    Predicates The predicates. Equalities are by the literal values, such as
+    1 or u'ACTIVE', ranges only cover integer comparisons.
+  """
+  where = statement.where
+  if isinstance(where, Junction) and where.operator == 'AND':
+    conditions = where.operands
+  else:
+    conditions = [where]
+
+  equalities = {}
+  ranges = {}
+  for condition in conditions:
+    if not isinstance(condition, Condition):
+      continue
+    column, operator, operand = condition
+    if operator in ('=', 'IN'):
+      values = operand if operator == 'IN' else [operand]
+      if any(value.kind == 'bind' for value in values):
+        continue
+      values = frozenset(LiteralValue(value) for value in values)
+      equalities[column] = equalities.get(column, values) & values
+    elif (operator in ('<', '<=', '>', '>=') and operand.kind == 'number' and
+          isinstance(LiteralValue(operand), (int, long))):
+      number = LiteralValue(operand)
+      lowest, highest = ranges.get(column, (None, None))
+      if operator in ('>', '>='):
+        bound = number + 1 if operator == '>' else number
+        lowest = bound if lowest is None else max(lowest, bound)
+      else:
+        bound = number - 1 if operator == '<' else number
+        highest = bound if highest is None else min(highest, bound)
+      ranges[column] = (lowest, highest)
+  return Predicates(equalities, ranges)
+
+
+def LiteralValue(value):
+  """Returns the Python value of a literal.
+
+  Args:
+    value: Value The literal.
+
+  Returns:
+    The unquoted string, the int or float number, or the boolean.
+  """
+  if value.kind == 'string':
+    return re.sub(r'\\(.)', r'\1', value.text[1:-1])
+  if value.kind == 'number':
+    return float(value.text) if '.' in value.text else int(value.text)
+  if value.kind == 'boolean':
+    return value.text == 'TRUE'
+  raise ValueError('Bind variable %s has no value' % value.text)
+
+
+def _FormatExpression(expression, parent_operator=None):
+  """Writes a where clause expression in its canonical form."""
+  if isinstance(expression, Junction):
+    text = (' %s ' % expression.operator).join(
+        _FormatExpression(operand, expression.operator)
+        for operand in expression.operands)
+    # AND binds more tightly than OR
+    if parent_operator and (parent_operator != 'OR' or
+                            expression.operator != 'AND'):
+      text = '(%s)' % text
+    return text
+  if isinstance(expression, Negation):
+    return 'NOT %s' % _FormatExpression(expression.operand, 'NOT')
+
+  column, operator, operand = expression
+  if operand is None:
+    return '%s %s' % (column, operator)
+  if isinstance(operand, tuple) and not isinstance(operand, Value):
+    return '%s %s (%s)' % (column, operator,
+                           ', '.join(value.text for value in operand))
+  return '%s %s %s' % (column, operator, operand.text)
+
+
+class _StatementParser(object):
+  """Recursive descent parser for PQL statements."""
+
+  def __init__(self, text, columns):
+    """Initializes a _StatementParser.
+
+    Args:
+      text: str The statement.
+      columns: tuple The valid column names, or None to accept any.
+
+    Raises:
+      InvalidStatementError: The statement contains invalid characters.
+    """
+    self._tokens = []
+    self._length = len(text)
+    position = 0
+    while position < len(text):
+      match = _TOKEN_PATTERN.match(text, position)
+      if not match or match.end() == position:
+        if not text[position:].strip():
+          break
+        raise InvalidStatementError('Unexpected character',
+                                    len(text) - len(text[position:].lstrip()))
+      self._tokens.append((match.lastgroup, match.group(match.lastgroup),
+                           match.start(match.lastgroup)))
+      position = match.end()
+    self._position = 0
+    self._columns = None
+    if columns is not None:
+      self._columns = dict((column.lower(), column) for column in columns)
+
+  def Parse(self, select=False):
+    """Parses the whole statement.
+
+    Args:
+      select: bool Whether the statement is a select with columns and table.
+
+    Returns:
+      Statement The parsed statement.
+    """
+    columns = table = None
+    if select:
+      self._ExpectWord('SELECT')
+      columns = [self._ParseColumn()]
+      while self._AcceptOperator(','):
+        columns.append(self._ParseColumn())
+      self._ExpectWord('FROM')
+      table = self._ParseName('table').lower()
+
+    where = None
+    if self._AcceptWord('WHERE'):
+      where = self._ParseOr()
+    order_by = []
+    if self._AcceptWord('ORDER'):
+      self._ExpectWord('BY')
+      order_by.append(self._ParseOrdering())
+      while self._AcceptOperator(','):
+        order_by.append(self._ParseOrdering())
+    limit = offset = None
+    if self._AcceptWord('LIMIT'):
+      limit = self._ExpectInteger()
+    if self._AcceptWord('OFFSET'):
+      offset = self._ExpectInteger()
+    if self._Peek()[0] is not None:
+      self._Fail('Unexpected %s' % self._Peek()[1])
+    return Statement(columns and tuple(columns), table, where, tuple(order_by),
+                     limit, offset)
+
+  def _ParseOr(self):
+    return self._Junction('OR', self._ParseAnd)
+
+  def _ParseAnd(self):
+    return self._Junction('AND', self._ParseNot)
+
+  def _Junction(self, operator, parse_operand):
+    """Parses operands separated by an operator, flattening nested ones."""
+    operands = []
+    while True:
+      operand = parse_operand()
+      if isinstance(operand, Junction) and operand.operator == operator:
+        operands.extend(operand.operands)
+      else:
+        operands.append(operand)
+      if not self._AcceptWord(operator):
+        break
+    if len(operands) == 1:
+      return operands[0]
+    return Junction(operator, tuple(operands))
+
+  def _ParseNot(self):
+    if self._AcceptWord('NOT'):
+      return Negation(self._ParseNot())
+    if self._AcceptOperator('('):
+      expression = self._ParseOr()
+      self._ExpectOperator(')')
+      return expression
+    return self._ParseCondition()
+
+  def _ParseCondition(self):
+    """Parses a single condition on a column."""
+    column = self._ParseColumn()
+    if self._AcceptWord('IS'):
+      negated = self._AcceptWord('NOT')
+      self._ExpectWord('NULL')
+      return Condition(column, 'IS NOT NULL' if negated else 'IS NULL', None)
+    negated = self._AcceptWord('NOT')
+    if self._AcceptWord('LIKE'):
+      operand = self._ParseValue()
+      if operand.kind not in ('string', 'bind'):
+        self._Fail('Expected a string', -1)
+      return Condition(column, 'NOT LIKE' if negated else 'LIKE', operand)
+    if self._AcceptWord('IN'):
+      self._ExpectOperator('(')
+      operands = [self._ParseValue()]
+      while self._AcceptOperator(','):
+        operands.append(self._ParseValue())
+      self._ExpectOperator(')')
+      return Condition(column, 'NOT IN' if negated else 'IN', tuple(operands))
+    if negated:
+      self._Fail('Expected LIKE or IN')
+    kind, operator, _ = self._Peek()
+    if kind != 'operator' or (operator not in _COMPARISONS and
+                              operator != '<>'):
+      self._Fail('Expected a comparison')
+    self._position += 1
+    return Condition(column, '!=' if operator == '<>' else operator,
+                     self._ParseValue())
+
+  def _ParseOrdering(self):
+    column = self._ParseColumn()
+    if self._AcceptWord('DESC'):
+      return (column, True)
+    self._AcceptWord('ASC')
+    return (column, False)
+
+  def _ParseValue(self):
+    kind, text, _ = self._Peek()
+    if kind in ('string', 'number', 'bind'):
+      self._position += 1
+      return Value(kind, text)
+    if kind == 'word' and text.upper() in ('TRUE', 'FALSE'):
+      self._position += 1
+      return Value('boolean', text.upper())
+    self._Fail('Expected a value')
+
+  def _ParseColumn(self):
+    """Parses a column name and returns its canonical spelling."""
+    name = self._ParseName('column')
+    if self._columns is None:
+      return name.lower()
+    if name.lower() not in self._columns:
+      self._Fail('Unknown column %s' % name, -1)
+    return self._columns[name.lower()]
+
+  def _ParseName(self, what):
+    kind, text, _ = self._Peek()
+    if kind != 'word' or text.upper() in _KEYWORDS:
+      self._Fail('Expected a %s name' % what)
+    self._position += 1
+    return text
+
+  def _ExpectInteger(self):
+    kind, text, _ = self._Peek()
+    if kind != 'number' or not text.isdigit():
+      self._Fail('Expected a non-negative integer')
+    self._position += 1
+    return int(text)
+
+  def _Peek(self):
+    if self._position < len(self._tokens):
+      return self._tokens[self._position]
+    return (None, None, self._length)
+
+  def _Fail(self, message, offset=0):
+    """Raises an InvalidStatementError at a token relative to the current."""
+    position = self._position + offset
+    if position < len(self._tokens):
+      raise InvalidStatementError(message, self._tokens[position][2])
+    raise InvalidStatementError(message, self._length)
+
+  def _AcceptWord(self, word):
+    kind, text, _ = self._Peek()
+    if kind == 'word' and text.upper() == word:
+      self._position += 1
+      return True
+    return False
+
+  def _ExpectWord(self, word):
+    if not self._AcceptWord(word):
+      self._Fail('Expected %s' % word)
+
+  def _AcceptOperator(self, operator):
+    if self._Peek()[:2] == ('operator', operator):
+      self._position += 1
+      return True
+    return False
+
+  def _ExpectOperator(self, operator):
+    if not self._AcceptOperator(operator):
+      self._Fail('Expected %s' % operator)
@@ -0,0 +1,143 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the PQL parser."""
+
+import unittest
+
+from pql_parser import Condition
+from pql_parser import ExtractPredicates
+from pql_parser import FormatStatement
+from pql_parser import InvalidStatementError
+from pql_parser import Junction
+from pql_parser import ParseFilter
+from pql_parser import ParseSelect
+from pql_parser import Value
+
+
+class PQLParserTest(unittest.TestCase):
+  """Tests for pql_parser.py."""
+
+  def testParseFilter(self):
+    statement = ParseFilter(
+        "where STATUS = 'PAUSED' and (orderid IN (1, 2) or Name LIKE 'a%') "
+        'order by ID desc LIMIT 10 OFFSET 20', 'GetLineItems')
+
+    self.assertEqual(
+        Junction('AND', (
+            Condition('status', '=', Value('string', "'PAUSED'")),
+            Junction('OR', (
+                Condition('orderId', 'IN', (Value('number', '1'),
+                                            Value('number', '2'))),
+                Condition('name', 'LIKE', Value('string', "'a%'")),
+            )),
+        )), statement.where)
+    self.assertEqual((('id', True),), statement.order_by)
+    self.assertEqual(10, statement.limit)
+    self.assertEqual(20, statement.offset)
+    self.assertEqual(None, statement.table)
+
+  def testParseFilterIsMemoized(self):
+    self.assertTrue(ParseFilter('WHERE id = 1', 'GetUsers') is
+                    ParseFilter('WHERE id = 1', 'GetUsers'))
+
+  def testParseEmptyFilter(self):
+    statement = ParseFilter('', 'GetUsers')
+    self.assertEqual(None, statement.where)
+    self.assertEqual('', FormatStatement(statement))
+
+  def testParseSelect(self):
+    statement = ParseSelect(
+        'SELECT Id, BrowserName FROM Browser WHERE MajorVersion >= :version')
+
+    self.assertEqual(('id', 'browsername'), statement.columns)
+    self.assertEqual('browser', statement.table)
+    self.assertEqual(
+        Condition('majorversion', '>=', Value('bind', ':version')),
+        statement.where)
+
+  def testInvalidStatements(self):
+    for clause, position in [
+        ('WHERE id = ', 11),
+        ('WHERE id == 1', 10),
+        ("WHERE name = 'unterminated", 13),
+        ('WHERE unknown = 1', 6),
+        ('WHERE (id = 1', 13),
+        ('WHERE id = 1 LIMIT -1', 19),
+        ('WHERE id NOT = 1', 13),
+        ('id = 1', 0),
+        ('WHERE id = 1 LIMIT 5 LIMIT 5', 21),
+    ]:
+      try:
+        ParseFilter(clause, 'GetUsers')
+        self.fail('%s is not valid' % clause)
+      except InvalidStatementError as e:
+        self.assertEqual(position, e.position, clause)
+
+    self.assertRaises(InvalidStatementError, ParseSelect,
+                      'SELECT COUNT(Id) FROM Browser')
+    self.assertRaises(InvalidStatementError, ParseSelect, 'SELECT FROM Browser')
+
+  def testUnknownServiceAcceptsAnyColumn(self):
+    self.assertEqual(Condition('anything', 'IS NULL', None),
+                     ParseFilter('WHERE anything IS NULL').where)
+
+  def testFormatStatementIsCanonical(self):
+    clauses = [
+        "WHERE status = 'PAUSED' AND (orderId = 1 OR id <> 2) ORDER BY id",
+        "  where STATUS='PAUSED'   AND(ORDERID=1 or ID!=2)order by Id asc",
+        "WHERE ((status = 'PAUSED') AND (orderid = 1 OR (id != 2))) "
+        'ORDER BY ID ASC',
+    ]
+    canonical = set(
+        FormatStatement(ParseFilter(clause, 'GetLineItems'))
+        for clause in clauses)
+
+    self.assertEqual(
+        set(["WHERE status = 'PAUSED' AND (orderId = 1 OR id != 2) "
+             'ORDER BY id ASC']), canonical)
+
+  def testFormatStatementKeepsMeaning(self):
+    for clause in [
+        'WHERE NOT (id = 1 OR id = 2) AND name IS NOT NULL',
+        "WHERE id = 1 OR id = 2 AND name NOT LIKE 'x%' LIMIT 1 OFFSET 0",
+        'WHERE (id = 1 OR id = 2) AND id NOT IN (3, 4)',
+        'WHERE isMissingCreatives = TRUE',
+    ]:
+      statement = ParseFilter(clause, 'GetLineItems')
+      self.assertEqual(clause, FormatStatement(statement))
+      self.assertEqual(statement,
+                       ParseFilter(FormatStatement(statement), 'GetLineItems'))
+
+  def testExtractPredicates(self):
+    predicates = ExtractPredicates(ParseFilter(
+        "WHERE id > 10 AND id <= 20 AND id >= 15 AND status = 'READY' "
+        'AND orderId IN (1, 2, 3) AND orderId IN (3, 2, 5) '
+        'AND (name = 1 OR name = 2) AND lineItemType = :type',
+        'GetLineItems'))
+
+    self.assertEqual({'id': (15, 20)}, predicates.ranges)
+    self.assertEqual({
+        'status': frozenset([u'READY']),
+        'orderId': frozenset([2, 3]),
+    }, predicates.equalities)
+
+  def testExtractPredicatesOfAlternatives(self):
+    predicates = ExtractPredicates(
+        ParseFilter('WHERE id = 1 OR id = 2', 'GetLineItems'))
+    self.assertEqual(({}, {}), predicates)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,406 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local answers to PQL selects against static reference tables.
+
+Tables such as Browser or Geo_Target have the same contents for every network
+and almost never change. A full copy of each of them is kept in the datastore,
+shared by all users, and PQL selects against them are answered from that copy
+instead of the DFP API.
+
+A table that has no copy yet is loaded by a task queue request made with the
+credentials of the first user who queries it; until then, queries go to the
+API as before. A copy that is older than REFRESH_INTERVAL is still used, and
+refreshed the same way in the background.
+"""
+
+import bisect
+import collections
+import datetime
+import itertools
+import logging
+import re
+import threading
+
+from entity_store import CompactRow
+from ndb_handler import ReplaceReferenceTable
+from ndb_handler import RetrieveReferenceRows
+from ndb_handler import RetrieveReferenceTable
+import pql_parser
+
+from google.appengine.api import taskqueue
+
+# The columns of each reference table that are loaded and can be selected.
+REFERENCE_TABLES = {
+    'Bandwidth_Group': ('Id', 'BandwidthName'),
+    'Browser': ('Id', 'BrowserName', 'MajorVersion', 'MinorVersion'),
+    'Browser_Language': ('Id', 'BrowserLanguageName'),
+    'Device_Capability': ('Id', 'DeviceCapabilityName'),
+    'Device_Category': ('Id', 'DeviceCategoryName'),
+    'Device_Manufacturer': ('Id', 'MobileDeviceManufacturerName'),
+    'Geo_Target': ('Id', 'Name', 'CanonicalParentId', 'ParentIds',
+                   'CountryCode', 'Type', 'Targetable'),
+    'Mobile_Carrier': ('Id', 'CountryCode', 'MobileCarrierName'),
+    'Mobile_Device': ('Id', 'MobileDeviceManufacturerId', 'MobileDeviceName'),
+    'Mobile_Device_Submodel': ('Id', 'MobileDeviceId',
+                               'MobileDeviceSubmodelName'),
+    'Operating_System': ('Id', 'OperatingSystemName'),
+    'Operating_System_Version': ('Id', 'OperatingSystemId', 'MajorVersion',
+                                 'MinorVersion', 'MicroVersion'),
+}
+# Age after which a copy is refreshed.
+REFRESH_INTERVAL = datetime.timedelta(days=1)
+LOAD_URL = '/tasks/reference-data'
+
+# Every table's first column is its Id, by which the rows are kept sorted.
+_ID_COLUMN = 0
+
+_TABLE_NAMES = dict((name.lower(), name) for name in REFERENCE_TABLES)
+_FROM_PATTERN = re.compile(r'\bfrom\s+(\w+)', re.IGNORECASE)
+_COMPARISONS = {
+    '=': lambda x, y: x == y,
+    '!=': lambda x, y: x != y,
+    '<': lambda x, y: x < y,
+    '<=': lambda x, y: x <= y,
+    '>': lambda x, y: x > y,
+    '>=': lambda x, y: x >= y,
+}
+
+# Instance-wide copies of the tables' rows, by table name, as (version, rows,
+# keys). Rows are tuples with their enum strings, such as the Type and
+# CountryCode of Geo_Target, interned, sorted by Id. keys are the rows' Id
+# sort keys, for bisecting.
+_rows_lock = threading.Lock()
+_rows_by_table = {}
+
+Query = collections.namedtuple(
+    'Query', ['table', 'columns', 'where', 'order_by', 'limit', 'offset',
+              'predicates'])
+
+
+class UnsupportedQueryError(Exception):
+  """Raised when a query cannot be answered from a local copy."""
+
+
+def IsReferenceQuery(query):
+  """Returns whether a PQL select is against a reference table.
+
+  Args:
+    query: str The PQL select statement.
+
+  Returns:
+    bool Whether the statement selects from a reference table.
+  """
+  match = _FROM_PATTERN.search(query or '')
+  return bool(match) and match.group(1).lower() in _TABLE_NAMES
+
+
+def ParseQuery(query):
+  """Parses a PQL select against a reference table.
+
+  Supported are column lists, WHERE clauses made of comparisons, LIKE, IN and
+  IS NULL conditions combined with AND and OR, ORDER BY, LIMIT and OFFSET.
+
+  Args:
+    query: str The PQL select statement.
+
+  Returns:
+    Query The parsed query. Columns are resolved to their indexes in
+    REFERENCE_TABLES. The where clause is a list of alternatives, each a list
+    of (column index, operator, operand) conditions that must all hold. The
+    predicates are those of pql_parser.ExtractPredicates.
+
+  Raises:
+    UnsupportedQueryError: The statement is not a select against a reference
+                           table, or uses syntax that is not supported.
+  """
+  try:
+    statement = pql_parser.ParseSelect(query)
+  except pql_parser.InvalidStatementError as e:
+    raise UnsupportedQueryError(str(e))
+  table = _TABLE_NAMES.get(statement.table)
+  if not table:
+    raise UnsupportedQueryError('Not a reference table')
+  column_indexes = dict(
+      (name.lower(), index)
+      for index, name in enumerate(REFERENCE_TABLES[table]))
+
+  def ResolveColumn(name):
+    try:
+      return column_indexes[name]
+    except KeyError:
+      raise UnsupportedQueryError('Unknown column %s' % name)
+
+  where = []
+  if statement.where:
+    alternatives = [statement.where]
+    if (isinstance(statement.where, pql_parser.Junction) and
+        statement.where.operator == 'OR'):
+      alternatives = statement.where.operands
+    for alternative in alternatives:
+      conditions = [alternative]
+      if (isinstance(alternative, pql_parser.Junction) and
+          alternative.operator == 'AND'):
+        conditions = alternative.operands
+      where.append([
+          _ResolveCondition(condition, ResolveColumn)
+          for condition in conditions
+      ])
+  return Query(table, [ResolveColumn(name) for name in statement.columns],
+               where,
+               [(ResolveColumn(name), descending)
+                for name, descending in statement.order_by],
+               statement.limit, statement.offset or 0,
+               pql_parser.ExtractPredicates(statement))
+
+
+def Select(statement, network_code, user):
+  """Answers a PQL select from the local copy of a reference table.
+
+  Schedules loading the table if there is no copy yet, or refreshing it if
+  the copy is out of date. Id equality, IN and range predicates are looked
+  up in the Id-sorted rows, and only the rows they leave are scanned.
+
+  Args:
+    statement: FilterStatement The PQL statement, with its limit and offset.
+    network_code: str Network code of the user making the query. The table
+                  contents do not depend on it, but loading them does.
+    user: AppUser The user making the query.
+
+  Returns:
+    dict Dict including a list of Row-like dicts and the column names, as
+    returned by APIHandler.GetPQLSelection, or None if the query has to be
+    sent to the DFP API.
+  """
+  if statement.values:
+    return None
+  try:
+    query = ParseQuery(statement.ToStatement()['query'])
+  except UnsupportedQueryError:
+    return None
+
+  table = RetrieveReferenceTable(query.table)
+  if not table or datetime.datetime.now() - table.refreshed > REFRESH_INTERVAL:
+    _ScheduleLoad(query.table, network_code, user)
+  if not table:
+    return None
+
+  rows, keys = _GetRows(table)
+  rows = (row for row in _FindById(rows, keys, query.predicates)
+          if _Matches(row, query.where))
+  if query.order_by and query.order_by != [(_ID_COLUMN, False)]:
+    rows = list(rows)
+    for column, descending in reversed(query.order_by):
+      rows.sort(key=lambda row: _SortKey(row[column]), reverse=descending)
+  # rows in Id order are only scanned up to the last one returned
+  rows = list(itertools.islice(
+      rows, query.offset,
+      None if query.limit is None else query.offset + query.limit))
+
+  columns = REFERENCE_TABLES[query.table]
+  return {
+      'results': [{
+          'values': [{'value': row[column]} for column in query.columns]
+      } for row in rows],
+      'columns': [columns[column] for column in query.columns],
+  }
+
+
+def LoadTable(api_handler, network_code, table_name):
+  """Replaces the local copy of a reference table with the API's contents.
+
+  Args:
+    api_handler: APIHandler Handler whose user's credentials are used.
+    network_code: str Network code to make the PQL queries in.
+    table_name: str The table name, a key of REFERENCE_TABLES.
+
+  Returns:
+    int The number of rows loaded.
+  """
+  columns = REFERENCE_TABLES[table_name]
+  rows = []
+  for page in api_handler.GetAllPQLRows(
+      network_code, 'SELECT %s FROM %s' % (', '.join(columns), table_name)):
+    rows.extend([_UnpackValue(value) for value in row['values']]
+                for row in page)
+  ReplaceReferenceTable(table_name, list(columns), rows)
+  logging.info('Loaded %d rows of reference table %s', len(rows), table_name)
+  return len(rows)
+
+
+def _ResolveCondition(condition, resolve_column):
+  """Converts a parsed condition into a (column index, operator, operand).
+
+  Args:
+    condition: pql_parser.Condition The condition.
+    resolve_column: func Function returning a column name's index.
+
+  Returns:
+    tuple The condition, with literal operands and LIKE patterns compiled.
+
+  Raises:
+    UnsupportedQueryError: The condition is nested or uses bind variables.
+  """
+  if not isinstance(condition, pql_parser.Condition):
+    raise UnsupportedQueryError('Nested conditions are not supported')
+  column, operator, operand = condition
+  operands = operand if operator in ('IN', 'NOT IN') else [operand]
+  if any(value is not None and value.kind == 'bind' for value in operands):
+    raise UnsupportedQueryError('Bind variables are not supported')
+
+  if operand is None:
+    pass
+  elif operator in ('LIKE', 'NOT LIKE'):
+    pattern = re.escape(pql_parser.LiteralValue(operand))
+    pattern = pattern.replace(r'\%', '.*').replace(r'\_', '.')
+    operand = re.compile(pattern + r'\Z', re.IGNORECASE | re.DOTALL)
+  elif operator in ('IN', 'NOT IN'):
+    operand = [_Operand(value) for value in operand]
+  else:
+    operand = _Operand(operand)
+  return (resolve_column(column), operator, operand)
+
+
+def _Operand(value):
+  """Returns a literal as compared by _Holds, with numbers kept as text."""
+  if value.kind == 'number':
+    return value.text
+  return pql_parser.LiteralValue(value)
+
+
+def _ScheduleLoad(table_name, network_code, user):
+  """Adds a task loading a table, at most once per table and day."""
+  if not network_code or not user:
+    return
+  try:
+    taskqueue.add(
+        name='reference-data-%s-%s' % (
+            table_name, datetime.date.today().strftime('%Y%m%d')),
+        url=LOAD_URL,
+        params={
+            'table': table_name,
+            'network_code': network_code,
+            'user': user.key.urlsafe(),
+        })
+  except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+    pass
+
+
+def _GetRows(table):
+  """Returns the rows of a table, reading them at most once per version.
+
+  Args:
+    table: ReferenceTable The table.
+
+  Returns:
+    tuple A tuple of (rows sorted by Id, the rows' Id sort keys).
+  """
+  name = table.key.id()
+  with _rows_lock:
+    cached = _rows_by_table.get(name)
+  if cached and cached[0] == table.version:
+    return cached[1:]
+  rows = sorted((CompactRow(row) for row in RetrieveReferenceRows(table)),
+                key=lambda row: _SortKey(row[_ID_COLUMN]))
+  keys = [_SortKey(row[_ID_COLUMN]) for row in rows]
+  with _rows_lock:
+    _rows_by_table[name] = (table.version, rows, keys)
+  return rows, keys
+
+
+def _FindById(rows, keys, predicates):
+  """Returns the rows the Id predicates of a query may hold for, by Id.
+
+  Args:
+    rows: list The rows, sorted by Id.
+    keys: list The rows' Id sort keys.
+    predicates: pql_parser.Predicates The query's predicates.
+
+  Returns:
+    list The rows whose Id is one of the Id equality's values, or within the
+    Id range, or all rows if the query has neither.
+  """
+  ids = predicates.equalities.get('id')
+  if ids is not None:
+    found = []
+    for key in sorted(set(_SortKey(value) for value in ids)):
+      found.extend(rows[bisect.bisect_left(keys, key):
+                        bisect.bisect_right(keys, key)])
+    return found
+  lowest, highest = predicates.ranges.get('id', (None, None))
+  start = 0
+  if lowest is not None:
+    start = bisect.bisect_left(keys, _SortKey(lowest))
+  end = len(rows)
+  if highest is not None:
+    end = bisect.bisect_right(keys, _SortKey(highest))
+  return rows[start:end]
+
+
+def _UnpackValue(value):
+  """Returns the plain value of a PQL Value object."""
+  if value is None:
+    return None
+  if 'values' in value:
+    # SetValue
+    return [_UnpackValue(item) for item in value['values'] or []]
+  return value['value']
+
+
+def _Matches(row, where):
+  if not where:
+    return True
+  return any(
+      all(_Holds(row[column], operator, operand)
+          for column, operator, operand in conditions)
+      for conditions in where)
+
+
+def _Holds(value, operator, operand):
+  """Returns whether a condition holds for a row's value."""
+  if operator == 'IS NULL':
+    return value is None
+  if operator == 'IS NOT NULL':
+    return value is not None
+  if value is None:
+    return False
+  if operator in ('IN', 'NOT IN'):
+    found = any(_Compare(value, item) == 0 for item in operand)
+    return found if operator == 'IN' else not found
+  if operator in ('LIKE', 'NOT LIKE'):
+    found = bool(operand.match(unicode(value)))
+    return found if operator == 'LIKE' else not found
+  return _COMPARISONS[operator](_Compare(value, operand), 0)
+
+
+def _Compare(value, operand):
+  """Compares numbers numerically and everything else as text."""
+  if isinstance(value, list):
+    # a set matches if any of its values does
+    return 0 if any(_Compare(item, operand) == 0 for item in value) else 1
+  if isinstance(value, bool) or isinstance(operand, bool):
+    return cmp(value, operand)
+  try:
+    return cmp(float(value), float(operand))
+  except (TypeError, ValueError):
+    return cmp(unicode(value), unicode(operand))
+
+
+def _SortKey(value):
+  if value is None:
+    return (0, None)
+  try:
+    return (1, float(value))
+  except (TypeError, ValueError):
+    return (2, unicode(value))
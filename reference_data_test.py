@@ -0,0 +1,205 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for local answers to reference table queries."""
+
+import datetime
+import unittest
+
+from googleads.ad_manager import FilterStatement
+import mock
+from models import AppUser
+from ndb_handler import ReplaceReferenceTable
+from ndb_handler import RetrieveReferenceTable
+import reference_data
+from reference_data import IsReferenceQuery
+from reference_data import LoadTable
+from reference_data import ParseQuery
+from reference_data import Select
+from reference_data import UnsupportedQueryError
+
+from google.appengine.api import users
+from google.appengine.ext import testbed
+
+_BROWSER_COLUMNS = ['Id', 'BrowserName', 'MajorVersion', 'MinorVersion']
+_BROWSER_ROWS = [
+    ['500072', 'Chrome', '49', 'x'],
+    ['500073', 'Chrome', '50', 'x'],
+    ['500074', 'Firefox', '45', 'x'],
+    ['500075', 'Safari', '9', 'x'],
+    ['500076', 'Safari', '10', '1'],
+]
+
+
+class ReferenceDataTest(unittest.TestCase):
+  """Tests for reference_data.py."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_taskqueue_stub()
+    self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    reference_data._rows_by_table.clear()
+
+    self.user = AppUser(user=users.User('johndoe@gmail.com'),
+                        email='johndoe@gmail.com', refresh_token='token')
+    self.user.put()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _Select(self, query, limit=25, offset=0):
+    return Select(FilterStatement(query, limit=limit, offset=offset), '1234',
+                  self.user)
+
+  def testIsReferenceQuery(self):
+    self.assertTrue(IsReferenceQuery('SELECT Id, BrowserName from Browser'))
+    self.assertTrue(IsReferenceQuery('select id FROM geo_target'))
+    self.assertFalse(IsReferenceQuery('SELECT Id FROM Line_Item'))
+    self.assertFalse(IsReferenceQuery(''))
+
+  def testParseQuery(self):
+    query = ParseQuery(
+        "SELECT Id, browsername FROM Browser WHERE MajorVersion >= 10 AND "
+        "BrowserName IN ('Chrome', 'Safari') OR Id = 1 ORDER BY Id DESC "
+        "LIMIT 10 OFFSET 5")
+    self.assertEqual('Browser', query.table)
+    self.assertEqual([0, 1], query.columns)
+    self.assertEqual([
+        [(2, '>=', '10'), (1, 'IN', ['Chrome', 'Safari'])],
+        [(0, '=', '1')],
+    ], query.where)
+    self.assertEqual([(0, True)], query.order_by)
+    self.assertEqual(10, query.limit)
+    self.assertEqual(5, query.offset)
+
+    # parentheses that do not change the meaning are fine
+    query = ParseQuery('SELECT Id FROM Browser WHERE (Id = 1 OR (Id = 2))')
+    self.assertEqual([[(0, '=', '1')], [(0, '=', '2')]], query.where)
+
+  def testParseUnsupportedQuery(self):
+    for query in ('SELECT Id FROM Line_Item',
+                  'SELECT Id, Unknown FROM Browser',
+                  'SELECT Id FROM Browser WHERE Id = :id',
+                  'SELECT Id FROM Browser WHERE Id = 1 AND (Id = 2 OR Id = 3)',
+                  'SELECT Id FROM Browser WHERE NOT Id = 1',
+                  'SELECT Id FROM Browser LIMIT 5 LIMIT 25 OFFSET 0',
+                  'SELECT COUNT(Id) FROM Browser'):
+      self.assertRaises(UnsupportedQueryError, ParseQuery, query)
+
+  def testSelectWithoutCopySchedulesLoad(self):
+    self.assertEqual(None, self._Select('SELECT Id, BrowserName FROM Browser'))
+    self.assertEqual(None, self._Select('SELECT Id FROM Browser'))
+
+    tasks = self.taskqueue_stub.get_filtered_tasks(url=reference_data.LOAD_URL)
+    self.assertEqual(1, len(tasks))
+    self.assertEqual('Browser', tasks[0].extract_params()['table'])
+
+  def testSelectFromCopy(self):
+    ReplaceReferenceTable('Browser', _BROWSER_COLUMNS, _BROWSER_ROWS)
+
+    result = self._Select('SELECT Id, BrowserName FROM Browser')
+    self.assertEqual(['Id', 'BrowserName'], result['columns'])
+    self.assertEqual(5, len(result['results']))
+    self.assertEqual([{'value': '500072'}, {'value': 'Chrome'}],
+                     result['results'][0]['values'])
+
+    result = self._Select(
+        "SELECT Id FROM Browser WHERE BrowserName LIKE 's%' "
+        "AND MajorVersion > 9")
+    self.assertEqual([[{'value': '500076'}]],
+                     [row['values'] for row in result['results']])
+
+    result = self._Select(
+        'SELECT Id FROM Browser ORDER BY MajorVersion DESC', limit=2, offset=1)
+    self.assertEqual([[{'value': '500072'}], [{'value': '500074'}]],
+                     [row['values'] for row in result['results']])
+    self.assertEqual(
+        [], self.taskqueue_stub.get_filtered_tasks(url=reference_data.LOAD_URL))
+
+  def testSelectById(self):
+    # stored out of Id order
+    ReplaceReferenceTable('Browser', _BROWSER_COLUMNS, _BROWSER_ROWS[::-1])
+
+    def SelectIds(query, limit=25):
+      with mock.patch.object(reference_data, '_Matches',
+                             wraps=reference_data._Matches) as matches:
+        result = self._Select(query, limit=limit)
+      return ([row['values'][0]['value'] for row in result['results']],
+              matches.call_count)
+
+    self.assertEqual((['500074'], 1),
+                     SelectIds('SELECT Id FROM Browser WHERE Id = 500074'))
+    self.assertEqual(
+        (['500073', '500076'], 2),
+        SelectIds("SELECT Id FROM Browser WHERE Id IN (500076, '500073', 9)"))
+    self.assertEqual(
+        (['500075'], 2),
+        SelectIds("SELECT Id FROM Browser WHERE Id > 500073 AND Id < 500076 "
+                  "AND BrowserName = 'Safari'"))
+    self.assertEqual(
+        (['500076', '500075'], 2),
+        SelectIds('SELECT Id FROM Browser WHERE Id >= 500075 '
+                  'ORDER BY Id DESC'))
+    # without an Id predicate, rows in Id order are scanned up to the limit
+    self.assertEqual((['500072', '500073'], 2),
+                     SelectIds('SELECT Id FROM Browser', limit=2))
+    self.assertEqual(
+        (['500072', '500076'], 5),
+        SelectIds('SELECT Id FROM Browser WHERE Id = 500072 OR Id = 500076'))
+
+  def testSelectFromStaleCopySchedulesRefresh(self):
+    table = ReplaceReferenceTable('Browser', _BROWSER_COLUMNS, _BROWSER_ROWS)
+    table.refreshed = datetime.datetime.now() - datetime.timedelta(days=2)
+    table.put()
+
+    result = self._Select('SELECT Id FROM Browser')
+    self.assertEqual(5, len(result['results']))
+    self.assertEqual(
+        1,
+        len(self.taskqueue_stub.get_filtered_tasks(
+            url=reference_data.LOAD_URL)))
+
+  def testSelectSeesReplacedCopy(self):
+    ReplaceReferenceTable('Browser', _BROWSER_COLUMNS, _BROWSER_ROWS)
+    self.assertEqual(5, len(self._Select('SELECT Id FROM Browser')['results']))
+    ReplaceReferenceTable('Browser', _BROWSER_COLUMNS, _BROWSER_ROWS[:2])
+    self.assertEqual(2, len(self._Select('SELECT Id FROM Browser')['results']))
+
+  def testLoadTable(self):
+    def row(*values):
+      return {'values': [{'value': value} for value in values]}
+    api_handler = mock.MagicMock()
+    api_handler.GetAllPQLRows.return_value = iter([
+        [row('1', 'Broadband'), row('2', 'Dialup')],
+        [row('3', 'Mobile')],
+    ])
+
+    self.assertEqual(3, LoadTable(api_handler, '1234', 'Bandwidth_Group'))
+    api_handler.GetAllPQLRows.assert_called_once_with(
+        '1234', 'SELECT Id, BandwidthName FROM Bandwidth_Group')
+    table = RetrieveReferenceTable('Bandwidth_Group')
+    self.assertEqual(['Id', 'BandwidthName'], table.columns)
+    self.assertEqual(3, table.row_count)
+
+    result = self._Select("SELECT BandwidthName FROM Bandwidth_Group "
+                          "WHERE Id != 2")
+    self.assertEqual([[{'value': 'Broadband'}], [{'value': 'Mobile'}]],
+                     [r['values'] for r in result['results']])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,180 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental decoding of gzipped CSV report downloads.
+
+Reports can be far larger than an instance's memory, so a download is
+decompressed and parsed chunk by chunk, and only the current partial line is
+buffered. Whoever consumes the rows may still hold them all, as App Engine
+does for response bodies, so a stream can be given a maximum size beyond
+which it stops with ReportTooLargeError. Every stream records its
+throughput, time to first row and largest buffer, and the totals over all
+streams are kept for the stats page.
+"""
+
+import csv
+import threading
+import time
+import zlib
+
+# Accepts gzip members, which is how report downloads are compressed.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+# Maximum number of bytes decompressed at once. Reports compress very well,
+# so a single downloaded chunk can expand to many times its size.
+_MAX_DECOMPRESSED_CHUNK_SIZE = 64 * 1024
+
+_stats_lock = threading.Lock()
+_totals = {
+    'reports': 0,
+    'rows': 0,
+    'compressed_bytes': 0,
+    'decompressed_bytes': 0,
+    'seconds': 0.0,
+    'max_time_to_first_row': 0.0,
+    'max_buffer_bytes': 0,
+}
+
+
+class ReportTooLargeError(Exception):
+  """Raised when a report decompresses to more than a stream's maximum."""
+
+
+class ReportStream(object):
+  """Iterates over the rows of a gzipped CSV report, decoding incrementally.
+
+  The first row is the header with the column names.
+
+  Attributes:
+    header: list The column names, once the first row has been read.
+  """
+
+  def __init__(self, chunks, max_bytes=None):
+    """Initializes a ReportStream.
+
+    Args:
+      chunks: iterable The compressed report, as byte strings of any size.
+              It is closed once the stream ends, if it can be.
+      max_bytes: int Maximum size of the decompressed report, if any.
+    """
+    self.header = None
+    self._chunks = chunks
+    self._max_bytes = max_bytes
+    self._start = None
+    self._elapsed = None
+    self._first_row_seconds = None
+    self._compressed_bytes = 0
+    self._decompressed_bytes = 0
+    self._max_buffer_bytes = 0
+    self._row_count = 0
+    self._finished = False
+
+  def __iter__(self):
+    self._start = time.time()
+    reader = csv.reader(self._IterLines())
+    try:
+      for row in reader:
+        if self.header is None:
+          self.header = row
+        else:
+          if self._first_row_seconds is None:
+            self._first_row_seconds = time.time() - self._start
+          self._row_count += 1
+        yield row
+    finally:
+      self._Finish()
+      # frees the download, also when the caller stops early
+      close = getattr(self._chunks, 'close', None)
+      if close:
+        close()
+
+  def GetStats(self):
+    """Returns the stream's statistics.
+
+    Returns:
+      dict The number of rows, compressed and decompressed bytes, seconds
+      spent, rows per second, seconds until the first row and the size of
+      the largest buffered partial line.
+    """
+    elapsed = self._elapsed
+    if elapsed is None:
+      elapsed = time.time() - self._start if self._start else 0.0
+    return {
+        'rows': self._row_count,
+        'compressed_bytes': self._compressed_bytes,
+        'decompressed_bytes': self._decompressed_bytes,
+        'seconds': elapsed,
+        'rows_per_second': self._row_count / elapsed if elapsed else 0.0,
+        'time_to_first_row': self._first_row_seconds,
+        'max_buffer_bytes': self._max_buffer_bytes,
+    }
+
+  def _IterLines(self):
+    """Yields the decompressed report line by line."""
+    pending = ''
+    for data in self._Decompress():
+      pending += data
+      self._max_buffer_bytes = max(self._max_buffer_bytes, len(pending))
+      lines = pending.split('\n')
+      pending = lines.pop()
+      for line in lines:
+        yield line + '\n'
+    if pending:
+      yield pending
+
+  def _Decompress(self):
+    """Yields the decompressed report in pieces of bounded size."""
+    decompressor = zlib.decompressobj(_GZIP_WBITS)
+    for chunk in self._chunks:
+      self._compressed_bytes += len(chunk)
+      while chunk:
+        data = decompressor.decompress(chunk, _MAX_DECOMPRESSED_CHUNK_SIZE)
+        chunk = decompressor.unconsumed_tail
+        self._decompressed_bytes += len(data)
+        if self._max_bytes and self._decompressed_bytes > self._max_bytes:
+          raise ReportTooLargeError(
+              'Report is larger than %d bytes' % self._max_bytes)
+        yield data
+    data = decompressor.flush()
+    self._decompressed_bytes += len(data)
+    yield data
+
+  def _Finish(self):
+    """Adds the stream's statistics to the process-wide totals once."""
+    if self._finished:
+      return
+    self._finished = True
+    self._elapsed = time.time() - self._start
+    stats = self.GetStats()
+    with _stats_lock:
+      _totals['reports'] += 1
+      for key in ('rows', 'compressed_bytes', 'decompressed_bytes',
+                  'seconds'):
+        _totals[key] += stats[key]
+      _totals['max_time_to_first_row'] = max(
+          _totals['max_time_to_first_row'], stats['time_to_first_row'] or 0.0)
+      _totals['max_buffer_bytes'] = max(_totals['max_buffer_bytes'],
+                                        stats['max_buffer_bytes'])
+
+
+def GetReportStats():
+  """Returns the statistics of all report streams of this instance.
+
+  Returns:
+    dict The totals and maximums of the streams' statistics.
+  """
+  with _stats_lock:
+    stats = dict(_totals)
+  stats['rows_per_second'] = (stats['rows'] / stats['seconds']
+                              if stats['seconds'] else 0.0)
+  return stats
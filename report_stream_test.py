@@ -0,0 +1,86 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for incremental decoding of report downloads."""
+
+import gzip
+import StringIO
+import unittest
+
+from report_stream import GetReportStats
+from report_stream import ReportStream
+from report_stream import ReportTooLargeError
+
+
+def _Gzip(data):
+  out = StringIO.StringIO()
+  with gzip.GzipFile(fileobj=out, mode='wb') as gzip_file:
+    gzip_file.write(data)
+  return out.getvalue()
+
+
+def _Chunks(data, size):
+  return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class ReportStreamTest(unittest.TestCase):
+  """Tests for report_stream.py."""
+
+  def testRows(self):
+    report = ('Dimension.DATE,Column.AD_SERVER_IMPRESSIONS\r\n'
+              '2016-01-01,10\r\n'
+              '"2016-01-02, a\nb",20\r\n'
+              '2016-01-03,30')
+    stream = ReportStream(_Chunks(_Gzip(report), 7))
+
+    self.assertEqual([
+        ['Dimension.DATE', 'Column.AD_SERVER_IMPRESSIONS'],
+        ['2016-01-01', '10'],
+        ['2016-01-02, a\nb', '20'],
+        ['2016-01-03', '30'],
+    ], list(stream))
+    self.assertEqual(['Dimension.DATE', 'Column.AD_SERVER_IMPRESSIONS'],
+                     stream.header)
+
+    stats = stream.GetStats()
+    self.assertEqual(3, stats['rows'])
+    self.assertEqual(len(report), stats['decompressed_bytes'])
+    self.assertTrue(stats['time_to_first_row'] is not None)
+
+  def testBuffersOnlyPartialLines(self):
+    line = '2016-01-01,%s\n' % ('x' * 100)
+    report = 'Dimension.DATE,Column.X\n' + line * 10000
+    stream = ReportStream(_Chunks(_Gzip(report), 1024))
+
+    before = GetReportStats()['reports']
+    self.assertEqual(10001, sum(1 for _ in stream))
+    # the whole report is about 1 MB, but only one decompressed piece and a
+    # partial line are held at once
+    self.assertTrue(stream.GetStats()['max_buffer_bytes'] < 128 * 1024)
+    self.assertEqual(before + 1, GetReportStats()['reports'])
+
+  def testMaxBytes(self):
+    report = 'Dimension.DATE,Column.X\n' + '2016-01-01,1\n' * 10000
+    stream = ReportStream(_Chunks(_Gzip(report), 1024), max_bytes=len(report))
+    self.assertEqual(10001, sum(1 for _ in stream))
+
+    stream = ReportStream(_Chunks(_Gzip(report), 1024), max_bytes=1000)
+    with self.assertRaises(ReportTooLargeError):
+      list(stream)
+    # decompression stops at the first piece beyond the maximum
+    self.assertTrue(stream.GetStats()['decompressed_bytes'] < len(report))
+
+
+if __name__ == '__main__':
+  unittest.main()
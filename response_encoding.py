@@ -0,0 +1,224 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Content negotiation and compression for DFP Playground API responses.
+
+Two independent negotiations happen for every JSON response:
+
+* Representation (Accept header): plain JSON, or "packed" JSON in which every
+  object key is replaced by a short reference into a string table that is sent
+  once alongside the payload. Serialized entities repeat the same keys on every
+  row, so this removes most of the redundancy before compression even starts.
+* Transfer coding (Accept-Encoding header): brotli when the optional `brotli`
+  module is installed, otherwise gzip, applied only above a size threshold.
+"""
+
+import json
+import zlib
+
+try:
+  import brotli  # optional dependency, not available on every runtime
+except ImportError:
+  brotli = None
+
+JSON_MIME_TYPE = 'application/json'
+PACKED_JSON_MIME_TYPE = 'application/vnd.dfp-playground.packed+json'
+
+# Bodies smaller than this are sent uncompressed; the framing overhead and CPU
+# cost are not worth it for tiny payloads.
+COMPRESSION_THRESHOLD = 1024
+
+_GZIP_LEVEL = 6
+_BROTLI_QUALITY = 5
+_KEY_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def _KeyReference(index):
+  """Returns the short base-36 reference used for a string table index.
+
+  Args:
+    index: int Position of the key in the string table.
+
+  Returns:
+    str The reference for the key.
+  """
+  if index == 0:
+    return _KEY_ALPHABET[0]
+  digits = []
+  while index:
+    index, remainder = divmod(index, len(_KEY_ALPHABET))
+    digits.append(_KEY_ALPHABET[remainder])
+  return ''.join(reversed(digits))
+
+
+def PackObject(obj):
+  """Replaces all dict keys in obj with references into a string table.
+
+  Args:
+    obj: A JSON-serializable object.
+
+  Returns:
+    dict A dict with the string table under 'keys' and the packed object under
+    'data'. The packed object can be restored by looking every dict key up in
+    the string table, after parsing it as base 36.
+  """
+  key_table = []
+  key_references = {}
+
+  def PackValue(value):
+    if isinstance(value, dict):
+      packed = {}
+      for key, item in value.iteritems():
+        reference = key_references.get(key)
+        if reference is None:
+          reference = _KeyReference(len(key_table))
+          key_references[key] = reference
+          key_table.append(key)
+        packed[reference] = PackValue(item)
+      return packed
+    elif isinstance(value, (list, tuple)):
+      return [PackValue(item) for item in value]
+    return value
+
+  data = PackValue(obj)
+  return {'keys': key_table, 'data': data}
+
+
+def UnpackObject(packed):
+  """Restores an object produced by PackObject.
+
+  Args:
+    packed: dict The packed representation.
+
+  Returns:
+    The original object.
+  """
+  key_table = packed['keys']
+
+  def UnpackValue(value):
+    if isinstance(value, dict):
+      return dict((key_table[int(reference, 36)], UnpackValue(item))
+                  for reference, item in value.iteritems())
+    elif isinstance(value, list):
+      return [UnpackValue(item) for item in value]
+    return value
+
+  return UnpackValue(packed['data'])
+
+
+def _ParseQualityList(header_value):
+  """Parses an Accept or Accept-Encoding header into a token to q-value map.
+
+  Args:
+    header_value: str The raw header value, possibly empty.
+
+  Returns:
+    dict A dict mapping lowercase tokens to float q-values.
+  """
+  accepted = {}
+  for part in (header_value or '').split(','):
+    params = [param.strip() for param in part.split(';')]
+    token = params[0].lower()
+    if not token:
+      continue
+    quality = 1.0
+    for param in params[1:]:
+      if param.startswith('q='):
+        try:
+          quality = float(param[2:])
+        except ValueError:
+          quality = 0.0
+    accepted[token] = quality
+  return accepted
+
+
+def NegotiateMimeType(accept_header):
+  """Chooses between plain and packed JSON.
+
+  Packed JSON is only used when the client explicitly asks for it, so plain
+  HTTP clients such as curl keep receiving ordinary JSON.
+
+  Args:
+    accept_header: str The request's Accept header.
+
+  Returns:
+    str The MIME type to respond with.
+  """
+  accepted = _ParseQualityList(accept_header)
+  packed_quality = accepted.get(PACKED_JSON_MIME_TYPE, 0.0)
+  json_quality = max(accepted.get(JSON_MIME_TYPE, 0.0),
+                     accepted.get('*/*', 0.0))
+  if packed_quality > 0 and packed_quality >= json_quality:
+    return PACKED_JSON_MIME_TYPE
+  return JSON_MIME_TYPE
+
+
+def NegotiateContentEncoding(accept_encoding_header):
+  """Chooses the transfer coding for a response.
+
+  Args:
+    accept_encoding_header: str The request's Accept-Encoding header.
+
+  Returns:
+    str 'br', 'gzip' or None for the identity encoding.
+  """
+  accepted = _ParseQualityList(accept_encoding_header)
+  wildcard = accepted.get('*', 0.0)
+  if brotli and accepted.get('br', wildcard) > 0:
+    return 'br'
+  if accepted.get('gzip', wildcard) > 0:
+    return 'gzip'
+  return None
+
+
+def Compress(body, content_encoding):
+  """Compresses a response body.
+
+  Args:
+    body: str The uncompressed body.
+    content_encoding: str 'br' or 'gzip'.
+
+  Returns:
+    str The compressed body.
+  """
+  if content_encoding == 'br':
+    return brotli.compress(body, quality=_BROTLI_QUALITY)
+  # wbits offset by 16 makes zlib write a gzip header and trailer
+  compressor = zlib.compressobj(_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  return compressor.compress(body) + compressor.flush()
+
+
+def WriteJsonResponse(request, response, obj):
+  """Serializes obj into the response using the negotiated encodings.
+
+  Args:
+    request: webapp2.Request The incoming request.
+    response: webapp2.Response The response to write to.
+    obj: A JSON-serializable object.
+  """
+  mime_type = NegotiateMimeType(request.headers.get('Accept'))
+  if mime_type == PACKED_JSON_MIME_TYPE:
+    obj = PackObject(obj)
+  body = json.dumps(obj, separators=(',', ':'))
+
+  response.headers['Content-Type'] = mime_type
+  response.headers['Vary'] = 'Accept, Accept-Encoding'
+
+  content_encoding = NegotiateContentEncoding(
+      request.headers.get('Accept-Encoding'))
+  if content_encoding and len(body) >= COMPRESSION_THRESHOLD:
+    body = Compress(body, content_encoding)
+    response.headers['Content-Encoding'] = content_encoding
+
+  response.write(body)
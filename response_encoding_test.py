@@ -0,0 +1,120 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for response encoding used in the DFP Playground."""
+
+import json
+import unittest
+import zlib
+
+import mock
+import response_encoding
+from response_encoding import NegotiateContentEncoding
+from response_encoding import NegotiateMimeType
+from response_encoding import PackObject
+from response_encoding import UnpackObject
+from response_encoding import WriteJsonResponse
+
+
+class ResponseEncodingTest(unittest.TestCase):
+  """Tests for response_encoding.py."""
+
+  def setUp(self):
+    self.line_items = {
+        'results': [{
+            'id': i,
+            'name': 'Line item %d' % i,
+            'status': 'READY',
+            'targeting': {'inventoryTargeting': {'targetedAdUnits': []}},
+        } for i in range(100)],
+        'totalResultSetSize': 100,
+    }
+
+    class RequestMock(object):
+
+      def __init__(self, headers):
+        self.headers = headers
+
+    class ResponseMock(object):
+
+      def __init__(self):
+        self.headers = {}
+        self.body = ''
+
+      def write(self, body):
+        self.body += body
+
+    self.request_mock = RequestMock
+    self.response_mock = ResponseMock
+
+  def testPackRoundTrip(self):
+    packed = PackObject(self.line_items)
+    self.assertEqual(self.line_items, UnpackObject(packed))
+
+  def testPackStoresEachKeyOnce(self):
+    packed = PackObject(self.line_items)
+    self.assertEqual(len(packed['keys']), len(set(packed['keys'])))
+    self.assertEqual(
+        set(['results', 'totalResultSetSize', 'id', 'name', 'status',
+             'targeting', 'inventoryTargeting', 'targetedAdUnits']),
+        set(packed['keys']))
+
+  def testNegotiateMimeType(self):
+    self.assertEqual('application/json', NegotiateMimeType(None))
+    self.assertEqual('application/json', NegotiateMimeType('*/*'))
+    self.assertEqual(
+        response_encoding.PACKED_JSON_MIME_TYPE,
+        NegotiateMimeType(response_encoding.PACKED_JSON_MIME_TYPE +
+                          ', application/json;q=0.9'))
+    self.assertEqual(
+        'application/json',
+        NegotiateMimeType(response_encoding.PACKED_JSON_MIME_TYPE +
+                          ';q=0.5, application/json'))
+
+  def testNegotiateContentEncoding(self):
+    with mock.patch.object(response_encoding, 'brotli', None):
+      self.assertEqual('gzip', NegotiateContentEncoding('gzip, deflate, br'))
+      self.assertEqual(None, NegotiateContentEncoding('gzip;q=0, deflate'))
+      self.assertEqual(None, NegotiateContentEncoding(''))
+    with mock.patch.object(response_encoding, 'brotli', mock.MagicMock()):
+      self.assertEqual('br', NegotiateContentEncoding('gzip, deflate, br'))
+
+  def testWriteCompressedPackedResponse(self):
+    request = self.request_mock({
+        'Accept': response_encoding.PACKED_JSON_MIME_TYPE,
+        'Accept-Encoding': 'gzip',
+    })
+    response = self.response_mock()
+    with mock.patch.object(response_encoding, 'brotli', None):
+      WriteJsonResponse(request, response, self.line_items)
+
+    self.assertEqual('gzip', response.headers['Content-Encoding'])
+    self.assertEqual(response_encoding.PACKED_JSON_MIME_TYPE,
+                     response.headers['Content-Type'])
+    body = zlib.decompress(response.body, 16 + zlib.MAX_WBITS)
+    self.assertEqual(self.line_items, UnpackObject(json.loads(body)))
+    self.assertLess(len(response.body), len(json.dumps(self.line_items)) / 5)
+
+  def testWriteSmallResponseUncompressed(self):
+    request = self.request_mock({'Accept-Encoding': 'gzip'})
+    response = self.response_mock()
+    WriteJsonResponse(request, response, {'results': []})
+
+    self.assertNotIn('Content-Encoding', response.headers)
+    self.assertEqual('application/json', response.headers['Content-Type'])
+    self.assertEqual({'results': []}, json.loads(response.body))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,122 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Saved queries, whose results are refreshed in the background.
+
+A saved query is a where clause of an entity method that a user runs many
+times a day. Rather than running it against the DFP API every time, its
+matching entities are paged through by a task queue request and stored in the
+datastore, so opening the query returns them at once, along with their age.
+A cron job schedules the refresh of every query whose refresh interval has
+passed, and users can refresh a query whenever they want.
+"""
+
+import calendar
+import logging
+
+from ndb_handler import RecordSavedQueryError
+from ndb_handler import RequestSavedQueryRefreshes
+from ndb_handler import RetrieveDueSavedQueries
+from ndb_handler import StoreSavedQueryResults
+
+from google.appengine.api import taskqueue
+
+REFRESH_URL = '/tasks/saved-queries'
+# Minutes between background refreshes. The cron job runs every
+# MIN_REFRESH_MINUTES.
+MIN_REFRESH_MINUTES = 15
+DEFAULT_REFRESH_MINUTES = 60
+MAX_REFRESH_MINUTES = 7 * 24 * 60
+# Number of saved queries a user may have.
+MAX_SAVED_QUERIES = 50
+# Number of entities stored per query. Queries matching more are stored
+# truncated, and are better narrowed down.
+MAX_ENTITIES = 10000
+
+# Number of due queries the cron job schedules per run. The others are
+# scheduled by the next runs.
+_MAX_DUE_QUERIES = 500
+
+
+def ScheduleRefresh(saved_query):
+  """Adds a task refreshing a saved query now.
+
+  Args:
+    saved_query: SavedQuery The query, which is modified.
+  """
+  RequestSavedQueryRefreshes([saved_query])
+  _AddRefreshTask(saved_query)
+
+
+def ScheduleDueRefreshes():
+  """Adds a task refreshing each saved query whose refresh is due.
+
+  Returns:
+    int The number of queries scheduled.
+  """
+  saved_queries = RetrieveDueSavedQueries(_MAX_DUE_QUERIES)
+  if saved_queries:
+    RequestSavedQueryRefreshes(saved_queries)
+  for saved_query in saved_queries:
+    _AddRefreshTask(saved_query)
+  return len(saved_queries)
+
+
+def RefreshSavedQuery(api_handler, saved_query):
+  """Runs a saved query and stores its results.
+
+  The entities are paged through in full, and stored page by page. If the
+  DFP API rejects the query, the error is stored with the previous results.
+
+  Args:
+    api_handler: APIHandler Handler making calls as the query's user.
+    saved_query: SavedQuery The query.
+
+  Returns:
+    SavedQuery The refreshed query, or None if it failed or was deleted.
+  """
+  # pylint: disable=g-import-not-at-top
+  from zeep.exceptions import Fault
+  from zeep.helpers import serialize_object
+  # pylint: enable=g-import-not-at-top
+  pages = api_handler.GetAllResults(
+      saved_query.method_name, saved_query.network_code,
+      saved_query.where_clause, limit=MAX_ENTITIES + 1)
+  try:
+    return StoreSavedQueryResults(
+        saved_query,
+        ([serialize_object(entity) for entity in page] for page in pages),
+        MAX_ENTITIES)
+  except Fault as e:
+    logging.warning('Could not refresh saved query %s: %s',
+                    saved_query.key.id(), e)
+    RecordSavedQueryError(saved_query, str(e))
+    return None
+
+
+def _AddRefreshTask(saved_query):
+  """Adds a task refreshing a query, once per refresh request."""
+  user_key = saved_query.key.parent()
+  try:
+    taskqueue.add(
+        name='saved-query-%s-%s-%d' % (
+            user_key.id(), saved_query.key.id(),
+            calendar.timegm(saved_query.refresh_requested.timetuple())),
+        url=REFRESH_URL,
+        params={
+            'user': user_key.urlsafe(),
+            'saved_query': saved_query.key.id(),
+        })
+  except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+    pass
@@ -0,0 +1,119 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for saved queries."""
+
+import datetime
+import unittest
+
+import mock
+from models import AppUser
+from ndb_handler import CreateSavedQuery
+from ndb_handler import RetrieveSavedQuery
+from ndb_handler import RetrieveSavedQueryResults
+import saved_queries
+from saved_queries import RefreshSavedQuery
+from saved_queries import ScheduleDueRefreshes
+from saved_queries import ScheduleRefresh
+from zeep.exceptions import Fault
+
+from google.appengine.api import users
+from google.appengine.ext import testbed
+
+
+class SavedQueriesTest(unittest.TestCase):
+  """Tests for saved_queries.py."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_taskqueue_stub()
+    self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+    self.user = AppUser(user=users.User('johndoe@gmail.com'),
+                        email='johndoe@gmail.com', refresh_token='token')
+    self.user.put()
+    self.saved_query = CreateSavedQuery(self.user, 'Active', 'GetLineItems',
+                                        '1234', 'WHERE status = \'ACTIVE\'',
+                                        60)
+    self.api_handler = mock.MagicMock()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _RefreshTasks(self):
+    return self.taskqueue_stub.get_filtered_tasks(
+        url=saved_queries.REFRESH_URL)
+
+  def testRefreshSavedQuery(self):
+    self.api_handler.GetAllResults.return_value = iter([
+        [{'id': 1}, {'id': 2}],
+        [{'id': 3}],
+    ])
+
+    saved_query = RefreshSavedQuery(self.api_handler, self.saved_query)
+
+    self.api_handler.GetAllResults.assert_called_once_with(
+        'GetLineItems', '1234', 'WHERE status = \'ACTIVE\'',
+        limit=saved_queries.MAX_ENTITIES + 1)
+    self.assertEqual(3, saved_query.result_count)
+    self.assertNotEqual(None, saved_query.refreshed)
+    self.assertEqual([{'id': 1}, {'id': 2}, {'id': 3}],
+                     RetrieveSavedQueryResults(saved_query))
+
+  def testRefreshSavedQueryKeepsResultsOnFault(self):
+    self.api_handler.GetAllResults.return_value = iter([[{'id': 1}]])
+    RefreshSavedQuery(self.api_handler, self.saved_query)
+
+    def FailingPages():
+      raise Fault('PERMISSION_DENIED')
+      yield  # pylint: disable=unreachable
+    self.api_handler.GetAllResults.return_value = FailingPages()
+    saved_query = RetrieveSavedQuery(self.user, self.saved_query.key.id())
+    self.assertEqual(None, RefreshSavedQuery(self.api_handler, saved_query))
+
+    saved_query = RetrieveSavedQuery(self.user, self.saved_query.key.id())
+    self.assertEqual('PERMISSION_DENIED', saved_query.error)
+    self.assertEqual([{'id': 1}], RetrieveSavedQueryResults(saved_query))
+
+  def testScheduleRefreshOnce(self):
+    ScheduleRefresh(self.saved_query)
+    ScheduleRefresh(self.saved_query)
+
+    self.assertEqual(1, len(self._RefreshTasks()))
+    saved_query = RetrieveSavedQuery(self.user, self.saved_query.key.id())
+    self.assertNotEqual(None, saved_query.refresh_requested)
+    self.assertEqual(datetime.timedelta(minutes=60),
+                     saved_query.next_refresh - saved_query.refresh_requested)
+
+  def testScheduleDueRefreshes(self):
+    later_query = CreateSavedQuery(self.user, 'Later', 'GetOrders', '1234',
+                                   '', 60)
+    later_query.next_refresh = (datetime.datetime.now() +
+                                datetime.timedelta(minutes=30))
+    later_query.put()
+
+    self.assertEqual(1, ScheduleDueRefreshes())
+    tasks = self._RefreshTasks()
+    self.assertEqual(1, len(tasks))
+    self.assertEqual(str(self.saved_query.key.id()),
+                     tasks[0].extract_params()['saved_query'])
+    # the query is no longer due
+    self.assertEqual(0, ScheduleDueRefreshes())
+
+
+if __name__ == '__main__':
+  unittest.main()
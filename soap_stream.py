@@ -0,0 +1,121 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental parsing of get*ByStatement SOAP responses.
+
+zeep reads a whole response into memory and parses it into one object tree
+before returning it. For pages of large entities, such as line items with deep
+targeting, that tree and its copies dominate a request's memory. Here the
+response body is read as a stream and parsed with iterparse, and each result
+entity is handed to the caller as soon as its closing tag has been read. The
+entity's elements are discarded before the next one is parsed, so only one
+entity is held in memory at a time.
+"""
+
+from http_transport import GetSession
+from lxml import etree
+from zeep.wsdl.utils import etree_to_string
+
+_PAGE_ELEMENT = 'rval'
+_RESULTS_ELEMENT = 'results'
+
+
+def IterPage(service, method_name, statement):
+  """Calls a get*ByStatement method and parses its response incrementally.
+
+  The request is sent before this returns, so errors returned by the API are
+  raised here rather than while iterating.
+
+  Args:
+    service: ZeepServiceProxy The service, as returned by GetService.
+    method_name: str The method, such as 'getLineItemsByStatement'.
+    statement: dict The statement, as returned by FilterStatement.ToStatement.
+
+  Returns:
+    generator Yields ('totalResultSetSize', int) and ('startIndex', int),
+    then ('results', entity) for every entity of the page, where entity is
+    the same zeep object the regular call would have returned in its list.
+
+  Raises:
+    zeep.exceptions.Fault: The API returned an error.
+  """
+  # pylint: disable=protected-access
+  zeep_client = service.zeep_client
+  binding = service._method_bindings
+  packed_args = service._PackArguments(method_name, (statement,))
+  envelope, http_headers = binding._create(
+      method_name, packed_args,
+      {'_soapheaders': service._GetZeepFormattedSOAPHeaders()},
+      client=zeep_client)
+  address = zeep_client.service._binding_options['address']
+  # pylint: enable=protected-access
+
+  response = GetSession().post(address, data=etree_to_string(envelope),
+                               headers=http_headers, stream=True)
+  operation = binding.get(method_name)
+  if response.status_code != 200:
+    # faults are small, let zeep read and raise them
+    binding.process_reply(zeep_client, operation, response)
+    response.close()
+    raise ValueError('Unexpected response status %d' % response.status_code)
+
+  results_element = _GetResultsElement(operation)
+  schema = zeep_client.wsdl.types
+  response.raw.decode_content = True
+  return _CloseAfter(
+      ParsePage(response.raw,
+                lambda element: results_element.parse(element, schema)),
+      response)
+
+
+def ParsePage(stream, parse_result):
+  """Parses a get*ByStatement response envelope from a stream.
+
+  Args:
+    stream: file A file-like object returning the response body.
+    parse_result: func Function converting a results element into an entity.
+
+  Yields:
+    tuple A tuple of (field name, value) for the page's totalResultSetSize
+    and startIndex, and a ('results', entity) tuple for every entity.
+  """
+  for _, element in etree.iterparse(stream, events=('end',)):
+    parent = element.getparent()
+    if parent is None or etree.QName(parent).localname != _PAGE_ELEMENT:
+      continue
+    name = etree.QName(element).localname
+    if name == _RESULTS_ELEMENT:
+      yield name, parse_result(element)
+    else:
+      yield name, int(element.text) if element.text else None
+    # discard the element and the page's earlier children
+    element.clear()
+    while element.getprevious() is not None:
+      del parent[0]
+
+
+def _GetResultsElement(operation):
+  """Returns the schema element of the results in an operation's response."""
+  response_type = operation.output.body.type
+  page_type = dict(response_type.elements)[_PAGE_ELEMENT].type
+  return dict(page_type.elements)[_RESULTS_ELEMENT]
+
+
+def _CloseAfter(generator, response):
+  """Yields from a generator and closes the response when it is done."""
+  try:
+    for item in generator:
+      yield item
+  finally:
+    response.close()
@@ -0,0 +1,83 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for incremental parsing of SOAP responses."""
+
+from StringIO import StringIO
+import unittest
+
+from soap_stream import ParsePage
+
+_ENVELOPE_START = (
+    '<soap:Envelope '
+    'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Header><ResponseHeader xmlns="https://dfp"><requestId>1'
+    '</requestId></ResponseHeader></soap:Header><soap:Body>'
+    '<getLineItemsByStatementResponse xmlns="https://dfp"><rval>'
+    '<totalResultSetSize>%d</totalResultSetSize>'
+    '<startIndex>0</startIndex>')
+_RESULT = ('<results><id>%d</id><name>Line item %d</name><targeting>%s'
+           '</targeting></results>')
+_ENVELOPE_END = ('</rval></getLineItemsByStatementResponse></soap:Body>'
+                 '</soap:Envelope>')
+
+
+class _TrackedStream(StringIO):
+  """A stream recording how far it has been read."""
+
+  def read(self, size=-1):
+    data = StringIO.read(self, size)
+    self.position = self.tell()
+    return data
+
+
+def _Page(count, padding=2000):
+  body = ''.join(_RESULT % (i, i, 'x' * padding) for i in xrange(count))
+  return _ENVELOPE_START % count + body + _ENVELOPE_END
+
+
+class SoapStreamTest(unittest.TestCase):
+  """Tests for soap_stream.py."""
+
+  def testParsePage(self):
+    items = list(ParsePage(StringIO(_Page(3)),
+                           lambda element: element.findtext('{*}id')))
+
+    self.assertEqual([('totalResultSetSize', 3), ('startIndex', 0),
+                      ('results', '0'), ('results', '1'), ('results', '2')],
+                     items)
+
+  def testParsePageIncrementally(self):
+    page = _Page(500)
+    stream = _TrackedStream(page)
+    tree_sizes = []
+
+    def parse_result(element):
+      # the page element only holds the entities of the last read from the
+      # stream, never the ones already handed over
+      tree_sizes.append(len(element.getparent()))
+      return stream.position
+
+    positions = [value for name, value in ParsePage(stream, parse_result)
+                 if name == 'results']
+
+    self.assertEqual(500, len(positions))
+    # entities are handed over long before the whole response has been read
+    self.assertTrue(positions[0] < len(page) / 10)
+    self.assertTrue(positions[249] < len(page) * 3 / 4)
+    self.assertTrue(max(tree_sizes) < 500 / 10)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,11 +1,286 @@
 var app =
     angular.module('dfpPlayground', ['ngMaterial', 'ngMessages', 'ngSanitize']);
 
-app.config(function($interpolateProvider, $mdThemingProvider) {
+var PACKED_JSON_MIME_TYPE = 'application/vnd.dfp-playground.packed+json';
+
+app.config(function($httpProvider, $interpolateProvider, $mdThemingProvider) {
   $mdThemingProvider.theme('default').primaryPalette('green').accentPalette(
       'lime');
   $interpolateProvider.startSymbol('{a');
   $interpolateProvider.endSymbol('a}');
+  $httpProvider.interceptors.push('packedJsonInterceptor');
+});
+
+// Restore a payload whose object keys were replaced by base 36 references
+// into a string table (see response_encoding.PackObject).
+var unpackObject = function(packed) {
+  var keys = packed.keys;
+  var unpackValue = function(value) {
+    if (Array.isArray(value)) {
+      return value.map(unpackValue);
+    } else if (value !== null && typeof value === 'object') {
+      var unpacked = {};
+      for (var reference in value) {
+        if (value.hasOwnProperty(reference)) {
+          var key = keys[parseInt(reference, 36)];
+          unpacked[key] = unpackValue(value[reference]);
+        }
+      }
+      return unpacked;
+    }
+    return value;
+  };
+  return unpackValue(packed.data);
+};
+
+// Fixed-size cache that evicts the least recently used entry. Map iterates in
+// insertion order, so re-inserting an entry on access keeps it the newest.
+var LruCache = function(capacity) {
+  this.capacity = capacity;
+  this.entries = new Map();
+};
+
+LruCache.prototype.get = function(key) {
+  if (!this.entries.has(key)) return undefined;
+  var value = this.entries.get(key);
+  this.entries.delete(key);
+  this.entries.set(key, value);
+  return value;
+};
+
+LruCache.prototype.has = function(key) {
+  return this.entries.has(key);
+};
+
+LruCache.prototype.clear = function() {
+  this.entries.clear();
+};
+
+LruCache.prototype.put = function(key, value) {
+  this.entries.delete(key);
+  this.entries.set(key, value);
+  if (this.entries.size > this.capacity) {
+    this.entries.delete(this.entries.keys().next().value);
+  }
+};
+
+// Renders only the rows of a long collection that are inside the scrollable
+// viewport, plus a buffer above and below it. Spacer elements marked with
+// dfp-virtual-spacer="top" and "bottom" stand in for the rows that are not
+// rendered. Row heights start from an estimate and are replaced with measured
+// heights once rendered, so rows that grow (an expanded accordion) keep the
+// scrollbar accurate. MDL components are upgraded only on newly added rows.
+//
+// Usage:
+//   <div dfp-virtual-scroll="rows" dfp-virtual-window="view">
+//     <div dfp-virtual-spacer="top"></div>
+//     <div ng-repeat="row in view.rows"
+//          data-virtual-index="{a view.start + $index a}">...</div>
+//     <div dfp-virtual-spacer="bottom"></div>
+//   </div>
+app.directive('dfpVirtualScroll', function($parse, $timeout) {
+  return {
+    restrict: 'A',
+    link: function(scope, element, attrs) {
+      var container = element[0];
+      var getRows = $parse(attrs.dfpVirtualScroll);
+      var buffer = parseInt(attrs.dfpVirtualBuffer, 10) || 20;
+      var estimatedHeight = parseInt(attrs.dfpRowHeight, 10) || 48;
+
+      var rows = [];
+      var heights = [];
+      var measured = [];
+      var measuredCount = 0;
+      var measuredTotal = 0;
+      var offsets = [0];  // offsets[i] is the top of row i, relative to rows
+      var offsetsDirty = false;
+      var frameRequested = false;
+      var view = {rows: [], start: 0, end: 0};
+      $parse(attrs.dfpVirtualWindow).assign(scope, view);
+
+      var updateOffsets = function() {
+        if (!offsetsDirty) return;
+        offsets = new Array(rows.length + 1);
+        offsets[0] = 0;
+        for (var i = 0; i < rows.length; i++) {
+          offsets[i + 1] = offsets[i] + heights[i];
+        }
+        offsetsDirty = false;
+      };
+
+      // Index of the row that contains the given offset.
+      var rowAt = function(position) {
+        var low = 0;
+        var high = rows.length - 1;
+        while (low < high) {
+          var mid = (low + high + 1) >> 1;
+          if (offsets[mid] <= position) {
+            low = mid;
+          } else {
+            high = mid - 1;
+          }
+        }
+        return low;
+      };
+
+      var spacer = function(position) {
+        return container.querySelector(
+            '[dfp-virtual-spacer="' + position + '"]');
+      };
+
+      var applySpacers = function() {
+        var top = spacer('top');
+        var bottom = spacer('bottom');
+        if (top) {
+          top.style.height = offsets[view.start] + 'px';
+        }
+        if (bottom) {
+          bottom.style.height =
+              (offsets[rows.length] - offsets[view.end]) + 'px';
+        }
+      };
+
+      // Recompute which rows should be rendered. Returns whether the set of
+      // rendered rows changed, which requires a digest.
+      var computeWindow = function() {
+        updateOffsets();
+        var start = 0;
+        var end = 0;
+        if (rows.length) {
+          var top = spacer('top');
+          var rowsTop = top ?
+              (top.getBoundingClientRect().top -
+               container.getBoundingClientRect().top + container.scrollTop) :
+              0;
+          var scrollTop = Math.max(0, container.scrollTop - rowsTop);
+          start = Math.max(0, rowAt(scrollTop) - buffer);
+          end = Math.min(
+              rows.length,
+              rowAt(scrollTop + container.clientHeight) + 1 + buffer);
+        }
+        applySpacers();
+        if (start === view.start && end === view.end &&
+            view.rows.length === end - start) {
+          return false;
+        }
+        view.start = start;
+        view.end = end;
+        view.rows = rows.slice(start, end);
+        applySpacers();
+        return true;
+      };
+
+      var upgradeNewComponents = function() {
+        var pending = container.querySelectorAll(
+            '.mdl-js-accordion:not([data-upgraded])');
+        if (pending.length) {
+          componentHandler.upgradeElements(
+              Array.prototype.slice.call(pending));
+        }
+      };
+
+      // Replace estimated heights with the heights of the rendered rows.
+      var measure = function() {
+        var changed = false;
+        var elements = container.querySelectorAll('[data-virtual-index]');
+        for (var i = 0; i < elements.length; i++) {
+          var index =
+              parseInt(elements[i].getAttribute('data-virtual-index'), 10);
+          var height = elements[i].offsetHeight;
+          if (!height || index >= rows.length || heights[index] === height) {
+            continue;
+          }
+          if (!measured[index]) {
+            measured[index] = true;
+            measuredCount++;
+            measuredTotal += height;
+          }
+          heights[index] = height;
+          changed = true;
+        }
+
+        if (changed) {
+          // unmeasured rows are assumed to be as tall as the measured average
+          var average = measuredTotal / measuredCount;
+          for (var j = 0; j < rows.length; j++) {
+            if (!measured[j]) {
+              heights[j] = average;
+            }
+          }
+          offsetsDirty = true;
+          if (computeWindow()) {
+            scope.$applyAsync(scheduleMeasure);
+          }
+        }
+        upgradeNewComponents();
+      };
+
+      var scheduleMeasure = function() {
+        $timeout(measure, 0, false);
+      };
+
+      var onScroll = function() {
+        if (frameRequested) return;
+        frameRequested = true;
+        window.requestAnimationFrame(function() {
+          frameRequested = false;
+          if (computeWindow()) {
+            scope.$apply();
+            measure();
+          }
+        });
+      };
+
+      scope.$watch(getRows, function(newRows) {
+        rows = newRows || [];
+        heights = new Array(rows.length);
+        measured = new Array(rows.length);
+        for (var i = 0; i < rows.length; i++) {
+          heights[i] = estimatedHeight;
+        }
+        measuredCount = 0;
+        measuredTotal = 0;
+        offsetsDirty = true;
+        container.scrollTop = 0;
+        view.start = view.end = 0;
+        view.rows = [];
+        computeWindow();
+        scheduleMeasure();
+      });
+
+      container.addEventListener('scroll', onScroll);
+      // expanding or collapsing an accordion changes the row's height
+      container.addEventListener('transitionend', scheduleMeasure);
+      container.addEventListener('click', scheduleMeasure);
+
+      scope.$on('$destroy', function() {
+        container.removeEventListener('scroll', onScroll);
+        container.removeEventListener('transitionend', scheduleMeasure);
+        container.removeEventListener('click', scheduleMeasure);
+      });
+    }
+  };
+});
+
+// Ask the API for packed JSON and transparently unpack it, so controllers
+// always see plain objects. Compression is negotiated by the browser itself.
+app.factory('packedJsonInterceptor', function() {
+  return {
+    request: function(config) {
+      if (config.url.indexOf('/api/') === 0) {
+        config.headers.Accept =
+            PACKED_JSON_MIME_TYPE + ', application/json;q=0.9';
+      }
+      return config;
+    },
+    response: function(response) {
+      var contentType = response.headers('Content-Type') || '';
+      if (contentType.indexOf(PACKED_JSON_MIME_TYPE) === 0) {
+        response.data = unpackObject(response.data);
+      }
+      return response;
+    }
+  };
 });
 
 // Share networkCode among different controllers
@@ -17,20 +292,31 @@ app.factory('networkInfo', function() {
 app.controller('networkCtrl', function($scope, $http, networkInfo) {
   $scope.networkInfo = networkInfo;
 
+  var setNetworks = function(networks) {
+    $scope.networkInfo.networks = networks;
+    // autoselect first network
+    if ($scope.networkInfo.networks.length) {
+      $scope.networkInfo.code = $scope.networkInfo.networks[0].networkCode;
+    }
+  };
+
   $scope.loadNetworks = function() {
     if ($scope.networkInfo.networks) {
       // networks have already been loaded
       return null;
     }
     return $http.get('/api/networks').then(function(response) {
-      $scope.networkInfo.networks = response.data.results;
-      // autoselect first network
-      if ($scope.networkInfo.networks.length) {
-        $scope.networkInfo.code = $scope.networkInfo.networks[0].networkCode;
-      }
+      setNetworks(response.data.results);
     });
   };
 
+  // the main page embeds the networks when the server has them cached, in a
+  // script element so that Angular does not interpolate their names
+  var embeddedNetworks = document.getElementById('embedded-networks');
+  if (embeddedNetworks) {
+    setNetworks(JSON.parse(embeddedNetworks.textContent));
+  }
+
   // load networks immediately
   $scope.loadNetworks();
 });
@@ -38,7 +324,11 @@ app.controller('networkCtrl', function($scope, $http, networkInfo) {
 app.controller(
     'tabsCtrl',
     function(
-        $scope, $http, $httpParamSerializer, $mdDialog, $timeout, networkInfo) {
+        $scope, $http, $httpParamSerializer, $mdDialog, $q, $timeout,
+        networkInfo) {
+      // Number of result pages kept per tab.
+      var PAGE_CACHE_SIZE = 20;
+
       $scope.networkInfo = networkInfo;
       $scope.tabs = [];
       $scope.selectedIndex = 0;
@@ -174,7 +464,10 @@ app.controller(
           docsinfo: service.docsinfo,
           loading: false,
           errormsg: '',
-          pagination: {}
+          pagination: {},
+          pageCache: new LruCache(PAGE_CACHE_SIZE),
+          canceller: null,
+          prefetchCanceller: null
         };
         $scope.tabs.push(newTab);
         newTab.whereClause = (service.defaultWhereClause || 'WHERE id != 0');
@@ -183,6 +476,15 @@ app.controller(
         if (newTab.customfunc) {
           newTab.customfunc();
         }
+
+        // results requested for an older where clause are no longer wanted
+        $scope.$watch(
+            function() { return newTab.whereClause; },
+            function(newClause, oldClause) {
+              if (newClause !== oldClause) {
+                cancelRequests(newTab);
+              }
+            });
       };
 
       // load service tabs immediately
@@ -194,6 +496,28 @@ app.controller(
       };
       loadTabs();
 
+      // Badge a tab with the number of entities its where clause matches once
+      // it is opened, rather than every tab on every network change. Counts
+      // only request a single entity and are cached by the server.
+      var loadCount = function(tab) {
+        var networkCode = networkInfo.code;
+        if (!tab || tab.countNetworkCode === networkCode) return;
+        tab.count = undefined;
+        tab.countNetworkCode = networkCode;
+        if (!networkCode || !tab.route || tab.route === 'pql') return;
+        var qs = $httpParamSerializer(
+            {where: tab.whereClause, network_code: networkCode});
+        $http.get('/api/' + tab.route + '/count?' + qs)
+            .then(function(response) {
+              if (tab.countNetworkCode === networkCode) {
+                tab.count = response.data.totalResultSetSize;
+              }
+            });
+      };
+      $scope.$watchGroup(
+          [function() { return networkInfo.code; }, 'selectedIndex'],
+          function() { loadCount($scope.getCurrentTab()); });
+
       $scope.resetTab = function(tab) {
         tab.loading = false;
         tab.errormsg = '';
@@ -212,15 +536,32 @@ app.controller(
       };
 
       $scope.setTabIndex = function(idx) {
+        if (idx !== $scope.selectedIndex) {
+          cancelRequests($scope.tabs[$scope.selectedIndex]);
+        }
         $scope.selectedIndex = idx;
       };
 
+      // Abort the tab's in-flight page load and prefetch, if any.
+      var cancelRequests = function(tab) {
+        if (tab.canceller) {
+          tab.canceller.resolve();
+          tab.canceller = null;
+          tab.loading = false;
+        }
+        if (tab.prefetchCanceller) {
+          tab.prefetchCanceller.resolve();
+          tab.prefetchCanceller = null;
+        }
+      };
+
       $scope.makeNewRequest = function(route, whereClause, limit, offset) {
         var params = {
           where: whereClause,
           limit: limit,
           offset: offset,
-          network_code: networkInfo.code
+          network_code: networkInfo.code,
+          view: 'summary'
         };
         var qs = $httpParamSerializer(params);
 
@@ -228,34 +569,67 @@ app.controller(
 
         var tab = $scope.tabs[$scope.selectedIndex];
         $scope.resetPages(tab);
+        // an explicit query always goes to the server, page flips are cached
+        tab.pageCache.clear();
         $scope.callAPI(uri, tab, function(response) {
+          if (response.data.totalResultSetSize !== undefined) {
+            tab.count = response.data.totalResultSetSize;
+          }
           tab.pages = generateContinuationLinks(
-              route, params, response.data.totalResultSetSize);
+              route, params, response.data.totalResultSetSize,
+              response.data.pageSize);
+          if (tab.pages.length) {
+            tab.pageCache.put(tab.pages[0], response.data);
+          }
           $scope.updateResults(response, tab);
+          prefetchPage(tab, tab.pageNum + 1);
         });
       };
 
       $scope.updateResults = function(response, tab) {
         tab.loading = false;
         tab.results = response.data.results;
+        tab.summary = !!response.data.summary;
+        tab.networkCode = networkInfo.code;
         tab.columns = response.data.columns;  // for PQL Service
         if (!tab.results.length) {
           tab.empty = true;
         }
-
-        // upgrade accordions once they are rendered
-        $timeout(componentHandler.upgradeDom);
+        // accordions are upgraded by dfpVirtualScroll as rows are rendered
       };
 
       $scope.callAPI = function(uri, tab, successCallback) {
+        cancelRequests(tab);
         $scope.resetTab(tab);
-        tab.loading = true;
 
-        $http.get(uri).then(successCallback, function(response) {
+        var cached = tab.pageCache.get(uri);
+        if (cached) {
+          successCallback({data: cached});
+          return;
+        }
+
+        tab.loading = true;
+        var canceller = tab.canceller = $q.defer();
+        $http.get(uri, {timeout: canceller.promise}).then(function(response) {
+          if (tab.canceller === canceller) {
+            tab.canceller = null;
+          }
+          tab.pageCache.put(uri, response.data);
+          successCallback(response);
+        }, function(response) {
+          if (tab.canceller !== canceller) {
+            // superseded by a newer request, nothing to report
+            return;
+          }
           // on error
+          tab.canceller = null;
           tab.loading = false;
           tab.errormsg = 'HTTP ' + response.status + ' Error';
-          if (!networkInfo.code) {
+          if (response.status === 400 && typeof response.data === 'string' &&
+              response.data) {
+            // the server explains what is wrong with the statement
+            tab.errormsg += ': ' + response.data;
+          } else if (!networkInfo.code) {
             tab.errormsg += '. Did you forget to select a network?';
           } else {
             tab.errormsg += '. Is your where statement valid?';
@@ -263,10 +637,10 @@ app.controller(
         });
       };
 
-      // pagination
+      // pagination, in pages of the size the server chose for the first page
       var generateContinuationLinks = function(
-          route, params, totalResultSetSize) {
-        var pageSize = 25;
+          route, params, totalResultSetSize, pageSize) {
+        pageSize = pageSize || 25;
         var limit = params.limit;
         var offset = params.offset;
 
@@ -284,7 +658,8 @@ app.controller(
           var uri =
               ('/api/' + route + '?where=' + encodeURIComponent(params.where) +
                '&network_code=' + params.network_code + '&limit=' + limit +
-               '&offset=' + offset);
+               '&offset=' + offset + '&page_size=' + pageSize +
+               '&view=' + params.view);
           continuationLinks.push(uri);
           offset += pageSize;
           limit -= pageSize;
@@ -292,14 +667,171 @@ app.controller(
         return continuationLinks;
       };
 
+      // Summary rows only carry an id and the display attribute. The full
+      // entity is fetched when its accordion is first expanded. Expansions
+      // within the same digest are batched into a single request.
+      var pendingDetails = {};
+
+      $scope.loadDetails = function(tab, result) {
+        if (!tab.summary || result.details || result.detailsLoading) return;
+        result.detailsLoading = true;
+
+        var batchKey = tab.route + '/' + tab.networkCode;
+        var batch = pendingDetails[batchKey];
+        if (!batch) {
+          batch = pendingDetails[batchKey] = {tab: tab, results: []};
+          $timeout(function() {
+            delete pendingDetails[batchKey];
+            fetchDetails(batch.tab, batch.results);
+          });
+        }
+        batch.results.push(result);
+      };
+
+      var fetchDetails = function(tab, results) {
+        var ids = results.map(function(result) { return result.id; });
+        var uri = ('/api/' + tab.route + '/' + ids.join(',') +
+                   '?network_code=' + tab.networkCode);
+        $http.get(uri).then(function(response) {
+          var entities = {};
+          response.data.results.forEach(function(entity) {
+            entities[entity.id] = entity;
+          });
+          results.forEach(function(result) {
+            result.detailsLoading = false;
+            result.details = entities[result.id] || null;
+            result.detailsError = !result.details;
+          });
+        }, function() {
+          results.forEach(function(result) {
+            result.detailsLoading = false;
+            result.detailsError = true;
+          });
+        });
+      };
+
+      // Load a page into the tab's cache in the background so flipping to it
+      // is instant. Only one prefetch per tab is in flight at a time.
+      var prefetchPage = function(tab, pageNum) {
+        if (pageNum < 1 || pageNum > tab.pages.length) return;
+        var uri = tab.pages[pageNum - 1];
+        if (tab.pageCache.has(uri)) return;
+
+        if (tab.prefetchCanceller) {
+          tab.prefetchCanceller.resolve();
+        }
+        var canceller = tab.prefetchCanceller = $q.defer();
+        $http.get(uri, {timeout: canceller.promise}).then(function(response) {
+          tab.pageCache.put(uri, response.data);
+        }).finally(function() {
+          if (tab.prefetchCanceller === canceller) {
+            tab.prefetchCanceller = null;
+          }
+        });
+      };
+
       $scope.navigateToPage = function(tab, newPageNum) {
-        if (tab.pageNum === newPageNum || tab.loading) return;
+        if (tab.pageNum === newPageNum) return;
         if (newPageNum >= 1 && newPageNum <= tab.pages.length) {
           tab.pageNum = newPageNum;
           var uri = tab.pages[newPageNum - 1];
           $scope.callAPI(uri, tab, function(response) {
             $scope.updateResults(response, tab);
+            prefetchPage(tab, newPageNum + 1);
+          });
+        }
+      };
+    });
+
+// Search-as-you-type over the names of the selected network's entities (see
+// name_index). A search starts once typing pauses, and a search still in
+// flight when the query or network changes is cancelled, so the results
+// shown are always those of the latest query. Choosing a result opens it in
+// its service's tab.
+app.controller(
+    'searchCtrl',
+    function(
+        $scope, $http, $httpParamSerializer, $q, $timeout, networkInfo) {
+      // Milliseconds without typing after which a search starts.
+      var SEARCH_DELAY_MS = 250;
+
+      $scope.search = {query: '', results: [], loading: false, errormsg: ''};
+      var pendingSearch = null;
+      var canceller = null;
+
+      var cancelSearch = function() {
+        if (pendingSearch) {
+          $timeout.cancel(pendingSearch);
+          pendingSearch = null;
+        }
+        if (canceller) {
+          canceller.resolve();
+          canceller = null;
+        }
+        $scope.search.loading = false;
+      };
+
+      var runSearch = function(query, networkCode) {
+        pendingSearch = null;
+        var current = canceller = $q.defer();
+        $scope.search.loading = true;
+        var qs = $httpParamSerializer({q: query, network_code: networkCode});
+        $http.get('/api/search?' + qs, {timeout: current.promise})
+            .then(function(response) {
+              if (canceller !== current) return;
+              canceller = null;
+              $scope.search.loading = false;
+              $scope.search.errormsg = '';
+              $scope.search.results = response.data.results;
+            }, function(response) {
+              if (canceller !== current) {
+                // cancelled for a newer query, nothing to report
+                return;
+              }
+              canceller = null;
+              $scope.search.loading = false;
+              $scope.search.errormsg = 'HTTP ' + response.status + ' Error';
+            });
+      };
+
+      var scheduleSearch = function() {
+        cancelSearch();
+        var query = ($scope.search.query || '').trim();
+        if (!query || !networkInfo.code) {
+          $scope.search.results = [];
+          $scope.search.errormsg = '';
+          return;
+        }
+        var networkCode = networkInfo.code;
+        pendingSearch = $timeout(function() {
+          runSearch(query, networkCode);
+        }, SEARCH_DELAY_MS);
+      };
+      $scope.$watch('search.query', scheduleSearch);
+      $scope.$watch(function() { return networkInfo.code; }, scheduleSearch);
+
+      $scope.getServiceTitle = function(route) {
+        for (var i = 0; i < $scope.tabs.length; i++) {
+          if ($scope.tabs[i].route === route) {
+            return $scope.tabs[i].title;
+          }
+        }
+        return route;
+      };
+
+      $scope.openResult = function(result) {
+        for (var i = 0; i < $scope.tabs.length; i++) {
+          var tab = $scope.tabs[i];
+          if (tab.route !== result.method) continue;
+          tab.whereClause = 'WHERE id = ' + result.id;
+          $scope.setTabIndex(i);
+          // the tab's where clause watcher cancels its requests, so the
+          // query is made after the watchers have run
+          $timeout(function() {
+            $scope.makeNewRequest(tab.route, tab.whereClause, $scope.limit, 0);
           });
+          break;
         }
+        $scope.search.query = '';
       };
     });
@@ -0,0 +1,80 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Jinja environment for the DFP Playground, with precompiled templates.
+
+Parsing and compiling templates is a noticeable part of the first request on a
+new instance. Running this module as a script compiles every template into
+Python modules under templates_compiled/, which are then loaded with a
+ModuleLoader. Templates missing from that directory, or a missing directory,
+fall back to compiling from templates/ at runtime.
+
+Usage:
+  python template_loader.py
+"""
+
+import os
+
+from assets import AssetUrls
+
+_TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), 'templates')
+_COMPILED_TEMPLATES_PATH = os.path.join(
+    os.path.dirname(__file__), 'templates_compiled')
+
+
+def _CreateEnvironment(loader):
+  """Creates a Jinja environment with the playground's settings.
+
+  Precompiled templates must be compiled by an environment with the same
+  settings as the one loading them, so both go through this function.
+
+  Args:
+    loader: jinja2.BaseLoader The loader to use.
+
+  Returns:
+    jinja2.Environment The environment.
+  """
+  import jinja2  # pylint: disable=g-import-not-at-top
+  environment = jinja2.Environment(
+      autoescape=True,
+      extensions=['jinja2.ext.autoescape'],
+      loader=loader)
+  environment.globals['asset_urls'] = AssetUrls
+  return environment
+
+
+def CreateEnvironment():
+  """Creates the Jinja environment used to render pages.
+
+  Returns:
+    jinja2.Environment The environment.
+  """
+  import jinja2  # pylint: disable=g-import-not-at-top
+  loader = jinja2.FileSystemLoader(_TEMPLATES_PATH)
+  if os.path.isdir(_COMPILED_TEMPLATES_PATH):
+    loader = jinja2.ChoiceLoader(
+        [jinja2.ModuleLoader(_COMPILED_TEMPLATES_PATH), loader])
+  return _CreateEnvironment(loader)
+
+
+def CompileTemplates():
+  """Compiles all templates into _COMPILED_TEMPLATES_PATH."""
+  import jinja2  # pylint: disable=g-import-not-at-top
+  environment = _CreateEnvironment(jinja2.FileSystemLoader(_TEMPLATES_PATH))
+  environment.compile_templates(
+      _COMPILED_TEMPLATES_PATH, zip=None, ignore_errors=False)
+
+
+if __name__ == '__main__':
+  CompileTemplates()
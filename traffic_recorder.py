@@ -0,0 +1,278 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in recording of API traffic, to be replayed as a load test.
+
+With RECORD_TRAFFIC set, every request handled by APIViewHandler is recorded
+with its anonymized parameters, status and duration, and every upstream HTTP
+response with its timing. Network codes and the string literals of where
+clauses are replaced by salted hashes, in the request parameters as well as in
+the keys of the upstream requests they lead to, so that replaying the
+anonymized requests finds the recorded responses. Response bodies are kept as
+they are, since the replay parses them; a cassette holds whatever data those
+responses held, and must be handled like it.
+
+Upstream calls are often made on worker threads, which cannot use the
+datastore, so records are buffered in memory and stored at the end of each
+recorded request. Admins download them as a JSONL cassette from
+/tasks/traffic, which benchmarks/replay_benchmark.py replays.
+"""
+
+import base64
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import time
+from urlparse import urlparse
+from xml.sax import saxutils
+import zlib
+
+from ndb_handler import StoreTrafficRecords
+
+# Whether API requests and upstream responses are recorded.
+RECORD_TRAFFIC = False
+
+# Hosts of the OAuth2 endpoints, whose requests and responses hold
+# credentials and are never recorded.
+_UNRECORDED_HOSTS = frozenset([
+    'accounts.google.com',
+    'oauth2.googleapis.com',
+    'www.googleapis.com',
+])
+# Maximum number of records buffered between two recorded requests. Further
+# records are dropped.
+_MAX_BUFFERED_RECORDS = 1000
+# Maximum size of a recorded response body, compressed and encoded, which
+# keeps records below the datastore's entity size limit.
+_MAX_BODY_SIZE = 900 * 1024
+# Request parameters holding comma separated network codes.
+_NETWORK_CODE_PARAMETERS = frozenset([
+    'left_network_code',
+    'network_code',
+    'network_codes',
+])
+# Request parameters holding PQL statements.
+_STATEMENT_PARAMETERS = frozenset(['where'])
+
+# Salt of the anonymizing hashes. It is new for every instance and never
+# stored, so the hashes of the few possible network codes cannot be reversed.
+_SALT = os.urandom(16)
+
+_PQL_STRING_PATTERN = re.compile(r"'((?:[^'\\]|\\.)*)'")
+_NETWORK_CODE_PATTERN = re.compile(
+    r'<(?:[\w.-]+:)?networkCode>(\d*)</(?:[\w.-]+:)?networkCode>')
+_SOAP_HEADER_PATTERN = re.compile(
+    r'<((?:[\w.-]+:)?)Header\b.*?</\1Header>', re.DOTALL)
+_PLAIN_VALUE_PATTERN = re.compile(r'^[\w.,:-]*$')
+
+_buffer_lock = threading.Lock()
+_buffer = []
+_dropped_count = [0]
+
+
+def AnonymizeNetworkCode(network_code):
+  """Returns a network code replaced by a salted hash, which is a number too.
+
+  Args:
+    network_code: str The network code.
+
+  Returns:
+    str The anonymized network code, empty for an empty network code.
+  """
+  if not network_code:
+    return network_code
+  return str(int(_Hash(network_code)[:8], 16))
+
+
+def AnonymizeStatement(statement):
+  """Returns a PQL statement with its string literals replaced by hashes.
+
+  Args:
+    statement: str The statement or where clause.
+
+  Returns:
+    str The anonymized statement.
+  """
+  return _PQL_STRING_PATTERN.sub(
+      lambda match: "'%s'" % _Hash(match.group(1))[:12], statement)
+
+
+def AnonymizeParameters(params):
+  """Anonymizes request parameters.
+
+  Network codes and where clauses are anonymized as by AnonymizeNetworkCode
+  and AnonymizeStatement. Other values are kept if they are numbers, names or
+  lists of them, and replaced by a hash otherwise.
+
+  Args:
+    params: list The (name, value) pairs of the parameters.
+
+  Returns:
+    list The [name, anonymized value] pairs.
+  """
+  anonymized = []
+  for name, value in params:
+    if name in _NETWORK_CODE_PARAMETERS:
+      value = ','.join(
+          AnonymizeNetworkCode(network_code)
+          for network_code in value.split(','))
+    elif name in _STATEMENT_PARAMETERS:
+      value = AnonymizeStatement(value)
+    elif not _PLAIN_VALUE_PATTERN.match(value):
+      value = _Hash(value)[:12]
+    anonymized.append([name, value])
+  return anonymized
+
+
+def UpstreamKey(method, url, body, anonymize=True):
+  """Returns the key that matches a replayed upstream request to a recording.
+
+  The SOAP header is left out, except for the network code, since it also
+  holds the client library's version.
+
+  Args:
+    method: str The HTTP method.
+    url: str The URL.
+    body: str The request body, or None.
+    anonymize: bool Whether to anonymize the request first. Requests made
+               while replaying come from anonymized parameters already.
+
+  Returns:
+    str The key.
+  """
+  body = body or ''
+  if isinstance(body, unicode):
+    body = body.encode('utf-8')
+  network_codes = _NETWORK_CODE_PATTERN.findall(body)
+  body = saxutils.unescape(_SOAP_HEADER_PATTERN.sub('', body),
+                           {'&apos;': "'", '&quot;': '"'})
+  if anonymize:
+    network_codes = [AnonymizeNetworkCode(code) for code in network_codes]
+    body = AnonymizeStatement(body)
+  return hashlib.sha1('\n'.join(
+      [method, url, ','.join(network_codes), body])).hexdigest()
+
+
+def BufferedResponseBody(body, status, content_type=None):
+  """Returns a response body that can be read again like a streamed one.
+
+  Args:
+    body: str The decoded body.
+    status: int The HTTP status.
+    content_type: str The Content-Type header, if any.
+
+  Returns:
+    urllib3.HTTPResponse The body, for a requests.Response's raw attribute
+    or requests' HTTPAdapter.build_response.
+  """
+  import urllib3  # pylint: disable=g-import-not-at-top
+  headers = {'Content-Type': content_type} if content_type else {}
+  return urllib3.HTTPResponse(body=io.BytesIO(body), headers=headers,
+                              status=status, preload_content=False)
+
+
+def RecordUpstream(request, response, started):
+  """Buffers a record of an upstream response, if traffic is recorded.
+
+  Recording reads the whole response body, so streamed responses are given
+  a new body which their reader can read from the start.
+
+  Args:
+    request: requests.PreparedRequest The upstream request.
+    response: requests.Response The response.
+    started: float Time the request was sent, in seconds since the epoch.
+
+  Returns:
+    requests.Response The response to return to the caller.
+  """
+  if not RECORD_TRAFFIC or urlparse(request.url).hostname in _UNRECORDED_HOSTS:
+    return response
+  body = response.content
+  seconds = time.time() - started
+  response.raw = BufferedResponseBody(body, response.status_code)
+  encoded_body = base64.b64encode(zlib.compress(body))
+  if len(encoded_body) > _MAX_BODY_SIZE:
+    logging.warning('Not recording a response of %d bytes from %s', len(body),
+                    request.url)
+    return response
+  _Buffer({
+      'type': 'upstream',
+      'key': UpstreamKey(request.method, request.url, request.body),
+      'started': started,
+      'seconds': seconds,
+      'status': response.status_code,
+      'contentType': response.headers.get('Content-Type'),
+      'body': encoded_body,
+  })
+  return response
+
+
+def RecordRequest(request, response, started, seconds):
+  """Records a handled API request and stores the buffered records.
+
+  Must be called on the request's thread.
+
+  Args:
+    request: webapp2.Request The request.
+    response: webapp2.Response The response.
+    started: float Time the request arrived, in seconds since the epoch.
+    seconds: float Seconds it took to handle.
+  """
+  _Buffer({
+      'type': 'request',
+      'method': request.method,
+      'path': request.path,
+      'params': AnonymizeParameters(request.params.items()),
+      'started': started,
+      'seconds': seconds,
+      'status': response.status_int,
+  })
+  with _buffer_lock:
+    records = _buffer[:]
+    del _buffer[:]
+    dropped_count = _dropped_count[0]
+    _dropped_count[0] = 0
+  if dropped_count:
+    logging.warning('Dropped %d traffic records', dropped_count)
+  StoreTrafficRecords(records)
+
+
+def DecodeBody(record):
+  """Returns the response body of an upstream record.
+
+  Args:
+    record: dict The record.
+
+  Returns:
+    str The body.
+  """
+  return zlib.decompress(base64.b64decode(record['body']))
+
+
+def _Buffer(record):
+  with _buffer_lock:
+    if len(_buffer) < _MAX_BUFFERED_RECORDS:
+      _buffer.append(record)
+    else:
+      _dropped_count[0] += 1
+
+
+def _Hash(value):
+  """Returns the salted hash of a value, in hex."""
+  if isinstance(value, unicode):
+    value = value.encode('utf-8')
+  return hashlib.sha1(_SALT + value).hexdigest()
@@ -0,0 +1,132 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the API traffic recorder."""
+
+import unittest
+
+import mock
+from ndb_handler import RetrieveTrafficRecords
+import requests
+from requests.adapters import HTTPAdapter
+import traffic_recorder
+from traffic_recorder import AnonymizeParameters
+from traffic_recorder import BufferedResponseBody
+from traffic_recorder import DecodeBody
+from traffic_recorder import RecordRequest
+from traffic_recorder import RecordUpstream
+from traffic_recorder import UpstreamKey
+import webapp2
+
+from google.appengine.ext import testbed
+
+_URL = 'https://ads.google.com/apis/ads/publisher/v201902/LineItemService'
+
+
+def _SOAPBody(network_code, query):
+  return (
+      '<soap-env:Envelope><soap-env:Header><ns0:RequestHeader>'
+      '<ns0:networkCode>%s</ns0:networkCode>'
+      '<ns0:applicationName>DFP Playground</ns0:applicationName>'
+      '</ns0:RequestHeader></soap-env:Header><soap-env:Body>'
+      '<ns0:getLineItemsByStatement><ns0:filterStatement>'
+      '<ns0:query>%s</ns0:query>'
+      '</ns0:filterStatement></ns0:getLineItemsByStatement>'
+      '</soap-env:Body></soap-env:Envelope>' % (network_code, query))
+
+
+class TrafficRecorderTest(unittest.TestCase):
+  """Tests for traffic_recorder.py."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.record_patcher = mock.patch.object(traffic_recorder,
+                                            'RECORD_TRAFFIC', True)
+    self.record_patcher.start()
+
+  def tearDown(self):
+    self.record_patcher.stop()
+    self.testbed.deactivate()
+
+  def testAnonymizeParameters(self):
+    params = dict(AnonymizeParameters([
+        ('network_code', '1234'),
+        ('network_codes', '1234,5678'),
+        ('where', "WHERE name = 'secret' AND id > 5"),
+        ('limit', '25'),
+        ('q', 'john@example.com'),
+    ]))
+
+    network_code = params['network_code']
+    self.assertTrue(network_code.isdigit())
+    self.assertNotEqual('1234', network_code)
+    self.assertTrue(params['network_codes'].startswith(network_code + ','))
+    self.assertNotIn('secret', params['where'])
+    self.assertTrue(params['where'].endswith("' AND id > 5"))
+    self.assertEqual('25', params['limit'])
+    self.assertNotIn('john', params['q'])
+
+  def testReplayedRequestMatchesRecording(self):
+    where_clause = "WHERE name = 'a<b' LIMIT 10 OFFSET 0"
+    recorded_key = UpstreamKey(
+        'POST', _URL, _SOAPBody('1234', where_clause.replace('<', '&lt;')))
+
+    params = dict(AnonymizeParameters([('network_code', '1234'),
+                                       ('where', where_clause)]))
+    replayed_body = _SOAPBody(params['network_code'], params['where'])
+    self.assertEqual(recorded_key, UpstreamKey('POST', _URL, replayed_body,
+                                               anonymize=False))
+
+    other_body = _SOAPBody(params['network_code'],
+                           params['where'].replace('10', '20'))
+    self.assertNotEqual(recorded_key, UpstreamKey('POST', _URL, other_body,
+                                                  anonymize=False))
+
+  def testRecordTraffic(self):
+    upstream_request = requests.Request(
+        'POST', _URL, data=_SOAPBody('1234', 'LIMIT 1')).prepare()
+    upstream_response = HTTPAdapter().build_response(
+        upstream_request, BufferedResponseBody('<xml/>', 200, 'text/xml'))
+    upstream_response = RecordUpstream(upstream_request, upstream_response,
+                                       started=1.0)
+    # a streamed response can still be read
+    self.assertEqual('<xml/>', upstream_response.raw.read())
+
+    request = webapp2.Request.blank('/api/lineitems?network_code=1234')
+    response = webapp2.Response()
+    response.status = 400
+    RecordRequest(request, response, started=1.5, seconds=0.5)
+
+    upstream_record, request_record = sorted(
+        RetrieveTrafficRecords(), key=lambda record: record['started'])
+    self.assertEqual('<xml/>', DecodeBody(upstream_record))
+    self.assertEqual(200, upstream_record['status'])
+    self.assertEqual('/api/lineitems', request_record['path'])
+    self.assertEqual(400, request_record['status'])
+    self.assertEqual([], traffic_recorder._buffer)
+
+  def testTokenRequestsAreNotRecorded(self):
+    token_request = requests.Request(
+        'POST', 'https://accounts.google.com/o/oauth2/token',
+        data='refresh_token=secret').prepare()
+    RecordUpstream(token_request, mock.Mock(), started=1.0)
+
+    self.assertEqual([], traffic_recorder._buffer)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,335 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Instance-wide admission of upstream calls, fair between users.
+
+Every call an APIHandler makes to the DFP API waits here for a slot. Calls
+are either interactive, such as loading a tab, or bulk, such as fan-outs,
+aggregates and report downloads. Waiting calls are admitted by weighted fair
+queuing: each user's interactive and bulk calls form a flow, and flows are
+served in proportion to their weight, so a user with hundreds of queued bulk
+calls delays another user's call by at most a few calls. Each user has a
+limit of running calls per priority, and bulk calls never take the slots
+kept for interactive ones, so interactive calls do not wait for long bulk
+calls to finish.
+"""
+
+import bisect
+import collections
+import itertools
+import threading
+import time
+
+from utils import lazy_singleton
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Upstream calls running at once, one per connection of the shared session,
+# see http_transport.POOL_SIZE.
+MAX_CONCURRENT_CALLS = 20
+# Upstream calls running at once that may be bulk calls. The other slots are
+# kept for interactive calls.
+MAX_BULK_CALLS = 12
+# Upstream calls a user may have running at once, by priority.
+MAX_USER_CALLS = {
+    INTERACTIVE: 4,
+    BULK: 4,
+}
+# Share of the slots a flow of each priority gets when all flows are waiting.
+_WEIGHTS = {
+    INTERACTIVE: 4.0,
+    BULK: 1.0,
+}
+# Number of recent wait times kept per priority for the statistics.
+_WAIT_SAMPLES = 1000
+# Number of flows above which the finish tags of idle flows are dropped.
+_MAX_FLOWS = 1000
+
+_last_admission = threading.local()
+
+
+class _Ticket(object):
+  """A call waiting to be admitted."""
+
+  def __init__(self, user_key, priority):
+    self.user_key = user_key
+    self.priority = priority
+    self.admitted = False
+
+
+class _StreamedCall(object):
+  """Iterator over a call's streamed response, which holds the call's slot.
+
+  The slot is freed once the iterator is exhausted, fails or is closed, or
+  at the latest when the iterator is garbage collected.
+  """
+
+  def __init__(self, iterator, release):
+    self._iterator = iterator
+    self._release = release
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    try:
+      return next(self._iterator)
+    except BaseException:
+      self.close()
+      raise
+
+  def close(self):
+    """Closes the response and frees the call's slot."""
+    release, self._release = self._release, None
+    if release:
+      try:
+        close = getattr(self._iterator, 'close', None)
+        if close:
+          close()
+      finally:
+        release()
+
+  def __del__(self):
+    self.close()
+
+
+class UpstreamScheduler(object):
+  """Admits upstream calls by weighted fair queuing between users.
+
+  Each waiting call gets a finish tag, the virtual time at which its flow
+  would be done with it if every flow were served at the rate of its weight.
+  Calls are admitted in the order of their tags as far as the limits allow,
+  which is self-clocked fair queuing with a cost of one per call.
+  """
+
+  def __init__(self, max_calls=MAX_CONCURRENT_CALLS,
+               max_bulk_calls=MAX_BULK_CALLS, max_user_calls=None):
+    """Initializes an UpstreamScheduler.
+
+    Args:
+      max_calls: int Maximum number of calls running at once.
+      max_bulk_calls: int Maximum number of bulk calls running at once.
+      max_user_calls: dict Maximum number of a user's calls running at once,
+                      by priority. Defaults to MAX_USER_CALLS.
+    """
+    self._max_calls = max_calls
+    self._max_bulk_calls = max_bulk_calls
+    self._max_user_calls = max_user_calls or MAX_USER_CALLS
+    self._condition = threading.Condition()
+    self._sequence = itertools.count()
+    self._virtual_time = 0.0
+    self._finish_tags = {}
+    self._waiting = []
+    self._running = collections.defaultdict(int)
+    self._running_count = 0
+    self._call_counts = collections.defaultdict(int)
+    self._peak_waiting = 0
+    self._waits = dict((priority, collections.deque(maxlen=_WAIT_SAMPLES))
+                       for priority in _WEIGHTS)
+
+  def Run(self, user_key, priority, func, *args, **kwargs):
+    """Calls func(*args, **kwargs) once the call is admitted.
+
+    Args:
+      user_key: str Identifies the user the call is made for.
+      priority: str INTERACTIVE or BULK.
+      func: func The function making the upstream call.
+      *args: Positional arguments for func.
+      **kwargs: Keyword arguments for func.
+
+    Returns:
+      The function's return value.
+    """
+    self._Acquire(user_key, priority)
+    try:
+      return func(*args, **kwargs)
+    finally:
+      self._Release(user_key, priority)
+
+  def RunStream(self, user_key, priority, func, *args, **kwargs):
+    """Calls func(*args, **kwargs), which streams a response, once admitted.
+
+    Unlike Run, the call's slot is held while the response is read, until
+    the returned iterator is exhausted or closed.
+
+    Args:
+      user_key: str Identifies the user the call is made for.
+      priority: str INTERACTIVE or BULK.
+      func: func The function making the upstream call, which returns an
+            iterator over the response.
+      *args: Positional arguments for func.
+      **kwargs: Keyword arguments for func.
+
+    Returns:
+      iterator The items of the function's iterator.
+    """
+    self._Acquire(user_key, priority)
+    try:
+      iterator = iter(func(*args, **kwargs))
+    except BaseException:
+      self._Release(user_key, priority)
+      raise
+    return _StreamedCall(iterator,
+                         lambda: self._Release(user_key, priority))
+
+  def GetStats(self):
+    """Returns the running and waiting calls and recent wait times.
+
+    Returns:
+      dict The statistics, with those of each priority under its name.
+    """
+    with self._condition:
+      waiting = collections.Counter(
+          ticket.priority for _, _, ticket in self._waiting)
+      stats = {
+          'running': self._running_count,
+          'waiting': len(self._waiting),
+          'peak_waiting': self._peak_waiting,
+          'max_calls': self._max_calls,
+          'max_bulk_calls': self._max_bulk_calls,
+          'users': len(set(user_key for user_key, _ in self._running)),
+      }
+      for priority in _WEIGHTS:
+        waits = sorted(self._waits[priority])
+        stats[priority] = {
+            'running': sum(count for (_, flow_priority), count
+                           in self._running.iteritems()
+                           if flow_priority == priority),
+            'waiting': waiting[priority],
+            'calls': self._call_counts[priority],
+            'wait_p50_seconds': _Percentile(waits, 0.5),
+            'wait_p95_seconds': _Percentile(waits, 0.95),
+            'wait_max_seconds': waits[-1] if waits else 0.0,
+        }
+      return stats
+
+  def _Acquire(self, user_key, priority):
+    """Queues a call and waits until it is admitted.
+
+    A call that stops waiting for any reason leaves the queue, and gives its
+    slot back if it was admitted meanwhile.
+
+    Raises:
+      requests.exceptions.Timeout: The thread's deadline, see
+        http_transport.SetThreadDeadline, passed before the call was
+        admitted.
+    """
+    # only upstream calls are scheduled, and they have loaded these already
+    # pylint: disable=g-import-not-at-top
+    from http_transport import GetThreadDeadline
+    from requests.exceptions import Timeout
+    # pylint: enable=g-import-not-at-top
+
+    deadline = GetThreadDeadline()
+    flow = (user_key, priority)
+    ticket = _Ticket(user_key, priority)
+    start = time.time()
+    with self._condition:
+      if len(self._finish_tags) > _MAX_FLOWS:
+        # flows whose tags are behind the virtual time start over anyway
+        self._finish_tags = dict(
+            (other_flow, tag)
+            for other_flow, tag in self._finish_tags.iteritems()
+            if tag > self._virtual_time)
+      tag = (max(self._virtual_time, self._finish_tags.get(flow, 0.0)) +
+             1.0 / _WEIGHTS[priority])
+      self._finish_tags[flow] = tag
+      entry = (tag, next(self._sequence), ticket)
+      bisect.insort(self._waiting, entry)
+      self._Dispatch()
+      self._peak_waiting = max(self._peak_waiting, len(self._waiting))
+      try:
+        while not ticket.admitted:
+          remaining = None
+          if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+              raise Timeout('Deadline passed while waiting for a slot')
+          self._condition.wait(remaining)
+      except BaseException:
+        if ticket.admitted:
+          self._Release(user_key, priority)
+        else:
+          self._waiting.remove(entry)
+        raise
+      admitted = time.time()
+      self._call_counts[priority] += 1
+      self._waits[priority].append(admitted - start)
+    _last_admission.time = admitted
+
+  def _Release(self, user_key, priority):
+    """Frees a finished call's slot and admits the calls waiting for it."""
+    flow = (user_key, priority)
+    with self._condition:
+      self._running_count -= 1
+      self._running[flow] -= 1
+      if not self._running[flow]:
+        del self._running[flow]
+      self._Dispatch()
+
+  def _Dispatch(self):
+    """Admits waiting calls in the order of their tags, within the limits.
+
+    Must be called with the condition's lock held.
+    """
+    admitted = False
+    bulk_count = sum(count for (_, priority), count in self._running.iteritems()
+                     if priority == BULK)
+    for entry in list(self._waiting):
+      if self._running_count >= self._max_calls:
+        break
+      tag, _, ticket = entry
+      flow = (ticket.user_key, ticket.priority)
+      if self._running.get(flow, 0) >= self._max_user_calls[ticket.priority]:
+        continue
+      if ticket.priority == BULK:
+        if bulk_count >= self._max_bulk_calls:
+          continue
+        bulk_count += 1
+      self._waiting.remove(entry)
+      self._virtual_time = max(self._virtual_time, tag)
+      self._running_count += 1
+      self._running[flow] += 1
+      ticket.admitted = True
+      admitted = True
+    if admitted:
+      self._condition.notify_all()
+
+
+def _Percentile(values, fraction):
+  """Returns a percentile of sorted values, or 0 if there are none."""
+  if not values:
+    return 0.0
+  return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def GetLastAdmissionTime():
+  """Returns when the current thread's last call was admitted.
+
+  Returns:
+    float The time, as returned by time.time(), or None if the thread has
+    not made a call.
+  """
+  return getattr(_last_admission, 'time', None)
+
+
+@lazy_singleton
+def GetScheduler():
+  """Returns the instance-wide scheduler.
+
+  Returns:
+    UpstreamScheduler The scheduler.
+  """
+  return UpstreamScheduler()
@@ -0,0 +1,203 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the upstream call scheduler."""
+
+import threading
+import time
+import unittest
+
+import http_transport
+import mock
+import requests
+from upstream_scheduler import BULK
+from upstream_scheduler import INTERACTIVE
+from upstream_scheduler import UpstreamScheduler
+
+
+class UpstreamSchedulerTest(unittest.TestCase):
+  """Tests for upstream_scheduler.py."""
+
+  def setUp(self):
+    self.admitted = []
+    self.threads = []
+
+  def tearDown(self):
+    for thread in self.threads:
+      thread.join(5)
+
+  def _Start(self, scheduler, user_key, priority, release=None):
+    """Starts a call on a new thread, waiting until it is queued or runs."""
+    expected = scheduler.GetStats()['waiting'] + scheduler.GetStats()['running']
+
+    def Call():
+      self.admitted.append((user_key, priority))
+      if release:
+        release.wait(5)
+
+    thread = threading.Thread(
+        target=scheduler.Run, args=(user_key, priority, Call))
+    thread.daemon = True
+    thread.start()
+    self.threads.append(thread)
+    deadline = time.time() + 5
+    while time.time() < deadline:
+      stats = scheduler.GetStats()
+      if stats['waiting'] + stats['running'] > expected:
+        return
+      time.sleep(0.001)
+    self.fail('Call was not queued')
+
+  def _WaitForAll(self):
+    for thread in self.threads:
+      thread.join(5)
+      self.assertFalse(thread.is_alive())
+
+  def testRunReturnsResult(self):
+    scheduler = UpstreamScheduler()
+    self.assertEqual(3, scheduler.Run('a', INTERACTIVE, lambda x: x + 1, 2))
+    stats = scheduler.GetStats()
+    self.assertEqual(0, stats['running'])
+    self.assertEqual(1, stats[INTERACTIVE]['calls'])
+
+  def testRunReleasesSlotOnException(self):
+    scheduler = UpstreamScheduler(max_calls=1)
+
+    def Fail():
+      raise ValueError()
+
+    self.assertRaises(ValueError, scheduler.Run, 'a', BULK, Fail)
+    self.assertEqual(1, scheduler.Run('a', BULK, lambda: 1))
+
+  def testRunStreamHoldsSlotUntilRead(self):
+    scheduler = UpstreamScheduler(max_calls=1)
+
+    stream = scheduler.RunStream('a', BULK, lambda: iter([1, 2]))
+    self.assertEqual(1, next(stream))
+    self.assertEqual(1, scheduler.GetStats()['running'])
+    self.assertEqual([2], list(stream))
+    self.assertEqual(0, scheduler.GetStats()['running'])
+
+    # closing a stream that is not read to the end frees its slot too
+    stream = scheduler.RunStream('a', BULK, lambda: iter([1, 2]))
+    self.assertEqual(1, next(stream))
+    stream.close()
+    stream.close()
+    self.assertEqual(0, scheduler.GetStats()['running'])
+
+    def Fail():
+      raise ValueError()
+    self.assertRaises(ValueError, scheduler.RunStream, 'a', BULK, Fail)
+    self.assertEqual(0, scheduler.GetStats()['running'])
+
+  def testInterruptedWaitLeavesNoTicket(self):
+    scheduler = UpstreamScheduler(max_calls=1)
+    scheduler._Acquire('a', BULK)
+
+    # interrupted while queued
+    with mock.patch.object(scheduler._condition, 'wait',
+                           side_effect=KeyboardInterrupt):
+      self.assertRaises(KeyboardInterrupt, scheduler.Run, 'b', BULK, int)
+    self.assertEqual((1, 0), (scheduler.GetStats()['running'],
+                              scheduler.GetStats()['waiting']))
+
+    # interrupted once admitted, by the first call's release
+    def Interrupt(unused_timeout):
+      scheduler._Release('a', BULK)
+      raise KeyboardInterrupt()
+    with mock.patch.object(scheduler._condition, 'wait',
+                           side_effect=Interrupt):
+      self.assertRaises(KeyboardInterrupt, scheduler.Run, 'b', BULK, int)
+    self.assertEqual((0, 0), (scheduler.GetStats()['running'],
+                              scheduler.GetStats()['waiting']))
+
+  def testWaitEndsAtThreadDeadline(self):
+    scheduler = UpstreamScheduler(max_calls=1)
+    scheduler._Acquire('a', BULK)
+    http_transport.SetThreadDeadline(time.time() + 0.05)
+    try:
+      self.assertRaises(requests.exceptions.Timeout, scheduler.Run, 'b', BULK,
+                        int)
+    finally:
+      http_transport.SetThreadDeadline(None)
+    self.assertEqual((1, 0), (scheduler.GetStats()['running'],
+                              scheduler.GetStats()['waiting']))
+    scheduler._Release('a', BULK)
+    self.assertEqual(0, scheduler.Run('b', BULK, int))
+
+  def testUsersAreServedInTurn(self):
+    scheduler = UpstreamScheduler(max_calls=1)
+    release = threading.Event()
+    self._Start(scheduler, 'blocker', INTERACTIVE, release)
+    for _ in range(3):
+      self._Start(scheduler, 'a', BULK)
+    self._Start(scheduler, 'b', BULK)
+    self.assertEqual(4, scheduler.GetStats()[BULK]['waiting'])
+
+    release.set()
+    self._WaitForAll()
+    self.assertEqual(['blocker', 'a', 'b', 'a', 'a'],
+                     [user_key for user_key, _ in self.admitted])
+
+  def testInteractiveCallsGetLargerShare(self):
+    scheduler = UpstreamScheduler(max_calls=1)
+    release = threading.Event()
+    self._Start(scheduler, 'blocker', INTERACTIVE, release)
+    for _ in range(3):
+      self._Start(scheduler, 'a', BULK)
+    for _ in range(5):
+      self._Start(scheduler, 'b', INTERACTIVE)
+
+    release.set()
+    self._WaitForAll()
+    self.assertEqual([INTERACTIVE, INTERACTIVE, INTERACTIVE, INTERACTIVE,
+                      BULK, INTERACTIVE, INTERACTIVE, BULK, BULK],
+                     [priority for _, priority in self.admitted])
+
+  def testUserLimit(self):
+    scheduler = UpstreamScheduler(
+        max_user_calls={INTERACTIVE: 1, BULK: 2})
+    release = threading.Event()
+    for _ in range(3):
+      self._Start(scheduler, 'a', BULK, release)
+    self._Start(scheduler, 'a', INTERACTIVE, release)
+    self._Start(scheduler, 'b', BULK, release)
+
+    stats = scheduler.GetStats()
+    self.assertEqual(4, stats['running'])
+    self.assertEqual(3, stats[BULK]['running'])
+    self.assertEqual(1, stats[BULK]['waiting'])
+    self.assertEqual(2, stats['users'])
+    release.set()
+    self._WaitForAll()
+
+  def testBulkCallsLeaveSlotsForInteractiveCalls(self):
+    scheduler = UpstreamScheduler(max_calls=3, max_bulk_calls=2)
+    release = threading.Event()
+    for user_key in ('a', 'b', 'c'):
+      self._Start(scheduler, user_key, BULK, release)
+    self._Start(scheduler, 'd', INTERACTIVE, release)
+
+    stats = scheduler.GetStats()
+    self.assertEqual(1, stats[INTERACTIVE]['running'])
+    self.assertEqual(2, stats[BULK]['running'])
+    self.assertEqual(1, stats[BULK]['waiting'])
+    self.assertEqual(1, stats['peak_waiting'])
+    release.set()
+    self._WaitForAll()
+    self.assertEqual(4, len(self.admitted))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -14,11 +14,15 @@
 
 """Utilities for the DFP Playground Webapp."""
 
+import binascii
+import collections
 from functools import wraps
+import hmac
 import logging
+import os
+import threading
 
 from ndb_handler import InitUser
-from suds.sudsobject import asdict
 
 
 def oauth2required(view_func):
@@ -59,6 +63,69 @@ def oauth2required(view_func):
   return check_dfp_credentials_exist
 
 
+# The cookie holding a browser's XSRF token, and the header in which requests
+# that change state must repeat it. These are the names Angular's $http uses,
+# so the app's requests carry the header without further code.
+XSRF_COOKIE_NAME = 'XSRF-TOKEN'
+XSRF_HEADER_NAME = 'X-XSRF-TOKEN'
+
+
+def set_xsrf_cookie(request, response):
+  """Gives the browser an XSRF token, unless it already has one.
+
+  Args:
+    request: Request The webapp2 request object.
+    response: Response The webapp2 response object.
+  """
+  if not request.cookies.get(XSRF_COOKIE_NAME):
+    # not HttpOnly, since the app's scripts read it
+    response.set_cookie(XSRF_COOKIE_NAME, binascii.hexlify(os.urandom(16)),
+                        path='/', secure=request.scheme == 'https')
+
+
+def xsrf_protected(view_func):
+  """Decorator to reject cross-site requests to a view that changes state.
+
+  The request must repeat the XSRF cookie's token in the XSRF header, which
+  other sites can neither read nor set. Posts must also have a JSON body,
+  which forms on other sites cannot send. Other requests are rejected with a
+  403 response.
+
+  Args:
+    view_func: func The original request view function.
+
+  Returns:
+    func The decorator function.
+  """
+
+  @wraps(view_func)
+  def check_xsrf_token(handler, *args, **kwargs):
+    """The decorator function.
+
+    Args:
+      handler: RequestHandler The webapp2 request handler.
+      *args: Additional args.
+      **kwargs: Additional kwargs.
+
+    Returns:
+      The view function's return value, or None if the request is rejected.
+    """
+    request = handler.request
+    token = request.cookies.get(XSRF_COOKIE_NAME, '')
+    header = request.headers.get(XSRF_HEADER_NAME, '')
+    if request.method == 'POST' and request.content_type != 'application/json':
+      error = 'Content-Type must be application/json'
+    elif not token or not hmac.compare_digest(str(token), str(header)):
+      error = 'The %s header must match the %s cookie' % (XSRF_HEADER_NAME,
+                                                          XSRF_COOKIE_NAME)
+    else:
+      return view_func(handler, *args, **kwargs)
+    handler.response.status = 403
+    handler.response.write(error)
+
+  return check_xsrf_token
+
+
 def retry(exception_to_check, attempts=3):
   """Decorator to retry a function upon exception.
 
@@ -122,6 +189,90 @@ def retry(exception_to_check, attempts=3):
   return decorator_wrap
 
 
+def lazy_singleton(func):
+  """Decorator to compute a function's value once, on first use.
+
+  Used for expensive module-level state (credentials, OAuth flow, template
+  environment) so that it is not paid for on instance start-up by requests
+  that never use it. The function must not take any arguments. Concurrent
+  first calls are serialized so the value is only computed once.
+
+  Args:
+    func: func The function computing the value.
+
+  Returns:
+    func The decorator function.
+  """
+  lock = threading.Lock()
+  value = []
+
+  @wraps(func)
+  def lazy_singleton_func():
+    """The decorator function.
+
+    Returns:
+      The value returned by the first call to func.
+    """
+    if not value:
+      with lock:
+        if not value:
+          value.append(func())
+    return value[0]
+
+  return lazy_singleton_func
+
+
+def lru_cache(max_size):
+  """Decorator to memoize a function's most recently used return values.
+
+  The function's positional arguments must be hashable. Once max_size values
+  are cached, the least recently used one is evicted. Exceptions raised by
+  the function are not cached.
+
+  Args:
+    max_size: int Maximum number of cached values.
+
+  Returns:
+    func The decorator function.
+  """
+
+  def decorator(func):
+    """The decorator.
+
+    Args:
+      func: func The function to memoize.
+
+    Returns:
+      func The memoized function.
+    """
+    lock = threading.Lock()
+    cache = collections.OrderedDict()
+
+    @wraps(func)
+    def lru_cache_func(*args):
+      """The decorator function.
+
+      Returns:
+        The value returned by func for these arguments.
+      """
+      with lock:
+        if args in cache:
+          value = cache.pop(args)
+          cache[args] = value
+          return value
+      value = func(*args)
+      with lock:
+        cache[args] = value
+        if len(cache) > max_size:
+          cache.popitem(last=False)
+      return value
+
+    lru_cache_func.cache_clear = cache.clear
+    return lru_cache_func
+
+  return decorator
+
+
 def unpack_suds_object(d):
   """Convert suds object into serializable format.
 
@@ -133,6 +284,7 @@ def unpack_suds_object(d):
   Returns:
     dict A serializable Python dict.
   """
+  from suds.sudsobject import asdict  # pylint: disable=g-import-not-at-top
   out = {}
   for key, value in asdict(d).iteritems():
     if hasattr(value, '__keylist__'):
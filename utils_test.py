@@ -21,10 +21,14 @@ import mock
 from models import AppCredential
 from models import AppUser
 import suds.sudsobject
+from utils import lazy_singleton
+from utils import lru_cache
 from utils import oauth2required
 from utils import retry
 from utils import unpack_row
 from utils import unpack_suds_object
+from utils import xsrf_protected
+import webapp2
 
 from google.appengine.api import users
 from google.appengine.ext import testbed
@@ -174,6 +178,36 @@ class UtilsTest(unittest.TestCase):
     users.get_current_user = mock.MagicMock(return_value=self.existing_app_user)
     self.assertEqual('/', self.homepage_mock(self.request_mock))
 
+  def testXsrfProtected(self):
+
+    class Handler(webapp2.RequestHandler):
+
+      @xsrf_protected
+      def post(self):
+        self.response.write('posted')
+
+    app = webapp2.WSGIApplication([('/', Handler)])
+
+    def Post(content_type='application/json', cookie='token',
+             header='token'):
+      request = webapp2.Request.blank('/', POST='{}')
+      request.content_type = content_type
+      if cookie:
+        request.headers['Cookie'] = 'XSRF-TOKEN=%s' % cookie
+      if header:
+        request.headers['X-XSRF-TOKEN'] = header
+      return request.get_response(app)
+
+    response = Post()
+    self.assertEqual(200, response.status_int)
+    self.assertEqual('posted', response.body)
+    self.assertEqual(403, Post(
+        content_type='application/x-www-form-urlencoded').status_int)
+    self.assertEqual(403, Post(cookie=None).status_int)
+    self.assertEqual(403, Post(header=None).status_int)
+    self.assertEqual(403, Post(cookie=None, header=None).status_int)
+    self.assertEqual(403, Post(header='other').status_int)
+
   def testEventualSuccess(self):
     self.assertEqual('success', self.test_obj.eventual_success_func())
     self.assertEqual(2, logging.warning.call_count)
@@ -186,6 +220,37 @@ class UtilsTest(unittest.TestCase):
     self.assertEqual('success', self.test_obj.instant_success_func())
     self.assertEqual(0, logging.warning.call_count)
 
+  def testLazySingleton(self):
+    calls = []
+
+    @lazy_singleton
+    def factory():
+      calls.append(None)
+      return 'value'
+
+    self.assertEqual(0, len(calls))
+    self.assertEqual('value', factory())
+    self.assertEqual('value', factory())
+    self.assertEqual(1, len(calls))
+
+  def testLruCache(self):
+    calls = []
+
+    @lru_cache(2)
+    def square(x):
+      calls.append(x)
+      return x * x
+
+    self.assertEqual(4, square(2))
+    self.assertEqual(9, square(3))
+    self.assertEqual(4, square(2))
+    self.assertEqual([2, 3], calls)
+    # 3 is the least recently used value
+    self.assertEqual(16, square(4))
+    self.assertEqual(4, square(2))
+    self.assertEqual(9, square(3))
+    self.assertEqual([2, 3, 4, 3], calls)
+
   def testUnpackEmptyObject(self):
     empty_obj = suds.sudsobject.Object()
     self.assertEqual({}, unpack_suds_object(empty_obj))
@@ -14,54 +14,152 @@
 
 """View handlers for the DFP Playground."""
 
+import csv
+import datetime
 import json
 import logging
-import os
-import socket
+import re
+import time
 
-from api_handler import APIHandler
-from googleads import ad_manager
-from googleads import oauth2
-import jinja2
+from ndb_handler import CreateEntitySnapshot
+from ndb_handler import CreateSavedQuery
+from ndb_handler import DeleteSavedQuery
 from ndb_handler import InitUser
+from ndb_handler import InitUserAsync
 from ndb_handler import ReplaceAppCredential
 from ndb_handler import RetrieveAppCredential
+from ndb_handler import RetrieveEntitySnapshot
+from ndb_handler import RetrieveSavedQueries
+from ndb_handler import RetrieveSavedQuery
+from ndb_handler import RetrieveSavedQueryResults
+from ndb_handler import RetrieveSnapshotDigests
+from ndb_handler import RetrieveTrafficRecords
+from ndb_handler import RetrieveUserByKey
 from ndb_handler import RevokeOldCredentials
-from oauth2client import client
+import name_index
+import network_cache
+import page_sizer
+import pql_parser
+import reference_data
+from response_encoding import WriteJsonResponse
+import saved_queries
+from template_loader import CreateEnvironment
+import traffic_recorder
+import upstream_scheduler
+from utils import lazy_singleton
 from utils import oauth2required
+from utils import set_xsrf_cookie
 from utils import unpack_row
+from utils import xsrf_protected
 import webapp2
-from zeep.helpers import serialize_object
 
 from google.appengine.api import app_identity
+from google.appengine.api import taskqueue
 from google.appengine.api import users
 
+# The googleads, zeep and oauth2client libraries are imported where they are
+# first needed rather than here. Importing them, reading the app credential
+# and building the OAuth flow would otherwise be paid for by every new
+# instance, even when it only serves a redirect or a static page.
+
 _APPLICATION_NAME = 'DFP Playground'
+# Seconds a report request waits for the report job before returning its id,
+# so that the client can fetch the report later.
+_REPORT_WAIT_SECONDS = 30
+# Maximum size of a report's CSV, which stays below App Engine's 32 MB limit
+# on responses.
+_MAX_REPORT_BYTES = 30 * 1024 * 1024
+# Maximum number of line items forecast in one request.
+_MAX_FORECAST_LINE_ITEMS = 1000
+# Seconds a fan-out query waits for each network, by default and at most.
+# Each network's clock starts with its call, which may wait up to as long for
+# a free worker, so twice the maximum must fit in App Engine's 60 second
+# request deadline.
+_FANOUT_TIMEOUT = 20
+_MAX_FANOUT_TIMEOUT = 25
+# Maximum number of entities whose details are requested at once.
+_MAX_DETAIL_IDS = 25
+# Maximum number of duplicate keys listed when entities cannot be compared.
+_MAX_LISTED_DUPLICATE_KEYS = 20
+# Maximum number of attributes an aggregate groups by.
+_MAX_GROUP_BY_ATTRIBUTES = 3
+# Seconds for which browsers may reuse aggregates and counts.
+_AGGREGATE_MAX_AGE = 5 * 60
+# Number of entities of each service a name search returns, by default and
+# at most.
+_SEARCH_LIMIT = 10
+_MAX_SEARCH_LIMIT = 50
+# Seconds a name search waits for the live queries of unindexed services.
+_SEARCH_TIMEOUT = 10
+
+
+@lazy_singleton
+def _GetJinjaEnvironment():
+  """Returns the Jinja environment, loading precompiled templates if any."""
+  return CreateEnvironment()
+
+
+@lazy_singleton
+def _GetAppCredential():
+  """Returns the (client id, client secret) tuple stored in the datastore."""
+  return RetrieveAppCredential()
+
+
+@lazy_singleton
+def _GetFlow():
+  """Returns the OAuth2 web server flow, initialized on first use."""
+  # pylint: disable=g-import-not-at-top
+  from googleads import oauth2
+  from oauth2client import client
+  # pylint: enable=g-import-not-at-top
+  client_id, client_secret = _GetAppCredential()
+  hostname = app_identity.get_default_version_hostname()
+  return client.OAuth2WebServerFlow(
+      client_id=client_id,
+      client_secret=client_secret,
+      scope=oauth2.GetAPIScope('ad_manager'),
+      user_agent='DFP Playground',
+      redirect_uri=(
+          ('https://' + hostname) if hostname else 'http://localhost:8008') +
+      '/oauth2callback',
+      access_type='offline',
+      approval_prompt='force')
+
+
+def _CreateAPIHandler(user_ndb=None, priority=upstream_scheduler.INTERACTIVE):
+  """Creates an APIHandler for the given user.
 
-# load templates
-_TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), 'templates')
-_JINJA_ENVIRONMENT = jinja2.Environment(
-    autoescape=True,
-    extensions=['jinja2.ext.autoescape'],
-    loader=jinja2.FileSystemLoader(_TEMPLATES_PATH))
+  Args:
+    user_ndb: AppUser The user to make calls to the DFP API as. If None, it
+              must be set with APIHandler.SetUser before making calls.
+    priority: str Priority of the handler's upstream calls. Defaults to
+              upstream_scheduler.INTERACTIVE.
 
-_CLIENT_ID, _CLIENT_SECRET = RetrieveAppCredential()
+  Returns:
+    APIHandler The handler.
+  """
+  from api_handler import APIHandler  # pylint: disable=g-import-not-at-top
+  client_id, client_secret = _GetAppCredential()
+  api_handler = APIHandler(client_id, client_secret, user_ndb,
+                           _APPLICATION_NAME)
+  api_handler.priority = priority
+  return api_handler
 
-# set timeout to 10 s
-socket.setdefaulttimeout(10)
 
-# initialize flow object
-_HOSTNAME = app_identity.get_default_version_hostname()
-_FLOW = client.OAuth2WebServerFlow(
-    client_id=_CLIENT_ID,
-    client_secret=_CLIENT_SECRET,
-    scope=oauth2.GetAPIScope('ad_manager'),
-    user_agent='DFP Playground',
-    redirect_uri=(
-        ('https://' + _HOSTNAME) if _HOSTNAME else 'http://localhost:8008') +
-    '/oauth2callback',
-    access_type='offline',
-    approval_prompt='force')
+def _ScriptJson(value):
+  """Returns a value as JSON that is safe to embed in a script element.
+
+  The characters that could end the element or start markup are escaped, so
+  the JSON can be written unescaped inside <script type="application/json">.
+
+  Args:
+    value: The JSON-serializable value.
+
+  Returns:
+    str The JSON.
+  """
+  return (json.dumps(value).replace('<', '\\u003c').replace('>', '\\u003e')
+          .replace('&', '\\u0026'))
 
 
 class MainPage(webapp2.RequestHandler):
@@ -74,12 +172,16 @@ class MainPage(webapp2.RequestHandler):
     user_email = user.email()
     logout_url = users.create_logout_url('/')
     user_ndb = InitUser()
+    # embed the networks when they are cached, which saves the page a request
+    networks = network_cache.GetCachedNetworks(user_ndb)
 
-    template = _JINJA_ENVIRONMENT.get_template('index_page.html')
+    set_xsrf_cookie(self.request, self.response)
+    template = _GetJinjaEnvironment().get_template('index_page.html')
     self.response.write(
         template.render({
             'user_email': user_email,
             'logout_url': logout_url,
+            'networks_json': _ScriptJson(networks) if networks else '',
         }))
 
 
@@ -88,7 +190,7 @@ class Login(webapp2.RequestHandler):
 
   def get(self):
     """Handle get request."""
-    auth_uri = _FLOW.step1_get_authorize_url()
+    auth_uri = _GetFlow().step1_get_authorize_url()
     self.redirect(auth_uri)
 
 
@@ -102,15 +204,14 @@ class LoginCallback(webapp2.RequestHandler):
       logging.info('User denied OAuth2 permissions')
       return self.redirect('/login/error')
 
-    credentials = _FLOW.step2_exchange(self.request.get('code'))
+    credentials = _GetFlow().step2_exchange(self.request.get('code'))
     if credentials:
       # store user's credentials in database
       user_ndb = InitUser(credentials.refresh_token)
 
-      # check if user has any networks
-      api_handler = APIHandler(
-          _CLIENT_ID, _CLIENT_SECRET, user_ndb, _APPLICATION_NAME)
-      networks = api_handler.GetAllNetworks()
+      # check if user has any networks, seeding the cache for the main page
+      api_handler = _CreateAPIHandler(user_ndb)
+      networks = network_cache.RefreshNetworks(api_handler, user_ndb)
       if not networks:
         # if user has no networks, redirect to ask if one should be made
         return self.redirect('/make-test-network')
@@ -136,7 +237,7 @@ class MakeTestNetworkPage(webapp2.RequestHandler):
 
   def get(self):
     """Handle get request."""
-    template = _JINJA_ENVIRONMENT.get_template('make_network_page.html')
+    template = _GetJinjaEnvironment().get_template('make_network_page.html')
     self.response.write(template.render({}))
 
 
@@ -157,17 +258,90 @@ class APIViewHandler(webapp2.RequestHandler):
       'pql': 'GetPQLSelection',
   }
 
-  def get(self, method):
-    """Delegate GET request calls to the DFP API."""
+  # Attributes kept for each row when a list is requested with view=summary.
+  # Services whose entities have no id of their own always return full rows.
+  summary_attributes_map = {
+      'users': ('id', 'email'),
+      'adunits': ('id', 'name'),
+      'companies': ('id', 'name'),
+      'creatives': ('id', 'name'),
+      'creativetemplates': ('id', 'name'),
+      'customtargetingkeys': ('id', 'name'),
+      'customtargetingvalues': ('id', 'name'),
+      'orders': ('id', 'name'),
+      'lineitems': ('id', 'name'),
+      'placements': ('id', 'name'),
+  }
+
+  def dispatch(self):
+    """Dispatches the request, recording it if traffic is recorded."""
+    if not traffic_recorder.RECORD_TRAFFIC:
+      return super(APIViewHandler, self).dispatch()
+    started = time.time()
+    try:
+      return super(APIViewHandler, self).dispatch()
+    finally:
+      traffic_recorder.RecordRequest(self.request, self.response, started,
+                                     time.time() - started)
+
+  def get(self, method, ids=None):
+    """Delegate GET request calls to the DFP API.
+
+    With stream=1, entity lists are parsed and written one entity at a time
+    instead of as a whole page, which bounds the memory used by pages of
+    large entities. Such responses are always plain JSON.
+
+    At most a page of the limit entities is returned. The page size is
+    chosen by page_sizer for the service and network and reported as
+    pageSize, unless it is given as page_size, so that the pages of one list
+    have the same size.
+
+    Args:
+      method: str The API method, see api_handler_method_map.
+      ids: str Comma separated entity ids. If given, the full entities with
+           these ids are returned instead of a filtered list.
+    """
+    from googleads import ad_manager  # pylint: disable=g-import-not-at-top
+
     method = method.lower()
-    user_ndb = InitUser()
-    api_handler = APIHandler(
-        _CLIENT_ID, _CLIENT_SECRET, user_ndb, _APPLICATION_NAME)
+    if (ids is None and method in self.api_handler_method_map and
+        not self._CheckStatement(self.api_handler_method_map[method])):
+      return
+    # Look the user up while the service's WSDL is fetched and parsed, then
+    # refresh the access token while the service is still being resolved.
+    user_future = InitUserAsync()
+    api_handler = _CreateAPIHandler()
+    if method == 'networks':
+      # usually answered from network_cache
+      pass
+    elif method == 'pql' and reference_data.IsReferenceQuery(
+        self.request.get('where')):
+      # likely answered locally, see reference_data
+      pass
+    elif method in self.api_handler_method_map:
+      api_handler.Prefetch(self.api_handler_method_map[method])
+    user_ndb = user_future.get_result()
+    api_handler.SetUser(user_ndb)
     network_code = self.request.get('network_code')
 
+    if ids is not None:
+      return self._GetDetails(api_handler, method, network_code, ids)
+
     # parse parameters
     try:
-      limit = int(self.request.get('limit', api_handler.page_limit))
+      page_size = int(self.request.get('page_size', 0))
+    except ValueError:
+      self.response.status = 400
+      return self.response.write('Page size must be an integer')
+    # the reported page size is the one used, even if statistics change
+    if page_size:
+      page_size = page_sizer.ClampPageSize(page_size)
+    else:
+      page_size = api_handler.GetPageLimit(
+          self.api_handler_method_map.get(method), network_code)
+    api_handler.page_limit = page_size
+    try:
+      limit = int(self.request.get('limit', page_size))
     except ValueError:
       self.response.status = 400
       return self.response.write('Limit must be an integer')
@@ -178,7 +352,11 @@ class APIViewHandler(webapp2.RequestHandler):
       return self.response.write('Offset must be an integer')
 
     if method == 'networks':
-      return_obj = api_handler.GetAllNetworks()
+      networks = network_cache.GetNetworks(api_handler, user_ndb)
+      return_obj = {
+          'results': networks,
+          'totalResultSetSize': len(networks),
+      }
     else:
       # construct PQL statement
       where_clause = self.request.get('where', '')
@@ -191,23 +369,16 @@ class APIViewHandler(webapp2.RequestHandler):
                                    self.api_handler_method_map[method])
       except KeyError:
         self.response.status = 400
-        self.response.write('API method not supported (%s).' % method)
+        return self.response.write('API method not supported (%s).' % method)
+
+      if self.request.get('stream') and method != 'pql':
+        return self._StreamResults(api_handler, method, network_code,
+                                   statement, offset)
 
       # retrieve return_obj from api_handler and modify it
       return_obj = api_handler_func(network_code, statement)
 
-    # process return_obj
-    if 'columns' in return_obj:
-      # special case: return_obj is from PQL Service
-      cols = return_obj['columns']
-      return_obj['results'] = [
-          unpack_row(row, cols) for row in return_obj['results']
-      ]
-    else:
-      # regular case
-      return_obj['results'] = [
-          serialize_object(obj) for obj in return_obj['results']
-      ]
+    self._ProcessResults(method, return_obj)
 
     if self.request.get('limit'):
       return_obj['limit'] = limit
@@ -215,43 +386,1113 @@ class APIViewHandler(webapp2.RequestHandler):
       try:
         return_obj['limit'] = return_obj['totalResultSetSize']
       except KeyError:
-        return_obj['limit'] = api_handler.page_limit
+        return_obj['limit'] = page_size
     return_obj['offset'] = offset
+    return_obj['pageSize'] = page_size
+
+    WriteJsonResponse(self.request, self.response, return_obj)
+
+  def fan_out(self, method):
+    """Runs a GET request's statement against several networks.
+
+    The networks are given as comma separated network_codes and default to
+    all of the user's networks. The response is newline delimited JSON with
+    one object per network, written in the order the networks answer, whose
+    results are tagged with their network code. A network that fails or does
+    not answer within the timeout parameter has an error instead.
+
+    Args:
+      method: str The API method, see api_handler_method_map.
+    """
+    method = method.lower()
+    if method not in self.api_handler_method_map:
+      self.response.status = 400
+      return self.response.write('API method not supported (%s).' % method)
+    try:
+      limit = int(self.request.get('limit', 0)) or None
+      offset = int(self.request.get('offset', 0))
+      timeout = min(float(self.request.get('timeout', _FANOUT_TIMEOUT)),
+                    _MAX_FANOUT_TIMEOUT)
+    except ValueError:
+      self.response.status = 400
+      return self.response.write('Limit, offset and timeout must be numbers')
+    network_codes = [
+        network_code for network_code in
+        self.request.get('network_codes', '').split(',') if network_code
+    ]
+    if not all(network_code.isdigit() for network_code in network_codes):
+      self.response.status = 400
+      return self.response.write('Network codes must be numbers')
+
+    method_name = self.api_handler_method_map[method]
+    if not self._CheckStatement(method_name):
+      return
+    user_future = InitUserAsync()
+    api_handler = _CreateAPIHandler(priority=upstream_scheduler.BULK)
+    api_handler.Prefetch(method_name)
+    user_ndb = user_future.get_result()
+    api_handler.SetUser(user_ndb)
+    if not network_codes:
+      network_codes = [
+          str(network['networkCode'])
+          for network in network_cache.GetNetworks(api_handler, user_ndb)
+      ]
+
+    self.response.headers['Content-Type'] = 'application/x-ndjson'
+    for network_code, return_obj, error in api_handler.FanOut(
+        method_name, network_codes, self.request.get('where', ''), limit,
+        offset, timeout):
+      if return_obj is None:
+        return_obj = {'results': []}
+      else:
+        self._ProcessResults(method, return_obj)
+      for result in return_obj['results']:
+        result['networkCode'] = network_code
+      return_obj['networkCode'] = network_code
+      return_obj['error'] = error
+      self.response.write(json.dumps(return_obj, separators=(',', ':')))
+      self.response.write('\n')
+
+  def aggregate(self, method):
+    """Counts the entities matching a where clause by attribute values.
+
+    The attributes are given as comma separated group_by, such as
+    group_by=status,orderId.
+
+    Args:
+      method: str The API method, see api_handler_method_map.
+    """
+    method_name = self._GetEntityMethodName(method)
+    if not method_name:
+      return
+    group_by = [
+        attribute for attribute in self.request.get('group_by', '').split(',')
+        if attribute
+    ]
+    if (not group_by or len(group_by) > _MAX_GROUP_BY_ATTRIBUTES or
+        not all(re.match(r'^[a-zA-Z]\w*$', attribute)
+                for attribute in group_by)):
+      self.response.status = 400
+      return self.response.write(
+          'Group by must be 1 to %d comma separated attributes' %
+          _MAX_GROUP_BY_ATTRIBUTES)
+
+    api_handler = self._CreateEntityAPIHandler(method_name,
+                                               upstream_scheduler.BULK)
+    return_obj = api_handler.Aggregate(
+        method_name, self.request.get('network_code'), group_by,
+        self.request.get('where', ''))
+
+    self.response.headers['Cache-Control'] = (
+        'private, max-age=%d' % _AGGREGATE_MAX_AGE)
+    WriteJsonResponse(self.request, self.response, return_obj)
+
+  def count(self, method):
+    """Returns the number of entities matching a where clause.
+
+    Args:
+      method: str The API method, see api_handler_method_map.
+    """
+    method_name = self._GetEntityMethodName(method)
+    if not method_name:
+      return
+
+    api_handler = self._CreateEntityAPIHandler(method_name)
+    total_result_set_size = api_handler.CountResults(
+        method_name, self.request.get('network_code'),
+        self.request.get('where', ''))
+
+    self.response.headers['Cache-Control'] = (
+        'private, max-age=%d' % _AGGREGATE_MAX_AGE)
+    WriteJsonResponse(self.request, self.response,
+                      {'totalResultSetSize': total_result_set_size})
+
+  def diff(self, method):
+    """Compares the entities matching a where clause on two sides.
+
+    The right side is network_code as it is now. The left side is either
+    network left_network_code, or the network of a snapshot taken earlier
+    with the snapshot route, given as snapshot. A snapshot also determines
+    the where clause and how entities are compared. Otherwise entities are
+    matched by id, or by the attribute given as key, and fields given as
+    comma separated ignore are left out of the comparison.
+
+    Entities of one side that share a key cannot be compared, and are
+    listed in a 400 response instead.
+
+    Args:
+      method: str The API method, see api_handler_method_map.
+    """
+    # pylint: disable=g-import-not-at-top
+    from entity_diff import DuplicateKeyError
+    # pylint: enable=g-import-not-at-top
+
+    method_name = self._GetEntityMethodName(method)
+    if not method_name:
+      return
+    network_code = self.request.get('network_code')
+    left_network_code = self.request.get('left_network_code')
+    snapshot_id = self.request.get('snapshot')
+    if bool(left_network_code) == bool(snapshot_id):
+      self.response.status = 400
+      return self.response.write(
+          'Either left_network_code or snapshot is required')
+    if snapshot_id and not snapshot_id.isdigit():
+      self.response.status = 400
+      return self.response.write('Snapshot must be a snapshot id')
+
+    if snapshot_id:
+      api_handler = self._CreateEntityAPIHandler(method_name,
+                                                 upstream_scheduler.BULK)
+      snapshot = RetrieveEntitySnapshot(api_handler.user, int(snapshot_id))
+      if not snapshot or snapshot.method_name != method_name:
+        self.response.status = 404
+        return self.response.write('No such snapshot (%s).' % snapshot_id)
+      try:
+        return_obj = api_handler.DiffEntities(
+            method_name, snapshot.network_code,
+            network_code or snapshot.network_code, snapshot.where_clause,
+            tuple(snapshot.key_attributes), frozenset(snapshot.ignored_fields),
+            left_digests=RetrieveSnapshotDigests(snapshot))
+      except DuplicateKeyError as e:
+        return self._WriteDuplicateKeys(e.keys)
+      return_obj['snapshotCreated'] = snapshot.created.isoformat()
+    else:
+      comparison = self._GetComparison(method_name)
+      if not comparison:
+        return
+      api_handler = self._CreateEntityAPIHandler(method_name,
+                                                 upstream_scheduler.BULK)
+      try:
+        return_obj = api_handler.DiffEntities(
+            method_name, left_network_code, network_code,
+            self.request.get('where', ''), *comparison)
+      except DuplicateKeyError as e:
+        return self._WriteDuplicateKeys(e.keys)
+
+    WriteJsonResponse(self.request, self.response, return_obj)
+
+  @xsrf_protected
+  def snapshot(self, method):
+    """Records the state of the entities matching a where clause.
+
+    Only a digest of each entity is stored. The snapshot's id can be given
+    to the diff route later, to find the entities that changed since. The
+    key and ignore parameters are as for diffs, and entities that share a
+    key are likewise refused.
+
+    Args:
+      method: str The API method, see api_handler_method_map.
+    """
+    # pylint: disable=g-import-not-at-top
+    from entity_diff import DuplicateKeyError
+    # pylint: enable=g-import-not-at-top
+
+    method_name = self._GetEntityMethodName(method)
+    if not method_name:
+      return
+    comparison = self._GetComparison(method_name)
+    if not comparison:
+      return
+    key_attributes, ignored_fields = comparison
+    network_code = self.request.get('network_code')
+    where_clause = self.request.get('where', '')
+
+    api_handler = self._CreateEntityAPIHandler(method_name,
+                                               upstream_scheduler.BULK)
+    try:
+      digests = api_handler.DigestEntities(method_name, network_code,
+                                           where_clause, key_attributes,
+                                           ignored_fields)
+    except DuplicateKeyError as e:
+      return self._WriteDuplicateKeys(e.keys)
+    snapshot = CreateEntitySnapshot(api_handler.user, method_name,
+                                    network_code, where_clause,
+                                    key_attributes, ignored_fields, digests)
+
+    WriteJsonResponse(self.request, self.response, {
+        'snapshot': snapshot.key.id(),
+        'entityCount': snapshot.entity_count,
+        'created': snapshot.created.isoformat(),
+    })
+
+  def _WriteDuplicateKeys(self, keys):
+    """Writes a 400 response listing keys shared by several entities.
+
+    Args:
+      keys: list The duplicate keys.
+    """
+    self.response.status = 400
+    self.response.write(
+        '%d keys are shared by several entities, which therefore cannot be '
+        'compared; choose a key that is unique, such as id. Duplicate keys: '
+        '%s' % (len(keys), json.dumps(keys[:_MAX_LISTED_DUPLICATE_KEYS])))
+
+  def _GetComparison(self, method_name):
+    """Returns how entities are compared, or writes an error.
+
+    Args:
+      method_name: str The APIHandler method the entities are from.
+
+    Returns:
+      tuple A tuple of the key attributes and the ignored fields, or None if
+      the key or ignore parameters are not valid.
+    """
+    # pylint: disable=g-import-not-at-top
+    from api_handler import GetKeyAttributes
+    from entity_diff import VOLATILE_FIELDS
+    # pylint: enable=g-import-not-at-top
+
+    key_attribute = self.request.get('key')
+    ignored_fields = [
+        field for field in self.request.get('ignore', '').split(',') if field
+    ]
+    if not all(re.match(r'^[a-zA-Z]\w*$', name)
+               for name in ignored_fields + [key_attribute or 'id']):
+      self.response.status = 400
+      self.response.write('Key and ignored fields must be attribute names')
+      return None
 
-    # construct response headers
+    key_attributes = GetKeyAttributes(method_name, key_attribute)
+    ignored_fields = VOLATILE_FIELDS.union(ignored_fields)
+    if 'id' not in key_attributes:
+      # ids differ between networks, entities are matched by key instead
+      ignored_fields = ignored_fields.union(['id'])
+    return key_attributes, ignored_fields.difference(key_attributes)
+
+  def _GetEntityMethodName(self, method):
+    """Returns the entity method behind a route, or writes an error.
+
+    Args:
+      method: str The API method, see api_handler_method_map.
+
+    Returns:
+      str The APIHandler method name, or None if the route has no entities.
+    """
+    method_name = self.api_handler_method_map.get(method.lower())
+    if not method_name or method_name == 'GetPQLSelection':
+      self.response.status = 400
+      self.response.write('API method not supported (%s).' % method)
+      return None
+    if not self._CheckStatement(method_name):
+      return None
+    return method_name
+
+  def _CheckStatement(self, method_name):
+    """Validates the request's where parameter before any upstream call.
+
+    Args:
+      method_name: str The APIHandler method the statement is for.
+
+    Returns:
+      bool Whether the statement is valid. If not, the error has been written
+      to the response.
+    """
+    where_clause = self.request.get('where', '')
+    try:
+      if method_name == 'GetPQLSelection':
+        pql_parser.ParseSelect(where_clause)
+      else:
+        pql_parser.ParseFilter(where_clause, method_name)
+    except pql_parser.InvalidStatementError as e:
+      self.response.status = 400
+      self.response.write('Invalid statement: %s' % e)
+      return False
+    return True
+
+  def _CreateEntityAPIHandler(self, method_name,
+                              priority=upstream_scheduler.INTERACTIVE):
+    """Creates an APIHandler for the current user, prefetching its service.
+
+    Args:
+      method_name: str The APIHandler method about to be called.
+      priority: str Priority of the handler's upstream calls.
+
+    Returns:
+      APIHandler The handler.
+    """
+    user_future = InitUserAsync()
+    api_handler = _CreateAPIHandler(priority=priority)
+    api_handler.Prefetch(method_name)
+    api_handler.SetUser(user_future.get_result())
+    return api_handler
+
+  def _StreamResults(self, api_handler, method, network_code, statement,
+                     offset):
+    """Writes a page of entities as they are parsed from the API's response.
+
+    Args:
+      api_handler: APIHandler The handler used to call the DFP API.
+      method: str The API method, see api_handler_method_map.
+      network_code: str Network code to look up the entities in.
+      statement: FilterStatement PQL Statement to filter results.
+      offset: int The statement's offset.
+    """
+    page = api_handler.StreamResults(self.api_handler_method_map[method],
+                                     network_code, statement)
     self.response.headers['Content-Type'] = 'application/json'
+    self.response.write('{"results":[')
+    fields = {}
+    separator = ''
+    for name, value in page:
+      if name == 'results':
+        self.response.write(separator)
+        self.response.write(json.dumps(self._SerializeEntity(method, value),
+                                       separators=(',', ':')))
+        separator = ','
+      else:
+        fields[name] = value
+
+    total_result_set_size = fields.get('totalResultSetSize') or 0
+    if self.request.get('limit'):
+      fields['limit'] = statement.limit
+    else:
+      fields['limit'] = total_result_set_size
+    fields['totalResultSetSize'] = total_result_set_size
+    fields['offset'] = offset
+    if (self.request.get('view') == 'summary' and
+        method in self.summary_attributes_map):
+      fields['summary'] = True
+    fields.pop('startIndex', None)
+    self.response.write('],')
+    self.response.write(json.dumps(fields, separators=(',', ':'))[1:])
+
+  def _SerializeEntity(self, method, obj):
+    """Converts an entity returned by APIHandler into a serializable dict.
 
-    self.response.write(json.dumps(return_obj))
+    Args:
+      method: str The API method, see api_handler_method_map.
+      obj: The zeep data object.
+
+    Returns:
+      dict The entity, or only its summary attributes if view=summary.
+    """
+    # pylint: disable=g-import-not-at-top
+    from zeep.helpers import serialize_object
+    # pylint: enable=g-import-not-at-top
+
+    if (self.request.get('view') == 'summary' and
+        method in self.summary_attributes_map):
+      # only keep what is needed to list the entities, the full entities are
+      # fetched on demand through the ids route
+      return dict((attribute, getattr(obj, attribute, None))
+                  for attribute in self.summary_attributes_map[method])
+    return serialize_object(obj)
+
+  def _ProcessResults(self, method, return_obj):
+    """Converts the results returned by APIHandler into serializable rows.
+
+    Args:
+      method: str The API method, see api_handler_method_map.
+      return_obj: dict The APIHandler method's result, which is modified.
+    """
+    if 'columns' in return_obj:
+      # special case: return_obj is from PQL Service
+      cols = return_obj['columns']
+      return_obj['results'] = [
+          unpack_row(row, cols) for row in return_obj['results']
+      ]
+      return
+
+    return_obj['results'] = [
+        self._SerializeEntity(method, obj) for obj in return_obj['results']
+    ]
+    if (self.request.get('view') == 'summary' and
+        method in self.summary_attributes_map):
+      return_obj['summary'] = True
+
+  def _GetDetails(self, api_handler, method, network_code, ids):
+    """Writes the full entities with the given ids.
+
+    Args:
+      api_handler: APIHandler The handler used to call the DFP API.
+      method: str The API method, see summary_attributes_map.
+      network_code: str Network code to look up the entities in.
+      ids: str Comma separated entity ids.
+    """
+    # pylint: disable=g-import-not-at-top
+    from googleads import ad_manager
+    from zeep.helpers import serialize_object
+    # pylint: enable=g-import-not-at-top
+
+    if method not in self.summary_attributes_map:
+      self.response.status = 400
+      return self.response.write(
+          'API method does not support id lookups (%s).' % method)
+
+    entity_ids = sorted(set(int(entity_id) for entity_id in ids.split(',')))
+    if len(entity_ids) > _MAX_DETAIL_IDS:
+      self.response.status = 400
+      return self.response.write(
+          'At most %d ids can be requested at once.' % _MAX_DETAIL_IDS)
+    api_handler.page_limit = len(entity_ids)
+
+    statement = ad_manager.FilterStatement(
+        'WHERE id IN (%s)' % ', '.join(str(i) for i in entity_ids),
+        limit=len(entity_ids))
+    api_handler_func = getattr(api_handler, self.api_handler_method_map[method])
+    return_obj = api_handler_func(network_code, statement)
+    return_obj['results'] = [
+        serialize_object(obj) for obj in return_obj['results']
+    ]
+
+    WriteJsonResponse(self.request, self.response, return_obj)
 
   def post(self, method):
     """Delegate POST request calls to the DFP API."""
     if method == 'networks':
       user_ndb = InitUser()
-      api_handler = APIHandler(
-          _CLIENT_ID, _CLIENT_SECRET, user_ndb, _APPLICATION_NAME)
+      api_handler = _CreateAPIHandler(user_ndb)
       api_handler.MakeTestNetwork()
+      network_cache.InvalidateNetworks(user_ndb)
       return self.redirect('/')
     else:
       self.response.status = 400
       self.response.write(method + ' API POST method not found.')
 
 
+class APIActionHandler(webapp2.RequestHandler):
+  """View that performs a bulk action on entities, such as pausing them."""
+
+  @xsrf_protected
+  def post(self, method):
+    """Handle post request.
+
+    The body is a JSON object with the action type, such as 'PauseLineItems',
+    and either the ids of the entities or a where clause selecting them, e.g.
+    {"action": "PauseLineItems", "ids": [1, 2]}.
+
+    Args:
+      method: str The API method, see APIViewHandler.api_handler_method_map.
+    """
+    # pylint: disable=g-import-not-at-top
+    from api_handler import ACTION_SERVICES
+    # pylint: enable=g-import-not-at-top
+
+    method_name = APIViewHandler.api_handler_method_map.get(method.lower())
+    if method_name not in ACTION_SERVICES:
+      self.response.status = 400
+      return self.response.write('API method has no actions (%s).' % method)
+
+    try:
+      body = json.loads(self.request.body)
+    except ValueError:
+      self.response.status = 400
+      return self.response.write('Body must be a JSON object')
+    if not isinstance(body, dict):
+      self.response.status = 400
+      return self.response.write('Body must be a JSON object')
+
+    action = body.get('action')
+    if not isinstance(action, basestring) or not re.match(r'^\w+$', action):
+      self.response.status = 400
+      return self.response.write('Action must be an action type name')
+    ids = body.get('ids')
+    where_clause = body.get('where')
+    if ids is not None:
+      if (method_name == 'GetLICAs' or not isinstance(ids, list) or
+          not all(isinstance(i, (int, long)) for i in ids)):
+        self.response.status = 400
+        return self.response.write('Ids must be a list of entity ids')
+    elif not isinstance(where_clause, basestring):
+      self.response.status = 400
+      return self.response.write('Either ids or a where clause is required')
+
+    user_future = InitUserAsync()
+    api_handler = _CreateAPIHandler()
+    api_handler.Prefetch(method_name)
+    api_handler.SetUser(user_future.get_result())
+    return_obj = api_handler.PerformAction(
+        method_name, self.request.get('network_code'), action, ids=ids,
+        where_clause=where_clause)
+
+    WriteJsonResponse(self.request, self.response, return_obj)
+
+
+class ForecastHandler(webapp2.RequestHandler):
+  """View that forecasts many line items at once."""
+
+  def get(self):
+    """Handle get request.
+
+    Forecasts the line items matching the where clause and merges the
+    forecasts onto their rows. The type parameter chooses between delivery
+    (the default) and availability forecasts.
+    """
+    forecast_type = self.request.get('type', 'delivery')
+    if forecast_type not in ('delivery', 'availability'):
+      self.response.status = 400
+      return self.response.write('Type must be delivery or availability')
+    try:
+      limit = min(int(self.request.get('limit', _MAX_FORECAST_LINE_ITEMS)),
+                  _MAX_FORECAST_LINE_ITEMS)
+    except ValueError:
+      self.response.status = 400
+      return self.response.write('Limit must be an integer')
+
+    network_code = self.request.get('network_code')
+    user_future = InitUserAsync()
+    api_handler = _CreateAPIHandler(priority=upstream_scheduler.BULK)
+    api_handler.Prefetch('GetLineItems', 'GetDeliveryForecasts')
+    api_handler.SetUser(user_future.get_result())
+
+    line_items = [
+        line_item
+        for page in api_handler.GetAllResults(
+            'GetLineItems', network_code, self.request.get('where', ''),
+            limit=limit)
+        for line_item in page
+    ]
+    if forecast_type == 'delivery':
+      forecasts = api_handler.GetDeliveryForecasts(
+          network_code, [line_item['id'] for line_item in line_items])
+    else:
+      forecasts = api_handler.GetAvailabilityForecasts(network_code,
+                                                       line_items)
+
+    attributes = APIViewHandler.summary_attributes_map['lineitems'] + (
+        'orderId', 'status')
+    WriteJsonResponse(self.request, self.response, {
+        'type': forecast_type,
+        'results': [
+            dict([(attribute, line_item[attribute])
+                  for attribute in attributes] +
+                 [('forecast', forecasts.get(line_item['id']))])
+            for line_item in line_items
+        ],
+        'totalResultSetSize': len(line_items),
+    })
+
+  @xsrf_protected
+  def post(self):
+    """Handle post request.
+
+    The body is a JSON object with a list of ProspectiveLineItem objects,
+    e.g. {"prospectiveLineItems": [{"lineItem": {...}}]}. Responds with their
+    availability forecasts, in the same order. Line items that could not be
+    forecast have an object with only an error message instead.
+    """
+    try:
+      prospective_line_items = json.loads(
+          self.request.body)['prospectiveLineItems']
+    except (ValueError, KeyError, TypeError):
+      prospective_line_items = None
+    if (not isinstance(prospective_line_items, list) or
+        len(prospective_line_items) > _MAX_FORECAST_LINE_ITEMS):
+      self.response.status = 400
+      return self.response.write(
+          'Body must be a JSON object with at most %d prospectiveLineItems' %
+          _MAX_FORECAST_LINE_ITEMS)
+
+    network_code = self.request.get('network_code')
+    user_future = InitUserAsync()
+    api_handler = _CreateAPIHandler()
+    api_handler.Prefetch('GetProspectiveAvailabilityForecasts')
+    api_handler.SetUser(user_future.get_result())
+    forecasts = api_handler.GetProspectiveAvailabilityForecasts(
+        network_code, prospective_line_items)
+
+    WriteJsonResponse(self.request, self.response, {
+        'results': forecasts,
+        'totalResultSetSize': len(forecasts),
+    })
+
+
+class ReportHandler(webapp2.RequestHandler):
+  """View that runs reports and serves completed ones as CSV."""
+
+  @xsrf_protected
+  def post(self):
+    """Handle post request.
+
+    The body is a JSON object with the report's dimensions, columns and date
+    range, e.g. {"dimensions": ["DATE"], "columns": ["AD_SERVER_IMPRESSIONS"],
+    "dateRangeType": "LAST_WEEK"}. A CUSTOM_DATE range also takes startDate
+    and endDate as YYYY-MM-DD. Responds with the report job's id and status.
+    """
+    try:
+      body = json.loads(self.request.body)
+      report_query = {
+          'dimensions': [str(dimension) for dimension in body['dimensions']],
+          'columns': [str(column) for column in body['columns']],
+          'dateRangeType': str(body.get('dateRangeType', 'LAST_WEEK')),
+      }
+      for date_key in ('startDate', 'endDate'):
+        if date_key in body:
+          date = datetime.datetime.strptime(body[date_key], '%Y-%m-%d')
+          report_query[date_key] = {
+              'year': date.year, 'month': date.month, 'day': date.day}
+    except (ValueError, KeyError, TypeError, AttributeError):
+      self.response.status = 400
+      return self.response.write(
+          'Body must be a JSON object with dimensions, columns and a valid '
+          'date range')
+
+    network_code = self.request.get('network_code')
+    user_future = InitUserAsync()
+    api_handler = _CreateAPIHandler()
+    api_handler.Prefetch('RunReportJob')
+    api_handler.SetUser(user_future.get_result())
+    report_job_id = api_handler.RunReportJob(network_code, report_query)
+    status = api_handler.WaitForReportJob(network_code, report_job_id,
+                                          _REPORT_WAIT_SECONDS)
+
+    WriteJsonResponse(self.request, self.response, {
+        'id': report_job_id,
+        'status': status,
+    })
+
+  def get(self, report_job_id=None):
+    """Handle get request.
+
+    Writes the report as CSV if it has completed, and its status otherwise.
+    App Engine holds the whole response in memory, so reports larger than
+    _MAX_REPORT_BYTES are refused with a 400 response; they are better run
+    with fewer dimensions or a shorter date range.
+
+    Args:
+      report_job_id: str The id of the report job.
+    """
+    # pylint: disable=g-import-not-at-top
+    from report_stream import ReportStream
+    from report_stream import ReportTooLargeError
+    # pylint: enable=g-import-not-at-top
+
+    if not report_job_id:
+      self.response.status = 400
+      return self.response.write('A report job id is required, as in '
+                                 '/api/reports/<id>')
+    network_code = self.request.get('network_code')
+    report_job_id = int(report_job_id)
+    user_future = InitUserAsync()
+    api_handler = _CreateAPIHandler(priority=upstream_scheduler.BULK)
+    api_handler.Prefetch('RunReportJob')
+    api_handler.SetUser(user_future.get_result())
+    status = api_handler.GetReportJobStatus(network_code, report_job_id)
+    if status != 'COMPLETED':
+      return WriteJsonResponse(self.request, self.response, {
+          'id': report_job_id,
+          'status': status,
+      })
+
+    stream = ReportStream(api_handler.DownloadReport(network_code,
+                                                     report_job_id),
+                          max_bytes=_MAX_REPORT_BYTES)
+    writer = csv.writer(self.response.out)
+    try:
+      for row in stream:
+        writer.writerow(row)
+    except ReportTooLargeError:
+      logging.warning('Refused report %d: %s', report_job_id,
+                      stream.GetStats())
+      self.response.clear()
+      self.response.status = 400
+      return self.response.write(
+          'The report is larger than %d MB. Run it with fewer dimensions or '
+          'a shorter date range.' % (_MAX_REPORT_BYTES // (1024 * 1024)))
+    self.response.headers['Content-Type'] = 'text/csv'
+    self.response.headers['Content-Disposition'] = (
+        'attachment; filename=report-%d.csv' % report_job_id)
+    logging.info('Wrote report %d: %s', report_job_id, stream.GetStats())
+
+
+class SavedQueryHandler(webapp2.RequestHandler):
+  """View that manages saved queries and serves their stored results."""
+
+  def get(self, saved_query_id=None):
+    """Handle get request.
+
+    Without an id, the user's saved queries are listed. With one, the query
+    is returned with the results stored by its last refresh, of which limit
+    and offset select a part. ageSeconds is how old they are.
+
+    Args:
+      saved_query_id: str The query's id, if any.
+    """
+    user_ndb = InitUser()
+    if saved_query_id is None:
+      return WriteJsonResponse(self.request, self.response, {
+          'results': [
+              _SerializeSavedQuery(saved_query)
+              for saved_query in RetrieveSavedQueries(user_ndb)
+          ],
+      })
+
+    saved_query = self._GetSavedQuery(user_ndb, saved_query_id)
+    if not saved_query:
+      return
+    try:
+      limit = int(self.request.get('limit', 0)) or None
+      offset = int(self.request.get('offset', 0))
+    except ValueError:
+      self.response.status = 400
+      return self.response.write('Limit and offset must be integers')
+
+    return_obj = _SerializeSavedQuery(saved_query)
+    return_obj['results'] = RetrieveSavedQueryResults(saved_query, offset,
+                                                      limit)
+    return_obj['totalResultSetSize'] = saved_query.result_count
+    return_obj['offset'] = offset
+    WriteJsonResponse(self.request, self.response, return_obj)
+
+  @xsrf_protected
+  def post(self):
+    """Handle post request, saving a new query.
+
+    The body is a JSON object with the query's name, method, network_code and
+    where clause, and how often it is refreshed, e.g. {"name": "Paused",
+    "method": "lineitems", "network_code": "1234",
+    "where": "WHERE status = 'PAUSED'", "refresh_minutes": 60}. Its first
+    refresh starts right away.
+    """
+    try:
+      body = json.loads(self.request.body)
+    except ValueError:
+      body = None
+    if not isinstance(body, dict):
+      self.response.status = 400
+      return self.response.write('Body must be a JSON object')
+
+    method = body.get('method')
+    method_name = APIViewHandler.api_handler_method_map.get(
+        method.lower() if isinstance(method, basestring) else None)
+    if not method_name or method_name == 'GetPQLSelection':
+      self.response.status = 400
+      return self.response.write('API method not supported (%s).' % method)
+    name = body.get('name')
+    network_code = body.get('network_code')
+    if (not isinstance(name, basestring) or not name.strip() or
+        not isinstance(network_code, basestring) or
+        not network_code.isdigit()):
+      self.response.status = 400
+      return self.response.write('A name and a network code are required')
+    name = name.strip()
+    try:
+      refresh_minutes = int(body.get('refresh_minutes',
+                                     saved_queries.DEFAULT_REFRESH_MINUTES))
+    except (ValueError, TypeError):
+      self.response.status = 400
+      return self.response.write('Refresh minutes must be an integer')
+    refresh_minutes = max(saved_queries.MIN_REFRESH_MINUTES,
+                          min(saved_queries.MAX_REFRESH_MINUTES,
+                              refresh_minutes))
+    where_clause = body.get('where') or ''
+    if not isinstance(where_clause, basestring):
+      self.response.status = 400
+      return self.response.write('Where must be a string')
+    try:
+      pql_parser.ParseFilter(where_clause, method_name)
+    except pql_parser.InvalidStatementError as e:
+      self.response.status = 400
+      return self.response.write('Invalid statement: %s' % e)
+
+    user_ndb = InitUser()
+    if len(RetrieveSavedQueries(user_ndb)) >= saved_queries.MAX_SAVED_QUERIES:
+      self.response.status = 400
+      return self.response.write('At most %d queries can be saved' %
+                                 saved_queries.MAX_SAVED_QUERIES)
+    saved_query = CreateSavedQuery(user_ndb, name, method_name, network_code,
+                                   where_clause, refresh_minutes)
+    saved_queries.ScheduleRefresh(saved_query)
+    WriteJsonResponse(self.request, self.response,
+                      _SerializeSavedQuery(saved_query))
+
+  @xsrf_protected
+  def refresh(self, saved_query_id):
+    """Handle post request, refreshing a saved query in the background.
+
+    Args:
+      saved_query_id: str The query's id.
+    """
+    saved_query = self._GetSavedQuery(InitUser(), saved_query_id)
+    if not saved_query:
+      return
+    saved_queries.ScheduleRefresh(saved_query)
+    self.response.status = 202
+    WriteJsonResponse(self.request, self.response,
+                      _SerializeSavedQuery(saved_query))
+
+  @xsrf_protected
+  def delete(self, saved_query_id):
+    """Handle delete request.
+
+    Args:
+      saved_query_id: str The query's id.
+    """
+    saved_query = self._GetSavedQuery(InitUser(), saved_query_id)
+    if not saved_query:
+      return
+    DeleteSavedQuery(saved_query)
+    self.response.status = 204
+
+  def _GetSavedQuery(self, user_ndb, saved_query_id):
+    """Returns one of the user's saved queries, or writes a 404 response."""
+    saved_query = RetrieveSavedQuery(user_ndb, int(saved_query_id))
+    if not saved_query:
+      self.response.status = 404
+      self.response.write('No such saved query (%s).' % saved_query_id)
+    return saved_query
+
+
+def _SerializeSavedQuery(saved_query):
+  """Returns a saved query's settings and the state of its results.
+
+  Args:
+    saved_query: SavedQuery The query.
+
+  Returns:
+    dict The query.
+  """
+  methods = dict((method_name, method) for method, method_name
+                 in APIViewHandler.api_handler_method_map.iteritems())
+  refreshed = saved_query.refreshed
+  return {
+      'id': saved_query.key.id(),
+      'name': saved_query.name,
+      'method': methods.get(saved_query.method_name),
+      'networkCode': saved_query.network_code,
+      'where': saved_query.where_clause,
+      'refreshMinutes': saved_query.refresh_minutes,
+      'refreshed': refreshed.isoformat() if refreshed else None,
+      'ageSeconds': (int((datetime.datetime.now() - refreshed).total_seconds())
+                     if refreshed else None),
+      'refreshing': saved_query.refresh_requested is not None,
+      'error': saved_query.error,
+      'resultCount': saved_query.result_count,
+      'truncated': saved_query.truncated,
+  }
+
+
+class SearchHandler(webapp2.RequestHandler):
+  """View that looks entities up by name across services."""
+
+  def get(self):
+    """Handle get request.
+
+    Entities of the services in name_index.SEARCH_METHODS whose names have
+    words starting with the words of q are returned, at most limit of each
+    service and best matches first. Services whose names are not indexed yet
+    are searched with a live query instead, as are all services of networks
+    that are not among the user's cached networks. sources tells, by service,
+    whether its results came from the 'index' or a 'live' query, or the
+    error of the live query.
+    """
+    query = self.request.get('q', '').strip()
+    network_code = self.request.get('network_code')
+    if not network_code.isdigit():
+      self.response.status = 400
+      return self.response.write('Network code must be a number')
+    try:
+      limit = int(self.request.get('limit', _SEARCH_LIMIT))
+    except ValueError:
+      self.response.status = 400
+      return self.response.write('Limit must be an integer')
+    limit = max(1, min(_MAX_SEARCH_LIMIT, limit))
+    if not query:
+      return WriteJsonResponse(self.request, self.response, {
+          'query': query,
+          'results': [],
+          'sources': {},
+      })
+
+    user_ndb = InitUser()
+    # live queries check the user's access to the network, indexes do not
+    networks = network_cache.GetCachedNetworks(user_ndb) or []
+    if any(str(network['networkCode']) == network_code
+           for network in networks):
+      found, unindexed = name_index.Search(network_code, query, limit,
+                                           user_ndb)
+    else:
+      found, unindexed = {}, list(name_index.SEARCH_METHODS)
+    sources = dict((method_name, 'index') for method_name in found)
+    if unindexed:
+      api_handler = _CreateAPIHandler(user_ndb)
+      api_handler.Prefetch(*unindexed)
+      for method_name, entries, error in api_handler.SearchNames(
+          network_code, unindexed, query, limit, _SEARCH_TIMEOUT):
+        found[method_name] = entries or []
+        sources[method_name] = error or 'live'
+
+    methods = dict((method_name, method) for method, method_name
+                   in APIViewHandler.api_handler_method_map.iteritems())
+    results = []
+    for method_name in name_index.SEARCH_METHODS:
+      results.extend({
+          'method': methods[method_name],
+          'id': entity_id,
+          'name': name,
+      } for entity_id, name in found.get(method_name, []))
+    WriteJsonResponse(self.request, self.response, {
+        'query': query,
+        'results': results,
+        'sources': dict((methods[method_name], source)
+                        for method_name, source in sources.iteritems()),
+    })
+
+
 class RevokeOldRefreshTokens(webapp2.RequestHandler):
-  """View that revokes old credentials. It is used in cron.yaml."""
+  """View that revokes old credentials. It is used in cron.yaml.
+
+  Long runs continue from their checkpoint in a chained task queue request.
+  """
 
   def get(self):
     """Handle get request."""
-    if self.request.headers.get('X-Appengine-Cron'):
-      RevokeOldCredentials()
+    if (self.request.headers.get('X-Appengine-Cron') or
+        self.request.headers.get('X-Appengine-QueueName')):
+      _, finished = RevokeOldCredentials()
+      if not finished:
+        # ran out of time, continue from the checkpoint in a new request
+        taskqueue.add(url='/tasks/revoke', method='GET')
     else:
       self.response.status = 401
 
 
+class LoadReferenceData(webapp2.RequestHandler):
+  """View that loads a reference table. It is used by reference_data."""
+
+  def post(self):
+    """Handle post request."""
+    if not self.request.headers.get('X-Appengine-QueueName'):
+      self.response.status = 401
+      return
+
+    table_name = self.request.get('table')
+    if table_name not in reference_data.REFERENCE_TABLES:
+      self.response.status = 400
+      return self.response.write('Not a reference table (%s).' % table_name)
+
+    user_ndb = RetrieveUserByKey(self.request.get('user'))
+    if not user_ndb or not user_ndb.refresh_token:
+      # the user's credentials are gone, the next query schedules a new load
+      logging.warning('No credentials to load reference table %s', table_name)
+      return
+    api_handler = _CreateAPIHandler(user_ndb, upstream_scheduler.BULK)
+    reference_data.LoadTable(api_handler, self.request.get('network_code'),
+                             table_name)
+
+
+class SyncNameIndex(webapp2.RequestHandler):
+  """View that syncs a name index. It is used by name_index."""
+
+  def post(self):
+    """Handle post request."""
+    if not self.request.headers.get('X-Appengine-QueueName'):
+      self.response.status = 401
+      return
+
+    method_name = self.request.get('method')
+    network_code = self.request.get('network_code')
+    if (method_name not in name_index.SEARCH_METHODS or
+        not network_code.isdigit()):
+      self.response.status = 400
+      return self.response.write('Not a searchable method (%s).' % method_name)
+
+    user_ndb = RetrieveUserByKey(self.request.get('user'))
+    if not user_ndb or not user_ndb.refresh_token:
+      # the user's credentials are gone, the next search schedules a new sync
+      logging.warning('No credentials to sync the name index of %s',
+                      method_name)
+      return
+    name_index.SyncIndex(_CreateAPIHandler(user_ndb, upstream_scheduler.BULK),
+                         network_code, method_name)
+
+
+class RefreshNetworkList(webapp2.RequestHandler):
+  """View that refreshes a user's cached networks. Used by network_cache."""
+
+  def post(self):
+    """Handle post request."""
+    if not self.request.headers.get('X-Appengine-QueueName'):
+      self.response.status = 401
+      return
+
+    user_ndb = RetrieveUserByKey(self.request.get('user'))
+    if not user_ndb or not user_ndb.refresh_token:
+      # the user's credentials are gone, the stale list expires on its own
+      logging.warning('No credentials to refresh networks')
+      return
+    network_cache.RefreshNetworks(
+        _CreateAPIHandler(user_ndb, upstream_scheduler.BULK), user_ndb)
+
+
+class RefreshSavedQueries(webapp2.RequestHandler):
+  """View that refreshes saved queries. It is used in cron.yaml.
+
+  Cron requests schedule the refreshes that are due, and the task queue
+  requests added by saved_queries run each refresh.
+  """
+
+  def get(self):
+    """Handle get request."""
+    if not self.request.headers.get('X-Appengine-Cron'):
+      self.response.status = 401
+      return
+    logging.info('Scheduled %d saved query refreshes',
+                 saved_queries.ScheduleDueRefreshes())
+
+  def post(self):
+    """Handle post request."""
+    if not self.request.headers.get('X-Appengine-QueueName'):
+      self.response.status = 401
+      return
+
+    user_ndb = RetrieveUserByKey(self.request.get('user'))
+    if not user_ndb or not user_ndb.refresh_token:
+      # the previous results are kept until the user logs in again
+      logging.warning('No credentials to refresh saved queries')
+      return
+    saved_query = RetrieveSavedQuery(user_ndb,
+                                     int(self.request.get('saved_query')))
+    if not saved_query:
+      # deleted since the refresh was scheduled
+      return
+    saved_queries.RefreshSavedQuery(
+        _CreateAPIHandler(user_ndb, upstream_scheduler.BULK), saved_query)
+
+
+class StatsPage(webapp2.RequestHandler):
+  """View that reports instance-wide statistics to admin users."""
+
+  def get(self):
+    """Handle get request."""
+    if not users.is_current_user_admin():
+      self.response.status = 403
+      return
+    # pylint: disable=g-import-not-at-top
+    from http_transport import GetTransportStats
+    from report_stream import GetReportStats
+    # pylint: enable=g-import-not-at-top
+    WriteJsonResponse(self.request, self.response, {
+        'transport': GetTransportStats(),
+        'reports': GetReportStats(),
+        'scheduler': upstream_scheduler.GetScheduler().GetStats(),
+    })
+
+
+class DownloadTrafficRecords(webapp2.RequestHandler):
+  """View that lets admin users download recorded traffic."""
+
+  def get(self):
+    """Handle get request.
+
+    The records are written as a JSONL cassette, one record per line, see
+    traffic_recorder.
+    """
+    if not users.is_current_user_admin():
+      self.response.status = 403
+      return
+    self.response.headers['Content-Type'] = 'application/x-ndjson'
+    for record in RetrieveTrafficRecords():
+      self.response.write(json.dumps(record, separators=(',', ':')))
+      self.response.write('\n')
+
+
 class PutCredentials(webapp2.RequestHandler):
   """View that allows an admin user to replace credentials."""
 
   def get(self):
-    template = _JINJA_ENVIRONMENT.get_template('create_credentials.html')
+    template = _GetJinjaEnvironment().get_template('create_credentials.html')
     self.response.write(template.render())
 
   def post(self):